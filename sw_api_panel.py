@@ -12,88 +12,1181 @@ Repository: https://github.com/sina-salim/solipy
 """
 
 import os
+import re
 import sys
 import time
 import json
 import glob
 import shutil
 import logging
+import logging.handlers
+import collections
+import hashlib
+import hmac
+import ipaddress
+import argparse
+import atexit
+import importlib
+import itertools
+import ast
+import bisect
+import csv
+import difflib
+import functools
 import uuid
+import zlib
+import socket
 import subprocess
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, simpledialog
+import concurrent.futures
+import contextlib
+import contextvars
 import threading
 import queue
 import datetime
-import requests
-from typing import Dict, List, Any, Optional, Tuple
-
-# تنظیم کدگذاری برای خروجی
-if sys.platform.startswith('win'):
-    import codecs
-    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
-    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
-
-# تنظیم لاگینگ
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("sw_api_panel.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from typing import Dict, List, Any, Optional, Tuple, Callable
+
+class _LazyModule:
+    """بارگذاری ماژول در اولین دسترسی به یکی از ویژگی‌های آن
+
+    ماژول‌های سنگین (tkinter و requests) فقط وقتی import می‌شوند که واقعاً استفاده شوند،
+    تا import این فایل از تردهای کارگر، سرور یا تست‌ها سریع و بدون اثر جانبی باشد.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+tk = _LazyModule("tkinter")
+ttk = _LazyModule("tkinter.ttk")
+scrolledtext = _LazyModule("tkinter.scrolledtext")
+messagebox = _LazyModule("tkinter.messagebox")
+simpledialog = _LazyModule("tkinter.simpledialog")
+filedialog = _LazyModule("tkinter.filedialog")
+requests = _LazyModule("requests")
+sqlite3 = _LazyModule("sqlite3")
+tempfile = _LazyModule("tempfile")
+np = _LazyModule("numpy")
+asyncio = _LazyModule("asyncio")
+cProfile = _LazyModule("cProfile")
+pstats = _LazyModule("pstats")
+tracemalloc = _LazyModule("tracemalloc")
+gzip = _LazyModule("gzip")
+
 logger = logging.getLogger("SolidWorksPanel")
 
 # تنظیمات مسیرها
 SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
 HISTORY_DIR = os.path.join(SCRIPTS_DIR, "history")
 MAX_HISTORY = 20  # حداکثر تعداد اسکریپت‌های ذخیره شده در تاریخچه
+OUTPUT_MAX_LINES = 5000  # حداکثر خطوط نمایش داده شده در کنسول خروجی
+
+class AppConfig:
+    """تنظیمات برنامه که در اولین استفاده بارگذاری می‌شوند
+
+    import ماژول هیچ فایلی نمی‌خواند و نمی‌نویسد. تنظیمات با load() از .env و doc.txt
+    خوانده می‌شوند و prepare_runtime() لاگینگ، پوشه‌ها و اسکریپت فعلی را آماده می‌کند.
+    متغیرهای محیطی بر مقادیر فایل .env مقدم هستند.
+    """
+
+    def __init__(self, env_path: str = ".env", doc_path: str = "doc.txt"):
+        """راه‌اندازی تنظیمات با مقادیر پیش‌فرض
+
+        Args:
+            env_path: مسیر فایل .env
+            doc_path: مسیر فایل doc.txt (منبع جایگزین کلید API)
+        """
+        self.env_path = env_path
+        self.doc_path = doc_path
+        self.values: Dict[str, str] = {}
+
+        # کلیدهای API و تنظیمات
+        self.api_key = ""
+        self.base_url = "https://api.openai.com/v1/chat/completions"
+        self.api_model = "gpt-4o-mini"
+
+        # سطوح مدل از سریع/ارزان به قوی برای مسیریابی (خالی یعنی فقط api_model)
+        self.model_tiers: List[str] = []
+
+        # نقاط پایانی جایگزین (آدرس، کلید، الگوی نام مدل) و تنظیمات hedging
+        self.fallback_endpoints: List[Tuple[str, str, str]] = []
+        self.hedge_requests = True
+        self.hedge_delay_s = 8.0
+
+        # سقف نرخ هر نقطه پایانی: نام میزبان (یا *) -> (درخواست در دقیقه، توکن در دقیقه)
+        self.rate_limits: Dict[str, Tuple[int, int]] = {}
+
+        # تعداد اسکریپت‌های نامزد که به صورت موازی تولید و اعتبارسنجی می‌شوند
+        self.generation_candidates = 1
+
+        # بودجه توکن نمونه‌های موفق مشابه (few-shot) در پرامپت؛ 0 یعنی غیرفعال
+        self.fewshot_tokens = 1500
+
+        # حداکثر توکن ورودی هر درخواست LLM (0 یعنی بدون محدودیت)
+        self.prompt_budget_tokens = 6000
+
+        # روش اجرای اسکریپت‌ها: cscript (پردازش جداگانه برای هر اجرا)، com (اتصال ماندگار درون‌پردازشی)
+        # یا standin (جایگزین محلی بدون SolidWorks برای آزمایش)
+        self.execution_mode = "cscript"
+
+        # مدت اجرای شبیه‌سازی شده هر اسکریپت در حالت standin (ثانیه)
+        self.standin_run_s = 0.5
+
+        # پورت سرور MCP تعبیه شده در پنل روی 127.0.0.1 (0 یعنی غیرفعال)
+        self.mcp_port = 0
+
+        # حداکثر کارهای فعال هر کاربر در سرویس کارهای HTTP
+        self.job_quota = 20
+
+        # توکن‌های دسترسی کاربران سرویس کارهای HTTP: توکن -> نام کاربر
+        self.job_tokens: Dict[str, str] = {}
+
+        # آدرس هماهنگ کننده مزرعه اجرا (خالی یعنی اجرای محلی)
+        self.farm_url = ""
+
+        # مدت واگذاری هر کار به کارگر مزرعه پیش از نیاز به heartbeat (ثانیه)
+        self.farm_lease_s = 30.0
+
+        # توکن مشترک هماهنگ کننده، کارگرها و پنل‌های مزرعه (برای شنود روی شبکه الزامی است)
+        self.farm_token = ""
+
+        # اتصال پیش‌دستانه به SolidWorks هنگام باز شدن پنل
+        self.prewarm_session = True
+
+        # ثبت بازه‌های زمانی درخواست‌ها در traces.jsonl پوشه تاریخچه
+        self.trace_enabled = True
+
+        # پروفایل CPU/حافظه مراحل و تشخیص انسداد رابط کاربری از ابتدای اجرا (قابل تغییر از پنل)
+        self.profile_enabled = False
+        self.profile_block_ms = 200.0
+
+        self.max_history = MAX_HISTORY
+        self.scripts_dir = SCRIPTS_DIR
+        self.history_dir = HISTORY_DIR
+        self.diagnostics_dir = os.path.join(os.path.dirname(SCRIPTS_DIR), "diagnostics")
+        self.log_path = os.path.join(os.path.dirname(SCRIPTS_DIR), "logs", "sw_api_panel.log")
+        # چرخش فایل لاگ (مگابایت)، تعداد نسخه‌های فشرده و قالب JSON رکوردها
+        self.log_max_mb = 5.0
+        self.log_backups = 5
+        self.log_json = True
+
+        self._loaded = False
+        self._runtime_ready = False
+        self._lock = threading.RLock()
+
+    def get(self, name: str, default: str = "") -> str:
+        """خواندن یک تنظیم از متغیرهای محیطی یا فایل .env"""
+        self.load()
+        value = os.environ.get(name)
+        if value is None:
+            value = self.values.get(name, default)
+        return value
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        """خواندن یک تنظیم بولی (0/false/no غیرفعال است)"""
+        value = self.get(name, "")
+        if value == "":
+            return default
+        return value.strip().lower() not in ("0", "false", "no", "off")
+
+    @staticmethod
+    def parse_endpoints(value: str) -> List[Tuple[str, str, str]]:
+        """خواندن لیست نقاط پایانی با قالب url|api_key|model_template جدا شده با ;
+
+        Args:
+            value: متن تنظیم (مثلاً https://openrouter.ai/api/v1/chat/completions|sk-or-...|openai/{model})
+
+        Returns:
+            List[Tuple[str, str, str]]: (آدرس، کلید، الگوی نام مدل)
+        """
+        endpoints = []
+        for item in value.split(";"):
+            parts = [p.strip() for p in item.split("|")]
+            if not parts[0]:
+                continue
+            parts += [""] * (3 - len(parts))
+            endpoints.append((parts[0], parts[1], parts[2] or "{model}"))
+        return endpoints
+
+    @staticmethod
+    def parse_rate_limits(value: str) -> Dict[str, Tuple[int, int]]:
+        """خواندن سقف نرخ‌ها با قالب host=rpm/tpm جدا شده با ;
+
+        Args:
+            value: متن تنظیم (مثلاً *=60/90000;openrouter.ai=20/40000)
+
+        Returns:
+            Dict[str, Tuple[int, int]]: نام میزبان -> (rpm، tpm)
+        """
+        limits = {}
+        for item in value.split(";"):
+            if "=" not in item:
+                continue
+            name, rates = item.split("=", 1)
+            rpm, _, tpm = rates.partition("/")
+            try:
+                limits[name.strip()] = (int(rpm or 0), int(tpm or 0))
+            except ValueError:
+                logger.warning(f"سقف نرخ نامعتبر نادیده گرفته شد: {item}")
+        return limits
+
+    @staticmethod
+    def parse_tokens(value: str) -> Dict[str, str]:
+        """خواندن توکن‌های کاربران با قالب user=token جدا شده با ;
+
+        Args:
+            value: متن تنظیم (مثلاً ali=3f9c...;sara=a71b...)
+
+        Returns:
+            Dict[str, str]: توکن -> نام کاربر
+        """
+        tokens = {}
+        for item in value.split(";"):
+            user, _, token = item.partition("=")
+            if user.strip() and token.strip():
+                tokens[token.strip()] = user.strip()
+        return tokens
+
+    def load(self) -> "AppConfig":
+        """خواندن کلید API و تنظیمات از فایل .env یا doc.txt (فقط یک بار)"""
+        with self._lock:
+            if self._loaded:
+                return self
+            self._loaded = True
+            try:
+                if os.path.exists(self.env_path):
+                    with open(self.env_path, "r", encoding='utf-8') as f:
+                        for line in f:
+                            line = line.strip()
+                            if not line or line.startswith("#") or "=" not in line:
+                                continue
+                            key, value = line.split("=", 1)
+                            value = value.strip()
+                            if value[:1] not in ('"', "'"):
+                                value = re.sub(r'\s+#.*$', '', value)
+                            self.values[key.strip()] = value.strip('"\'')
+
+                self.api_key = self.get("OPENAI_API_KEY", self.api_key)
+                self.base_url = self.get("OPENAI_BASE_URL", self.base_url)
+                self.api_model = self.get("OPENAI_MODEL", self.api_model).strip() or self.api_model
+                self.model_tiers = [m.strip() for m in self.get("SW_MODEL_TIERS", "").split(",") if m.strip()]
+                self.fallback_endpoints = self.parse_endpoints(self.get("SW_FALLBACK_ENDPOINTS", ""))
+                self.hedge_requests = self.get_bool("SW_HEDGE", self.hedge_requests)
+                self.rate_limits = self.parse_rate_limits(self.get("SW_RATE_LIMITS", ""))
+                try:
+                    self.hedge_delay_s = float(self.get("SW_HEDGE_DELAY", str(self.hedge_delay_s)))
+                except ValueError:
+                    pass
+                try:
+                    self.generation_candidates = max(1, int(self.get("SW_CANDIDATES", str(self.generation_candidates))))
+                except ValueError:
+                    pass
+                try:
+                    self.fewshot_tokens = max(0, int(self.get("SW_FEWSHOT_TOKENS", str(self.fewshot_tokens))))
+                except ValueError:
+                    pass
+                try:
+                    self.prompt_budget_tokens = max(0, int(self.get("SW_PROMPT_BUDGET", str(self.prompt_budget_tokens))))
+                except ValueError:
+                    pass
+                self.execution_mode = self.get("SW_EXECUTION_MODE", self.execution_mode).lower()
+                try:
+                    self.standin_run_s = float(self.get("SW_STANDIN_RUN_SECONDS", str(self.standin_run_s)))
+                except ValueError:
+                    pass
+                try:
+                    self.mcp_port = int(self.get("SW_MCP_PORT", str(self.mcp_port)))
+                except ValueError:
+                    pass
+                try:
+                    self.job_quota = max(1, int(self.get("SW_JOB_QUOTA", str(self.job_quota))))
+                except ValueError:
+                    pass
+                self.job_tokens = self.parse_tokens(self.get("SW_JOB_TOKENS", ""))
+                self.farm_url = self.get("SW_FARM_URL", self.farm_url)
+                self.farm_token = self.get("SW_FARM_TOKEN", self.farm_token)
+                try:
+                    self.farm_lease_s = max(1.0, float(self.get("SW_FARM_LEASE_SECONDS", str(self.farm_lease_s))))
+                except ValueError:
+                    pass
+                self.prewarm_session = self.get_bool("SW_PREWARM", self.prewarm_session)
+                self.trace_enabled = self.get_bool("SW_TRACE", self.trace_enabled)
+                self.profile_enabled = self.get_bool("SW_PROFILE", self.profile_enabled)
+                try:
+                    self.profile_block_ms = max(1.0, float(self.get("SW_PROFILE_BLOCK_MS", str(self.profile_block_ms))))
+                except ValueError:
+                    pass
+                self.log_path = self.get("SW_LOG_FILE", self.log_path)
+                try:
+                    self.log_max_mb = max(0.0, float(self.get("SW_LOG_MAX_MB", str(self.log_max_mb))))
+                except ValueError:
+                    pass
+                try:
+                    self.log_backups = max(1, int(self.get("SW_LOG_BACKUPS", str(self.log_backups))))
+                except ValueError:
+                    pass
+                self.log_json = self.get_bool("SW_LOG_JSON", self.log_json)
+                try:
+                    self.max_history = int(self.get("MAX_HISTORY", str(self.max_history)))
+                except ValueError:
+                    pass
+
+                if not self.api_key and os.path.exists(self.doc_path):
+                    with open(self.doc_path, "r", encoding='utf-8') as f:
+                        for line in f:
+                            if "api key" in line.lower():
+                                parts = line.split("=", 1)
+                                if len(parts) == 2:
+                                    self.api_key = parts[1].strip().strip('"\'')
+                            if "base_url" in line.lower():
+                                parts = line.split("=", 1)
+                                if len(parts) == 2:
+                                    self.base_url = parts[1].strip().strip('"\'')
+                            if "model" in line.lower():
+                                parts = line.split("=", 1)
+                                if len(parts) == 2:
+                                    self.api_model = parts[1].strip().strip('"\'')
+            except Exception as e:
+                logger.error(f"خطا در خواندن کلید API: {e}")
+            return self
+
+    def prepare_runtime(self) -> "AppConfig":
+        """آماده‌سازی لاگینگ، پوشه‌ها و اسکریپت فعلی (فقط یک بار)"""
+        with self._lock:
+            if self._runtime_ready:
+                return self
+            self.load()
+            self._runtime_ready = True
+            setup_logging(self.log_path, int(self.log_max_mb * 1024 * 1024), self.log_backups, self.log_json)
+
+            # اطمینان از وجود پوشه‌های مورد نیاز
+            os.makedirs(self.scripts_dir, exist_ok=True)
+            os.makedirs(self.history_dir, exist_ok=True)
+
+            # کپی اسکریپت نمونه به عنوان اسکریپت فعلی اگر وجود نداشته باشد
+            current_script_path = os.path.join(self.scripts_dir, "current_script.vbs")
+            sample_script_path = os.path.join(self.scripts_dir, "create_simple_part.vbs")
+            if not os.path.exists(current_script_path) and os.path.exists(sample_script_path):
+                shutil.copy2(sample_script_path, current_script_path)
+                logger.info(f"اسکریپت نمونه به عنوان اسکریپت فعلی کپی شد.")
+            return self
+
+_config: Optional[AppConfig] = None
+_config_lock = threading.Lock()
+
+def get_config() -> AppConfig:
+    """دریافت تنظیمات سراسری برنامه (در اولین فراخوانی بارگذاری می‌شود)"""
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = AppConfig()
+    return _config.load()
+
+LOG_BODY_LIMIT = 500  # حداکثر نویسه‌های بدنه پاسخ یا خروجی اسکریپت در هر پیام لاگ
+
+def truncate_for_log(text: str, limit: int = LOG_BODY_LIMIT) -> str:
+    """کوتاه کردن بدنه پاسخ یا خروجی طولانی پیش از نوشتن در لاگ
+
+    Args:
+        text: متن کامل
+        limit: حداکثر نویسه‌های نگه داشته شده
+
+    Returns:
+        str: ابتدای متن به همراه طول کل در صورت کوتاه شدن
+    """
+    text = "" if text is None else str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text)} نویسه]"
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """فایل لاگ با چرخش بر اساس حجم یا تغییر روز و فشرده‌سازی gzip نسخه‌های قبلی
+
+    نسخه‌های قبلی با نام‌های .1.gz تا .N.gz نگه داشته می‌شوند. چرخش و فشرده‌سازی در ترد
+    QueueListener انجام می‌شود، پس تردهای برنامه هرگز منتظر آن نمی‌مانند.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, daily: bool = True):
+        """راه‌اندازی
+
+        Args:
+            filename: مسیر فایل لاگ
+            max_bytes: حجم چرخش (بایت)
+            backup_count: تعداد نسخه‌های فشرده نگه داشته شده
+            daily: چرخش با اولین رکورد هر روز جدید
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.daily = daily
+        try:
+            self._day = datetime.date.fromtimestamp(os.path.getmtime(self.baseFilename))
+        except OSError:
+            self._day = datetime.date.today()
+
+    def shouldRollover(self, record) -> bool:
+        if self.daily and datetime.date.today() != self._day:
+            self._day = datetime.date.today()
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                return True
+        return bool(super().shouldRollover(record))
+
+    def rotation_filename(self, default_name: str) -> str:
+        return default_name + ".gz"
+
+    def rotate(self, source: str, dest: str):
+        if not os.path.exists(source):
+            return
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+class JSONLogFormatter(logging.Formatter):
+    """قالب JSON یک‌خطی: زمان، سطح، ترد، پیام و ویژگی‌های اضافی (trace_id، duration_ms و ...)"""
+
+    STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+    def format(self, record) -> str:
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.STANDARD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler که شناسه درخواست را در ترد فراخواننده ثبت می‌کند و هرگز مسدود نمی‌شود
+
+    با رسیدن صف به maxsize (دیسک کند یا حجم بسیار زیاد لاگ) رکورد دور ریخته می‌شود و تعداد
+    رکوردهای از دست رفته در رکورد بعدی (dropped) گزارش می‌شود. چون این تنها handler ریشه است
+    رکورد بدون کپی آماده می‌شود.
+    """
+
+    def __init__(self, maxsize: int = 50000):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record):
+        # trace جاری فقط در ترد فراخواننده در دسترس است (ترد QueueListener آن را نمی‌بیند)
+        if _tracer is not None and not hasattr(record, "trace_id"):
+            trace_id = _tracer.current_trace_id()
+            if trace_id:
+                record.trace_id = trace_id
+        # پیام و traceback همین‌جا به متن تبدیل می‌شوند (args و exc_info ممکن است قابل انتقال نباشند)
+        record.msg = record.message = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        self.queue.put_nowait(record)
+
+_log_listener = None
+
+def setup_logging(log_path: str = "sw_api_panel.log", max_bytes: int = 5 * 1024 * 1024, backup_count: int = 5,
+                  json_format: bool = True):
+    """تنظیم لاگینگ ناهمگام فایل و کنسول (فقط یک بار)
+
+    همه تردها رکوردها را فقط در یک صف می‌گذارند؛ یک ترد QueueListener آنها را در فایل
+    چرخشی فشرده (یک رکورد JSON در هر خط) و کنسول می‌نویسد.
+
+    Args:
+        log_path: مسیر فایل لاگ
+        max_bytes: حجم چرخش فایل (0 یعنی فقط چرخش روزانه)
+        backup_count: تعداد نسخه‌های فشرده قبلی
+        json_format: نوشتن رکوردهای JSON در فایل (در غیر این صورت متن ساده)
+    """
+    global _log_listener
+    root_logger = logging.getLogger()
+    if getattr(root_logger, "_solipy_configured", False):
+        return
+    root_logger._solipy_configured = True
+    
+    text_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_dir = os.path.dirname(os.path.abspath(log_path))
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = CompressedRotatingFileHandler(log_path, max_bytes, backup_count)
+    file_handler.setFormatter(JSONLogFormatter() if json_format else text_formatter)
+    handlers = [file_handler]
+    # در pythonw (بدون کنسول) sys.stderr وجود ندارد
+    if sys.stderr is not None:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(text_formatter)
+        handlers.append(console_handler)
+    
+    # رکوردها به شناسه و نام پردازه نیاز ندارند
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    
+    queue_handler = NonBlockingQueueHandler()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(logging.INFO)
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    # رکوردهای باقی مانده در صف پیش از خروج نوشته می‌شوند
+    atexit.register(_log_listener.stop)
+
+def configure_console_encoding():
+    """تنظیم کدگذاری UTF-8 خروجی کنسول ویندوز (نویسه‌های غیرقابل نمایش جایگزین می‌شوند)"""
+    if sys.platform.startswith('win'):
+        for stream in (sys.stdout, sys.stderr):
+            if stream is not None and hasattr(stream, "reconfigure"):
+                stream.reconfigure(encoding="utf-8", errors="replace")
+
+# نام‌های قدیمی تنظیمات که اکنون به صورت تنبل از AppConfig خوانده می‌شوند
+_LEGACY_CONFIG_NAMES = {
+    "API_KEY": "api_key",
+    "BASE_URL": "base_url",
+    "API_MODEL": "api_model",
+    "EXECUTION_MODE": "execution_mode",
+    "PREWARM_SESSION": "prewarm_session",
+}
+
+def __getattr__(name):
+    if name in _LEGACY_CONFIG_NAMES:
+        return getattr(get_config(), _LEGACY_CONFIG_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def measure_import_time(runs: int = 5) -> Dict[str, float]:
+    """اندازه‌گیری زمان import این ماژول با python -X importtime
+
+    هر اجرا در یک پردازش تازه انجام می‌شود تا کش ماژول‌ها اثری نداشته باشد.
+
+    Args:
+        runs: تعداد اجرا
+
+    Returns:
+        Dict: کمینه و میانه زمان import تجمعی (میلی‌ثانیه) و ماژول‌های سنگین بارگذاری شده
+    """
+    module_name = os.path.splitext(os.path.basename(__file__))[0]
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    heavy = set()
+    for _ in range(max(1, runs)):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+            cwd=module_dir, capture_output=True, text=True, check=False
+        )
+        for line in result.stderr.splitlines():
+            # قالب: import time: self [us] | cumulative | imported package
+            parts = [part.strip() for part in line.split("|")]
+            if len(parts) != 3 or not parts[1].isdigit():
+                continue
+            if parts[2] == module_name:
+                samples.append(int(parts[1]) / 1000.0)
+            elif parts[2].lstrip() in ("tkinter", "requests"):
+                heavy.add(parts[2].strip())
+    samples.sort()
+    return {
+        "min_ms": samples[0] if samples else -1.0,
+        "median_ms": samples[len(samples) // 2] if samples else -1.0,
+        "heavy_modules": sorted(heavy),
+    }
+
+# === ردیابی درخواست‌ها از کلیک تا نتیجه ===
+
+class Tracer:
+    """ثبت بازه‌های زمانی (span) هر درخواست با یک شناسه همبستگی (trace id)
+
+    هر کلیک کاربر یک trace جدید شروع می‌کند و بازه‌های تردهای کارگر، درخواست‌های HTTP،
+    نوشتن فایل‌ها، اجرای اسکریپت و پردازش نتیجه در رابط کاربری زیر همان شناسه ثبت می‌شوند،
+    تا معلوم شود زمان یک درخواست کند صرف صف API، مدل، فایل‌ها، cscript، SolidWorks یا
+    تأخیر بررسی صف رابط کاربری شده است. بازه جاری در contextvars نگه داشته می‌شود و با
+    wrap() به تردهای دیگر منتقل می‌شود. بازه‌ها به صورت خطوط JSON با قالب OTLP
+    (ExportTraceServiceRequest) در traces.jsonl نوشته می‌شوند.
+    """
+
+    MAX_FILE_BYTES = 5 * 1024 * 1024
+    STATUS_OK = 1
+    STATUS_ERROR = 2
+
+    def __init__(self, path: Optional[str] = None, enabled: bool = True, service_name: str = "solipy"):
+        """راه‌اندازی ردیاب
+
+        Args:
+            path: مسیر فایل traces.jsonl (None یعنی بازه‌ها فقط در حافظه ساخته می‌شوند)
+            enabled: فعال بودن ردیابی
+            service_name: نام سرویس در منبع OTLP
+        """
+        self.path = path
+        self.enabled = enabled
+        self.service_name = service_name
+        self._current = contextvars.ContextVar("solipy_span", default=None)
+        self._lock = threading.Lock()
+        self._file_bytes: Optional[int] = None
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        """بازه جاری این ترد (یا None)"""
+        return self._current.get()
 
-# کلیدهای API و تنظیمات
-API_KEY = ""
-BASE_URL = "https://api.openai.com/v1/chat/completions"
-API_MODEL = "gpt-4o-mini"
-
-# خواندن کلید API از فایل .env یا doc.txt
-try:
-    if os.path.exists(".env"):
-        with open(".env", "r") as f:
-            for line in f:
-                if line.startswith("OPENAI_API_KEY="):
-                    API_KEY = line.strip().split("=", 1)[1].strip('"\'')
-                if line.startswith("OPENAI_BASE_URL="):
-                    BASE_URL = line.strip().split("=", 1)[1].strip('"\'')
-                if line.startswith("OPENAI_MODEL="):
-                    API_MODEL = line.strip().split("=", 1)[1].strip('"\'')
-    if not API_KEY and os.path.exists("doc.txt"):
-        with open("doc.txt", "r") as f:
-            for line in f:
-                if "api key" in line.lower():
-                    parts = line.split("=", 1)
-                    if len(parts) == 2:
-                        API_KEY = parts[1].strip().strip('"\'')
-                if "base_url" in line.lower():
-                    parts = line.split("=", 1)
-                    if len(parts) == 2:
-                        BASE_URL = parts[1].strip().strip('"\'')
-                if "model" in line.lower():
-                    parts = line.split("=", 1)
-                    if len(parts) == 2:
-                        API_MODEL = parts[1].strip().strip('"\'')
-except Exception as e:
-    logger.error(f"خطا در خواندن کلید API: {e}")
-
-# اطمینان از وجود پوشه‌های مورد نیاز
-os.makedirs(SCRIPTS_DIR, exist_ok=True)
-os.makedirs(HISTORY_DIR, exist_ok=True)
-
-# کپی اسکریپت نمونه به عنوان اسکریپت فعلی اگر وجود نداشته باشد
-current_script_path = os.path.join(SCRIPTS_DIR, "current_script.vbs")
-sample_script_path = os.path.join(SCRIPTS_DIR, "create_simple_part.vbs")
-if not os.path.exists(current_script_path) and os.path.exists(sample_script_path):
-    shutil.copy2(sample_script_path, current_script_path)
-    logger.info(f"اسکریپت نمونه به عنوان اسکریپت فعلی کپی شد.")
+    def current_trace_id(self) -> str:
+        """شناسه همبستگی درخواست جاری (خالی اگر درون هیچ trace نیستیم)"""
+        span = self._current.get()
+        return span["traceId"] if span else ""
+
+    def start(self, name: str, parent: Optional[Dict[str, Any]] = None, new_trace: bool = False,
+              **attributes) -> Optional[Dict[str, Any]]:
+        """ساخت یک بازه بدون فعال کردن آن (برای بازه‌هایی که در جای دیگری تمام می‌شوند)
+
+        Args:
+            name: نام بازه (مثلاً llm.http)
+            parent: بازه والد (پیش‌فرض: بازه جاری)
+            new_trace: شروع trace جدید حتی اگر بازه جاری وجود دارد
+            **attributes: ویژگی‌های بازه
+
+        Returns:
+            بازه ساخته شده یا None اگر ردیابی غیرفعال است
+        """
+        if not self.enabled:
+            return None
+        if parent is None and not new_trace:
+            parent = self._current.get()
+        return {
+            "traceId": parent["traceId"] if parent else uuid.uuid4().hex,
+            "spanId": uuid.uuid4().hex[:16],
+            "parentSpanId": parent["spanId"] if parent else "",
+            "name": name,
+            "start": time.time_ns(),
+            "attributes": dict(attributes),
+            "status": self.STATUS_OK,
+        }
+
+    def end(self, span: Optional[Dict[str, Any]], error: Optional[str] = None, end_ns: Optional[int] = None):
+        """پایان یک بازه و نوشتن آن در فایل
+
+        Args:
+            span: بازه ساخته شده با start (None نادیده گرفته می‌شود)
+            error: پیام خطا (بازه با وضعیت خطا ثبت می‌شود)
+            end_ns: زمان پایان (پیش‌فرض: اکنون)
+        """
+        if span is None:
+            return
+        span["end"] = end_ns or time.time_ns()
+        if error:
+            span["status"] = self.STATUS_ERROR
+            span["attributes"]["error"] = error[:300]
+        self._write(span)
+
+    @contextlib.contextmanager
+    def span(self, name: str, parent: Optional[Dict[str, Any]] = None, new_trace: bool = False, **attributes):
+        """بازه فعال در طول یک بلوک with؛ بازه‌های درون بلوک فرزند آن می‌شوند
+
+        Yields:
+            بازه (برای افزودن ویژگی در حین کار) یا None اگر ردیابی غیرفعال است
+        """
+        span = self.start(name, parent, new_trace, **attributes)
+        if span is None:
+            yield None
+            return
+        token = self._current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            self.end(span, error)
+
+    def record(self, name: str, start_ns: int, end_ns: int, parent: Optional[Dict[str, Any]] = None, **attributes):
+        """ثبت بازه‌ای که زمان‌هایش از قبل معلوم است (مثلاً انتظار در صف)"""
+        span = self.start(name, parent, **attributes)
+        if span is not None:
+            span["start"] = start_ns
+            self.end(span, end_ns=max(start_ns, end_ns))
+
+    def wrap(self, fn: Callable, name: Optional[str] = None) -> Callable:
+        """انتقال بازه جاری به تابعی که در ترد یا استخر دیگری اجرا می‌شود
+
+        Args:
+            fn: تابع هدف ترد یا کار استخر
+            name: نام بازه‌ای که دور اجرای تابع ثبت می‌شود (None یعنی بدون بازه جدید)
+        """
+        parent = self._current.get()
+        if not self.enabled or parent is None:
+            return fn
+
+        @functools.wraps(fn)
+        def _run(*args, **kwargs):
+            token = self._current.set(parent)
+            try:
+                if name is None:
+                    return fn(*args, **kwargs)
+                with self.span(name, thread=threading.current_thread().name):
+                    return fn(*args, **kwargs)
+            finally:
+                self._current.reset(token)
+        return _run
+
+    @staticmethod
+    def _otlp_value(value) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)[:500]}
+
+    @staticmethod
+    def _plain_value(value: Dict[str, Any]):
+        if "intValue" in value:
+            return int(value["intValue"])
+        for key in ("doubleValue", "boolValue", "stringValue"):
+            if key in value:
+                return value[key]
+        return None
+
+    def _write(self, span: Dict[str, Any]):
+        """نوشتن یک بازه به صورت یک خط OTLP JSON (با چرخش فایل در حجم MAX_FILE_BYTES)"""
+        if not self.path:
+            return
+        record = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "sw_api_panel"}, "spans": [{
+                "traceId": span["traceId"],
+                "spanId": span["spanId"],
+                "parentSpanId": span["parentSpanId"],
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span["start"]),
+                "endTimeUnixNano": str(span["end"]),
+                "attributes": [{"key": key, "value": self._otlp_value(value)}
+                               for key, value in span["attributes"].items() if value is not None],
+                "status": {"code": span["status"]},
+            }]}],
+        }]}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                if self._file_bytes is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    self._file_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                if self._file_bytes > self.MAX_FILE_BYTES:
+                    os.replace(self.path, self.path + ".1")
+                    self._file_bytes = 0
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                self._file_bytes += len(line.encode("utf-8"))
+        except Exception as e:
+            logger.error(f"خطا در نوشتن بازه ردیابی: {e}")
+
+    def load(self, trace_ids: List[str]) -> List[Dict[str, Any]]:
+        """خواندن بازه‌های چند trace از فایل (و نسخه چرخیده آن)
+
+        Args:
+            trace_ids: شناسه‌های همبستگی
+
+        Returns:
+            List[Dict[str, Any]]: بازه‌ها با کلیدهای traceId، spanId، parentSpanId، name، start، end،
+            attributes و status
+        """
+        wanted = set(trace_ids)
+        spans = []
+        for path in (self.path + ".1", self.path) if self.path else ():
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not any(trace_id in line for trace_id in wanted):
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    for resource in record.get("resourceSpans", []):
+                        for scope in resource.get("scopeSpans", []):
+                            for item in scope.get("spans", []):
+                                if item.get("traceId") not in wanted:
+                                    continue
+                                spans.append({
+                                    "traceId": item["traceId"],
+                                    "spanId": item["spanId"],
+                                    "parentSpanId": item.get("parentSpanId", ""),
+                                    "name": item["name"],
+                                    "start": int(item["startTimeUnixNano"]),
+                                    "end": int(item["endTimeUnixNano"]),
+                                    "attributes": {a["key"]: self._plain_value(a["value"])
+                                                   for a in item.get("attributes", [])},
+                                    "status": item.get("status", {}).get("code", self.STATUS_OK),
+                                })
+        return spans
+
+    @staticmethod
+    def waterfall_rows(spans: List[Dict[str, Any]]) -> List[Tuple[int, Dict[str, Any]]]:
+        """مرتب‌سازی درختی بازه‌ها برای نمایش آبشاری
+
+        Returns:
+            List[Tuple[int, Dict]]: (عمق، بازه) به ترتیب والد و سپس فرزندان بر اساس زمان شروع
+        """
+        by_id = {span["spanId"]: span for span in spans}
+        children = collections.defaultdict(list)
+        roots = []
+        for span in spans:
+            if span["parentSpanId"] in by_id:
+                children[span["parentSpanId"]].append(span)
+            else:
+                roots.append(span)
+        rows = []
+        stack = [(0, span) for span in sorted(roots, key=lambda s: s["start"], reverse=True)]
+        while stack:
+            depth, span = stack.pop()
+            rows.append((depth, span))
+            stack.extend((depth + 1, child) for child in sorted(children[span["spanId"]],
+                                                                key=lambda s: s["start"], reverse=True))
+        return rows
+
+    @classmethod
+    def format_waterfall(cls, spans: List[Dict[str, Any]], width: int = 40) -> str:
+        """نمایش متنی آبشاری بازه‌های یک یا چند trace
+
+        Args:
+            spans: بازه‌های خوانده شده با load
+            width: عرض نوار زمانی (نویسه)
+
+        Returns:
+            str: برای هر trace یک سرتیتر و برای هر بازه یک خط (شروع نسبی، مدت، نوار و نام)
+        """
+        lines = []
+        by_trace = collections.defaultdict(list)
+        for span in spans:
+            by_trace[span["traceId"]].append(span)
+        for trace_id, trace_spans in sorted(by_trace.items(), key=lambda item: min(s["start"] for s in item[1])):
+            begin = min(s["start"] for s in trace_spans)
+            total = max(1, max(s["end"] for s in trace_spans) - begin)
+            started = datetime.datetime.fromtimestamp(begin / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(f"trace {trace_id}  {started}  {total / 1e6:.1f} ms")
+            for depth, span in cls.waterfall_rows(trace_spans):
+                left = int((span["start"] - begin) * width / total)
+                length = max(1, int((span["end"] - span["start"]) * width / total))
+                bar = (" " * left + "#" * length)[:width].ljust(width)
+                details = " ".join(f"{key}={value}" for key, value in span["attributes"].items()
+                                   if key in ("endpoint", "model", "status_code", "exit_code", "path", "error"))
+                flag = " !" if span["status"] == cls.STATUS_ERROR else ""
+                lines.append(f"{(span['start'] - begin) / 1e6:9.1f} {(span['end'] - span['start']) / 1e6:9.1f} ms "
+                             f"|{bar}| {'  ' * depth}{span['name']}{flag} {details}".rstrip())
+            lines.append("")
+        return "\n".join(lines)
+
+class TracedQueue(queue.Queue):
+    """صف پیام تردها که بازه فرستنده و زمان ارسال را همراه هر پیام نگه می‌دارد
+
+    get() همان پیام را برمی‌گرداند؛ get_traced() (پیام، بازه، زمان ارسال) را برمی‌گرداند تا
+    گیرنده زمان انتظار در صف را ثبت کند و پردازش پیام را زیر همان trace ادامه دهد.
+    """
+
+    def __init__(self, tracer: Tracer):
+        super().__init__()
+        self.tracer = tracer
+
+    def put(self, item, block=True, timeout=None):
+        super().put((item, self.tracer.current(), time.time_ns()), block, timeout)
+
+    def get(self, block=True, timeout=None):
+        return super().get(block, timeout)[0]
+
+    def get_traced(self, block=True, timeout=None) -> Tuple[Any, Optional[Dict[str, Any]], int]:
+        return super().get(block, timeout)
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    """ردیاب مشترک کل برنامه (فایل traces.jsonl در پوشه تاریخچه)"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            config = get_config()
+            _tracer = Tracer(os.path.join(config.history_dir, "traces.jsonl"), config.trace_enabled)
+    return _tracer
+
+# === پروفایل عملکرد و تشخیص انسداد رابط کاربری ===
+
+class Profiler:
+    """پروفایل CPU و حافظه مراحل اصلی برنامه و تشخیص callbackهای مسدود کننده حلقه Tk
+
+    در حالت فعال هر مرحله (تولید، هایلایت، تاریخچه، اجرا) با cProfile اجرا می‌شود و زمان و
+    حجم تخصیص حافظه آن (tracemalloc) ثبت می‌شود. یک ترد نمونه‌بردار هر چند میلی‌ثانیه پشته
+    تردهایی را که درون یک مرحله هستند جمع می‌کند، و اگر ترد اصلی Tk بیش از block_ms به
+    heartbeat پاسخ ندهد پشته آن هم نمونه‌برداری و انسداد با callback مسئول ثبت می‌شود.
+    dump() نمونه‌ها را با قالب collapsed stack (برای flamegraph.pl یا speedscope)، آمار
+    cProfile هر مرحله و پرمصرف‌ترین محل‌های تخصیص حافظه را در پوشه diagnostics می‌نویسد.
+    در غیرفعال بودن، هزینه stage() فقط یک بررسی پرچم است.
+    """
+
+    SAMPLE_INTERVAL_S = 0.005
+    HEARTBEAT_MS = 50
+    MAX_STACK_DEPTH = 64
+    TRACEMALLOC_FRAMES = 10
+
+    def __init__(self, diagnostics_dir: str, enabled: bool = False, block_ms: float = 200.0):
+        """راه‌اندازی پروفایلر
+
+        Args:
+            diagnostics_dir: پوشه گزارش‌ها
+            enabled: فعال کردن از ابتدا
+            block_ms: حداقل مدت انسداد حلقه Tk برای ثبت (میلی‌ثانیه)
+        """
+        self.diagnostics_dir = diagnostics_dir
+        self.block_ms = block_ms
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._main_ident: Optional[int] = None
+        self._heartbeat: Optional[float] = None
+        self._reset()
+        if enabled:
+            self.set_enabled(True)
+
+    def _reset(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._profiles: Dict[str, Any] = {}
+        self._samples: "collections.Counter[str]" = collections.Counter()
+        self._active: Dict[int, List[str]] = {}
+        self._stall_stacks: "collections.Counter[str]" = collections.Counter()
+        self._stalls: List[Dict[str, Any]] = []
+        self._started = datetime.datetime.now()
+
+    def set_enabled(self, enabled: bool):
+        """فعال یا غیرفعال کردن پروفایل (با فعال شدن، آمار قبلی پاک می‌شود)"""
+        if enabled == self.enabled:
+            return
+        if enabled:
+            with self._lock:
+                self._reset()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACEMALLOC_FRAMES)
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="ProfilerSampler", daemon=True)
+            self.enabled = True
+            self._sampler.start()
+            logger.info(f"پروفایل عملکرد فعال شد (آستانه انسداد رابط کاربری {self.block_ms:.0f} ms)")
+        else:
+            self.enabled = False
+            self._stop.set()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            logger.info("پروفایل عملکرد غیرفعال شد")
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """اجرای یک بلوک به عنوان مرحله پروفایل شده
+
+        cProfile فقط برای بیرونی‌ترین مرحله هر ترد فعال می‌شود (فعال شدن پروفایلر دوم در همان
+        ترد اولی را قطع می‌کند)؛ در پایتون 3.12 به بعد اگر پروفایلر دیگری فعال باشد فقط زمان،
+        حافظه و نمونه‌های پشته ثبت می‌شوند.
+
+        Args:
+            name: نام مرحله (مثلاً generation یا highlight)
+        """
+        if not self.enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            stages = self._active.setdefault(ident, [])
+            stages.append(name)
+            outermost = len(stages) == 1
+        profile = cProfile.Profile() if outermost else None
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                profile = None
+        memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+            memory_after = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            with self._lock:
+                stages = self._active.get(ident, [])
+                if stages:
+                    stages.pop()
+                if not stages:
+                    self._active.pop(ident, None)
+                stat = self._stats.setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "net_alloc_kb": 0.0})
+                stat["calls"] += 1
+                stat["total_s"] += elapsed
+                stat["max_s"] = max(stat["max_s"], elapsed)
+                stat["net_alloc_kb"] += (memory_after - memory_before) / 1024
+                if profile is not None:
+                    if name in self._profiles:
+                        self._profiles[name].add(profile)
+                    else:
+                        self._profiles[name] = pstats.Stats(profile)
+
+    def watch_tk(self, root):
+        """شروع heartbeat روی حلقه Tk برای تشخیص callbackهای مسدود کننده
+
+        Args:
+            root: ریشه Tkinter (باید از ترد اصلی فراخوانی شود)
+        """
+        self._main_ident = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+
+        def _tick():
+            if not self.enabled:
+                self._heartbeat = None
+                return
+            now = time.perf_counter()
+            blocked_ms = (now - self._heartbeat) * 1000 - self.HEARTBEAT_MS
+            self._heartbeat = now
+            with self._lock:
+                stacks, self._stall_stacks = self._stall_stacks, collections.Counter()
+            if blocked_ms > self.block_ms:
+                culprit = self._culprit(stacks)
+                with self._lock:
+                    self._stalls.append({"at": datetime.datetime.now().strftime("%H:%M:%S"),
+                                         "blocked_ms": round(blocked_ms, 1), "callback": culprit,
+                                         "samples": sum(stacks.values())})
+                logger.warning(f"حلقه رابط کاربری {blocked_ms:.0f} ms مسدود شد ({culprit})")
+            root.after(self.HEARTBEAT_MS, _tick)
+
+        root.after(self.HEARTBEAT_MS, _tick)
+
+    @classmethod
+    def _collapse(cls, frame) -> str:
+        """تبدیل پشته یک فریم به یک خط collapsed stack (ریشه در ابتدا)"""
+        names = []
+        while frame is not None and len(names) < cls.MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    @staticmethod
+    def _culprit(stacks: "collections.Counter[str]") -> str:
+        """عمیق‌ترین تابع این ماژول در پرتکرارترین پشته انسداد (مثلاً _highlight_code)"""
+        if not stacks:
+            return "نامشخص"
+        stack = stacks.most_common(1)[0][0]
+        module = os.path.basename(__file__) + ":"
+        own = [name for name in stack.split(";") if name.startswith(module)]
+        return (own[-1] if own else stack.split(";")[-1]).split(":", 1)[1]
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL_S):
+            frames = sys._current_frames()
+            with self._lock:
+                active = {ident: stages[-1] for ident, stages in self._active.items() if stages}
+            for ident, name in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = self._collapse(frame)
+                    with self._lock:
+                        self._samples[f"{name};{stack}"] += 1
+            heartbeat = self._heartbeat
+            if heartbeat is not None and self._main_ident in frames:
+                blocked_ms = (time.perf_counter() - heartbeat) * 1000 - self.HEARTBEAT_MS
+                if blocked_ms > self.block_ms:
+                    stack = self._collapse(frames[self._main_ident])
+                    with self._lock:
+                        self._samples[f"tk-blocked;{stack}"] += 1
+                        self._stall_stacks[stack] += 1
+            del frames
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """آمار مراحل (تعداد، زمان کل، میانگین و بیشینه به میلی‌ثانیه و تخصیص خالص حافظه)"""
+        with self._lock:
+            stats = {name: dict(stat) for name, stat in self._stats.items()}
+        return [{"stage": name, "calls": int(stat["calls"]), "total_ms": round(stat["total_s"] * 1000, 1),
+                 "mean_ms": round(stat["total_s"] * 1000 / max(1, stat["calls"]), 1),
+                 "max_ms": round(stat["max_s"] * 1000, 1), "net_alloc_kb": round(stat["net_alloc_kb"], 1)}
+                for name, stat in sorted(stats.items(), key=lambda item: -item[1]["total_s"])]
+
+    def dump(self) -> str:
+        """نوشتن گزارش‌های پروفایل در یک زیرپوشه diagnostics
+
+        فایل‌ها: stacks.collapsed (نمونه‌های پشته، قابل نمایش با flamegraph.pl یا speedscope)،
+        report.txt (آمار مراحل، انسدادهای رابط کاربری و ۲۵ تابع پرهزینه هر مرحله)،
+        <مرحله>.prof (خروجی pstats) و allocations.txt (پرمصرف‌ترین محل‌های تخصیص حافظه).
+
+        Returns:
+            str: مسیر پوشه گزارش
+        """
+        output_dir = os.path.join(self.diagnostics_dir, datetime.datetime.now().strftime("profile_%Y%m%d_%H%M%S"))
+        os.makedirs(output_dir, exist_ok=True)
+        with self._lock:
+            samples = dict(self._samples)
+            profiles = dict(self._profiles)
+            stalls = list(self._stalls)
+        
+        with open(os.path.join(output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(samples.items()):
+                f.write(f"{stack} {count}\n")
+        
+        with open(os.path.join(output_dir, "report.txt"), "w", encoding="utf-8") as f:
+            f.write(f"SoliPy profile {self._started:%Y-%m-%d %H:%M:%S} - {datetime.datetime.now():%H:%M:%S}\n")
+            f.write(f"Python {sys.version.split()[0]} on {sys.platform}\n\n")
+            f.write(f"{'stage':<14}{'calls':>7}{'total ms':>12}{'mean ms':>10}{'max ms':>10}{'net alloc KB':>14}\n")
+            for row in self.summary():
+                f.write(f"{row['stage']:<14}{row['calls']:>7}{row['total_ms']:>12}{row['mean_ms']:>10}"
+                        f"{row['max_ms']:>10}{row['net_alloc_kb']:>14}\n")
+            f.write(f"\nUI loop blocked > {self.block_ms:.0f} ms: {len(stalls)}\n")
+            for stall in stalls:
+                f.write(f"  {stall['at']}  {stall['blocked_ms']:>8} ms  {stall['callback']}\n")
+            for name, stats in profiles.items():
+                stats.dump_stats(os.path.join(output_dir, f"{name}.prof"))
+                f.write(f"\n=== {name} (cProfile, cumulative) ===\n")
+                stats.stream = f
+                stats.sort_stats("cumulative").print_stats(25)
+        
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            with open(os.path.join(output_dir, "allocations.txt"), "w", encoding="utf-8") as f:
+                for stat in snapshot.statistics("traceback")[:25]:
+                    f.write(f"{stat.size / 1024:.1f} KB in {stat.count} blocks\n")
+                    for line in stat.traceback.format(limit=self.TRACEMALLOC_FRAMES):
+                        f.write(f"  {line}\n")
+                    f.write("\n")
+        
+        logger.info(f"گزارش پروفایل ذخیره شد: {output_dir}")
+        return output_dir
+
+    def dump_on_exit(self):
+        """نوشتن گزارش هنگام خروج برنامه اگر پروفایل هنوز فعال است"""
+        if self.enabled:
+            try:
+                self.dump()
+            except Exception as e:
+                logger.error(f"خطا در ذخیره گزارش پروفایل: {e}")
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+def get_profiler() -> Profiler:
+    """پروفایلر مشترک کل برنامه (با SW_PROFILE=1 از ابتدا فعال است)"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            config = get_config()
+            _profiler = Profiler(config.diagnostics_dir, config.profile_enabled, config.profile_block_ms)
+    return _profiler
 
 class APITester:
     """کلاس تست کننده API"""
@@ -146,7 +1239,7 @@ class APITester:
                     logger.warning(f"تست اتصال موفق بود اما خطا در پردازش پاسخ: {e}")
                     return True, "اتصال موفق، خطا در پردازش پاسخ"
             else:
-                logger.error(f"خطا در تست اتصال به API: {response.status_code} - {response.text}")
+                logger.error(f"خطا در تست اتصال به API: {response.status_code} - {truncate_for_log(response.text)}")
                 return False, f"خطا: {response.status_code}"
                 
         except requests.exceptions.Timeout:
@@ -159,44 +1252,246 @@ class APITester:
             logger.error(f"خطای کلی در تست API: {e}")
             return False, f"خطا: {str(e)[:40]}"
 
-class APISettingsDialog(tk.Toplevel):
-    """دیالوگ تنظیمات API برای وارد کردن API key، base URL و model"""
-    
-    def __init__(self, parent, api_key="", base_url="", api_model=""):
-        """راه‌اندازی دیالوگ تنظیمات API
+class EndpointBenchmark:
+    """مقایسه همزمان چند جفت نقطه پایانی/مدل و رتبه‌بندی آن‌ها
+
+    هر جفت با چند درخواست کوتاه stream سنجیده می‌شود: زمان اتصال TCP، زمان رسیدن اولین
+    توکن (TTFT)، سرعت تولید (توکن در ثانیه) و نرخ خطا. جفت‌ها به صورت موازی و نمونه‌های هر
+    جفت پشت سر هم اجرا می‌شوند تا نمونه‌های یک نقطه پایانی با هم رقابت نکنند. رتبه‌بندی با
+    زمان تخمینی یک پاسخ معمولی ((TTFT + EXPECTED_TOKENS / سرعت) / نرخ موفقیت) انجام می‌شود و بدون رابط
+    کاربری (خط فرمان یا سرور LLM آزمایشی) هم قابل استفاده است.
+    """
+
+    PROMPT = "Count from 1 to 40 separated by spaces."
+    MAX_TOKENS = 80
+    # طول تقریبی یک اسکریپت تولیدی برای تخمین زمان کل پاسخ
+    EXPECTED_TOKENS = 400
+    MAX_ERROR_RATE = 0.34
+
+    def __init__(self, samples: int = 3, timeout: float = 20.0, max_workers: int = 6):
+        """راه‌اندازی سنجش
 
         Args:
-            parent: پنجره والد
-            api_key: کلید API فعلی
-            base_url: آدرس API فعلی
-            api_model: مدل هوش مصنوعی فعلی
+            samples: تعداد درخواست برای هر جفت نقطه پایانی/مدل
+            timeout: حداکثر زمان هر درخواست (ثانیه)
+            max_workers: حداکثر جفت‌هایی که همزمان سنجیده می‌شوند
         """
-        super().__init__(parent)
-        self.title("تنظیمات API")
-        self.geometry("500x350")
-        self.resizable(False, False)
-        self.transient(parent)
-        self.grab_set()
-        
-        # رنگ‌های تم تیره
-        self.bg_color = "#1A1A2E"  # پس زمینه تیره
-        self.card_color = "#0F3460"  # کارت‌های تیره با کمی رنگ
-        self.text_color = "#FFFFFF"  # متن سفید
-        self.input_bg = "#1E2A4A"  # پس زمینه فیلد ورودی
-        self.button_bg = "#6A2CB3"  # بنفش تیره
-        self.button_active_bg = "#8A42D8"  # بنفش روشن‌تر
-        
-        # تنظیم رنگ پس‌زمینه
-        self.config(bg=self.bg_color)
-        
-        self.api_key = api_key
-        self.base_url = base_url
+        self.samples = max(1, samples)
+        self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+        self.cancel = threading.Event()
+
+    @staticmethod
+    def targets(api_key: str, base_url: str, api_model: str, model_tiers: Optional[List[str]] = None,
+                fallback_endpoints: Optional[List[Tuple[str, str, str]]] = None) -> List[Tuple["LLMEndpoint", str]]:
+        """جفت‌های نقطه پایانی/مدل قابل سنجش از تنظیمات
+
+        Args:
+            api_key: کلید نقطه پایانی اصلی
+            base_url: آدرس نقطه پایانی اصلی
+            api_model: مدل اصلی
+            model_tiers: سطوح مدل (هر کدام روی همه نقاط پایانی سنجیده می‌شود)
+            fallback_endpoints: نقاط پایانی جایگزین (آدرس، کلید، الگوی نام مدل)
+
+        Returns:
+            List[Tuple[LLMEndpoint, str]]: (نقطه پایانی، نام مدل در آن نقطه پایانی) بدون تکرار
+        """
+        models = list(dict.fromkeys([m for m in [api_model] + list(model_tiers or []) if m]))
+        endpoints = [LLMEndpoint(base_url, api_key)] if base_url else []
+        endpoints += [LLMEndpoint(url, key or api_key, template) for url, key, template in fallback_endpoints or []]
+        targets, seen = [], set()
+        for endpoint in endpoints:
+            for model in models:
+                key = (endpoint.url, endpoint.model_for(model))
+                if key not in seen:
+                    seen.add(key)
+                    targets.append((endpoint, key[1]))
+        return targets
+
+    def run(self, targets: List[Tuple["LLMEndpoint", str]],
+            progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """سنجش همزمان همه جفت‌ها
+
+        Args:
+            targets: جفت‌های نقطه پایانی/مدل (خروجی targets)
+            progress: تابعی که با نتیجه هر جفت، به محض آماده شدن، فراخوانی می‌شود
+
+        Returns:
+            List[Dict[str, Any]]: نتایج رتبه‌بندی شده (rank از 1؛ جفت‌های ناسالم در انتها)
+        """
+        results = []
+        if not targets:
+            return results
+        tracer = get_tracer()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets)),
+                                                   thread_name_prefix="EndpointBenchmark") as pool:
+            futures = [pool.submit(tracer.wrap(self.probe, "bench.probe"), endpoint, model)
+                       for endpoint, model in targets]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+        return self.rank(results)
+
+    @classmethod
+    def rank(cls, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """مرتب‌سازی نتایج: جفت‌های سالم بر اساس زمان تخمینی پاسخ، سپس ناسالم‌ها بر اساس نرخ خطا"""
+        ordered = sorted(results, key=lambda r: (not r["healthy"], r["expected_ms"] if r["healthy"] else r["error_rate"],
+                                                 r["error_rate"]))
+        for index, result in enumerate(ordered, 1):
+            result["rank"] = index
+        return ordered
+
+    @staticmethod
+    def best(results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """سریع‌ترین جفت سالم (None اگر هیچ جفتی سالم نیست)"""
+        healthy = [r for r in results if r["healthy"]]
+        return min(healthy, key=lambda r: r["expected_ms"]) if healthy else None
+
+    def probe(self, endpoint: "LLMEndpoint", model: str) -> Dict[str, Any]:
+        """سنجش یک جفت نقطه پایانی/مدل با چند نمونه پشت سر هم
+
+        Returns:
+            Dict[str, Any]: میانه connect_ms، ttft_ms و tokens_per_s نمونه‌های موفق، نرخ خطا،
+            زمان تخمینی پاسخ معمولی (expected_ms) و آخرین خطا
+        """
+        samples, errors, last_error = [], 0, ""
+        for _ in range(self.samples):
+            if self.cancel.is_set():
+                break
+            try:
+                samples.append(self._sample(endpoint, model))
+            except Exception as e:
+                errors += 1
+                last_error = str(e)[:120]
+        attempts = len(samples) + errors
+        error_rate = errors / attempts if attempts else 1.0
+
+        def median(key):
+            values = sorted(s[key] for s in samples if s[key] is not None)
+            return round(values[len(values) // 2], 1) if values else None
+
+        result = {"endpoint": endpoint.name, "url": endpoint.url, "api_key": endpoint.api_key, "model": model,
+                  "samples": attempts, "errors": errors, "error_rate": round(error_rate, 2),
+                  "connect_ms": median("connect_ms"), "ttft_ms": median("ttft_ms"),
+                  "tokens_per_s": median("tokens_per_s"), "error": last_error}
+        result["healthy"] = bool(samples) and error_rate <= self.MAX_ERROR_RATE
+        if samples:
+            tokens_per_s = result["tokens_per_s"] or 0.0
+            generation_ms = self.EXPECTED_TOKENS / tokens_per_s * 1000 if tokens_per_s > 0 else self.timeout * 1000
+            # هر خطا یعنی یک تلاش دوباره؛ زمان مورد انتظار با احتمال موفقیت تقسیم می‌شود
+            result["expected_ms"] = round((result["ttft_ms"] + generation_ms) / max(0.01, 1 - error_rate), 1)
+        else:
+            result["expected_ms"] = None
+        logger.info(f"سنجش {endpoint.name} / {model}: TTFT={result['ttft_ms']} ms، "
+                    f"{result['tokens_per_s']} توکن/ثانیه، خطا={errors}/{attempts}",
+                    extra={"endpoint": endpoint.name, "duration_ms": result["ttft_ms"]})
+        return result
+
+    def _sample(self, endpoint: "LLMEndpoint", model: str) -> Dict[str, Optional[float]]:
+        """یک درخواست stream و اندازه‌گیری زمان‌ها؛ خطاها به صورت استثنا برگردانده می‌شوند"""
+        connect_ms = self._connect_time(endpoint.url)
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": self.PROMPT}],
+            "temperature": 0,
+            "max_tokens": self.MAX_TOKENS,
+            "stream": True,
+        }
+        started = time.perf_counter()
+        first_token = None
+        text, usage_tokens = [], None
+        with requests.Session() as session:
+            response = session.post(endpoint.url, headers=endpoint.headers(), json=payload, stream=True,
+                                    timeout=(min(10.0, self.timeout), self.timeout))
+            try:
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code} {response.reason or ''}".strip())
+                if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                    # سرویس‌دهنده stream را نادیده گرفته؛ کل پاسخ به عنوان اولین توکن حساب می‌شود
+                    data = response.json()
+                    first_token = time.perf_counter()
+                    text.append(data.get("choices", [{}])[0].get("message", {}).get("content", "") or "")
+                    usage_tokens = (data.get("usage") or {}).get("completion_tokens")
+                else:
+                    for line in response.iter_lines():
+                        if self.cancel.is_set():
+                            raise concurrent.futures.CancelledError("سنجش لغو شد")
+                        if not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        if chunk.get("usage"):
+                            usage_tokens = chunk["usage"].get("completion_tokens")
+                        delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                        if delta:
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                            text.append(delta)
+            finally:
+                response.close()
+        finished = time.perf_counter()
+        if first_token is None:
+            raise RuntimeError("پاسخ خالی")
+        tokens = usage_tokens or PromptBuilder.count_tokens("".join(text))
+        # سرعت تولید پس از اولین توکن؛ پاسخ یکجا (بدون stream) با کل زمان سنجیده می‌شود
+        generation_s = finished - first_token
+        if generation_s < 0.001:
+            generation_s = finished - started
+        return {"connect_ms": connect_ms, "ttft_ms": (first_token - started) * 1000,
+                "tokens_per_s": tokens / generation_s if generation_s > 0 else None}
+
+    def _connect_time(self, url: str) -> Optional[float]:
+        """زمان برقراری اتصال TCP به میزبان نقطه پایانی (میلی‌ثانیه)؛ None اگر آدرس قابل تجزیه نیست"""
+        match = re.match(r'^(https?)://([^/:]+)(?::(\d+))?', url)
+        if not match:
+            return None
+        port = int(match.group(3) or (443 if match.group(1) == "https" else 80))
+        started = time.perf_counter()
+        with socket.create_connection((match.group(2), port), timeout=min(10.0, self.timeout)):
+            return (time.perf_counter() - started) * 1000
+
+class APISettingsDialog:
+    """دیالوگ تنظیمات API برای وارد کردن API key، base URL و model"""
+    
+    def __init__(self, parent, api_key="", base_url="", api_model=""):
+        """راه‌اندازی دیالوگ تنظیمات API
+
+        Args:
+            parent: پنجره والد
+            api_key: کلید API فعلی
+            base_url: آدرس API فعلی
+            api_model: مدل هوش مصنوعی فعلی
+        """
+        self.window = tk.Toplevel(parent)
+        self.window.title("تنظیمات API")
+        self.window.geometry("680x600")
+        self.window.resizable(False, False)
+        self.window.transient(parent)
+        self.window.grab_set()
+        
+        # رنگ‌های تم تیره
+        self.bg_color = "#1A1A2E"  # پس زمینه تیره
+        self.card_color = "#0F3460"  # کارت‌های تیره با کمی رنگ
+        self.text_color = "#FFFFFF"  # متن سفید
+        self.input_bg = "#1E2A4A"  # پس زمینه فیلد ورودی
+        self.button_bg = "#6A2CB3"  # بنفش تیره
+        self.button_active_bg = "#8A42D8"  # بنفش روشن‌تر
+        
+        # تنظیم رنگ پس‌زمینه
+        self.window.config(bg=self.bg_color)
+        
+        self.api_key = api_key
+        self.base_url = base_url
         self.api_model = api_model
         
         self.result = {"api_key": self.api_key, "base_url": self.base_url, "api_model": self.api_model}
         
         # ایجاد فریم اصلی
-        main_frame = tk.Frame(self, bg=self.bg_color, padx=10, pady=10)
+        main_frame = tk.Frame(self.window, bg=self.bg_color, padx=10, pady=10)
         main_frame.pack(fill=tk.BOTH, expand=True)
         
         # فیلدهای ورودی
@@ -235,8 +1530,50 @@ class APISettingsDialog(tk.Toplevel):
         self.test_result_label = tk.Label(test_frame, text="", anchor=tk.W, bg=self.bg_color, fg=self.text_color)
         self.test_result_label.pack(side=tk.LEFT, padx=(10, 0))
         
+        # مقایسه همزمان نقاط پایانی و مدل‌ها
+        bench_frame = tk.Frame(main_frame, bg=self.bg_color)
+        bench_frame.grid(row=4, column=0, columnspan=2, sticky=tk.EW, pady=(5, 0))
+        
+        self.bench_btn = tk.Button(bench_frame, text="مقایسه نقاط پایانی", 
+                                command=self._run_benchmark,
+                                bg=self.button_bg,
+                                fg="white",
+                                activebackground=self.button_active_bg,
+                                activeforeground="white",
+                                font=("Segoe UI", 10),
+                                bd=0,
+                                relief=tk.FLAT,
+                                padx=10,
+                                pady=5)
+        self.bench_btn.pack(side=tk.LEFT, padx=2)
+        
+        self.auto_select_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(bench_frame, text="انتخاب خودکار سریع‌ترین", variable=self.auto_select_var,
+                       bg=self.bg_color, fg=self.text_color, selectcolor=self.input_bg,
+                       activebackground=self.bg_color, activeforeground=self.text_color).pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.bench_status_label = tk.Label(bench_frame, text="", anchor=tk.W, bg=self.bg_color, fg=self.text_color)
+        self.bench_status_label.pack(side=tk.LEFT, padx=(10, 0))
+        
+        columns = ("rank", "endpoint", "model", "connect", "ttft", "tps", "errors", "status")
+        self.bench_table = ttk.Treeview(main_frame, columns=columns, show="headings", height=6)
+        for column, heading, width in zip(columns, ("#", "نقطه پایانی", "مدل", "اتصال (ms)", "TTFT (ms)",
+                                                    "توکن/ثانیه", "خطا", "وضعیت"),
+                                          (30, 150, 140, 70, 70, 70, 45, 60)):
+            self.bench_table.heading(column, text=heading)
+            self.bench_table.column(column, width=width, anchor=tk.W if column in ("endpoint", "model") else tk.CENTER)
+        self.bench_table.grid(row=5, column=0, columnspan=2, sticky=tk.EW, pady=(5, 0))
+        self.bench_table.bind("<Double-1>", self._on_bench_select)
+        
+        self._bench_results: Dict[str, Dict[str, Any]] = {}
+        self._bench_primary_url = ""
+        self._model_tiers: Optional[List[str]] = None
+        self._bench_queue = queue.Queue()
+        self._test_queue = queue.Queue()
+        self._benchmark: Optional[EndpointBenchmark] = None
+        
         # بخش توضیحات
-        tk.Label(main_frame, text="راهنما:", anchor=tk.W, bg=self.bg_color, fg=self.text_color, font=("Segoe UI", 10)).grid(row=4, column=0, sticky=tk.W, pady=(10, 5))
+        tk.Label(main_frame, text="راهنما:", anchor=tk.W, bg=self.bg_color, fg=self.text_color, font=("Segoe UI", 10)).grid(row=6, column=0, sticky=tk.W, pady=(10, 5))
         help_text = (
             "برای استفاده از OpenAI:\n"
             "- Base URL: https://api.openai.com/v1/chat/completions\n"
@@ -246,11 +1583,11 @@ class APISettingsDialog(tk.Toplevel):
             "- مدل: google/gemini-1.5-pro"
         )
         help_label = tk.Label(main_frame, text=help_text, anchor=tk.W, justify=tk.LEFT, bg=self.bg_color, fg=self.text_color)
-        help_label.grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=(0, 10))
+        help_label.grid(row=7, column=0, columnspan=2, sticky=tk.W, pady=(0, 10))
         
         # دکمه‌های پایین
         buttons_frame = tk.Frame(main_frame, bg=self.bg_color)
-        buttons_frame.grid(row=6, column=0, columnspan=2, pady=(10, 0))
+        buttons_frame.grid(row=8, column=0, columnspan=2, pady=(10, 0))
         
         save_btn = tk.Button(buttons_frame, text="ذخیره", 
                            command=self._on_save,
@@ -279,40 +1616,187 @@ class APISettingsDialog(tk.Toplevel):
         cancel_btn.pack(side=tk.LEFT, padx=5)
         
         # حذف تغییرات در صورت بستن پنجره
-        self.protocol("WM_DELETE_WINDOW", self._on_cancel)
+        self.window.protocol("WM_DELETE_WINDOW", self._on_cancel)
         
         # تمرکز بر فیلد اول
         self.api_key_entry.focus_set()
         
     def _test_api(self):
-        """تست اتصال به API"""
+        """تست اتصال به API در ترد جداگانه (رابط کاربری در طول تست پاسخگو می‌ماند)"""
         self.test_result_label.config(text="در حال تست...", foreground="white", background=self.bg_color)
-        self.update_idletasks()
+        self.test_btn.config(state=tk.DISABLED)
         
         api_key = self.api_key_entry.get().strip()
         base_url = self.base_url_entry.get().strip()
         api_model = self.model_entry.get().strip()
+        results = self._test_queue
         
-        success, message = APITester.test_api_connection(api_key, base_url, api_model)
+        def _worker():
+            try:
+                results.put(APITester.test_api_connection(api_key, base_url, api_model))
+            except Exception as e:
+                logger.error(f"خطا در تست API: {e}")
+                results.put((False, f"خطا: {str(e)[:40]}"))
+        
+        threading.Thread(target=_worker, name="APITest", daemon=True).start()
+        self.window.after(100, self._poll_test_api)
+    
+    def _poll_test_api(self):
+        """نمایش نتیجه تست اتصال پس از پایان آن (در ترد اصلی)"""
+        if not self.window.winfo_exists():
+            return
+        try:
+            success, message = self._test_queue.get_nowait()
+        except queue.Empty:
+            self.window.after(100, self._poll_test_api)
+            return
+        self.test_btn.config(state=tk.NORMAL)
         
         if success:
             self.test_result_label.config(text=f"✓ {message}", foreground="#4CAF50", background=self.bg_color)
         else:
             self.test_result_label.config(text=f"✗ {message}", foreground="#F44336", background=self.bg_color)
     
+    def _run_benchmark(self):
+        """سنجش همزمان همه جفت‌های نقطه پایانی/مدل تنظیم شده در ترد جداگانه"""
+        config = get_config()
+        self._bench_primary_url = self.base_url_entry.get().strip()
+        targets = EndpointBenchmark.targets(self.api_key_entry.get().strip(), self._bench_primary_url,
+                                            self.model_entry.get().strip(), config.model_tiers,
+                                            config.fallback_endpoints)
+        if not targets:
+            self.bench_status_label.config(text="✗ لطفاً Base URL و مدل را وارد کنید", fg="#F44336")
+            return
+        
+        self.bench_table.delete(*self.bench_table.get_children())
+        self._bench_results = {}
+        self.bench_btn.config(state=tk.DISABLED)
+        self.bench_status_label.config(text=f"در حال سنجش {len(targets)} گزینه...", fg=self.text_color)
+        
+        self._benchmark = EndpointBenchmark()
+        benchmark, results = self._benchmark, self._bench_queue
+        
+        def _worker():
+            try:
+                ranked = benchmark.run(targets, progress=lambda result: results.put(("progress", result)))
+                results.put(("done", ranked))
+            except Exception as e:
+                logger.error(f"خطا در سنجش نقاط پایانی: {e}")
+                results.put(("error", str(e)))
+        
+        threading.Thread(target=_worker, name="EndpointBenchmark", daemon=True).start()
+        self.window.after(100, self._poll_benchmark)
+    
+    def _poll_benchmark(self):
+        """نمایش نتایج سنجش به محض آماده شدن (در ترد اصلی)"""
+        if not self.window.winfo_exists():
+            return
+        finished = False
+        try:
+            while True:
+                kind, data = self._bench_queue.get_nowait()
+                if kind == "progress":
+                    self._show_bench_rows(list(self._bench_results.values()) + [data], ranked=False)
+                elif kind == "done":
+                    self._show_bench_rows(data, ranked=True)
+                    finished = True
+                else:
+                    self.bench_status_label.config(text=f"✗ {data[:60]}", fg="#F44336")
+                    finished = True
+        except queue.Empty:
+            pass
+        if finished:
+            self.bench_btn.config(state=tk.NORMAL)
+            self._benchmark = None
+        else:
+            self.window.after(100, self._poll_benchmark)
+    
+    def _show_bench_rows(self, results: List[Dict[str, Any]], ranked: bool):
+        """بازسازی جدول نتایج
+
+        Args:
+            results: نتایج EndpointBenchmark.probe
+            ranked: نتایج نهایی رتبه‌بندی شده هستند (انتخاب خودکار فقط در این حالت)
+        """
+        if not ranked:
+            results = EndpointBenchmark.rank([dict(r) for r in results])
+        self._bench_results = {}
+        self.bench_table.delete(*self.bench_table.get_children())
+        for result in results:
+            iid = f"{result['url']}|{result['model']}"
+            self._bench_results[iid] = result
+            self.bench_table.insert("", tk.END, iid=iid, values=(
+                result["rank"], result["endpoint"], result["model"],
+                "-" if result["connect_ms"] is None else f"{result['connect_ms']:.0f}",
+                "-" if result["ttft_ms"] is None else f"{result['ttft_ms']:.0f}",
+                "-" if result["tokens_per_s"] is None else f"{result['tokens_per_s']:.1f}",
+                f"{result['errors']}/{result['samples']}",
+                "سالم" if result["healthy"] else "ناسالم"))
+        if not ranked:
+            return
+        best = EndpointBenchmark.best(results)
+        if best is None:
+            self.bench_status_label.config(text="✗ هیچ گزینه سالمی پیدا نشد", fg="#F44336")
+            return
+        self.bench_table.selection_set(f"{best['url']}|{best['model']}")
+        # انتخاب خودکار فقط بین مدل‌های نقطه پایانی اصلی؛ تغییر نقطه پایانی با دوبار کلیک و آگاهانه انجام می‌شود
+        primary_best = EndpointBenchmark.best([r for r in results if r["url"] == self._bench_primary_url])
+        if self.auto_select_var.get() and primary_best is not None:
+            self._apply_bench_result(primary_best)
+            if primary_best is not best:
+                self.bench_status_label.config(
+                    text=f"✓ {primary_best['model']} انتخاب شد؛ سریع‌تر: {best['endpoint']} (دوبار کلیک)", fg="#4CAF50")
+            return
+        self.bench_status_label.config(text=f"✓ سریع‌ترین: {best['endpoint']} / {best['model']}", fg="#4CAF50")
+    
+    def _on_bench_select(self, event=None):
+        """انتخاب دستی یک ردیف جدول با دوبار کلیک"""
+        selection = self.bench_table.selection()
+        if selection and selection[0] in self._bench_results:
+            self._apply_bench_result(self._bench_results[selection[0]])
+    
+    def _apply_bench_result(self, result: Dict[str, Any]):
+        """قرار دادن نقطه پایانی، کلید و مدل یک نتیجه در فیلدها (با ذخیره اعمال می‌شود)
+
+        اگر نقطه پایانی تغییر کند، سطوح مدل هم با الگوی نام مدل همان نقطه پایانی بازنویسی
+        می‌شوند تا نام‌هایی که آنجا وجود ندارند فرستاده نشوند؛ تغییر در برچسب وضعیت نشان داده می‌شود.
+        """
+        for entry, value in ((self.base_url_entry, result["url"]), (self.model_entry, result["model"]),
+                             (self.api_key_entry, result["api_key"])):
+            if value:
+                entry.delete(0, tk.END)
+                entry.insert(0, value)
+        
+        config = get_config()
+        if result["url"] == self._bench_primary_url or not config.model_tiers:
+            self._model_tiers = None
+            self.bench_status_label.config(text=f"✓ انتخاب شد: {result['endpoint']} / {result['model']}", fg="#4CAF50")
+            return
+        template = next((t for url, _, t in config.fallback_endpoints if url == result["url"]), "{model}")
+        self._model_tiers = [template.replace("{model}", tier) for tier in config.model_tiers]
+        self.bench_status_label.config(
+            text=f"✓ نقطه پایانی تغییر کرد؛ سطوح مدل: {', '.join(config.model_tiers)} ← {', '.join(self._model_tiers)}",
+            fg="#FFC107")
+    
     def _on_save(self):
         """ذخیره تنظیمات و بستن دیالوگ"""
+        if self._benchmark is not None:
+            self._benchmark.cancel.set()
         self.result = {
             "api_key": self.api_key_entry.get().strip(),
             "base_url": self.base_url_entry.get().strip(),
             "api_model": self.model_entry.get().strip()
         }
-        self.destroy()
+        if self._model_tiers is not None:
+            self.result["model_tiers"] = self._model_tiers
+        self.window.destroy()
     
     def _on_cancel(self):
         """انصراف از تغییرات و بستن دیالوگ"""
+        if self._benchmark is not None:
+            self._benchmark.cancel.set()
         self.result = None
-        self.destroy()
+        self.window.destroy()
     
     @staticmethod
     def show_dialog(parent, api_key="", base_url="", api_model=""):
@@ -328,382 +1812,6194 @@ class APISettingsDialog(tk.Toplevel):
             dict: دیکشنری حاوی تنظیمات API یا None در صورت انصراف
         """
         dialog = APISettingsDialog(parent, api_key, base_url, api_model)
-        parent.wait_window(dialog)
+        parent.wait_window(dialog.window)
         return dialog.result
 
-class SolidWorksScriptGenerator:
-    """کلاس تولید کننده اسکریپت‌های VBS برای SolidWorks"""
-    
-    def __init__(self, api_key: str = "", base_url: str = "", api_model: str = ""):
-        """راه اندازی تولید کننده اسکریپت
+# === اجرای درون‌پردازشی از طریق COM ===
+
+class FakeSolidWorksApp:
+    """شیء جایگزین SolidWorks برای اجرای آزمایشی بدون نرم‌افزار CAD
+
+    تمام فراخوانی‌ها در لیست calls ثبت می‌شوند و هر متد ناشناخته یک شیء جایگزین
+    دیگر برمی‌گرداند تا زنجیره‌هایی مثل swModel.SketchManager.CreateCircleByRadius کار کنند.
+    """
+
+    def __init__(self, name: str = "SldWorks.Application", calls: Optional[List[Tuple[str, tuple]]] = None):
+        self._name = name
+        self.calls = calls if calls is not None else []
+        self.Visible = False
+        self.RevisionNumber = "0.0.0"
+        self.ActiveDoc = None
+
+    def NewDocument(self, template_path, *args):
+        """ایجاد سند جایگزین و فعال کردن آن"""
+        self.calls.append((f"{self._name}.NewDocument", (template_path,) + args))
+        self.ActiveDoc = FakeSolidWorksApp("ModelDoc2", self.calls)
+        return self.ActiveDoc
+
+    def __call__(self, *args):
+        self.calls.append((self._name, args))
+        return FakeSolidWorksApp(self._name, self.calls)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return FakeSolidWorksApp(f"{self._name}.{attr}", self.calls)
+
+class _WScriptShim:
+    """پیاده‌سازی حداقلی شیء WScript برای اجرای اسکریپت در ScriptControl"""
+
+    _public_methods_ = ["Echo", "Quit", "Sleep", "CreateObject", "GetObject"]
+    _public_attrs_ = ["ScriptName", "ScriptFullName", "Arguments"]
+    _readonly_attrs_ = ["ScriptName", "ScriptFullName", "Arguments"]
+
+    def __init__(self, script_path: str, args: Optional[List[str]] = None):
+        self.ScriptFullName = script_path
+        self.ScriptName = os.path.basename(script_path)
+        self.Arguments = _WScriptArguments(args or [])
+        self.output: List[str] = []
+        self.exit_code: Optional[int] = None
+
+    def Echo(self, *args):
+        self.output.append(" ".join(str(arg) for arg in args))
+
+    def Quit(self, exit_code=0):
+        from win32com.server.exception import COMException
+        self.exit_code = int(exit_code or 0)
+        # توقف اسکریپت با ایجاد خطا؛ کد خروج قبلاً ذخیره شده است
+        raise COMException(desc=f"WScript.Quit({self.exit_code})")
+
+    def Sleep(self, milliseconds):
+        time.sleep(int(milliseconds) / 1000.0)
+
+    def CreateObject(self, prog_id, *args):
+        import win32com.client
+        return win32com.client.Dispatch(prog_id)
+
+    def GetObject(self, path=None, prog_id=None):
+        import win32com.client
+        return win32com.client.GetObject(path, prog_id)
+
+class _WScriptArguments:
+    """مجموعه آرگومان‌های WScript.Arguments"""
+
+    _public_methods_ = ["Item"]
+    _public_attrs_ = ["Count", "length"]
+    _readonly_attrs_ = ["Count", "length"]
+
+    def __init__(self, args: List[str]):
+        self._args = list(args)
+        self.Count = len(self._args)
+        self.length = len(self._args)
+
+    def Item(self, index):
+        return self._args[int(index)]
+
+    def _value_(self, index):
+        return self.Item(index)
+
+class VBScriptHost:
+    """میزبان VBScript درون‌پردازشی بر پایه MSScriptControl
+
+    اسکریپت‌ها بدون ایجاد پردازش cscript اجرا می‌شوند و به جای GetObject/CreateObject
+    مستقیماً شیء SolidWorks زنده را از طریق نام SwSession دریافت می‌کنند.
+    MSScriptControl فقط نسخه 32 بیتی دارد؛ روی پایتون 64 بیتی (مگر با جایگزین 64 بیتی
+    ثبت شده) ساخته نمی‌شود و اجرا کننده به cscript برمی‌گردد.
+    """
+
+    # جایگزینی اتصال مجدد اسکریپت با نشست زنده
+    _CONNECT_PATTERN = re.compile(
+        r'(?:GetObject\s*\(\s*,\s*|CreateObject\s*\(\s*)"SldWorks\.Application"\s*\)',
+        re.IGNORECASE,
+    )
+
+    def __init__(self):
+        import win32com.client
+        try:
+            self._control = win32com.client.Dispatch("MSScriptControl.ScriptControl")
+        except Exception as e:
+            if sys.maxsize > 2 ** 32:
+                raise RuntimeError("MSScriptControl.ScriptControl فقط 32 بیتی است و از پایتون 64 بیتی قابل استفاده نیست "
+                                   f"(برای اجرای درون‌پردازشی پایتون 32 بیتی لازم است): {e}") from e
+            raise
+        self._control.Language = "VBScript"
+        self._control.AllowUI = True
+        self._control.Timeout = -1  # بدون محدودیت زمانی
+
+    @classmethod
+    def prepare_source(cls, source: str) -> str:
+        """جایگزینی کد اتصال اسکریپت با نشست زنده"""
+        return cls._CONNECT_PATTERN.sub("SwSession", source)
+
+    def run(self, source: str, app: Any, script_path: str, args: Optional[List[str]] = None) -> Tuple[int, str]:
+        """اجرای کد VBScript
 
         Args:
-            api_key: کلید API برای استفاده از سرویس هوش مصنوعی
-            base_url: آدرس API
-            api_model: مدل هوش مصنوعی
+            source: متن اسکریپت
+            app: شیء SolidWorks زنده
+            script_path: مسیر اسکریپت (برای WScript.ScriptName و پیام‌های خطا)
+            args: آرگومان‌های خط فرمان اسکریپت
+
+        Returns:
+            (کد_خروج, خروجی): کد خروج اسکریپت و خروجی WScript.Echo
         """
-        self.api_key = api_key if api_key else API_KEY
-        self.api_url = base_url if base_url else BASE_URL
-        self.api_model = api_model if api_model else API_MODEL
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-            "HTTP-Referer": "https://solipy.app"
-        }
-    
-    def generate_script(self, query: str) -> Tuple[bool, str, Optional[str]]:
-        """تولید اسکریپت VBS بر اساس درخواست کاربر
+        from win32com.server.util import wrap
+
+        shim = _WScriptShim(script_path, args)
+        self._control.Reset()
+        self._control.AddObject("WScript", wrap(shim), True)
+        self._control.AddObject("SwSession", app, True)
+
+        exit_code = 0
+        try:
+            self._control.AddCode(self.prepare_source(source))
+        except Exception as e:
+            if shim.exit_code is not None:
+                exit_code = shim.exit_code
+            else:
+                error = self._control.Error
+                shim.output.append(
+                    f"{script_path}({error.Line}, {error.Column}) Microsoft VBScript error: "
+                    f"{error.Description or e}"
+                )
+                exit_code = 1
+        return exit_code, "\n".join(shim.output)
+
+class SolidWorksCOMRunner:
+    """اجرای اسکریپت‌ها و عملیات کامپایل شده روی یک اتصال COM ماندگار به SolidWorks
+
+    تمام فراخوانی‌های COM در یک ترد کارگر اختصاصی انجام می‌شوند، چون اشیاء COM به
+    آپارتمان تردی که در آن ساخته شده‌اند وابسته‌اند. اتصال یک بار برقرار می‌شود و بین
+    اجراها حفظ می‌شود؛ در صورت قطع شدن، اجرای بعدی دوباره وصل می‌شود.
+    """
+
+    def __init__(self,
+                 app_factory: Optional[Callable[[], Any]] = None,
+                 script_host_factory: Optional[Callable[[], Any]] = None):
+        """راه‌اندازی اجرا کننده COM
 
         Args:
-            query: متن درخواست کاربر
+            app_factory: تابع ایجاد شیء SolidWorks (پیش‌فرض: اتصال از طریق pywin32)
+            script_host_factory: تابع ایجاد میزبان VBScript (پیش‌فرض: VBScriptHost)
+        """
+        self.app_factory = app_factory or self._default_app_factory
+        self.script_host_factory = script_host_factory or VBScriptHost
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._app = None
+        self._script_host = None
+        self._script_host_error = None
+        self._lock = threading.Lock()
+        self.busy = False
+
+    @staticmethod
+    def _default_app_factory():
+        """اتصال به SolidWorks در حال اجرا یا اجرای آن"""
+        import win32com.client
+        try:
+            return win32com.client.GetActiveObject("SldWorks.Application")
+        except Exception:
+            app = win32com.client.Dispatch("SldWorks.Application")
+            app.Visible = True
+            return app
+
+    def start(self):
+        """شروع ترد کارگر (در صورت نیاز)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_loop, name="SolidWorksCOMRunner", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """توقف ترد کارگر و آزادسازی اتصال"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            thread.join(timeout)
+        self._thread = None
+
+    def submit(self, operation: Callable[[Any], Any]) -> concurrent.futures.Future:
+        """ارسال یک عملیات برای اجرا روی ترد کارگر
+
+        Args:
+            operation: تابعی که شیء زنده SolidWorks را دریافت می‌کند
 
         Returns:
-            (موفقیت, پیام, مسیر_اسکریپت): وضعیت تولید اسکریپت، پیام و مسیر فایل اسکریپت تولید شده
+            Future: نتیجه عملیات
+        """
+        self.start()
+        future = concurrent.futures.Future()
+        self._jobs.put((operation, future))
+        return future
+
+    def run_operation(self, operation: Callable[[Any], Any], timeout: Optional[float] = None) -> Tuple[bool, str, Any]:
+        """اجرای یک عملیات کامپایل شده و انتظار برای نتیجه
+
+        Args:
+            operation: تابعی که شیء زنده SolidWorks را دریافت می‌کند
+            timeout: حداکثر زمان انتظار (ثانیه)
+
+        Returns:
+            (موفقیت, پیام, نتیجه): وضعیت اجرا، پیام و مقدار بازگشتی عملیات
         """
         try:
-            # لاگ کردن درخواست
-            logger.info(f"درخواست جدید: {query}")
-            
-            if not self.api_key:
-                return False, "کلید API تنظیم نشده است. لطفاً کلید API را در فایل .env یا doc.txt تنظیم کنید.", None
-            
-            # ایجاد درخواست API
-            system_prompt = """You are an expert in SolidWorks automation with VBScript. 
-Your task is to generate VBScript code that can automate SolidWorks operations.
-You MUST understand user instructions in both English and Persian (Farsi) language.
-When user instructions are in Persian, you should understand words like "بکش", "دایره", "خط", "مستطیل", etc.
-Keep your responses focused only on the VBScript code without any explanations.
+            result = self.submit(operation).result(timeout)
+            return True, "عملیات با موفقیت اجرا شد.", result
+        except concurrent.futures.TimeoutError:
+            return False, "زمان اجرای عملیات به پایان رسید", None
+        except Exception as e:
+            logger.error(f"خطا در اجرای عملیات COM: {e}")
+            return False, f"خطا در اجرای عملیات: {str(e)}", None
 
-IMPORTANT: Always structure your script in this sequence:
-1. Start with 'Option Explicit'
-2. Include connection code that connects to SolidWorks first:
+    def supports_scripts(self) -> bool:
+        """بررسی امکان اجرای VBScript درون‌پردازشی (پس از اولین ساخت یا شکست میزبان از کش)"""
+        if self._script_host is not None:
+            return True
+        if self._script_host_error is not None:
+            return False
+        ok, _, _ = self.run_operation(lambda app: self._get_script_host(), timeout=30)
+        return ok and self._script_host is not None
 
-Dim swApp
+    def execute_script(self, script_path: str, args: Optional[List[str]] = None,
+                       timeout: Optional[float] = None) -> Tuple[bool, str, str]:
+        """اجرای اسکریپت VBS روی اتصال ماندگار
+
+        Args:
+            script_path: مسیر فایل اسکریپت
+            args: آرگومان‌های خط فرمان اسکریپت
+            timeout: حداکثر زمان انتظار (ثانیه)
+
+        Returns:
+            (موفقیت, پیام, خروجی): وضعیت اجرا، پیام و خروجی اسکریپت
+        """
+        if not os.path.exists(script_path):
+            return False, f"فایل اسکریپت وجود ندارد: {script_path}", ""
+
+        with open(script_path, "r", encoding='utf-8') as f:
+            source = f.read()
+
+        def _run(app):
+            host = self._get_script_host()
+            if host is None:
+                raise RuntimeError(f"میزبان VBScript در دسترس نیست: {self._script_host_error}")
+            return host.run(source, app, script_path, args)
+
+        started = time.perf_counter()
+        ok, message, result = self.run_operation(_run, timeout)
+        if not ok:
+            return False, message, ""
+
+        exit_code, output = result
+        log_extra = {"duration_ms": round((time.perf_counter() - started) * 1000, 1), "exit_code": exit_code}
+        if exit_code == 0:
+            logger.info(f"اسکریپت با موفقیت اجرا شد (COM): {script_path}", extra=log_extra)
+            return True, "اسکریپت با موفقیت اجرا شد.", output
+        logger.error(f"خطا در اجرای اسکریپت {script_path} (COM): {truncate_for_log(output)}", extra=log_extra)
+        return False, f"خطا در اجرای اسکریپت (کد خروج: {exit_code})", output
+
+    def _get_script_host(self):
+        """ایجاد میزبان VBScript روی ترد کارگر (فقط یک بار)"""
+        if self._script_host is None and self._script_host_error is None:
+            try:
+                self._script_host = self.script_host_factory()
+            except Exception as e:
+                self._script_host_error = e
+                logger.warning(f"میزبان VBScript درون‌پردازشی در دسترس نیست؛ اسکریپت‌ها با cscript اجرا می‌شوند: {e}")
+        return self._script_host
+
+    def _connect(self):
+        """برقراری یا استفاده مجدد از اتصال"""
+        if self._app is None:
+            start = time.perf_counter()
+            self._app = self.app_factory()
+            logger.info(f"اتصال COM به SolidWorks برقرار شد ({time.perf_counter() - start:.2f}s)")
+        return self._app
+
+    def _is_alive(self) -> bool:
+        """بررسی سالم بودن اتصال فعلی"""
+        try:
+            _ = self._app.Visible
+            return True
+        except Exception:
+            return False
+
+    def _worker_loop(self):
+        """حلقه ترد کارگر"""
+        pythoncom = None
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pythoncom = None
+
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                operation, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.busy = True
+                try:
+                    future.set_result(operation(self._connect()))
+                except Exception as e:
+                    # اتصال قطع شده؛ اجرای بعدی دوباره وصل می‌شود
+                    if self._app is not None and not self._is_alive():
+                        logger.warning("اتصال COM به SolidWorks قطع شد.")
+                        self._app = None
+                    future.set_exception(e)
+                finally:
+                    self.busy = False
+        finally:
+            self._app = None
+            self._script_host = None
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+class LocalSolidWorksStandIn:
+    """جایگزین محلی SolidWorks برای آزمایش زمان‌بندی و بازیابی نشست بدون CAD
+
+    به عنوان app_factory به SolidWorksCOMRunner داده می‌شود. می‌توان تأخیر راه‌اندازی،
+    تعداد تلاش‌های ناموفق و قطع شدن ناگهانی نرم‌افزار را شبیه‌سازی کرد.
+    """
+
+    def __init__(self, startup_delay: float = 0.0, failures: int = 0):
+        """راه‌اندازی جایگزین
+
+        Args:
+            startup_delay: تأخیر شبیه‌سازی شده راه‌اندازی (ثانیه)
+            failures: تعداد تلاش‌های اتصال که باید ناموفق شوند
+        """
+        self.startup_delay = startup_delay
+        self.failures = failures
+        self.connect_count = 0
+        self.app = None
+
+    def __call__(self):
+        self.connect_count += 1
+        if self.startup_delay:
+            time.sleep(self.startup_delay)
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("SolidWorks stand-in failed to start")
+        self.app = _StandInSolidWorksApp()
+        return self.app
+
+    def crash(self):
+        """شبیه‌سازی بسته شدن ناگهانی SolidWorks"""
+        if self.app is not None:
+            self.app.alive = False
+
+class _StandInSolidWorksApp(FakeSolidWorksApp):
+    """شیء SolidWorks جایگزین که می‌تواند قطع شود"""
+
+    def __init__(self):
+        self.alive = True
+        super().__init__()
+
+    @property
+    def Visible(self):
+        if not self.alive:
+            raise RuntimeError("The object invoked has disconnected from its clients.")
+        return self._visible
+
+    @Visible.setter
+    def Visible(self, value):
+        self._visible = value
+
+class StandInScriptHost:
+    """میزبان VBScript جایگزین برای اجرای آزمایشی بدون ویندوز و SolidWorks
+
+    اسکریپت واقعاً اجرا نمی‌شود: ساختار آن با ScriptValidator بررسی می‌شود و پیام‌های
+    WScript.Echo متنی به عنوان خروجی برگردانده می‌شوند. مدت اجرا با run_seconds شبیه‌سازی
+    می‌شود تا صف اجرا و زمان‌بندی قابل آزمایش باشد.
+    """
+
+    _ECHO_PATTERN = re.compile(r'^\s*WScript\.Echo\s*\(?\s*"((?:[^"]|"")*)"', re.IGNORECASE | re.MULTILINE)
+
+    def __init__(self, run_seconds: float = 0.0):
+        self.run_seconds = run_seconds
+        self.validator = ScriptValidator()
+
+    def run(self, source: str, app: Any, script_path: str, args: Optional[List[str]] = None) -> Tuple[int, str]:
+        """اجرای شبیه‌سازی شده (همان امضای VBScriptHost.run)"""
+        if self.run_seconds:
+            time.sleep(self.run_seconds)
+        output = [message.replace('""', '"') for message in self._ECHO_PATTERN.findall(source)]
+        valid, issues = self.validator.validate(source)
+        if not valid:
+            output.append(f"{script_path}(1, 1) Stand-in VBScript error: {'؛ '.join(issues)}")
+            return 1, "\n".join(output)
+        return 0, "\n".join(output)
+
+class SolidWorksSessionBroker:
+    """مدیریت نشست ماندگار SolidWorks با پیش‌گرم کردن و بررسی سلامت دوره‌ای
+
+    اتصال از طریق ترد کارگر SolidWorksCOMRunner برقرار می‌شود، بنابراین در حالت‌های com و
+    standin نشستی که کارگزار گرم نگه می‌دارد همان نشستی است که مسیر اجرا از آن استفاده می‌کند؛
+    در حالت پیش‌فرض cscript فقط پردازش SolidWorks زودتر بالا می‌آید.
+    منطق زمان‌بندی در tick() است و بدون ترد پس‌زمینه هم قابل فراخوانی است.
+    """
+
+    STATE_IDLE = "idle"
+    STATE_CONNECTING = "connecting"
+    STATE_READY = "ready"
+    STATE_FAILED = "failed"
+    STATE_STOPPED = "stopped"
+
+    def __init__(self, runner: SolidWorksCOMRunner, health_interval: float = 15.0,
+                 retry_delays: Tuple[float, ...] = (2.0, 5.0, 15.0, 30.0, 60.0),
+                 operation_timeout: float = 180.0):
+        """راه‌اندازی کارگزار نشست
+
+        Args:
+            runner: اجرا کننده COM که اتصال را نگه می‌دارد
+            health_interval: فاصله بررسی سلامت در حالت آماده (ثانیه)
+            retry_delays: تأخیرهای تلاش مجدد پس از شکست‌های متوالی (ثانیه)
+            operation_timeout: حداکثر زمان انتظار برای اتصال یا بررسی سلامت (ثانیه)
+        """
+        self.runner = runner
+        self.health_interval = health_interval
+        self.retry_delays = retry_delays
+        self.operation_timeout = operation_timeout
+        self.state = self.STATE_IDLE
+        self.detail = ""
+        self.failures = 0
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """ثبت تابعی که با هر تغییر وضعیت فراخوانی می‌شود (state, detail)"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """شروع پیش‌گرم کردن و بررسی سلامت در پس‌زمینه"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="SolidWorksSessionBroker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """توقف کارگزار"""
+        self._stop.set()
+        self._wake.set()
+        self._set_state(self.STATE_STOPPED)
+
+    def request_check(self):
+        """درخواست بررسی فوری نشست (مثلاً پس از خطای اجرا)"""
+        self._wake.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """انتظار تا آماده شدن نشست"""
+        return self._ready.wait(timeout)
+
+    def session(self) -> Optional[SolidWorksCOMRunner]:
+        """دریافت اجرا کننده متصل به نشست زنده (در صورت آماده بودن)"""
+        return self.runner if self.state == self.STATE_READY else None
+
+    def tick(self) -> float:
+        """اجرای یک گام زمان‌بندی: اتصال یا بررسی سلامت
+
+        Returns:
+            float: تأخیر تا گام بعدی (ثانیه)
+        """
+        if self.state == self.STATE_READY:
+            # اجرای فعلی خودش نشان‌دهنده زنده بودن اتصال است
+            if self.runner.busy:
+                return self.health_interval
+            ok, message, _ = self.runner.run_operation(lambda app: app.Visible, self.operation_timeout)
+            if ok:
+                return self.health_interval
+            logger.warning(f"نشست SolidWorks از دست رفت: {message}")
+            self.failures = 0
+            self._set_state(self.STATE_FAILED, message)
+            return 0.0
+
+        self._set_state(self.STATE_CONNECTING)
+        start = time.perf_counter()
+        ok, message, _ = self.runner.run_operation(lambda app: app.Visible, self.operation_timeout)
+        if ok:
+            self.failures = 0
+            logger.info(f"نشست SolidWorks آماده شد ({time.perf_counter() - start:.2f}s)")
+            self._set_state(self.STATE_READY)
+            return self.health_interval
+
+        self.failures += 1
+        delay = self.retry_delays[min(self.failures, len(self.retry_delays)) - 1]
+        logger.warning(f"اتصال به SolidWorks ناموفق بود (تلاش {self.failures})، تلاش مجدد پس از {delay} ثانیه")
+        self._set_state(self.STATE_FAILED, message)
+        return delay
+
+    def _loop(self):
+        """حلقه پس‌زمینه کارگزار"""
+        while not self._stop.is_set():
+            delay = self.tick()
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _set_state(self, state: str, detail: str = ""):
+        """تغییر وضعیت و اطلاع به شنونده‌ها"""
+        if state == self.state and detail == self.detail:
+            return
+        self.state = state
+        self.detail = detail
+        if state == self.STATE_READY:
+            self._ready.set()
+        else:
+            self._ready.clear()
+        for callback in list(self._listeners):
+            try:
+                callback(state, detail)
+            except Exception as e:
+                logger.error(f"خطا در اطلاع‌رسانی وضعیت نشست: {e}")
+
+# === اجرای دسته‌ای چند دستور در یک نشست ===
+
+class BatchScriptBuilder:
+    """ادغام چند اسکریپت تولید شده در یک اسکریپت واحد
+
+    اسکریپت ادغام شده یک بار به SolidWorks متصل می‌شود، مراحل را به ترتیب در همان سند
+    اجرا می‌کند و قبل و بعد از هر مرحله نشانگر چاپ می‌کند تا خروجی و خطاها به دستور
+    مربوطه نسبت داده شوند. با reuse_document=False هر مرحله سند جدید خودش را می‌سازد.
+    """
+
+    MARKER = "@@STEP"
+
+    _NEW_DOCUMENT_PATTERN = re.compile(r'\b\w+\.NewDocument\s*\(', re.IGNORECASE)
+    _QUIT_SUCCESS_PATTERN = re.compile(r"^\s*WScript\.Quit\s*(?:\(\s*0\s*\)|0)?\s*(?:'.*)?$", re.IGNORECASE)
+    # شکل تک‌خطی: If ... Then WScript.Quit 0 [Else ...] (توضیح انتهای خط قبلاً حذف شده است)
+    _INLINE_QUIT_SUCCESS_PATTERN = re.compile(
+        r'^(\s*)If\s+(.+?)\s+Then\s*:?\s*WScript\.Quit\s*(?:\(\s*0\s*\)|0)?\s*(?:Else\s+(.*?))?\s*$', re.IGNORECASE)
+    _OPTION_EXPLICIT_PATTERN = re.compile(r'^\s*Option\s+Explicit\b', re.IGNORECASE)
+    _BLOCK_START_PATTERN = re.compile(r'^\s*(?:(?:Public|Private)\s+)?(?:Function|Sub|Class)\s+(\w+)', re.IGNORECASE)
+    _BLOCK_END_PATTERN = re.compile(r'^\s*End\s+(?:Function|Sub|Class)\b', re.IGNORECASE)
+    _CONST_PATTERN = re.compile(r'^\s*(?:(?:Public|Private)\s+)?Const\s+(\w+)', re.IGNORECASE)
+    _DIM_PATTERN = re.compile(r"^(\s*)Dim\s+([^:']+?)\s*('.*)?$", re.IGNORECASE)
+    _ERROR_LINE_PATTERN = re.compile(r'\((\d+),\s*(\d+)\)\s*Microsoft VBScript')
+    _MARKER_PATTERN = re.compile(r'^@@STEP (\d+) (BEGIN|END)$')
+
+    _PREAMBLE = """Option Explicit
+
+' اسکریپت دسته‌ای: {count} مرحله در یک نشست SolidWorks
+Dim BatchSwApp
 On Error Resume Next
 WScript.Echo "در حال اتصال به SolidWorks..."
-Set swApp = GetObject(, "SldWorks.Application")
+Set BatchSwApp = GetObject(, "SldWorks.Application")
 If Err.Number <> 0 Then
     Err.Clear
     WScript.Echo "SolidWorks در حال اجرا نیست. تلاش برای اجرای SolidWorks..."
-    Set swApp = CreateObject("SldWorks.Application")
+    Set BatchSwApp = CreateObject("SldWorks.Application")
     If Err.Number <> 0 Then
         WScript.Echo "خطا در اتصال به SolidWorks: " & Err.Description
         WScript.Quit(1)
     End If
 End If
-swApp.Visible = True
+BatchSwApp.Visible = True
 WScript.Echo "اتصال به SolidWorks با موفقیت انجام شد."
 On Error Goto 0
 
-3. Create or open a document
-4. Implement the requested feature or operation
-5. Include proper error handling
-
+' استفاده از سند فعال به جای ایجاد سند جدید در مراحل بعدی
+Function BatchNewDocument(templatePath, paperSize, width, height)
+    Dim doc
+    Set doc = BatchSwApp.ActiveDoc
+    If doc Is Nothing Then
+        Set doc = BatchSwApp.NewDocument(templatePath, paperSize, width, height)
+    End If
+    Set BatchNewDocument = doc
+End Function
+"""
+
+    _SAVE_ACTIVE_DOCUMENT = """
+' ذخیره سند مرحله {index}
+Dim BatchSaveDoc, BatchSavePath, BatchSaveErrors, BatchSaveWarnings
+Set BatchSaveDoc = BatchSwApp.ActiveDoc
+If BatchSaveDoc Is Nothing Then
+    WScript.Echo "{marker} {index} FAILED سندی برای ذخیره وجود ندارد"
+Else
+    Select Case BatchSaveDoc.GetType
+        Case 2
+            BatchSavePath = "{base}.SLDASM"
+        Case 3
+            BatchSavePath = "{base}.SLDDRW"
+        Case Else
+            BatchSavePath = "{base}.SLDPRT"
+    End Select
+    If BatchSaveDoc.Extension.SaveAs(BatchSavePath, 0, 1, Nothing, BatchSaveErrors, BatchSaveWarnings) Then
+        WScript.Echo "{marker} {index} SAVED " & BatchSavePath
+    Else
+        WScript.Echo "{marker} {index} FAILED " & BatchSaveErrors
+    End If
+    BatchSwApp.CloseDoc BatchSaveDoc.GetTitle
+End If
+"""
+
+    def __init__(self, reuse_document: bool = True):
+        self.reuse_document = reuse_document
+        self.steps: List[Tuple[str, str]] = []
+        # برای هر خط اسکریپت ادغام شده: (شماره مرحله, شماره خط اصلی) یا None
+        self.line_map: List[Optional[Tuple[int, int]]] = []
+
+    def add_step(self, command: str, script_content: str):
+        """افزودن یک مرحله به دسته
+
+        Args:
+            command: دستور کاربر که این مرحله از آن تولید شده است
+            script_content: اسکریپت کامل تولید شده برای دستور
+        """
+        self.steps.append((command, script_content))
+
+    @classmethod
+    def save_step(cls, index: int, base: str, marker: str) -> str:
+        """کد ذخیره و بستن سند فعال در پایان یک مرحله (برای reuse_document=False)
+
+        Args:
+            index: شماره مرحله یا نسخه در خروجی
+            base: مسیر فایل بدون پسوند (پسوند بر اساس نوع سند انتخاب می‌شود)
+            marker: پیشوند خط نتیجه («marker index SAVED مسیر» یا «marker index FAILED خطا»)
+        """
+        return cls._SAVE_ACTIVE_DOCUMENT.format(index=index, marker=marker, base=base.replace('"', '""'))
+
+    def build(self) -> str:
+        """ساخت اسکریپت ادغام شده
+
+        Returns:
+            str: متن اسکریپت دسته‌ای
+        """
+        lines: List[str] = []
+        self.line_map = []
+
+        def emit(text: str, origin: Optional[Tuple[int, int]] = None):
+            lines.append(text)
+            self.line_map.append(origin)
+
+        for line in self._PREAMBLE.format(count=len(self.steps)).splitlines():
+            emit(line)
+
+        declared = {"batchswapp", "batchnewdocument"}
+        for index, (command, script_content) in enumerate(self.steps, 1):
+            step_lines = self._prepare_step(index, script_content, declared)
+            summary = " ".join(command.split())
+            emit("")
+            emit(f"' ===== مرحله {index}: {summary} =====")
+            emit("On Error Goto 0")
+            emit(f'WScript.Echo "{self.MARKER} {index} BEGIN"')
+            for original_line, text in step_lines:
+                emit(text, (index, original_line))
+            emit("On Error Goto 0")
+            emit(f'WScript.Echo "{self.MARKER} {index} END"')
+
+        emit("")
+        emit('WScript.Echo "SUCCESS: همه مراحل دسته با موفقیت اجرا شدند."')
+        emit("WScript.Quit(0)")
+        return "\n".join(lines) + "\n"
+
+    def _prepare_step(self, index: int, script_content: str, declared: set) -> List[Tuple[int, str]]:
+        """بازنویسی اسکریپت یک مرحله برای قرار گرفتن در اسکریپت دسته‌ای
+
+        Args:
+            index: شماره مرحله
+            script_content: اسکریپت اصلی مرحله
+            declared: نام‌هایی که در مراحل قبلی تعریف شده‌اند (به‌روزرسانی می‌شود)
+
+        Returns:
+            List[Tuple[int, str]]: خطوط بازنویسی شده به همراه شماره خط اصلی
+        """
+        source_lines = script_content.splitlines()
+
+        # تغییر نام توابع و ثابت‌هایی که با مراحل قبلی تداخل دارند
+        defined = set()
+        depth = 0
+        for line in source_lines:
+            start = self._BLOCK_START_PATTERN.match(line)
+            if start and depth == 0:
+                defined.add(start.group(1))
+            const = self._CONST_PATTERN.match(line)
+            if const and depth == 0:
+                defined.add(const.group(1))
+            if start:
+                depth += 1
+            elif self._BLOCK_END_PATTERN.match(line):
+                depth = max(0, depth - 1)
+        renames = {name: f"{name}_Step{index}" for name in defined if name.lower() in declared}
+        declared.update(name.lower() for name in defined)
+
+        result = []
+        depth = 0
+        for number, line in enumerate(source_lines, 1):
+            for name, new_name in renames.items():
+                line = re.sub(rf'\b{re.escape(name)}\b', new_name, line, flags=re.IGNORECASE)
+
+            if self._OPTION_EXPLICIT_PATTERN.match(line):
+                continue
+
+            # اتصال یک بار در ابتدای دسته انجام می‌شود
+            line = VBScriptHost._CONNECT_PATTERN.sub("BatchSwApp", line)
+            if index > 1 and self.reuse_document:
+                line = self._NEW_DOCUMENT_PATTERN.sub("BatchNewDocument(", line)
+
+            if self._BLOCK_START_PATTERN.match(line):
+                depth += 1
+            elif self._BLOCK_END_PATTERN.match(line):
+                depth = max(0, depth - 1)
+
+            if depth == 0:
+                # خروج موفق یک مرحله نباید بقیه دسته را متوقف کند
+                if self._QUIT_SUCCESS_PATTERN.match(line):
+                    continue
+                inline_quit = self._INLINE_QUIT_SUCCESS_PATTERN.match(PromptBuilder._strip_comment(line))
+                if inline_quit:
+                    indent, condition, otherwise = inline_quit.groups()
+                    if not otherwise:
+                        continue
+                    line = f"{indent}If Not ({condition}) Then {otherwise}"
+                dim = self._DIM_PATTERN.match(line)
+                if dim:
+                    names = [n.strip() for n in dim.group(2).split(",") if n.strip()]
+                    fresh = [n for n in names if re.match(r'\w+', n).group(0).lower() not in declared]
+                    declared.update(re.match(r'\w+', n).group(0).lower() for n in names)
+                    if not fresh:
+                        continue
+                    line = f"{dim.group(1)}Dim {', '.join(fresh)}"
+
+            result.append((number, line))
+        return result
+
+    def locate_line(self, line_number: int) -> Optional[Tuple[int, int]]:
+        """تبدیل شماره خط اسکریپت ادغام شده به (شماره مرحله, شماره خط اصلی)"""
+        if 1 <= line_number <= len(self.line_map):
+            return self.line_map[line_number - 1]
+        return None
+
+    def parse_output(self, output: str) -> List[Dict[str, Any]]:
+        """تفکیک خروجی اجرای دسته به تفکیک مراحل
+
+        Args:
+            output: خروجی کامل اجرا (stdout و stderr)
+
+        Returns:
+            List[Dict]: برای هر مرحله: index، command، status (ok/failed/skipped)، output و error
+        """
+        results = [{"index": i, "command": command, "status": "skipped", "output": [], "error": ""}
+                   for i, (command, _) in enumerate(self.steps, 1)]
+        current = None
+        for line in (output or "").splitlines():
+            marker = self._MARKER_PATTERN.match(line.strip())
+            if marker:
+                step = results[int(marker.group(1)) - 1]
+                if marker.group(2) == "BEGIN":
+                    step["status"] = "running"
+                    current = step
+                else:
+                    step["status"] = "ok"
+                    current = None
+                continue
+
+            error = self._ERROR_LINE_PATTERN.search(line)
+            if error:
+                location = self.locate_line(int(error.group(1)))
+                if location:
+                    step = results[location[0] - 1]
+                    step["status"] = "failed"
+                    step["error"] = f"خط {location[1]} اسکریپت مرحله: {line.strip()}"
+                    continue
+            if current is not None:
+                current["output"].append(line)
+
+        for step in results:
+            if step["status"] == "running":
+                step["status"] = "failed"
+                if not step["error"]:
+                    step["error"] = step["output"][-1] if step["output"] else "اجرای مرحله کامل نشد"
+        return results
+
+    def format_report(self, output: str) -> str:
+        """ساخت گزارش متنی خروجی دسته به تفکیک مراحل"""
+        report = []
+        for step in self.parse_output(output):
+            if step["status"] == "ok":
+                report.append(f"[مرحله {step['index']}] ✓ {step['command']}")
+            elif step["status"] == "failed":
+                report.append(f"[مرحله {step['index']}] ✗ {step['command']}")
+            else:
+                report.append(f"[مرحله {step['index']}] - اجرا نشد: {step['command']}")
+            report.extend(f"    {line}" for line in step["output"])
+            if step["error"]:
+                report.append(f"    خطا: {step['error']}")
+        return "\n".join(report)
+
+# === جاروب پارامتری و جدول طراحی ===
+
+class DesignSweep:
+    """ساخت خانواده‌ای از قطعات از یک اسکریپت با جاروب پارامترها
+
+    پارامترهای قابل تغییر، ثابت‌ها و انتساب‌های عددی سطح بالای اسکریپت هستند
+    (مثل «Const BORE = 10» یا «thickness = 0.003»). ترکیب مقادیر از بازه‌ها و/یا جدول
+    طراحی CSV با NumPy ساخته می‌شود، با قیدها فیلتر می‌شود و همه نسخه‌ها در یک اسکریپت
+    دسته‌ای ساخته و ذخیره می‌شوند. هر نسخه باید سند جدید خودش را ایجاد کند؛ سند پس از
+    ذخیره بسته می‌شود.
+    """
+
+    MAX_VARIANTS = 500
+    VARIANT_MARKER = "@@VARIANT"
+
+    _ASSIGNMENT_PATTERN = re.compile(
+        r"^(\s*(?:(?:Public|Private)\s+)?(?:Const\s+)?)(\w+)(\s*=\s*)([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(\s*(?:'.*)?)$",
+        re.IGNORECASE,
+    )
+    _VARIANT_PATTERN = re.compile(r'^@@VARIANT (\d+) (SAVED|FAILED) ?(.*)$')
+
+    # عملگرها و توابع مجاز در قیدها (نام تابع NumPy معادل)
+    _BINARY_OPERATORS = {
+        ast.Add: "add", ast.Sub: "subtract", ast.Mult: "multiply", ast.Div: "true_divide",
+        ast.Pow: "power", ast.Mod: "mod",
+    }
+    _COMPARE_OPERATORS = {
+        ast.Gt: "greater", ast.GtE: "greater_equal", ast.Lt: "less", ast.LtE: "less_equal",
+        ast.Eq: "equal", ast.NotEq: "not_equal",
+    }
+    _FUNCTIONS = {"abs": "abs", "min": "minimum", "max": "maximum", "sqrt": "sqrt"}
+
+    def __init__(self, script_content: str):
+        """راه‌اندازی جاروب
+
+        Args:
+            script_content: اسکریپت پایه (تولید شده یا قالب)
+        """
+        self.script_content = script_content
+        self.parameters = self.extract_parameters(script_content)
+        self.names: List[str] = []
+        self.values = None
+        self.constraints: List[str] = []
+        self.rejected = 0
+        self.variants: List[Dict[str, Any]] = []
+        self.manifest_path = ""
+
+    @classmethod
+    def extract_parameters(cls, script_content: str) -> Dict[str, float]:
+        """استخراج پارامترهای عددی سطح بالای اسکریپت (نام با حروف کوچک -> مقدار پیش‌فرض)"""
+        parameters: Dict[str, float] = {}
+        depth = 0
+        for line in script_content.splitlines():
+            if BatchScriptBuilder._BLOCK_START_PATTERN.match(line):
+                depth += 1
+            elif BatchScriptBuilder._BLOCK_END_PATTERN.match(line):
+                depth = max(0, depth - 1)
+            elif depth == 0:
+                match = cls._ASSIGNMENT_PATTERN.match(line)
+                if match:
+                    parameters.setdefault(match.group(2).lower(), float(match.group(4)))
+        return parameters
+
+    @staticmethod
+    def parse_range(spec: str) -> "np.ndarray":
+        """تبدیل مشخصه بازه به آرایه مقادیر
+
+        شکل‌های مجاز: «شروع:پایان:گام» (شامل پایان)، «a, b, c» یا یک مقدار.
+        """
+        spec = spec.strip()
+        if ":" in spec:
+            parts = [float(part) for part in spec.split(":")]
+            if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+                raise ValueError(f"بازه نامعتبر است: {spec} (شکل درست: شروع:پایان:گام)")
+            start, stop, step = parts
+            return np.arange(start, stop + step / 2, step)
+        return np.array([float(part) for part in spec.split(",") if part.strip()])
+
+    def expand(self, ranges: Optional[Dict[str, str]] = None, table_path: str = ""):
+        """ساخت همه ترکیب‌ها از جدول طراحی و بازه‌ها (حاصل‌ضرب دکارتی)
+
+        Args:
+            ranges: نام پارامتر -> مشخصه بازه
+            table_path: فایل CSV با سطر سرستون نام پارامترها (هر سطر یک نسخه)
+        """
+        names: List[str] = []
+        values = np.empty((1, 0))
+        if table_path:
+            with open(table_path, "r", encoding="utf-8-sig", newline="") as f:
+                rows = [row for row in csv.reader(f) if any(cell.strip() for cell in row)]
+            if len(rows) < 2:
+                raise ValueError("جدول طراحی باید سطر سرستون و حداقل یک سطر مقدار داشته باشد")
+            names = [name.strip().lower() for name in rows[0]]
+            values = np.array([[float(cell) for cell in row] for row in rows[1:]], dtype=float)
+
+        for name, spec in (ranges or {}).items():
+            name = name.strip().lower()
+            if name in names:
+                raise ValueError(f"پارامتر {name} هم در جدول و هم در بازه‌ها آمده است")
+            column = self.parse_range(spec)
+            if column.size == 0:
+                raise ValueError(f"بازه پارامتر {name} خالی است")
+            # هر سطر موجود با همه مقادیر ستون جدید ترکیب می‌شود
+            values = np.hstack([np.repeat(values, column.size, axis=0), np.tile(column, values.shape[0])[:, None]])
+            names.append(name)
+
+        unknown = [name for name in names if name not in self.parameters]
+        if unknown:
+            raise ValueError(f"پارامترهای ناشناخته: {', '.join(unknown)} "
+                             f"(پارامترهای اسکریپت: {', '.join(self.parameters) or '-'})")
+        if not names:
+            raise ValueError("هیچ پارامتری برای جاروب تعیین نشده است")
+        self.names = names
+        self.values = values
+        self.rejected = 0
+
+    def apply_constraints(self, constraints: List[str]):
+        """حذف ترکیب‌هایی که قیدها را برآورده نمی‌کنند (ارزیابی برداری روی همه سطرها)
+
+        Args:
+            constraints: عبارت‌هایی مثل «(outer - bore) / 2 > 2»؛ پارامترهای ثابت با مقدار پیش‌فرض
+        """
+        columns = {name: np.full(self.values.shape[0], value) for name, value in self.parameters.items()}
+        columns.update({name: self.values[:, i] for i, name in enumerate(self.names)})
+        mask = np.ones(self.values.shape[0], dtype=bool)
+        for constraint in constraints:
+            constraint = constraint.strip()
+            if not constraint:
+                continue
+            try:
+                tree = ast.parse(constraint.lower(), mode="eval")
+            except SyntaxError as e:
+                raise ValueError(f"قید نامعتبر است: {constraint} ({e.msg})")
+            mask &= np.broadcast_to(np.asarray(self._evaluate(tree.body, columns), dtype=bool), mask.shape)
+            self.constraints.append(constraint)
+        self.rejected += int((~mask).sum())
+        self.values = self.values[mask]
+
+    def _evaluate(self, node, columns: Dict[str, "np.ndarray"]):
+        """ارزیابی امن درخت عبارت قید با آرایه‌های NumPy"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in columns:
+                raise ValueError(f"نام ناشناخته در قید: {node.id}")
+            return columns[node.id]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd, ast.Not)):
+            operand = self._evaluate(node.operand, columns)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(operand)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp) and type(node.op) in self._BINARY_OPERATORS:
+            return getattr(np, self._BINARY_OPERATORS[type(node.op)])(self._evaluate(node.left, columns),
+                                                         self._evaluate(node.right, columns))
+        if isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return functools.reduce(combine, (self._evaluate(value, columns) for value in node.values))
+        if isinstance(node, ast.Compare) and all(type(op) in self._COMPARE_OPERATORS for op in node.ops):
+            result = True
+            left = self._evaluate(node.left, columns)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._evaluate(comparator, columns)
+                result = np.logical_and(result, getattr(np, self._COMPARE_OPERATORS[type(op)])(left, right))
+                left = right
+            return result
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self._FUNCTIONS
+                and not node.keywords):
+            return getattr(np, self._FUNCTIONS[node.func.id])(*(self._evaluate(arg, columns) for arg in node.args))
+        raise ValueError(f"عبارت پشتیبانی نمی‌شود در قید: {ast.dump(node)[:60]}")
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        """نمایش عدد به شکل لیترال VBScript: مقدار صحیح بدون اعشار (10) و بقیه با نقطه اعشار مستقل از locale (2.5)"""
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    def _variant_script(self, row) -> str:
+        """اسکریپت یک نسخه با جایگزینی مقادیر پارامترها"""
+        values = {name: self._format_value(value) for name, value in zip(self.names, row)}
+        replaced = set()
+        lines = []
+        depth = 0
+        for line in self.script_content.splitlines():
+            if BatchScriptBuilder._BLOCK_START_PATTERN.match(line):
+                depth += 1
+            elif BatchScriptBuilder._BLOCK_END_PATTERN.match(line):
+                depth = max(0, depth - 1)
+            elif depth == 0:
+                match = self._ASSIGNMENT_PATTERN.match(line)
+                if match and match.group(2).lower() in values and match.group(2).lower() not in replaced:
+                    replaced.add(match.group(2).lower())
+                    line = f"{match.group(1)}{match.group(2)}{match.group(3)}{values[match.group(2).lower()]}{match.group(5)}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def build(self, output_dir: str, name_template: str = "variant_{index:03d}") -> BatchScriptBuilder:
+        """ساخت اسکریپت دسته‌ای همه نسخه‌ها و نوشتن مانیفست
+
+        Args:
+            output_dir: پوشه ذخیره قطعات و manifest.json
+            name_template: الگوی نام فایل هر نسخه با فیلدهای index و نام پارامترها
+
+        Returns:
+            BatchScriptBuilder: سازنده دسته (هر مرحله یک نسخه)
+        """
+        count = self.values.shape[0]
+        if count == 0:
+            raise ValueError("هیچ ترکیبی پس از اعمال قیدها باقی نماند")
+        if count > self.MAX_VARIANTS:
+            raise ValueError(f"تعداد نسخه‌ها ({count}) از حد مجاز {self.MAX_VARIANTS} بیشتر است")
+
+        output_dir = os.path.abspath(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        builder = BatchScriptBuilder(reuse_document=False)
+        self.variants = []
+        used_names = set()
+        for index, row in enumerate(self.values, 1):
+            values = {name: float(value) for name, value in zip(self.names, row)}
+            fields = {name: self._format_value(value) for name, value in values.items()}
+            name = re.sub(r'[<>:"/\\|?*\s]+', "_", name_template.format(index=index, **fields))
+            if name.lower() in used_names:
+                name = f"{name}_{index}"
+            used_names.add(name.lower())
+            base = os.path.join(output_dir, name)
+            summary = ", ".join(f"{key}={value}" for key, value in fields.items())
+            builder.add_step(f"نسخه {index}: {summary}",
+                             self._variant_script(row) + "\n" + builder.save_step(index, base, self.VARIANT_MARKER))
+            self.variants.append({"index": index, "values": values, "file": base, "status": "pending"})
+
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+        self._write_manifest()
+        return builder
+
+    def _write_manifest(self):
+        manifest = {
+            "parameters": self.names,
+            "defaults": self.parameters,
+            "constraints": self.constraints,
+            "rejected": self.rejected,
+            "variants": self.variants,
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def record_results(self, output: str) -> Dict[str, int]:
+        """ثبت نتیجه ذخیره هر نسخه از خروجی اجرا در مانیفست
+
+        Returns:
+            Dict[str, int]: تعداد نسخه‌ها به تفکیک وضعیت
+        """
+        for line in (output or "").splitlines():
+            match = self._VARIANT_PATTERN.match(line.strip())
+            if match and 1 <= int(match.group(1)) <= len(self.variants):
+                variant = self.variants[int(match.group(1)) - 1]
+                variant["status"] = match.group(2).lower()
+                if match.group(2) == "SAVED":
+                    variant["file"] = match.group(3)
+                else:
+                    variant["error"] = match.group(3)
+        if self.manifest_path:
+            self._write_manifest()
+        return dict(collections.Counter(variant["status"] for variant in self.variants))
+
+# === تولید اسمبلی چندقطعه‌ای ===
+
+class AssemblyPlanner:
+    """تجزیه درخواست‌های اسمبلی به قطعات مستقل و یک مرحله مونتاژ
+
+    مدل یک طرح JSON کوچک برمی‌گرداند؛ اسکریپت هر قطعه جداگانه (و همزمان) تولید و در
+    فایل خودش ذخیره می‌شود و مرحله مونتاژ قطعات ذخیره شده را درج و مقید می‌کند.
+    """
+
+    MAX_PARTS = 8
+    MAX_QUANTITY = 50
+    PLAN_MAX_TOKENS = 600
+    PART_MARKER = "@@PART"
+
+    PLAN_SYSTEM_PROMPT = """You plan SolidWorks assemblies.
+Split the user's request (English or Persian) into distinct part types and one assembly step.
+Respond ONLY with JSON in exactly this shape:
+{"parts": [{"name": "lid", "description": "full standalone description with all dimensions in mm", "quantity": 1}],
+ "assembly": "how the parts are positioned and mated"}
+Rules:
+- One entry per distinct part type; identical parts use quantity instead of repeated entries.
+- Each description must be complete on its own (the part is modelled without seeing the others).
+- Names are short lowercase ASCII identifiers.
+- If the request describes a single part, return exactly one part.
+"""
+
+    # نشانه‌های درخواست چندقطعه‌ای: کلمه صریح اسمبلی یا دست‌کم دو نام قطعه متفاوت
+    _ASSEMBLY_PATTERN = re.compile(r'\b(?:assembly|assemble|assembled|mate|mates)\b|اسمبلی|مونتاژ', re.IGNORECASE)
+    _PART_NOUNS = {
+        "box": "box", "lid": "lid", "cover": "cover", "shaft": "shaft", "axle": "shaft", "bracket": "bracket",
+        "plate": "plate", "bolt": "bolt", "screw": "screw", "nut": "nut", "washer": "washer", "gear": "gear",
+        "pin": "pin", "bearing": "bearing", "flange": "flange", "housing": "housing", "base": "base",
+        "wheel": "wheel", "spacer": "spacer", "hinge": "hinge", "pulley": "pulley", "spring": "spring",
+        "جعبه": "box", "درب": "lid", "درپوش": "lid", "شفت": "shaft", "محور": "shaft", "براکت": "bracket",
+        "صفحه": "plate", "پیچ": "screw", "مهره": "nut", "واشر": "washer", "چرخ‌دنده": "gear", "پین": "pin",
+        "یاتاقان": "bearing", "بلبرینگ": "bearing", "فلنج": "flange", "پوسته": "housing", "پایه": "base",
+        "چرخ": "wheel", "فاصله‌انداز": "spacer", "لولا": "hinge", "فنر": "spring",
+    }
+    _PART_NOUN_PATTERN = re.compile(
+        r'\b(' + "|".join(sorted(map(re.escape, _PART_NOUNS), key=len, reverse=True)) + r')(?:e?s|\u200c?های?)?\b',
+        re.IGNORECASE)
+    # نام قطعه‌ای که فقط یک ویژگی یا صفحه مرجع را توصیف می‌کند (bolt holes، سوراخ پیچ، صفحه جلو) قطعه جداگانه نیست
+    _FEATURE_PATTERN = re.compile(
+        r'\b(?:bolt|screw|pin|nut)\s+(?:holes?|threads?|circles?|patterns?)\b'
+        r'|(?:سوراخ|رزوه|جای)(?:\u200c?های?)?\s+(?:پیچ|پین|مهره)|صفحه\s+(?:جلو|بالا|راست|روبرو)', re.IGNORECASE)
+    _JSON_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+    @classmethod
+    def is_assembly_request(cls, query: str) -> bool:
+        """تشخیص سریع و محلی درخواست‌هایی که ارزش برنامه‌ریزی اسمبلی دارند
+
+        ویژگی‌های یک قطعه (سوراخ، پخ، رزوه) شیء جداگانه شمرده نمی‌شوند؛ یک درخواست تک‌قطعه‌ای
+        نباید هزینه درخواست طرح اسمبلی را بپردازد.
+        """
+        if cls._ASSEMBLY_PATTERN.search(query):
+            return True
+        text = cls._FEATURE_PATTERN.sub(" ", query)
+        parts, previous_end = set(), -1
+        for match in cls._PART_NOUN_PATTERN.finditer(text):
+            # نام‌های پشت سر هم یک قطعه‌اند (base plate، صفحه پایه)
+            if previous_end < 0 or text[previous_end:match.start()].strip():
+                parts.add(cls._PART_NOUNS[match.group(1).lower()])
+            previous_end = match.end()
+        return len(parts) >= 2
+
+    @classmethod
+    def parse_plan(cls, response: str) -> Optional[Dict[str, Any]]:
+        """خواندن و اعتبارسنجی طرح JSON مدل
+
+        Returns:
+            Optional[Dict]: parts (name، description، quantity) و assembly، یا None برای طرح نامعتبر
+        """
+        match = cls._JSON_PATTERN.search(response or "")
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return None
+        parts, names = [], set()
+        for part in (data.get("parts") or [])[:cls.MAX_PARTS]:
+            if not isinstance(part, dict) or not str(part.get("description", "")).strip():
+                continue
+            name = re.sub(r'\W+', "_", str(part.get("name", "")).strip().lower()).strip("_") or f"part{len(parts) + 1}"
+            while name in names:
+                name = f"{name}_{len(parts) + 1}"
+            names.add(name)
+            try:
+                quantity = min(cls.MAX_QUANTITY, max(1, int(part.get("quantity", 1))))
+            except (TypeError, ValueError):
+                quantity = 1
+            parts.append({"name": name, "description": str(part["description"]).strip(), "quantity": quantity})
+        if not parts:
+            return None
+        return {"parts": parts, "assembly": str(data.get("assembly", "")).strip()}
+
+    @staticmethod
+    def part_query(part: Dict[str, Any]) -> str:
+        """درخواست تولید اسکریپت یک قطعه (بدون ذخیره؛ ذخیره هنگام ادغام اضافه می‌شود)"""
+        return (f"Create a new part document and model: {part['description']}. "
+                f"Model a single part only. Do not save or close the document.")
+
+    @staticmethod
+    def assembly_query(plan: Dict[str, Any], part_paths: Dict[str, str], assembly_path: str) -> str:
+        """درخواست تولید اسکریپت مونتاژ با مسیر فایل قطعات (مسیرها از پیش معلوم‌اند)"""
+        components = "; ".join(f"{part['name']} x{part['quantity']} from \"{part_paths[part['name']]}\""
+                               for part in plan["parts"])
+        return (f"Create a new assembly document, insert these existing part files as components: {components}. "
+                f"Position and mate them: {plan['assembly'] or 'place them sensibly without overlap'}. "
+                f"Save the assembly to \"{assembly_path}\". Do not create or modify the parts themselves.")
+
+class PartScriptCache:
+    """کش دیسکی اسکریپت‌های معتبر قطعات بر اساس توضیح نرمال شده قطعه"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(description: str) -> str:
+        normalized = " ".join(description.lower().split())
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:20]
+
+    def get(self, description: str) -> Optional[str]:
+        path = os.path.join(self.cache_dir, f"{self.key(description)}.vbs")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, description: str, script_content: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{self.key(description)}.vbs")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(script_content)
+        os.replace(tmp_path, path)
+
+# === عملیات گروهی روی پوشه‌ها ===
+
+class BulkOperation:
+    """خروجی گرفتن/تبدیل همه فایل‌های SolidWorks یک پوشه در یک نشست
+
+    به جای درخواست LLM و اجرای جداگانه برای هر فایل، یک اسکریپت پارامتری ثابت برای
+    هر بخش (chunk) از فهرست فایل‌ها ساخته و در همان نشست SolidWorks اجرا می‌شود. وضعیت
+    هر فایل پس از هر بخش در job.json ذخیره می‌شود، پس اجرای دوباره همان عملیات از جایی
+    که متوقف شده ادامه می‌یابد. در پایان manifest.json در پوشه خروجی نوشته می‌شود.
+    """
+
+    FORMATS = {
+        "step": ".step", "iges": ".igs", "stl": ".stl", "pdf": ".pdf", "parasolid": ".x_t",
+        "dxf": ".dxf", "dwg": ".dwg", "sldprt": ".SLDPRT",
+    }
+    SOURCE_EXTENSIONS = (".sldprt", ".sldasm", ".slddrw")
+    FILE_MARKER = "@@FILE"
+
+    _FILE_PATTERN = re.compile(r'^@@FILE (\d+) (OK|FAILED) ?(.*)$')
+
+    _SCRIPT_HEADER = """Option Explicit
+
+' عملیات گروهی {operation}: بخش {chunk} ({count} فایل)
+Dim swApp
+On Error Resume Next
+Set swApp = GetObject(, "SldWorks.Application")
+If Err.Number <> 0 Then
+    Err.Clear
+    Set swApp = CreateObject("SldWorks.Application")
+    If Err.Number <> 0 Then
+        WScript.Echo "خطا در اتصال به SolidWorks: " & Err.Description
+        WScript.Quit(1)
+    End If
+End If
+On Error Goto 0
+
+Function BulkDocType(path)
+    Select Case LCase(Mid(path, InStrRev(path, ".") + 1))
+        Case "sldasm"
+            BulkDocType = 2
+        Case "slddrw"
+            BulkDocType = 3
+        Case Else
+            BulkDocType = 1
+    End Select
+End Function
+
+' باز کردن فایل، ذخیره در همه قالب‌های مقصد (جدا شده با |) و بستن آن
+Function BulkExport(index, source, targets)
+    Dim doc, errors, warnings, target, ok
+    BulkExport = False
+    On Error Resume Next
+    Set doc = swApp.OpenDoc6(source, BulkDocType(source), 1, "", errors, warnings)
+    If doc Is Nothing Or Err.Number <> 0 Then
+        WScript.Echo "{marker} " & index & " FAILED باز کردن فایل ناموفق بود (کد " & errors & ")"
+        Err.Clear
+        Exit Function
+    End If
+    ok = True
+    For Each target In Split(targets, "|")
+        If Not doc.Extension.SaveAs(target, 0, 1, Nothing, errors, warnings) Or Err.Number <> 0 Then
+            WScript.Echo "{marker} " & index & " FAILED ذخیره " & target & " ناموفق بود (کد " & errors & ")"
+            Err.Clear
+            ok = False
+            Exit For
+        End If
+    Next
+    swApp.CloseDoc doc.GetTitle
+    On Error Goto 0
+    BulkExport = ok
+End Function
+"""
+
+    def __init__(self, job_dir: str, state: Dict[str, Any]):
+        self.job_dir = job_dir
+        self.state = state
+        self.checkpoint_path = os.path.join(job_dir, "job.json")
+        self._stop = threading.Event()
+
+    @classmethod
+    def create(cls, source_dir: str, formats: List[str], output_dir: str = "", recursive: bool = True,
+               chunk_size: int = 25, jobs_dir: str = "") -> "BulkOperation":
+        """ساخت عملیات یا بارگذاری نقطه بازیابی همان عملیات (همان پوشه، قالب‌ها و خروجی)
+
+        Args:
+            source_dir: پوشه فایل‌های SolidWorks
+            formats: قالب‌های خروجی (کلیدهای FORMATS)
+            output_dir: پوشه خروجی (پیش‌فرض: زیرپوشه export در پوشه مبدأ)؛ ساختار زیرپوشه‌ها حفظ می‌شود
+            recursive: شامل زیرپوشه‌ها
+            chunk_size: تعداد فایل‌های هر اسکریپت
+            jobs_dir: پوشه نقاط بازیابی (پیش‌فرض: scripts/bulk)
+        """
+        formats = [fmt.strip().lower().lstrip(".") for fmt in formats if fmt.strip()]
+        unknown = [fmt for fmt in formats if fmt not in cls.FORMATS]
+        if unknown or not formats:
+            raise ValueError(f"قالب نامعتبر: {', '.join(unknown) or '-'} (قالب‌های مجاز: {', '.join(cls.FORMATS)})")
+        source_dir = os.path.abspath(source_dir)
+        if not os.path.isdir(source_dir):
+            raise ValueError(f"پوشه وجود ندارد: {source_dir}")
+        output_dir = os.path.abspath(output_dir or os.path.join(source_dir, "export"))
+        key = hashlib.sha1(json.dumps([source_dir, formats, output_dir, recursive]).encode("utf-8")).hexdigest()[:12]
+        job_dir = os.path.join(jobs_dir or os.path.join(get_config().scripts_dir, "bulk"), key)
+
+        files = cls._scan(source_dir, output_dir, formats, recursive)
+        checkpoint_path = os.path.join(job_dir, "job.json")
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            state["chunk_size"] = max(1, chunk_size)
+            # فایل‌هایی که پس از اجرای قبلی به پوشه اضافه شده‌اند
+            known = {item["source"] for item in state["files"]}
+            state["files"].extend(item for item in files if item["source"] not in known)
+            done = sum(1 for item in state["files"] if item["status"] == "done")
+            logger.info(f"ادامه عملیات گروهی {key}: {done} از {len(state['files'])} فایل قبلاً انجام شده")
+            return cls(job_dir, state)
+
+        if not files:
+            raise ValueError(f"هیچ فایل SolidWorks در پوشه یافت نشد: {source_dir}")
+        state = {
+            "id": key, "source_dir": source_dir, "output_dir": output_dir, "formats": formats,
+            "chunk_size": max(1, chunk_size), "created": time.time(), "elapsed_s": 0.0, "files": files,
+        }
+        os.makedirs(job_dir, exist_ok=True)
+        operation = cls(job_dir, state)
+        operation.save_checkpoint()
+        logger.info(f"عملیات گروهی {key}: {len(files)} فایل به {', '.join(formats)}")
+        return operation
+
+    @classmethod
+    def _scan(cls, source_dir: str, output_dir: str, formats: List[str], recursive: bool) -> List[Dict[str, Any]]:
+        """فهرست فایل‌های SolidWorks پوشه با مسیرهای مقصد (ساختار زیرپوشه‌ها حفظ می‌شود)"""
+        files = []
+        for root, dirs, names in os.walk(source_dir):
+            dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != output_dir) if recursive else []
+            for name in sorted(names):
+                if name.lower().endswith(cls.SOURCE_EXTENSIONS) and not name.startswith("~$"):
+                    source = os.path.join(root, name)
+                    relative = os.path.splitext(os.path.relpath(source, source_dir))[0]
+                    files.append({
+                        "source": source,
+                        "targets": [os.path.join(output_dir, relative + cls.FORMATS[fmt]) for fmt in formats],
+                        "status": "pending",
+                        "error": "",
+                    })
+        return files
+
+    def save_checkpoint(self):
+        """ذخیره اتمی وضعیت فایل‌ها"""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def stop(self):
+        """توقف پس از پایان بخش جاری (ادامه با اجرای دوباره)"""
+        self._stop.set()
+
+    @staticmethod
+    def _vbs_string(text: str) -> str:
+        return '"' + text.replace('"', '""') + '"'
+
+    def build_chunk_script(self, chunk: int, indexes: List[int]) -> str:
+        """ساخت اسکریپت یک بخش: یک فراخوانی BulkExport برای هر فایل"""
+        lines = [self._SCRIPT_HEADER.format(operation=", ".join(self.state["formats"]), chunk=chunk,
+                                            count=len(indexes), marker=self.FILE_MARKER)]
+        for index in indexes:
+            item = self.state["files"][index]
+            lines.append(f"If BulkExport({index + 1}, {self._vbs_string(item['source'])}, "
+                         f"{self._vbs_string('|'.join(item['targets']))}) Then")
+            lines.append(f'    WScript.Echo "{self.FILE_MARKER} {index + 1} OK"')
+            lines.append("End If")
+        lines.append("")
+        lines.append(f'WScript.Echo "SUCCESS: بخش {chunk} عملیات گروهی تمام شد."')
+        lines.append("WScript.Quit(0)")
+        return "\n".join(lines) + "\n"
+
+    def run(self, execute: Callable[[str, Optional[List[str]]], Tuple[bool, str, str]],
+            progress: Optional[Callable[[str], None]] = None, retry_failed: bool = False) -> Dict[str, Any]:
+        """اجرای بخش‌های باقی‌مانده
+
+        Args:
+            execute: تابع اجرای اسکریپت (مثل SolidWorksServices.execute)
+            progress: دریافت کننده خطوط پیشرفت هر فایل
+            retry_failed: اجرای دوباره فایل‌های ناموفق قبلی
+
+        Returns:
+            Dict: خلاصه مانیفست
+        """
+        files = self.state["files"]
+        statuses = ("pending", "failed") if retry_failed else ("pending",)
+        remaining = [i for i, item in enumerate(files) if item["status"] in statuses]
+        chunk_size = self.state["chunk_size"]
+        total = len(files)
+        completed = total - len(remaining)
+        os.makedirs(self.state["output_dir"], exist_ok=True)
+        for root in {os.path.dirname(target) for i in remaining for target in files[i]["targets"]}:
+            os.makedirs(root, exist_ok=True)
+
+        chunk_path = os.path.join(self.job_dir, "chunk.vbs")
+        for chunk, start in enumerate(range(0, len(remaining), chunk_size), 1):
+            if self._stop.is_set():
+                break
+            indexes = remaining[start:start + chunk_size]
+            with open(chunk_path, "w", encoding="utf-8") as f:
+                f.write(self.build_chunk_script(chunk, indexes))
+            started = time.perf_counter()
+            success, message, output = execute(chunk_path, None)
+            self.state["elapsed_s"] += time.perf_counter() - started
+
+            reported = {}
+            for line in (output or "").splitlines():
+                match = self._FILE_PATTERN.match(line.strip())
+                if match:
+                    reported.setdefault(int(match.group(1)) - 1, (match.group(2), match.group(3)))
+            for index in indexes:
+                if index not in reported and not success:
+                    # اسکریپت پیش از رسیدن به این فایل متوقف شده؛ در اجرای بعدی دوباره تلاش می‌شود
+                    files[index]["status"] = "pending"
+                    files[index]["error"] = message
+                    if progress:
+                        progress(f"[{completed}/{total}] … {os.path.relpath(files[index]['source'], self.state['source_dir'])} "
+                                 f"(اجرا نشد: {message})")
+                    continue
+                status, detail = reported.get(index, ("FAILED", "بدون نتیجه"))
+                files[index]["status"] = "done" if status == "OK" else "failed"
+                files[index]["error"] = "" if status == "OK" else detail
+                completed += 1
+                if progress:
+                    mark = "✓" if status == "OK" else f"✗ {detail}"
+                    progress(f"[{completed}/{total}] {mark} {os.path.relpath(files[index]['source'], self.state['source_dir'])}")
+            self.save_checkpoint()
+        return self.write_manifest()
+
+    def write_manifest(self) -> Dict[str, Any]:
+        """نوشتن manifest.json خلاصه در پوشه خروجی"""
+        files = self.state["files"]
+        counts = collections.Counter(item["status"] for item in files)
+        summary = {
+            "id": self.state["id"],
+            "source_dir": self.state["source_dir"],
+            "output_dir": self.state["output_dir"],
+            "formats": self.state["formats"],
+            "total": len(files),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "elapsed_s": round(self.state["elapsed_s"], 2),
+        }
+        manifest = dict(summary, files=[{key: item[key] for key in ("source", "targets", "status", "error")}
+                                        for item in files])
+        os.makedirs(self.state["output_dir"], exist_ok=True)
+        path = os.path.join(self.state["output_dir"], "manifest.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+        summary["manifest"] = path
+        return summary
+
+# === جایگذاری include‌ها و کش اسکریپت‌های مستقل ===
+
+class ScriptBundler:
+    """ساخت نسخه مستقل اسکریپت‌هایی که فایل‌های دیگر را با ExecuteGlobal اینکلود می‌کنند
+
+    الگوی FileSystemObject + ExecuteGlobal (مثل create_sketch_from_input.vbs) از پیش با متن
+    فایل اینکلود شده جایگزین می‌شود. خروجی در پوشه .bundles کش می‌شود و کلید کش از هش
+    محتوای همه ورودی‌ها ساخته می‌شود؛ با تغییر هر فایل در scripts/ کش حافظه باطل می‌شود.
+    """
+
+    _EXECUTE_GLOBAL_PATTERN = re.compile(r'^\s*ExecuteGlobal\b', re.IGNORECASE)
+    _FILE_EXISTS_PATTERN = re.compile(r'^\s*If\s+\w+\.FileExists\s*\(\s*(\w+)\s*\)\s*Then\b', re.IGNORECASE)
+    _INCLUDE_NAME_PATTERN = re.compile(r'"\\?([\w\-. ]+\.vbs)"', re.IGNORECASE)
+    _IF_BLOCK_PATTERN = re.compile(r"^\s*If\b.*\bThen\s*(?:'.*)?$", re.IGNORECASE)
+    _END_IF_PATTERN = re.compile(r'^\s*End\s+If\b', re.IGNORECASE)
+    _GUARD_PATTERN = re.compile(r'^\s*If\s+WScript\.ScriptName\s*=\s*"[^"]+"\s+Then\s*$', re.IGNORECASE)
+    _OPTION_EXPLICIT_PATTERN = re.compile(r'^\s*Option\s+Explicit\b', re.IGNORECASE)
+    _FSO_PATTERN = re.compile(r'^\s*Set\s+(\w+)\s*=\s*CreateObject\s*\(\s*"Scripting\.FileSystemObject"\s*\)', re.IGNORECASE)
+    _DIM_PATTERN = re.compile(r"^\s*Dim\s+([^:']+?)\s*(?:'.*)?$", re.IGNORECASE)
+
+    def __init__(self, scripts_dir: str = SCRIPTS_DIR, cache_dir: Optional[str] = None):
+        """راه‌اندازی باندلر
+
+        Args:
+            scripts_dir: پوشه اسکریپت‌ها که تغییرات آن پایش می‌شود
+            cache_dir: پوشه کش اسکریپت‌های مستقل (پیش‌فرض: scripts/.bundles)
+        """
+        self.scripts_dir = scripts_dir
+        self.cache_dir = cache_dir or os.path.join(scripts_dir, ".bundles")
+        self._bundles: Dict[str, str] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def bundle(self, script_path: str) -> str:
+        """دریافت مسیر نسخه مستقل یک اسکریپت
+
+        Args:
+            script_path: مسیر اسکریپت اصلی
+
+        Returns:
+            str: مسیر اسکریپت مستقل (یا همان مسیر اصلی اگر include نداشته باشد)
+        """
+        with self._lock:
+            self._check_directory()
+            try:
+                stat = os.stat(script_path)
+            except OSError:
+                return script_path
+            memo_key = f"{os.path.abspath(script_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+            cached = self._bundles.get(memo_key)
+            if cached and os.path.exists(cached):
+                return cached
+
+            with open(script_path, "r", encoding='utf-8') as f:
+                source = f.read()
+            if not self._find_include(source.splitlines()):
+                self._bundles[memo_key] = script_path
+                return script_path
+
+            bundled, inputs = self.bundle_source(source, os.path.dirname(os.path.abspath(script_path)))
+            digest = hashlib.sha256(source.encode("utf-8"))
+            for input_path, content in inputs:
+                digest.update(input_path.encode("utf-8"))
+                digest.update(content.encode("utf-8"))
+            key = digest.hexdigest()[:16]
+
+            base = os.path.splitext(os.path.basename(script_path))[0]
+            bundle_path = os.path.join(self.cache_dir, f"{base}.{key}.vbs")
+            if not os.path.exists(bundle_path):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # حذف نسخه‌های قدیمی همین اسکریپت
+                for stale in glob.glob(os.path.join(self.cache_dir, f"{base}.*.vbs")):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+                with open(bundle_path, "w", encoding='utf-8') as f:
+                    f.write(bundled)
+                logger.info(f"اسکریپت مستقل ساخته شد: {bundle_path}")
+
+            self._bundles[memo_key] = bundle_path
+            return bundle_path
+
+    def bundle_source(self, source: str, base_dir: str, seen: Optional[set] = None) -> Tuple[str, List[Tuple[str, str]]]:
+        """جایگذاری بازگشتی include‌های یک متن اسکریپت
+
+        Args:
+            source: متن اسکریپت
+            base_dir: پوشه‌ای که include‌ها نسبت به آن پیدا می‌شوند
+            seen: فایل‌هایی که در مسیر فعلی جایگذاری شده‌اند (برای تشخیص حلقه)
+
+        Returns:
+            (متن_مستقل, ورودی‌ها): متن نهایی و لیست (مسیر, محتوا) فایل‌های اینکلود شده
+        """
+        seen = set(seen or ())
+        inputs: List[Tuple[str, str]] = []
+        loader_names = set()
+        lines = source.splitlines()
+
+        while True:
+            include = self._find_include(lines)
+            if include is None:
+                break
+            start, end, include_name = include
+            loader_names.update(self._assigned_names(lines[start:end + 1]))
+            include_path = os.path.join(base_dir, include_name)
+            if include_path in seen:
+                raise ValueError(f"include حلقه‌ای: {include_name}")
+            if not os.path.exists(include_path):
+                raise FileNotFoundError(f"فایل include یافت نشد: {include_path}")
+
+            with open(include_path, "r", encoding='utf-8') as f:
+                include_source = f.read()
+            inputs.append((include_path, include_source))
+            nested, nested_inputs = self.bundle_source(include_source, os.path.dirname(include_path), seen | {include_path})
+            inputs.extend(nested_inputs)
+
+            inlined = [f"' ---- آغاز {include_name} (جایگذاری شده توسط ScriptBundler) ----"]
+            inlined.extend(self._strip_include_body(nested.splitlines()))
+            inlined.append(f"' ---- پایان {include_name} ----")
+            lines = lines[:start] + inlined + lines[end + 1:]
+
+        return "\n".join(self._drop_unused_loader(lines, loader_names)) + "\n", inputs
+
+    def invalidate(self):
+        """باطل کردن کش حافظه (مثلاً پس از تغییر فایل‌ها)"""
+        with self._lock:
+            self._bundles.clear()
+            self._signature = None
+
+    def _check_directory(self):
+        """باطل کردن کش حافظه در صورت تغییر هر فایل در scripts/"""
+        try:
+            signature = tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(self.scripts_dir)
+                if entry.is_file() and entry.name.lower().endswith(".vbs")
+            ))
+        except OSError:
+            signature = None
+        if signature != self._signature:
+            self._bundles.clear()
+            self._signature = signature
+
+    def _find_include(self, lines: List[str]) -> Optional[Tuple[int, int, str]]:
+        """یافتن بلوک include از نوع FileExists/ExecuteGlobal
+
+        Returns:
+            (شروع, پایان, نام_فایل): محدوده خطوطی که باید جایگزین شوند و نام فایل اینکلود شده
+        """
+        for index, line in enumerate(lines):
+            if not self._EXECUTE_GLOBAL_PATTERN.match(line):
+                continue
+
+            # بلوک If FileExists(var) Then که ExecuteGlobal داخل آن است
+            if_index = next((i for i in range(index, -1, -1) if self._FILE_EXISTS_PATTERN.match(lines[i])), None)
+            if if_index is None:
+                continue
+            path_var = self._FILE_EXISTS_PATTERN.match(lines[if_index]).group(1)
+
+            # خطی که مسیر فایل include را تعیین می‌کند
+            assign_pattern = re.compile(rf'^\s*{re.escape(path_var)}\s*=', re.IGNORECASE)
+            assign_index = next((i for i in range(if_index, -1, -1) if assign_pattern.match(lines[i])), None)
+            if assign_index is None:
+                continue
+            name = self._INCLUDE_NAME_PATTERN.search(lines[assign_index])
+            if not name:
+                continue
+
+            end_index = self._match_end_if(lines, if_index)
+            if end_index is None:
+                continue
+            return assign_index, end_index, name.group(1)
+        return None
+
+    def _match_end_if(self, lines: List[str], if_index: int) -> Optional[int]:
+        """یافتن End If متناظر با یک If چندخطی"""
+        depth = 0
+        for index in range(if_index, len(lines)):
+            if self._IF_BLOCK_PATTERN.match(lines[index]):
+                depth += 1
+            elif self._END_IF_PATTERN.match(lines[index]):
+                depth -= 1
+                if depth == 0:
+                    return index
+        return None
+
+    def _strip_include_body(self, lines: List[str]) -> List[str]:
+        """حذف Option Explicit و بلوک اجرای مستقیم از فایل اینکلود شده"""
+        result = []
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            if self._OPTION_EXPLICIT_PATTERN.match(line):
+                index += 1
+                continue
+            if self._GUARD_PATTERN.match(line):
+                end_index = self._match_end_if(lines, index)
+                if end_index is not None:
+                    index = end_index + 1
+                    continue
+            result.append(line)
+            index += 1
+        return result
+
+    @staticmethod
+    def _assigned_names(lines: List[str]) -> set:
+        """نام متغیرهایی که در خطوط بارگذار include مقداردهی یا تعریف شده‌اند"""
+        names = set()
+        for line in lines:
+            assign = re.match(r'^\s*(?:Set\s+)?(\w+)\s*=', line, re.IGNORECASE)
+            if assign:
+                names.add(assign.group(1).lower())
+            for receiver in re.findall(r'\b(\w+)\.(?:FileExists|GetParentFolderName|OpenTextFile|BuildPath)\b', line, re.IGNORECASE):
+                names.add(receiver.lower())
+        return names
+
+    def _drop_unused_loader(self, lines: List[str], loader_names: set) -> List[str]:
+        """حذف FileSystemObject و متغیرهای بارگذار include اگر دیگر استفاده نشوند"""
+        # ارجاع‌ها فقط در خطوطی غیر از تعریف متغیر و ساخت FileSystemObject شمرده می‌شوند
+        code_lines = [l for l in lines if not self._DIM_PATTERN.match(l) and not self._FSO_PATTERN.match(l)]
+
+        def used(name: str) -> bool:
+            pattern = re.compile(rf'\b{re.escape(name)}\b', re.IGNORECASE)
+            return any(pattern.search(l) for l in code_lines)
+
+        result = []
+        for line in lines:
+            fso = self._FSO_PATTERN.match(line)
+            if fso and fso.group(1).lower() in loader_names and not used(fso.group(1)):
+                continue
+            dim = self._DIM_PATTERN.match(line)
+            if dim:
+                names = [n.strip() for n in dim.group(1).split(",") if n.strip()]
+                kept = [n for n in names
+                        if n.lower() not in loader_names or used(n)]
+                if not kept:
+                    continue
+                if len(kept) != len(names):
+                    indent = line[:len(line) - len(line.lstrip())]
+                    line = f"{indent}Dim {', '.join(kept)}"
+            result.append(line)
+        return result
+
+# === کاتالوگ قالب‌های اسکریپت با بارگذاری مجدد خودکار ===
+
+class ScriptTemplate:
+    """یک قالب اسکریپت بارگذاری شده در حافظه"""
+
+    def __init__(self, name: str, path: str, content: str, mtime_ns: int = 0):
+        self.name = name
+        self.path = path
+        self.content = content
+        self.mtime_ns = mtime_ns
+        self.description = ScriptTemplateRegistry.extract_description(content)
+        self.parameters = ScriptTemplateRegistry.extract_parameters(content)
+
+class ScriptTemplateRegistry:
+    """نگهداری همه اسکریپت‌های پوشه scripts/ در حافظه
+
+    همه فایل‌های .vbs هنگام شروع خوانده می‌شوند و پارامترهای اعلام شده در هر کدام
+    استخراج می‌شود. پوشه با inotify (در لینوکس) یا بررسی دوره‌ای پایش می‌شود و
+    فایل‌های تغییر کرده دوباره بارگذاری می‌شوند؛ دریافت قالب از حافظه انجام می‌شود.
+    """
+
+    # فایل‌هایی که قالب نیستند
+    EXCLUDED = {"current_script.vbs"}
+
+    _PARAM_DECLARATION_PATTERN = re.compile(r"^\s*'\s*@param\s+(\w+)(?:\s*=\s*(\S+))?\s*(.*)$", re.IGNORECASE)
+    _PARAM_EXISTS_PATTERN = re.compile(r'\w+\.Exists\s*\(\s*"(\w+)"\s*\)(?:.*?\bElse\s+\w+\s*=\s*([^\s\']+))?', re.IGNORECASE)
+    _USAGE_PATTERN = re.compile(r"^\s*'\s*cscript\s+\S+\.vbs\s+(.+)$", re.IGNORECASE)
+
+    def __init__(self, scripts_dir: str = SCRIPTS_DIR, poll_interval: float = 1.0):
+        """راه‌اندازی کاتالوگ
+
+        Args:
+            scripts_dir: پوشه اسکریپت‌ها
+            poll_interval: فاصله بررسی تغییرات در حالت بدون inotify (ثانیه)
+        """
+        self.scripts_dir = scripts_dir
+        self.poll_interval = poll_interval
+        self._templates: Dict[str, ScriptTemplate] = {}
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._listeners: List[Callable[[str, Optional[ScriptTemplate]], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_all(self):
+        """بارگذاری همه قالب‌ها"""
+        self.refresh()
+        logger.info(f"{len(self._templates)} قالب اسکریپت بارگذاری شد.")
+
+    def get(self, name: str) -> Optional[ScriptTemplate]:
+        """دریافت قالب با نام فایل (مثلاً create_simple_part.vbs)"""
+        return self._templates.get(name)
+
+    def names(self) -> List[str]:
+        """نام همه قالب‌ها به ترتیب الفبا"""
+        return sorted(self._templates)
+
+    def templates(self) -> List[ScriptTemplate]:
+        """همه قالب‌ها به ترتیب نام"""
+        return [self._templates[name] for name in self.names()]
+
+    def add_listener(self, callback: Callable[[str, Optional[ScriptTemplate]], None]):
+        """ثبت تابعی که پس از بارگذاری مجدد یا حذف قالب فراخوانی می‌شود (name, template|None)"""
+        self._listeners.append(callback)
+
+    def refresh(self) -> List[str]:
+        """بارگذاری مجدد فایل‌های تغییر کرده
+
+        Returns:
+            List[str]: نام قالب‌هایی که اضافه، تغییر یا حذف شدند
+        """
+        with self._lock:
+            snapshot = {}
+            try:
+                for entry in os.scandir(self.scripts_dir):
+                    if entry.is_file() and entry.name.lower().endswith(".vbs") and entry.name not in self.EXCLUDED:
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError as e:
+                logger.error(f"خطا در خواندن پوشه اسکریپت‌ها: {e}")
+                return []
+
+            changed = []
+            for name, signature in snapshot.items():
+                if self._snapshot.get(name) == signature:
+                    continue
+                path = os.path.join(self.scripts_dir, name)
+                try:
+                    with open(path, "r", encoding='utf-8') as f:
+                        content = f.read()
+                except Exception as e:
+                    logger.error(f"خطا در بارگذاری قالب {name}: {e}")
+                    continue
+                self._templates[name] = ScriptTemplate(name, path, content, signature[0])
+                changed.append(name)
+            for name in set(self._templates) - set(snapshot):
+                del self._templates[name]
+                changed.append(name)
+            self._snapshot = snapshot
+
+        for name in changed:
+            template = self._templates.get(name)
+            for callback in list(self._listeners):
+                try:
+                    callback(name, template)
+                except Exception as e:
+                    logger.error(f"خطا در اطلاع‌رسانی تغییر قالب: {e}")
+        return changed
+
+    def start_watching(self):
+        """شروع پایش پوشه در پس‌زمینه"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch_loop, name="ScriptTemplateRegistry", daemon=True)
+        self._thread.start()
+
+    def stop_watching(self):
+        """توقف پایش پوشه"""
+        self._stop.set()
+
+    def _watch_loop(self):
+        """حلقه پایش: inotify در صورت امکان، در غیر این صورت بررسی دوره‌ای"""
+        watcher = _InotifyWatcher.create(self.scripts_dir)
+        if watcher is None:
+            logger.info("پایش قالب‌ها با بررسی دوره‌ای انجام می‌شود.")
+        try:
+            while not self._stop.is_set():
+                if watcher is not None:
+                    if not watcher.wait(self.poll_interval):
+                        continue
+                else:
+                    self._stop.wait(self.poll_interval)
+                changed = self.refresh()
+                if changed:
+                    logger.info(f"قالب‌های به‌روز شده: {', '.join(changed)}")
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    @staticmethod
+    def extract_description(content: str) -> str:
+        """اولین خط توضیحی اسکریپت"""
+        for line in content.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("'") and not stripped.lstrip("' ").lower().startswith(("@param", "cscript")):
+                text = stripped.lstrip("' ").strip()
+                if text:
+                    return text
+        return ""
+
+    @classmethod
+    def extract_parameters(cls, content: str) -> List[Dict[str, str]]:
+        """استخراج پارامترهای اعلام شده در اسکریپت
+
+        سه منبع بررسی می‌شود: خطوط «' @param نام=پیش‌فرض توضیح»، بررسی‌های
+        params.Exists("نام") و مثال‌های «' cscript فایل.vbs نام=مقدار» در توضیحات.
+
+        Returns:
+            List[Dict]: برای هر پارامتر name، default و description
+        """
+        parameters: Dict[str, Dict[str, str]] = {}
+
+        def add(name: str, default: str = "", description: str = ""):
+            key = name.lower()
+            param = parameters.setdefault(key, {"name": key, "default": "", "description": ""})
+            if default and not param["default"]:
+                param["default"] = default
+            if description and not param["description"]:
+                param["description"] = description
+
+        for line in content.splitlines():
+            declaration = cls._PARAM_DECLARATION_PATTERN.match(line)
+            if declaration:
+                add(declaration.group(1), declaration.group(2) or "", declaration.group(3).strip())
+                continue
+            usage = cls._USAGE_PATTERN.match(line)
+            if usage:
+                for pair in usage.group(1).split():
+                    if "=" in pair:
+                        name, example = pair.split("=", 1)
+                        add(name, description=f"مثال: {example}")
+                continue
+            for match in cls._PARAM_EXISTS_PATTERN.finditer(line):
+                add(match.group(1), match.group(2) or "")
+        return list(parameters.values())
+
+class _InotifyWatcher:
+    """پایش پوشه با inotify لینوکس از طریق ctypes"""
+
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _MASK = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    @classmethod
+    def create(cls, path: str) -> Optional["_InotifyWatcher"]:
+        """ایجاد پایشگر؛ در صورت عدم پشتیبانی None برمی‌گرداند"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(cls._IN_NONBLOCK | cls._IN_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(path), cls._MASK) < 0:
+                os.close(fd)
+                return None
+            return cls(fd)
+        except Exception as e:
+            logger.warning(f"inotify در دسترس نیست: {e}")
+            return None
+
+    def wait(self, timeout: float) -> bool:
+        """انتظار برای رویداد؛ True اگر تغییری رخ داده باشد"""
+        import select
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        # کمی صبر تا نوشتن فایل توسط ویرایشگر کامل شود
+        time.sleep(0.05)
+        return True
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+class HistoryIndex:
+    """فهرست SQLite تاریخچه اسکریپت‌ها برای پرس‌وجوی صفحه‌بندی شده
+
+    فایل‌های sw_script_*.vbs همچنان منبع اصلی هستند؛ این فهرست فقط متادیتا (درخواست،
+    وضعیت اجرا و اطلاعات اضافی) را نگه می‌دارد تا لیست تاریخچه بدون اسکن کامل پوشه
+    و بدون بارگذاری همه ردیف‌ها در حافظه نمایش داده شود.
+    """
+
+    FILE_PATTERN = "sw_script_*.vbs"
+
+    def __init__(self, history_dir: str = HISTORY_DIR, db_path: Optional[str] = None):
+        """راه‌اندازی فهرست
+
+        Args:
+            history_dir: پوشه فایل‌های تاریخچه
+            db_path: مسیر پایگاه داده (پیش‌فرض: history.db در پوشه تاریخچه)
+        """
+        self.history_dir = history_dir
+        self.db_path = db_path or os.path.join(history_dir, "history.db")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        """اتصال SQLite (در اولین استفاده ساخته می‌شود)"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " path TEXT PRIMARY KEY,"
+                " created TEXT NOT NULL,"
+                " query TEXT NOT NULL DEFAULT '',"
+                " status TEXT NOT NULL DEFAULT 'generated',"
+                " meta TEXT NOT NULL DEFAULT '{}')"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created DESC, path DESC)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def created_from_path(path: str) -> str:
+        """استخراج زمان ایجاد از نام فایل تاریخچه
+
+        Args:
+            path: مسیر فایل sw_script_YYYYmmdd_HHMMSS.vbs (یا با پسوند _N)
+
+        Returns:
+            str: زمان به صورت YYYY-mm-dd HH:MM:SS یا نام فایل در صورت نامعتبر بودن
+        """
+        filename = os.path.basename(path)
+        date_part = filename.replace("sw_script_", "").replace(".vbs", "")[:15]
+        try:
+            return datetime.datetime.strptime(date_part, "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return filename
+
+    def add(self, path: str, query: str = "", status: str = "generated", **meta):
+        """افزودن یا جایگزینی یک ورودی تاریخچه
+
+        Args:
+            path: مسیر فایل اسکریپت
+            query: درخواست کاربر
+            status: وضعیت (generated، success یا failed)
+            **meta: اطلاعات اضافی قابل ذخیره در JSON
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (path, created, query, status, meta) VALUES (?, ?, ?, ?, ?)",
+                (path, self.created_from_path(path), query, status, json.dumps(meta, ensure_ascii=False)),
+            )
+            conn.commit()
+
+    def update(self, path: str, status: Optional[str] = None, **meta) -> bool:
+        """بروزرسانی وضعیت و/یا متادیتای یک ورودی
+
+        Args:
+            path: مسیر فایل اسکریپت
+            status: وضعیت جدید (None یعنی بدون تغییر)
+            **meta: کلیدهایی که با متادیتای فعلی ادغام می‌شوند
+
+        Returns:
+            bool: آیا ورودی وجود داشت
+        """
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT status, meta FROM entries WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return False
+            merged = json.loads(row["meta"] or "{}")
+            merged.update(meta)
+            conn.execute("UPDATE entries SET status = ?, meta = ? WHERE path = ?",
+                         (status or row["status"], json.dumps(merged, ensure_ascii=False), path))
+            conn.commit()
+            return True
+
+    def remove(self, path: str):
+        """حذف یک ورودی از فهرست
+
+        Args:
+            path: مسیر فایل اسکریپت
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+            conn.commit()
+
+    def count(self) -> int:
+        """تعداد کل ورودی‌ها"""
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """دریافت یک صفحه از ورودی‌ها (جدیدترین در ابتدا)
+
+        Args:
+            offset: شماره اولین ردیف
+            limit: حداکثر تعداد ردیف
+
+        Returns:
+            List[Dict[str, Any]]: ورودی‌ها با کلیدهای path، created، query، status و meta
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT path, created, query, status, meta FROM entries ORDER BY created DESC, path DESC LIMIT ? OFFSET ?",
+                (max(0, int(limit)), max(0, int(offset))),
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def entries(self, status: str) -> List[Dict[str, Any]]:
+        """همه ورودی‌های دارای یک وضعیت (جدیدترین در ابتدا)"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT path, created, query, status, meta FROM entries WHERE status = ? ORDER BY created DESC, path DESC",
+                (status,),
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """دریافت یک ورودی با مسیر آن"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT path, created, query, status, meta FROM entries WHERE path = ?", (path,)
+            ).fetchone()
+        return self._row_to_entry(row) if row is not None else None
+
+    @staticmethod
+    def trace_ids(entry: Dict[str, Any]) -> List[str]:
+        """شناسه‌های ردیابی یک ورودی: تولید اسکریپت و سپس اجراهای اخیر آن"""
+        meta = entry.get("meta", {})
+        ids = ([meta["trace_id"]] if meta.get("trace_id") else []) + list(meta.get("run_trace_ids", []))
+        return list(dict.fromkeys(ids))
+
+    @staticmethod
+    def _row_to_entry(row) -> Dict[str, Any]:
+        entry = dict(row)
+        entry["meta"] = json.loads(entry["meta"] or "{}")
+        return entry
+
+    def sync(self) -> int:
+        """هماهنگ‌سازی فهرست با فایل‌های موجود در پوشه تاریخچه
+
+        فایل‌های جدید (مثلاً از نسخه‌های قبلی برنامه) اضافه و ردیف‌های فایل‌های حذف شده پاک می‌شوند.
+
+        Returns:
+            int: تعداد تغییرات
+        """
+        on_disk = set(glob.glob(os.path.join(self.history_dir, self.FILE_PATTERN)))
+        with self._lock:
+            conn = self._connection()
+            indexed = {row[0] for row in conn.execute("SELECT path FROM entries")}
+            missing = on_disk - indexed
+            stale = indexed - on_disk
+            conn.executemany("INSERT INTO entries (path, created) VALUES (?, ?)",
+                             [(path, self.created_from_path(path)) for path in missing])
+            conn.executemany("DELETE FROM entries WHERE path = ?", [(path,) for path in stale])
+            conn.commit()
+        if missing or stale:
+            logger.info(f"فهرست تاریخچه هماهنگ شد: {len(missing)} افزوده، {len(stale)} حذف")
+        return len(missing) + len(stale)
+
+    def close(self):
+        """بستن اتصال پایگاه داده"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class ScriptRetriever:
+    """بازیابی اسکریپت‌های موفق مشابه برای استفاده به عنوان نمونه (few-shot) در پرامپت
+
+    هر نمونه (درخواست + نام متدهای API اسکریپت) به بردار n-gram کاراکتری هش شده تبدیل
+    می‌شود و بردارها در examples.<نسخه>.npy ذخیره و با np.load(mmap_mode="r") خوانده می‌شوند.
+    هر ذخیره فایل نسخه جدیدی می‌نویسد و examples.json به آن اشاره می‌کند، چون در ویندوز
+    فایلی که نمونه دیگری mmap کرده قابل جایگزینی نیست؛ نسخه‌های قدیمی پس از آزاد شدن حذف می‌شوند.
+    شباهت با TF-IDF و کسینوس محاسبه می‌شود. مجموعه نمونه‌ها مستقل از پاکسازی تاریخچه است
+    و فقط اسکریپت‌هایی که با موفقیت اجرا شده‌اند به آن اضافه می‌شوند. بدون NumPy غیرفعال است.
+    """
+
+    DIMENSIONS = 2048
+    NGRAM_SIZES = (3, 4, 5)
+    MAX_EXAMPLES = 500
+    _METHOD_PATTERN = re.compile(r'\.(\w+)\s*\(')
+
+    def __init__(self, index_dir: str):
+        """راه‌اندازی بازیاب
+
+        Args:
+            index_dir: پوشه فایل‌های examples.<نسخه>.npy و examples.json
+        """
+        self.index_dir = index_dir
+        self.meta_path = os.path.join(index_dir, "examples.json")
+        self._lock = threading.Lock()
+        self._examples: Optional[List[Dict[str, Any]]] = None
+        self._vectors = None
+        self._version = 0
+        self._meta_mtime = None
+
+    @staticmethod
+    def available() -> bool:
+        """آیا NumPy نصب است"""
+        try:
+            importlib.import_module("numpy")
+            return True
+        except ImportError:
+            return False
+
+    def features(self, query: str, script_content: str = "") -> Any:
+        """بردار tf (لگاریتمی) n-gram های کاراکتری هش شده
+
+        Args:
+            query: متن درخواست
+            script_content: متن اسکریپت (فقط نام متدهای API با وزن کمتر استفاده می‌شود)
+        """
+        vector = np.zeros(self.DIMENSIONS, dtype=np.float32)
+        self._add_ngrams(vector, " ".join(query.lower().split()), 1.0)
+        methods = " ".join(sorted(set(m.lower() for m in self._METHOD_PATTERN.findall(script_content))))
+        if methods:
+            self._add_ngrams(vector, methods, 0.5)
+        return np.log1p(vector)
+
+    def _add_ngrams(self, vector, text: str, weight: float):
+        padded = f" {text} "
+        for size in self.NGRAM_SIZES:
+            for i in range(len(padded) - size + 1):
+                vector[zlib.crc32(padded[i:i + size].encode("utf-8")) % self.DIMENSIONS] += weight
+
+    def add(self, query: str, script_content: str, source_path: str = ""):
+        """افزودن یک اسکریپت موفق به مجموعه نمونه‌ها
+
+        Args:
+            query: درخواست کاربر
+            script_content: متن اسکریپت اجرا شده
+            source_path: مسیر فایل تاریخچه (برای جلوگیری از تکرار)
+        """
+        if not query.strip() or not self.available():
+            return
+        with self._lock:
+            examples, vectors = self._load()
+            if any(e["query"] == query and e["script"] == script_content for e in examples):
+                return
+            examples = examples + [{"query": query, "script": script_content, "path": source_path,
+                                    "added": datetime.datetime.now().isoformat(timespec="seconds")}]
+            vectors = np.vstack([np.asarray(vectors), self.features(query, script_content)[None, :]])
+            if len(examples) > self.MAX_EXAMPLES:
+                examples = examples[-self.MAX_EXAMPLES:]
+                vectors = vectors[-self.MAX_EXAMPLES:]
+            self._save(examples, vectors)
+        logger.info(f"نمونه موفق به بازیاب اضافه شد ({len(examples)} نمونه)")
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.2) -> List[Tuple[float, Dict[str, Any]]]:
+        """یافتن نزدیک‌ترین نمونه‌ها به یک درخواست
+
+        Args:
+            query: متن درخواست جدید
+            k: حداکثر تعداد نمونه
+            min_score: حداقل شباهت کسینوسی
+
+        Returns:
+            List[Tuple[float, Dict[str, Any]]]: (امتیاز، نمونه) به ترتیب نزولی امتیاز
+        """
+        if not query.strip() or not self.available():
+            return []
+        with self._lock:
+            examples, vectors = self._load()
+        if not examples:
+            return []
+        
+        document_frequency = np.count_nonzero(vectors, axis=0)
+        idf = np.log((1 + len(examples)) / (1 + document_frequency)) + 1.0
+        weighted = vectors * idf
+        query_vector = self.features(query) * idf
+        norms = np.linalg.norm(weighted, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = (weighted @ query_vector) / np.where(norms > 0, norms, 1.0)
+        
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), examples[i]) for i in top if scores[i] >= min_score]
+
+    def _vectors_path(self, version: int) -> str:
+        return os.path.join(self.index_dir, f"examples.{version}.npy")
+
+    def _load(self):
+        """خواندن نمونه‌ها و بردارها (بردارها به صورت mmap)؛ با تغییر examples.json توسط
+        نمونه یا پردازه دیگر دوباره خوانده می‌شوند. باید با _lock فراخوانی شود."""
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._examples is not None and mtime == self._meta_mtime:
+            return self._examples, self._vectors
+        self._meta_mtime = mtime
+        self._examples, self._vectors = [], np.zeros((0, self.DIMENSIONS), dtype=np.float32)
+        if mtime is None:
+            return self._examples, self._vectors
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if isinstance(meta, dict):
+                version, examples = int(meta.get("version", 0)), meta.get("examples", [])
+                vectors_path = self._vectors_path(version)
+            else:
+                # قالب قدیمی: لیست نمونه‌ها و examples.npy بدون نسخه
+                version, examples = 0, meta
+                vectors_path = os.path.join(self.index_dir, "examples.npy")
+            vectors = np.load(vectors_path, mmap_mode="r")
+            if vectors.shape == (len(examples), self.DIMENSIONS):
+                self._examples, self._vectors, self._version = examples, vectors, version
+            else:
+                logger.warning("فایل‌های بازیاب نمونه‌ها با هم سازگار نیستند؛ از نو ساخته می‌شوند")
+        except Exception as e:
+            logger.error(f"خطا در خواندن بازیاب نمونه‌ها: {e}")
+        return self._examples, self._vectors
+
+    def _save(self, examples: List[Dict[str, Any]], vectors):
+        """نوشتن نسخه جدید بردارها و سپس جایگزینی اتمی examples.json (با _lock)"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        version = self._version + 1
+        while os.path.exists(self._vectors_path(version)):
+            version += 1
+        vectors_path = self._vectors_path(version)
+        np.save(vectors_path, np.ascontiguousarray(vectors, dtype=np.float32))
+        temp_meta = self.meta_path + ".tmp"
+        with open(temp_meta, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "examples": examples}, f, ensure_ascii=False)
+        os.replace(temp_meta, self.meta_path)
+        self._examples, self._version = examples, version
+        self._vectors = np.load(vectors_path, mmap_mode="r")
+        self._meta_mtime = os.stat(self.meta_path).st_mtime_ns
+        self._remove_old_versions(vectors_path)
+
+    def _remove_old_versions(self, keep: str):
+        """حذف نسخه‌های قدیمی بردارها؛ نسخه‌ای که هنوز جایی mmap شده (ویندوز) دفعه بعد حذف می‌شود"""
+        for path in glob.glob(os.path.join(self.index_dir, "examples.*npy")):
+            if os.path.abspath(path) != os.path.abspath(keep):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+class TokenBucket:
+    """سطل توکن با ظرفیت و نرخ پر شدن بر حسب «در دقیقه»"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """زمان لازم (ثانیه) تا برداشتن amount توکن ممکن شود"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """بازگرداندن (یا با مقدار منفی، کسر) توکن پس از مشخص شدن مصرف واقعی"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RequestScheduler:
+    """زمان‌بند سراسری درخواست‌های LLM با سطل توکن برای هر نقطه پایانی
+
+    هر نقطه پایانی می‌تواند سقف درخواست در دقیقه (rpm) و توکن در دقیقه (tpm) داشته باشد.
+    درخواست‌ها بر اساس کلاس اولویت و سپس ترتیب ورود از صف خارج می‌شوند، بنابراین
+    درخواست‌های تعاملی رابط کاربری جلوتر از کارهای دسته‌ای و پیش‌واکشی قرار می‌گیرند.
+    پاسخ 429 با penalize نقطه پایانی را تا پایان Retry-After مسدود می‌کند.
+    """
+
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BATCH = 1
+    PRIORITY_PREFETCH = 2
+    PRIORITY_NAMES = {0: "interactive", 1: "batch", 2: "prefetch"}
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        """راه‌اندازی زمان‌بند
+
+        Args:
+            limits: نام نقطه پایانی (یا * برای پیش‌فرض) -> (rpm, tpm)؛ صفر یعنی بدون محدودیت
+        """
+        self.limits = dict(limits or {})
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._waiting: List[Tuple[int, int, str]] = []
+        self._sequence = itertools.count()
+        self._waits = {priority: collections.deque(maxlen=500) for priority in self.PRIORITY_NAMES}
+
+    def acquire(self, endpoint: str, tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                timeout: Optional[float] = None, cancel: Optional[threading.Event] = None) -> Optional[float]:
+        """انتظار تا مجاز شدن یک درخواست و کسر سهم آن از سطل‌ها
+
+        Args:
+            endpoint: نام نقطه پایانی
+            tokens: تخمین توکن‌های درخواست
+            priority: کلاس اولویت (عدد کمتر یعنی اولویت بیشتر)
+            timeout: حداکثر انتظار (None یعنی نامحدود، 0 یعنی فقط در صورت آزاد بودن فوری)
+            cancel: رویداد لغو؛ درخواست لغو شده بدون مصرف سهم از صف خارج می‌شود
+
+        Returns:
+            Optional[float]: مدت انتظار در صف (ثانیه) یا None اگر مهلت تمام شد یا لغو شد
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        with self._cond:
+            ticket = (priority, next(self._sequence), endpoint)
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    is_head = min(t for t in self._waiting if t[2] == endpoint) == ticket
+                    delay = self._delay(endpoint, tokens, now)
+                    if is_head and delay <= 0:
+                        rpm, tpm = self._buckets_for(endpoint)
+                        if rpm:
+                            rpm.take(1, now)
+                        if tpm:
+                            tpm.take(tokens, now)
+                        waited = now - started
+                        self._waits[priority].append(waited)
+                        return waited
+                    if (deadline is not None and now >= deadline) or (cancel is not None and cancel.is_set()):
+                        return None
+                    # سر صف تا آزاد شدن سطل می‌خوابد؛ بقیه با notify بیدار می‌شوند
+                    sleep = min(delay if is_head else 1.0, 0.1 if cancel is not None else 1.0)
+                    if deadline is not None:
+                        sleep = min(sleep, deadline - now)
+                    self._cond.wait(max(0.01, sleep))
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def penalize(self, endpoint: str, seconds: float):
+        """مسدود کردن نقطه پایانی تا پایان Retry-After"""
+        with self._cond:
+            self._blocked_until[endpoint] = max(self._blocked_until.get(endpoint, 0.0), time.monotonic() + seconds)
+            self._cond.notify_all()
+        logger.warning(f"محدودیت نرخ {endpoint}: توقف ارسال به مدت {seconds:.0f} ثانیه")
+
+    def settle(self, endpoint: str, estimated: int, actual: int):
+        """اصلاح سطل توکن با مصرف واقعی پس از دریافت پاسخ"""
+        with self._cond:
+            _, tpm = self._buckets_for(endpoint)
+            if tpm:
+                tpm.refund(estimated - actual)
+                self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        """تعداد درخواست‌های در انتظار"""
+        with self._cond:
+            return len(self._waiting)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """آمار زمان انتظار در صف به تفکیک کلاس اولویت (میلی‌ثانیه)"""
+        result = {}
+        with self._cond:
+            for priority, waits in self._waits.items():
+                samples = sorted(waits)
+                if not samples:
+                    continue
+                result[self.PRIORITY_NAMES[priority]] = {
+                    "count": len(samples),
+                    "mean_ms": round(sum(samples) / len(samples) * 1000, 1),
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+                    "max_ms": round(samples[-1] * 1000, 1),
+                }
+        return result
+
+    def _buckets_for(self, endpoint: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._buckets.get(endpoint)
+        if buckets is None:
+            rpm, tpm = self.limits.get(endpoint) or self.limits.get("*") or (0, 0)
+            buckets = self._buckets[endpoint] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+        return buckets
+
+    def _delay(self, endpoint: str, tokens: int, now: float) -> float:
+        rpm, tpm = self._buckets_for(endpoint)
+        delay = self._blocked_until.get(endpoint, 0.0) - now
+        if rpm:
+            delay = max(delay, rpm.wait_time(1, now))
+        if tpm:
+            delay = max(delay, tpm.wait_time(tokens, now))
+        return delay
+
+class LLMResponse:
+    """پاسخ HTTP خوانده شده به طور کامل (سازگار با status_code/text/json در requests)"""
+
+    def __init__(self, status_code: int, content: bytes, headers: Dict[str, str], endpoint: str = "", latency_s: float = 0.0):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.endpoint = endpoint
+        self.latency_s = latency_s
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+class CircuitBreaker:
+    """قطع‌کن مدار یک نقطه پایانی API
+
+    پس از failure_threshold خطای پیاپی (یا فوراً با 429) مدار به مدت cooldown_s یا مقدار
+    Retry-After باز می‌شود و نقطه پایانی کنار گذاشته می‌شود. پس از آن یک درخواست آزمایشی
+    (half-open) اجازه دارد؛ موفقیت مدار را می‌بندد و شکست دوباره آن را باز می‌کند.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """وضعیت مدار: closed، open یا half-open"""
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "half-open" if self.failures >= self.failure_threshold else "closed"
+
+    def allow(self) -> bool:
+        """آیا ارسال درخواست به این نقطه پایانی مجاز است"""
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """ثبت خطا
+
+        Args:
+            retry_after: مدت انتظار اعلام شده توسط سرور (برای 429)؛ مدار را فوراً باز می‌کند
+        """
+        with self._lock:
+            self.failures += 1
+            if retry_after is not None:
+                self.open_until = max(self.open_until, time.monotonic() + retry_after)
+            elif self.failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown_s
+
+class LLMEndpoint:
+    """یک نقطه پایانی API سازگار با OpenAI به همراه آمار تأخیر و قطع‌کن مدار"""
+
+    def __init__(self, url: str, api_key: str = "", model_template: str = "{model}", name: Optional[str] = None):
+        """راه‌اندازی نقطه پایانی
+
+        Args:
+            url: آدرس chat/completions
+            api_key: کلید API
+            model_template: نگاشت نام مدل (مثلاً openai/{model} برای OpenRouter)
+            name: نام نمایشی (پیش‌فرض: نام میزبان)
+        """
+        self.url = url
+        self.api_key = api_key
+        self.model_template = model_template or "{model}"
+        self.name = name or re.sub(r'^\w+://', '', url).split("/")[0]
+        self.extra_headers: Dict[str, str] = {}
+        self.breaker = CircuitBreaker()
+        self.latencies = collections.deque(maxlen=50)
+
+    def headers(self) -> Dict[str, str]:
+        """هدرهای درخواست"""
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": "https://solipy.app"
+        }
+        headers.update(self.extra_headers)
+        return headers
+
+    def model_for(self, model: str) -> str:
+        """نام مدل در این نقطه پایانی"""
+        return self.model_template.replace("{model}", model)
+
+    def p90(self) -> Optional[float]:
+        """صدک ۹۰ تأخیر پاسخ‌های موفق (ثانیه)؛ None اگر نمونه کافی نیست"""
+        samples = sorted(self.latencies)
+        if len(samples) < 5:
+            return None
+        return samples[max(0, int(len(samples) * 0.9 + 0.5) - 1)]
+
+class LLMClient:
+    """کلاینت مشترک درخواست‌های LLM با hedging و جابجایی خودکار بین نقاط پایانی
+
+    هر درخواست ابتدا به نقطه پایانی اصلی (تنظیمات API) فرستاده می‌شود. اگر تا صدک ۹۰ تأخیر
+    مشاهده شده آن پاسخی نیامد، همان درخواست به نقطه پایانی جایگزین هم فرستاده می‌شود؛ اولین
+    پاسخ موفق برگردانده و درخواست دیگر لغو می‌شود. در صورت خطا، نقطه پایانی بعدی امتحان
+    می‌شود. نقاط پایانی با قطع‌کن مدار باز (خطاهای اخیر یا 429) کنار گذاشته می‌شوند.
+    """
+
+    FAILURE_STATUS = {401, 403, 408, 409, 425, 429, 500, 502, 503, 504}
+    DEFAULT_RETRY_AFTER_S = 10.0
+
+    def __init__(self, fallback_endpoints: Optional[List[LLMEndpoint]] = None, hedge: bool = True,
+                 default_hedge_delay_s: float = 8.0, min_hedge_delay_s: float = 0.5, max_workers: int = 8,
+                 scheduler: Optional[RequestScheduler] = None, max_rate_limit_retries: int = 2):
+        """راه‌اندازی کلاینت
+
+        Args:
+            fallback_endpoints: نقاط پایانی جایگزین به ترتیب اولویت
+            hedge: ارسال درخواست دوم پس از تأخیر صدک ۹۰
+            default_hedge_delay_s: تأخیر hedging تا وقتی آمار کافی وجود ندارد
+            min_hedge_delay_s: حداقل تأخیر hedging
+            max_workers: حداکثر درخواست‌های همزمان
+            scheduler: زمان‌بند نرخ (پیش‌فرض: بدون محدودیت)
+            max_rate_limit_retries: تعداد تلاش مجدد پس از 429 وقتی نقطه پایانی دیگری نمانده
+        """
+        self.fallback_endpoints = list(fallback_endpoints or [])
+        self.scheduler = scheduler or RequestScheduler()
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.hedge = hedge
+        self.default_hedge_delay_s = default_hedge_delay_s
+        self.min_hedge_delay_s = min_hedge_delay_s
+        self.max_workers = max_workers
+        self._endpoints: Dict[str, LLMEndpoint] = {ep.url: ep for ep in self.fallback_endpoints}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def endpoint(self, url: str, headers: Optional[Dict[str, str]] = None) -> LLMEndpoint:
+        """نقطه پایانی ثبت شده برای یک آدرس (آمار بین فراخوانی‌ها حفظ می‌شود)
+
+        Args:
+            url: آدرس API
+            headers: هدرهای فراخواننده (کلید API فعلی)
+        """
+        with self._lock:
+            ep = self._endpoints.get(url)
+            if ep is None:
+                ep = self._endpoints[url] = LLMEndpoint(url)
+        if headers:
+            ep.extra_headers = dict(headers)
+        return ep
+
+    def candidates(self, url: str, headers: Optional[Dict[str, str]] = None) -> List[LLMEndpoint]:
+        """نقاط پایانی قابل استفاده به ترتیب اولویت (اصلی، سپس جایگزین‌ها)"""
+        primary = self.endpoint(url, headers)
+        ordered = [primary] + [ep for ep in self.fallback_endpoints if ep.url != url]
+        allowed = [ep for ep in ordered if ep.breaker.allow()]
+        if not allowed:
+            # همه مدارها باز هستند؛ نقطه پایانی‌ای که زودتر آزاد می‌شود امتحان می‌شود
+            allowed = [min(ordered, key=lambda ep: ep.breaker.open_until)]
+        return allowed
+
+    def hedge_delay(self, endpoint: LLMEndpoint) -> float:
+        """زمان انتظار پیش از ارسال درخواست hedge"""
+        p90 = endpoint.p90()
+        return max(self.min_hedge_delay_s, p90 if p90 is not None else self.default_hedge_delay_s)
+
+    def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float = 120,
+             priority: int = RequestScheduler.PRIORITY_INTERACTIVE,
+             cancel: Optional[threading.Event] = None) -> LLMResponse:
+        """ارسال درخواست chat/completions با زمان‌بندی نرخ، hedging و جابجایی بین نقاط پایانی
+
+        Args:
+            url: آدرس نقطه پایانی اصلی
+            headers: هدرهای نقطه پایانی اصلی
+            payload: بدنه درخواست
+            timeout: حداکثر زمان کل شامل انتظار در صف (ثانیه)
+            priority: کلاس اولویت در زمان‌بند (RequestScheduler.PRIORITY_*)
+            cancel: رویداد لغو مشترک (مثلاً بین نامزدهای همزمان)؛ با set شدن آن درخواست از صف
+                زمان‌بند خارج می‌شود و ارسال‌های در جریان رها می‌شوند
+
+        Returns:
+            LLMResponse: اولین پاسخ موفق، یا آخرین پاسخ ناموفق اگر همه نقاط پایانی خطا دادند
+
+        Raises:
+            concurrent.futures.CancelledError: اگر cancel پیش از رسیدن پاسخ set شود
+            Exception: آخرین خطای شبکه اگر هیچ پاسخی دریافت نشد
+        """
+        with get_tracer().span("llm.post", model=payload.get("model"), priority=priority) as span:
+            response = self._post(url, headers, payload, timeout, priority, cancel)
+            if span is not None:
+                span["attributes"].update(endpoint=response.endpoint, status_code=response.status_code)
+            return response
+
+    def _post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float,
+              priority: int, cancel: Optional[threading.Event] = None) -> LLMResponse:
+        candidates = self.candidates(url, headers)
+        to_try = list(candidates)
+        pool = self._executor()
+        tracer = get_tracer()
+        deadline = time.monotonic() + timeout
+        tokens = self.estimate_tokens(payload)
+        pending: Dict[Any, Tuple[LLMEndpoint, threading.Event]] = {}
+        hedged = False
+        rate_limit_retries = 0
+        last_response, last_error = None, None
+
+        def launch(wait: bool) -> bool:
+            ep = to_try[0]
+            remaining = deadline - time.monotonic()
+            waited = self.scheduler.acquire(ep.name, tokens, priority, timeout=max(0.0, remaining) if wait else 0.0,
+                                            cancel=cancel)
+            if waited is None:
+                return False
+            to_try.pop(0)
+            if waited > 0.001:
+                now_ns = time.time_ns()
+                tracer.record("llm.queue_wait", now_ns - int(waited * 1e9), now_ns, endpoint=ep.name)
+            if waited > 1.0:
+                logger.info(f"درخواست ({RequestScheduler.PRIORITY_NAMES.get(priority, priority)}) "
+                            f"{waited:.1f} ثانیه در صف {ep.name} منتظر ماند")
+            body = dict(payload)
+            if "model" in body:
+                body["model"] = ep.model_for(body["model"])
+            send_cancel = threading.Event()
+            future = pool.submit(tracer.wrap(self._send), ep, body, max(1.0, deadline - time.monotonic()), send_cancel)
+            pending[future] = (ep, send_cancel)
+            return True
+
+        if not launch(wait=True):
+            if cancel is not None and cancel.is_set():
+                raise concurrent.futures.CancelledError("درخواست پیش از ارسال لغو شد")
+            raise requests.exceptions.Timeout(f"درخواست در {timeout} ثانیه از صف زمان‌بند خارج نشد")
+        hedge_at = time.monotonic() + self.hedge_delay(candidates[0])
+        try:
+            while pending:
+                now = time.monotonic()
+                can_hedge = self.hedge and not hedged and to_try
+                wait_until = min(hedge_at, deadline) if can_hedge else deadline
+                # با رویداد لغو، انتظار به بازه‌های کوتاه تقسیم می‌شود تا لغو سریع دیده شود
+                slice_until = min(wait_until, now + 0.1) if cancel is not None else wait_until
+                done, _ = concurrent.futures.wait(list(pending), timeout=max(0.0, slice_until - now),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                if cancel is not None and cancel.is_set():
+                    # ارسال‌های در جریان در finally با رویداد لغو خودشان رها می‌شوند
+                    raise concurrent.futures.CancelledError("درخواست لغو شد")
+                if not done and time.monotonic() < wait_until:
+                    continue
+                if not done:
+                    if can_hedge and time.monotonic() < deadline:
+                        hedged = True
+                        # hedge فقط اگر ظرفیت نرخ فوراً موجود باشد؛ در غیر این صورت بار اضافه ایجاد نمی‌کند
+                        if launch(wait=False):
+                            logger.info(f"پاسخی از {candidates[0].name} تا {self.hedge_delay(candidates[0]):.1f} ثانیه "
+                                        f"نیامد؛ ارسال همزمان به {pending[list(pending)[-1]][0].name}")
+                        continue
+                    break
+                
+                for future in done:
+                    ep, _ = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = e
+                        ep.breaker.record_failure()
+                        self.scheduler.settle(ep.name, tokens, 0)
+                        logger.warning(f"خطا در درخواست به {ep.name}: {e}")
+                        continue
+                    self.scheduler.settle(ep.name, tokens, self._used_tokens(response, tokens))
+                    if response.status_code == 200:
+                        ep.latencies.append(response.latency_s)
+                        ep.breaker.record_success()
+                        return response
+                    if response.status_code == 429:
+                        retry_after = self._retry_after(response)
+                        self.scheduler.penalize(ep.name, retry_after if retry_after is not None else self.DEFAULT_RETRY_AFTER_S)
+                        ep.breaker.record_failure(retry_after)
+                        # اگر نقطه پایانی دیگری نمانده، پس از Retry-After دوباره همین نقطه امتحان می‌شود
+                        if not to_try and rate_limit_retries < self.max_rate_limit_retries:
+                            rate_limit_retries += 1
+                            to_try.append(ep)
+                    elif response.status_code in self.FAILURE_STATUS:
+                        ep.breaker.record_failure()
+                    logger.warning(f"پاسخ ناموفق از {ep.name}: {response.status_code}",
+                                   extra={"duration_ms": round(response.latency_s * 1000, 1), "endpoint": ep.name})
+                    last_response = response
+                
+                # جابجایی به نقطه پایانی بعدی اگر درخواست دیگری در جریان نیست
+                if not pending and to_try and time.monotonic() < deadline:
+                    launch(wait=True)
+        finally:
+            for _, send_cancel in pending.values():
+                send_cancel.set()
+
+        if last_response is not None:
+            return last_response
+        if last_error is not None:
+            raise last_error
+        raise requests.exceptions.Timeout(f"هیچ پاسخی از API در {timeout} ثانیه دریافت نشد")
+
+    @staticmethod
+    def estimate_tokens(payload: Dict[str, Any]) -> int:
+        """تخمین توکن‌های یک درخواست (ورودی + حداکثر خروجی) برای سطل توکن"""
+        return PromptBuilder.count_messages(payload.get("messages", [])) + int(payload.get("max_tokens", 0) or 0)
+
+    @staticmethod
+    def _used_tokens(response: LLMResponse, estimated: int) -> int:
+        """توکن‌های مصرف شده طبق usage پاسخ (در نبود آن همان تخمین)"""
+        if response.status_code != 200:
+            return 0
+        try:
+            return int(response.json()["usage"]["total_tokens"])
+        except Exception:
+            return estimated
+
+    def status(self) -> List[Dict[str, Any]]:
+        """وضعیت نقاط پایانی (برای نمایش و لاگ)؛ آمار صف از scheduler.metrics خوانده می‌شود"""
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return [{"name": ep.name, "url": ep.url, "breaker": ep.breaker.state, "p90_s": ep.p90(),
+                 "samples": len(ep.latencies)} for ep in endpoints]
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="LLMClient")
+            return self._pool
+
+    @staticmethod
+    def _retry_after(response: LLMResponse) -> Optional[float]:
+        """خواندن هدر Retry-After (فقط ثانیه)"""
+        value = response.headers.get("Retry-After") or response.headers.get("retry-after")
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _send(endpoint: LLMEndpoint, body: Dict[str, Any], timeout: float, cancel: threading.Event) -> LLMResponse:
+        """ارسال یک درخواست به صورت stream تا لغو (بازنده hedging) بین توکن‌ها اعمال شود
+
+        با لغو، پاسخ بسته و اتصال قطع می‌شود تا سرویس‌دهنده تولید را متوقف کند. رویدادهای SSE
+        در یک بدنه chat.completion معمولی جمع می‌شوند؛ اگر سرویس‌دهنده stream را نادیده بگیرد،
+        بدنه معمولی تکه‌تکه خوانده می‌شود.
+        """
+        started = time.perf_counter()
+        body = dict(body, stream=True, stream_options={"include_usage": True})
+        with get_tracer().span("llm.http", endpoint=endpoint.name, model=body.get("model")) as span:
+            with requests.Session() as session:
+                response = session.post(endpoint.url, headers=endpoint.headers(), json=body, stream=True,
+                                        timeout=(min(10.0, timeout), timeout))
+                # زمان رسیدن هدرهای پاسخ (اتصال و پردازش مدل) جدا از زمان دریافت بدنه
+                headers_ms = round((time.perf_counter() - started) * 1000, 1)
+                headers = dict(response.headers)
+                try:
+                    if response.status_code == 200 and "text/event-stream" in headers.get("Content-Type", ""):
+                        content = LLMClient._collect_stream(response, cancel, endpoint)
+                        headers["Content-Type"] = "application/json"
+                    else:
+                        chunks = []
+                        for chunk in response.iter_content(chunk_size=8192):
+                            if cancel.is_set():
+                                raise concurrent.futures.CancelledError(f"درخواست به {endpoint.name} لغو شد")
+                            chunks.append(chunk)
+                        content = b"".join(chunks)
+                finally:
+                    response.close()
+            if span is not None:
+                span["attributes"].update(status_code=response.status_code, headers_ms=headers_ms, bytes=len(content))
+        return LLMResponse(response.status_code, content, headers, endpoint.name, time.perf_counter() - started)
+
+    @staticmethod
+    def _collect_stream(response, cancel: threading.Event, endpoint: LLMEndpoint) -> bytes:
+        """جمع کردن رویدادهای SSE در بدنه JSON معادل پاسخ بدون stream"""
+        result: Dict[str, Any] = {}
+        text, finish_reason = [], None
+        for line in response.iter_lines():
+            if cancel.is_set():
+                raise concurrent.futures.CancelledError(f"درخواست به {endpoint.name} لغو شد")
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("error"):
+                raise RuntimeError(f"خطا در stream {endpoint.name}: {chunk['error']}")
+            for key in ("id", "model", "created"):
+                if key in chunk:
+                    result.setdefault(key, chunk[key])
+            if chunk.get("usage"):
+                result["usage"] = chunk["usage"]
+            choice = (chunk.get("choices") or [{}])[0]
+            if (choice.get("delta") or {}).get("content"):
+                text.append(choice["delta"]["content"])
+            finish_reason = choice.get("finish_reason") or finish_reason
+        result["object"] = "chat.completion"
+        result["choices"] = [{"index": 0, "message": {"role": "assistant", "content": "".join(text)},
+                              "finish_reason": finish_reason}]
+        return json.dumps(result, ensure_ascii=False).encode("utf-8")
+
+_llm_client: Optional[LLMClient] = None
+_llm_client_lock = threading.Lock()
+
+def get_llm_client() -> LLMClient:
+    """کلاینت LLM مشترک کل برنامه (نقاط پایانی جایگزین از تنظیمات خوانده می‌شوند)"""
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            config = get_config()
+            _llm_client = LLMClient(
+                [LLMEndpoint(url, key, template) for url, key, template in config.fallback_endpoints],
+                hedge=config.hedge_requests,
+                default_hedge_delay_s=config.hedge_delay_s,
+                scheduler=RequestScheduler(config.rate_limits),
+            )
+        return _llm_client
+
+class ScriptValidator:
+    """بررسی ایستای اسکریپت VBScript تولید شده پیش از ذخیره و اجرا
+
+    بررسی‌ها: خالی نبودن، نبود علامت‌های markdown، وجود کد اتصال به SolidWorks و توازن
+    بلوک‌ها (Sub/Function/Class/If/For/Do/While/Select/With). اسکریپتی که به دلیل
+    max_tokens نیمه‌کاره مانده معمولاً با یک بلوک بسته نشده شناسایی می‌شود.
+    """
+
+    _STRING_PATTERN = re.compile(r'"(?:[^"]|"")*"')
+    _CONNECT_PATTERN = re.compile(r'SldWorks\.Application', re.IGNORECASE)
+    _END_PATTERN = re.compile(r'^End\s+(Sub|Function|Class|Property|If|Select|With)\b', re.IGNORECASE)
+    _PROCEDURE_PATTERN = re.compile(r'^(?:(?:Public|Private)\s+)?(?:Default\s+)?(Sub|Function|Class|Property)\s+\w', re.IGNORECASE)
+    _IF_BLOCK_PATTERN = re.compile(r'^If\b.*\bThen$', re.IGNORECASE)
+    _SIMPLE_OPENERS = [
+        (re.compile(r'^Select\s+Case\b', re.IGNORECASE), "select"),
+        (re.compile(r'^With\b', re.IGNORECASE), "with"),
+        (re.compile(r'^For\b', re.IGNORECASE), "for"),
+        (re.compile(r'^Do\b', re.IGNORECASE), "do"),
+        (re.compile(r'^While\b', re.IGNORECASE), "while"),
+    ]
+    _SIMPLE_CLOSERS = [
+        (re.compile(r'^Next\b', re.IGNORECASE), "for"),
+        (re.compile(r'^Loop\b', re.IGNORECASE), "do"),
+        (re.compile(r'^Wend\b', re.IGNORECASE), "while"),
+    ]
+
+    # تعداد آرگومان‌های متدهای پرکاربرد API سالیدورکس
+    API_ARITY = {
+        "newdocument": 4,
+        "selectbyid2": 9,
+        "clearselection2": 1,
+        "insertsketch": 1,
+        "createline": 6,
+        "createcircle": 6,
+        "createcirclebyradius": 4,
+        "createcornerrectangle": 6,
+        "createcenterrectangle": 6,
+        "createarc": 10,
+        "featureextrusion2": 23,
+        "saveas3": 3,
+    }
+    _METHOD_CALL_PATTERN = re.compile(r'\.(\w+)\s*\(')
+    _STATEMENT_CALL_PATTERN = re.compile(r'^(?:Call\s+)?[\w.]+\.(\w+)(?:\s+(.+))?$', re.IGNORECASE)
+
+    def validate(self, script_content: str) -> Tuple[bool, List[str]]:
+        """اعتبارسنجی اسکریپت (ساختار بلوک‌ها و تعداد آرگومان‌های API)
+
+        Args:
+            script_content: متن اسکریپت
+
+        Returns:
+            (معتبر, مشکلات): وضعیت و لیست مشکلات یافت شده
+        """
+        if not script_content or not script_content.strip():
+            return False, ["اسکریپت خالی است"]
+        
+        issues = []
+        if "```" in script_content:
+            issues.append("اسکریپت شامل علامت‌های markdown است")
+        if not self._CONNECT_PATTERN.search(script_content):
+            issues.append("کد اتصال به SolidWorks (SldWorks.Application) یافت نشد")
+        issues.extend(self.check_blocks(script_content))
+        issues.extend(self.check_arity(script_content))
+        return not issues, issues
+
+    def check_arity(self, script_content: str) -> List[str]:
+        """بررسی تعداد آرگومان‌های فراخوانی متدهای شناخته شده API
+
+        Args:
+            script_content: متن اسکریپت
+
+        Returns:
+            List[str]: مشکلات یافت شده
+        """
+        issues = []
+        for line_number, statement in self.statements(script_content):
+            calls = []
+            for match in self._METHOD_CALL_PATTERN.finditer(statement):
+                args = self._parenthesized(statement, match.end() - 1)
+                if args is not None:
+                    calls.append((match.group(1), args))
+            if not calls:
+                match = self._STATEMENT_CALL_PATTERN.match(statement)
+                if match and "=" not in statement:
+                    calls.append((match.group(1), match.group(2) or ""))
+            
+            for name, args in calls:
+                expected = self.API_ARITY.get(name.lower())
+                if expected is None:
+                    continue
+                count = self._count_args(args)
+                if count != expected:
+                    issues.append(f"خط {line_number}: {name} به {expected} آرگومان نیاز دارد اما {count} آرگومان داده شده")
+        return issues
+
+    @staticmethod
+    def _parenthesized(statement: str, open_index: int) -> Optional[str]:
+        """متن داخل پرانتز متوازن از موقعیت داده شده"""
+        depth = 0
+        for i in range(open_index, len(statement)):
+            if statement[i] == "(":
+                depth += 1
+            elif statement[i] == ")":
+                depth -= 1
+                if depth == 0:
+                    return statement[open_index + 1:i]
+        return None
+
+    @staticmethod
+    def _count_args(args: str) -> int:
+        """شمارش آرگومان‌های جدا شده با کاما در سطح بالا"""
+        if not args.strip():
+            return 0
+        depth, count = 0, 1
+        for ch in args:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            elif ch == "," and depth == 0:
+                count += 1
+        return count
+
+    def check_blocks(self, script_content: str) -> List[str]:
+        """بررسی بسته شدن همه بلوک‌ها به ترتیب صحیح
+
+        Args:
+            script_content: متن اسکریپت
+
+        Returns:
+            List[str]: مشکلات یافت شده
+        """
+        stack: List[Tuple[str, int]] = []
+        for line_number, statement in self.statements(script_content):
+            closer = None
+            match = self._END_PATTERN.match(statement)
+            if match:
+                closer = match.group(1).lower()
+            else:
+                for pattern, kind in self._SIMPLE_CLOSERS:
+                    if pattern.match(statement):
+                        closer = kind
+                        break
+            
+            if closer:
+                if not stack or stack[-1][0] != closer:
+                    opened = f"{stack[-1][0]} (خط {stack[-1][1]})" if stack else "هیچ بلوکی"
+                    return [f"خط {line_number}: «{statement}» با {opened} مطابقت ندارد"]
+                stack.pop()
+                continue
+            
+            match = self._PROCEDURE_PATTERN.match(statement)
+            if match:
+                stack.append((match.group(1).lower(), line_number))
+            elif self._IF_BLOCK_PATTERN.match(statement):
+                stack.append(("if", line_number))
+            else:
+                for pattern, kind in self._SIMPLE_OPENERS:
+                    if pattern.match(statement):
+                        stack.append((kind, line_number))
+                        break
+        
+        return [f"بلوک {kind} در خط {line_number} بسته نشده است (احتمالاً اسکریپت ناقص است)" for kind, line_number in stack]
+
+    def statements(self, script_content: str):
+        """تولید دستورات اسکریپت بدون رشته‌ها و توضیحات
+
+        خطوط ادامه‌دار (با _) به هم متصل و دستورات جدا شده با : از هم جدا می‌شوند.
+
+        Yields:
+            (شماره خط, دستور)
+        """
+        pending = ""
+        pending_line = 0
+        for line_number, line in enumerate(script_content.splitlines(), 1):
+            code = self._STRING_PATTERN.sub('""', line)
+            code = code.split("'", 1)[0]
+            if re.match(r'^\s*Rem\b', code, re.IGNORECASE):
+                continue
+            if not pending:
+                pending_line = line_number
+            if code.rstrip().endswith(" _"):
+                pending += code.rstrip()[:-1] + " "
+                continue
+            code = pending + code
+            pending = ""
+            parts = [part.strip() for part in code.split(":")]
+            for index, statement in enumerate(parts):
+                if not statement:
+                    continue
+                # «If x Then: y» یک If تک‌خطی است، نه شروع بلوک
+                if self._IF_BLOCK_PATTERN.match(statement) and any(parts[index + 1:]):
+                    statement += " :"
+                yield pending_line, statement
+
+class ScriptPatcher:
+    """اعمال وصله‌های SEARCH/REPLACE مدل روی اسکریپت فعلی
+
+    در حالت ویرایش به جای تولید دوباره کل اسکریپت، مدل فقط بلوک‌های زیر را برمی‌گرداند:
+
+        <<<<<<< SEARCH
+        (خطوط دقیق اسکریپت فعلی)
+        =======
+        (خطوط جایگزین)
+        >>>>>>> REPLACE
+
+    هر بلوک ابتدا با تطبیق دقیق و سپس با نادیده گرفتن فاصله‌های ابتدا/انتهای خطوط اعمال
+    می‌شود. بلوک SEARCH خالی یعنی افزودن به انتهای اسکریپت (قبل از پیام موفقیت نهایی).
+    """
+
+    _BLOCK_PATTERN = re.compile(
+        r'^<{5,}\s*SEARCH[ \t]*\n(.*?)^={5,}[ \t]*\n(.*?)^>{5,}\s*REPLACE[ \t]*$',
+        re.MULTILINE | re.DOTALL,
+    )
+
+    def parse(self, response: str) -> List[Tuple[str, str]]:
+        """استخراج بلوک‌های (search, replace) از پاسخ مدل"""
+        response = response.replace("\r\n", "\n")
+        return [(search, replace) for search, replace in self._BLOCK_PATTERN.findall(response)]
+
+    def apply(self, script_content: str, response: str) -> Tuple[bool, str, List[str]]:
+        """اعمال همه بلوک‌های پاسخ روی اسکریپت
+
+        Args:
+            script_content: متن اسکریپت فعلی
+            response: پاسخ مدل شامل بلوک‌های SEARCH/REPLACE
+
+        Returns:
+            (موفقیت, اسکریپت_جدید, خطاها): در صورت شکست هر بلوک، اسکریپت اصلی برگردانده می‌شود
+        """
+        blocks = self.parse(response)
+        if not blocks:
+            return False, script_content, ["پاسخ مدل هیچ بلوک SEARCH/REPLACE معتبری ندارد"]
+        
+        lines = script_content.replace("\r\n", "\n").split("\n")
+        errors = []
+        for number, (search, replace) in enumerate(blocks, 1):
+            search_lines = search.split("\n")[:-1] if search else []
+            replace_lines = replace.split("\n")[:-1] if replace else []
+            if not search_lines:
+                lines = self._insert_before_end(lines, replace_lines)
+                continue
+            start = self._find(lines, search_lines)
+            if start is None:
+                errors.append(f"بلوک {number}: متن SEARCH در اسکریپت فعلی یافت نشد ({search_lines[0].strip()[:50]})")
+                continue
+            lines[start:start + len(search_lines)] = replace_lines
+        
+        if errors:
+            return False, script_content, errors
+        return True, "\n".join(lines), []
+
+    @staticmethod
+    def _find(lines: List[str], search_lines: List[str]) -> Optional[int]:
+        """یافتن اولین محل تطبیق (ابتدا دقیق، سپس بدون فاصله‌های ابتدا/انتها)"""
+        size = len(search_lines)
+        for normalize in (lambda s: s, lambda s: s.strip()):
+            target = [normalize(line) for line in search_lines]
+            for start in range(len(lines) - size + 1):
+                if [normalize(line) for line in lines[start:start + size]] == target:
+                    return start
+        return None
+
+    @staticmethod
+    def _insert_before_end(lines: List[str], new_lines: List[str]) -> List[str]:
+        """افزودن خطوط قبل از پیام‌های موفقیت/خروج پایانی یا در انتهای اسکریپت"""
+        insert_at = len(lines)
+        for index in range(len(lines) - 1, -1, -1):
+            code = lines[index].strip().lower()
+            if code.startswith("wscript.quit") or code.startswith("wscript.echo"):
+                insert_at = index
+            elif code and not code.startswith("'"):
+                break
+        return lines[:insert_at] + new_lines + lines[insert_at:]
+
+class MinifiedScript:
+    """نسخه فشرده اسکریپت برای ارسال به مدل همراه با نگاشت خطوط به اسکریپت اصلی
+
+    line_map[i] اندیس (از صفر) خط اصلی متناظر با خط i نسخه فشرده است. با این نگاشت
+    شماره خط پیام‌های خطا به نسخه فشرده و تغییرات مدل روی نسخه فشرده به اسکریپت اصلی
+    (همراه با توضیحات و پیام‌های پیشرفت حذف شده) برگردانده می‌شوند.
+    """
+
+    _ERROR_LINE_PATTERNS = (
+        re.compile(r'\((\d+),\s*(\d+)\)'),
+        re.compile(r'(\bline\s+)(\d+)', re.IGNORECASE),
+        re.compile(r'(خط\s+)(\d+)'),
+    )
+
+    def __init__(self, original: str, lines: List[str], line_map: List[int]):
+        self.original = original
+        self.lines = lines
+        self.line_map = line_map
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def to_minified_line(self, original_line: int) -> int:
+        """شماره خط (از یک) نسخه فشرده برای یک خط اسکریپت اصلی"""
+        index = bisect.bisect_left(self.line_map, original_line - 1)
+        return min(index, max(0, len(self.lines) - 1)) + 1
+
+    def remap_error(self, error_message: str) -> str:
+        """تبدیل شماره خطوط پیام خطای اجرا به شماره خطوط نسخه فشرده"""
+        def line_group(match):
+            if match.re is self._ERROR_LINE_PATTERNS[0]:
+                return f"({self.to_minified_line(int(match.group(1)))}, {match.group(2)})"
+            return f"{match.group(1)}{self.to_minified_line(int(match.group(2)))}"
+        for pattern in self._ERROR_LINE_PATTERNS:
+            error_message = pattern.sub(line_group, error_message)
+        return error_message
+
+    def restore(self, edited: str) -> str:
+        """اعمال تغییرات نسخه فشرده ویرایش شده روی اسکریپت اصلی
+
+        خطوط بدون تغییر، توضیحات و پیام‌های حذف شده دست نخورده می‌مانند و خطوط جدید
+        تورفتگی خط اصلی متناظر را می‌گیرند.
+
+        Args:
+            edited: نسخه فشرده اصلاح شده توسط مدل
+
+        Returns:
+            str: اسکریپت اصلی با تغییرات اعمال شده
+        """
+        original_lines = self.original.replace("\r\n", "\n").split("\n")
+        edited_lines = edited.replace("\r\n", "\n").strip("\n").split("\n")
+        matcher = difflib.SequenceMatcher(None, self.lines, [line.strip() for line in edited_lines], autojunk=False)
+        
+        replacements: Dict[int, List[str]] = {}
+        inserts: Dict[int, List[str]] = collections.defaultdict(list)
+        deleted = set()
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            new_lines = edited_lines[j1:j2]
+            if tag == "insert":
+                anchor = self.line_map[i1 - 1] if i1 > 0 else -1
+                indent_source = original_lines[anchor] if anchor >= 0 else ""
+                inserts[anchor].extend(self._indent(line, indent_source) for line in new_lines)
+                continue
+            targets = self.line_map[i1:i2]
+            replacements[targets[0]] = [self._indent(line, original_lines[targets[min(k, len(targets) - 1)]])
+                                        for k, line in enumerate(new_lines)]
+            deleted.update(targets[1:])
+        
+        result = list(inserts.get(-1, []))
+        for index, line in enumerate(original_lines):
+            if index not in deleted:
+                result.extend(replacements.get(index, [line]))
+            result.extend(inserts.get(index, []))
+        return "\n".join(result)
+
+    @staticmethod
+    def _indent(line: str, source: str) -> str:
+        if line[:1].isspace():
+            return line
+        return source[:len(source) - len(source.lstrip())] + line
+
+class PromptBuilder:
+    """ساخت پیام‌های LLM با شمارش محلی توکن، بودجه ورودی هر درخواست و گزارش صرفه‌جویی
+
+    - پرامپت‌های سیستمی ثابت همیشه اولین پیام هستند تا پیشوند درخواست‌ها بایت به بایت
+      یکسان بماند و کش پرامپت سمت سرویس‌دهنده (prefix caching) استفاده شود.
+    - پیام‌های اختیاری (نمونه‌های few-shot) در صورت عبور از بودجه از انتها حذف می‌شوند.
+    - اسکریپت‌ها قبل از ارسال بدون توضیحات، خطوط خالی و WScript.Echo های متنی فرستاده
+      می‌شوند (minify) و تغییرات مدل با MinifiedScript.restore برگردانده می‌شود.
+    """
+
+    _ECHO_LITERAL_PATTERN = re.compile(r'^WScript\.Echo\s*\(?\s*"(?:[^"]|"")*"\s*\)?$', re.IGNORECASE)
+    _encoding = None
+
+    def __init__(self, budget_tokens: int = 6000):
+        """راه‌اندازی سازنده پرامپت
+
+        Args:
+            budget_tokens: حداکثر توکن ورودی هر درخواست (0 یعنی بدون محدودیت)
+        """
+        self.budget_tokens = budget_tokens
+        self._lock = threading.Lock()
+        self.totals = {"calls": 0, "sent_tokens": 0, "saved_tokens": 0, "cached_tokens": 0}
+
+    @classmethod
+    def count_tokens(cls, text: str) -> int:
+        """شمارش محلی توکن‌ها (tiktoken در صورت نصب بودن، در غیر این صورت تخمین)
+
+        در تخمین هر 4 نویسه لاتین و هر 2 نویسه غیرلاتین (فارسی) یک توکن حساب می‌شود.
+        """
+        if cls._encoding is None:
+            try:
+                cls._encoding = importlib.import_module("tiktoken").get_encoding("cl100k_base")
+            except Exception:
+                cls._encoding = False
+        if cls._encoding:
+            return len(cls._encoding.encode(text, disallowed_special=()))
+        ascii_chars = sum(1 for char in text if ord(char) < 128)
+        return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+    @classmethod
+    def count_messages(cls, messages: List[Dict[str, Any]]) -> int:
+        """شمارش توکن‌های یک لیست پیام (با سربار تقریبی هر پیام)"""
+        return sum(cls.count_tokens(str(message.get("content", ""))) + 4 for message in messages)
+
+    def minify(self, script_content: str) -> MinifiedScript:
+        """حذف توضیحات، خطوط خالی، تورفتگی و WScript.Echo های صرفاً متنی
+
+        پیام‌های Echo که متغیر یا Err.Description را چاپ می‌کنند حفظ می‌شوند.
+        """
+        lines, line_map = [], []
+        for index, line in enumerate(script_content.replace("\r\n", "\n").split("\n")):
+            code = self._strip_comment(line).strip()
+            if not code or re.match(r'^Rem\b', code, re.IGNORECASE) or self._ECHO_LITERAL_PATTERN.match(code):
+                continue
+            lines.append(code)
+            line_map.append(index)
+        return MinifiedScript(script_content, lines, line_map)
+
+    @staticmethod
+    def _strip_comment(line: str) -> str:
+        """حذف توضیح انتهای خط (علامت ' بیرون از رشته‌ها)"""
+        in_string = False
+        for index, char in enumerate(line):
+            if char == '"':
+                in_string = not in_string
+            elif char == "'" and not in_string:
+                return line[:index]
+        return line
+
+    def build(self, kind: str, system_prompt: str, user_content: str,
+              optional_messages: Optional[List[Dict[str, str]]] = None,
+              saved_tokens: int = 0) -> Tuple[Optional[List[Dict[str, str]]], str]:
+        """ساخت پیام‌ها در محدوده بودجه
+
+        Args:
+            kind: نوع درخواست برای گزارش (generate، edit، debug، guidance)
+            system_prompt: پرامپت سیستمی ثابت
+            user_content: پیام کاربر
+            optional_messages: جفت پیام‌های اختیاری (کاربر/دستیار) که در صورت نیاز حذف می‌شوند
+            saved_tokens: توکن‌های صرفه‌جویی شده توسط فشرده‌سازی (برای گزارش)
+
+        Returns:
+            (پیام‌ها, خطا): پیام‌ها یا None با پیام خطا اگر حتی بدون بخش‌های اختیاری از بودجه بیشتر باشد
+        """
+        optional_messages = list(optional_messages or [])
+        required = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}]
+        tokens = self.count_messages(required)
+        if self.budget_tokens and tokens > self.budget_tokens:
+            logger.warning(f"پرامپت {kind} ({tokens} توکن) از بودجه {self.budget_tokens} توکن بیشتر است")
+            return None, f"درخواست ({tokens} توکن) از بودجه ورودی {self.budget_tokens} توکن بزرگ‌تر است (SW_PROMPT_BUDGET)"
+        
+        dropped = 0
+        optional_tokens = self.count_messages(optional_messages)
+        while optional_messages and self.budget_tokens and tokens + optional_tokens > self.budget_tokens:
+            optional_messages = optional_messages[:-2]
+            optional_tokens = self.count_messages(optional_messages)
+            dropped += 1
+        tokens += optional_tokens
+        
+        with self._lock:
+            self.totals["calls"] += 1
+            self.totals["sent_tokens"] += tokens
+            self.totals["saved_tokens"] += saved_tokens
+        percent = 100 * saved_tokens / (tokens + saved_tokens) if saved_tokens else 0
+        logger.info(f"پرامپت {kind}: {tokens} توکن ورودی"
+                    + (f"، صرفه‌جویی {saved_tokens} توکن ({percent:.0f}%)" if saved_tokens else "")
+                    + (f"، {dropped} نمونه به دلیل بودجه حذف شد" if dropped else ""))
+        return [required[0], *optional_messages, required[1]], ""
+
+    def record_usage(self, kind: str, response_data: Dict[str, Any]):
+        """ثبت توکن‌های کش شده سمت سرویس‌دهنده از usage پاسخ (در صورت گزارش)"""
+        usage = response_data.get("usage") or {}
+        if not usage:
+            return
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        with self._lock:
+            self.totals["cached_tokens"] += cached
+        logger.info(f"مصرف توکن {kind}: ورودی {usage.get('prompt_tokens')} (کش شده {cached})، "
+                    f"خروجی {usage.get('completion_tokens')}")
+
+    def summary(self) -> Dict[str, int]:
+        """مجموع توکن‌های ارسالی، صرفه‌جویی شده و کش شده از ابتدای اجرا"""
+        with self._lock:
+            return dict(self.totals)
+
+_prompt_builder: Optional[PromptBuilder] = None
+
+def get_prompt_builder() -> PromptBuilder:
+    """سازنده پرامپت مشترک کل برنامه (بودجه از تنظیمات خوانده می‌شود)"""
+    global _prompt_builder
+    if _prompt_builder is None:
+        _prompt_builder = PromptBuilder(get_config().prompt_budget_tokens)
+    return _prompt_builder
+
+class RouteDecision:
+    """نتیجه مسیریابی یک درخواست به یکی از سطوح مدل"""
+
+    def __init__(self, tier: int, model: str, max_tokens: int, band: str, complexity: Dict[str, Any]):
+        self.tier = tier
+        self.model = model
+        self.max_tokens = max_tokens
+        self.band = band
+        self.complexity = complexity
+
+    def __repr__(self):
+        return f"RouteDecision(tier={self.tier}, model={self.model!r}, max_tokens={self.max_tokens}, band={self.band!r})"
+
+class ModelRouter:
+    """انتخاب مدل بر اساس پیچیدگی درخواست و آمار عملکرد هر سطح
+
+    سطوح (tiers) از ارزان/سریع به قوی مرتب هستند. پیچیدگی به صورت محلی از طول درخواست،
+    عملیات شناسایی شده و تعداد ابعاد تخمین زده می‌شود و سطح پایه و max_tokens را تعیین
+    می‌کند. از سطح پایه به بالا، سطحی انتخاب می‌شود که کمترین زمان مورد انتظار تا یک
+    اسکریپت سالم را دارد: (تأخیر + احتمال شکست × جریمه شکست) / احتمال موفقیت.
+    در صورت شکست اعتبارسنجی یا اجرا، escalate سطح بعدی را برمی‌گرداند.
+    """
+
+    # سطح پیش‌فرض وقتی هیچ مدلی تنظیم نشده (همان پیش‌فرض AppConfig.api_model)
+    DEFAULT_MODEL = "gpt-4o-mini"
+    BANDS = ("simple", "medium", "complex")
+    BAND_THRESHOLDS = (3.0, 7.0)
+    MIN_TOKENS = 1200
+    MAX_TOKENS = 4000
+    ESCALATION_TOKEN_FACTOR = 1.5
+    PRIOR_SUCCESS = 0.8
+    PRIOR_WEIGHT = 3
+    PRIOR_LATENCY_S = 10.0
+    FAILURE_PENALTY_S = 15.0
+
+    OPERATION_KEYWORDS = {
+        "extrude": ("extrude", "اکسترود", "برآمدگی"),
+        "cut": ("cut", "برش"),
+        "revolve": ("revolve", "دوران"),
+        "fillet": ("fillet", "فیلت"),
+        "chamfer": ("chamfer", "پخ"),
+        "hole": ("hole", "سوراخ"),
+        "pattern": ("pattern", "الگو", "آرایه"),
+        "mirror": ("mirror", "قرینه"),
+        "shell": ("shell", "پوسته"),
+        "sweep": ("sweep", "جاروب"),
+        "loft": ("loft", "لافت"),
+        "circle": ("circle", "دایره"),
+        "rectangle": ("rectangle", "مستطیل"),
+        "line": ("line", "خط"),
+        "arc": ("arc", "کمان"),
+        "polygon": ("polygon", "چندضلعی"),
+        "plane": ("plane", "صفحه"),
+        "assembly": ("assembly", "اسمبلی", "مونتاژ"),
+        "mate": ("mate", "قید"),
+        "drawing": ("drawing", "نقشه"),
+        "save": ("save", "export", "ذخیره"),
+    }
+    _DIMENSION_PATTERN = re.compile(r'\d+(?:[.,/]\d+)?')
+
+    def __init__(self, tiers: List[str], stats_path: Optional[str] = None):
+        """راه‌اندازی مسیریاب
+
+        Args:
+            tiers: نام مدل‌ها از ارزان‌ترین به قوی‌ترین (خالی یعنی DEFAULT_MODEL)
+            stats_path: مسیر فایل JSON برای نگهداری آمار بین اجراها (اختیاری)
+        """
+        self.tiers = self._valid_tiers(tiers)
+        self.stats_path = stats_path
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._keyword_patterns = {
+            operation: re.compile("|".join(rf'(?<!\w){re.escape(k)}(?!\w)' for k in keywords), re.IGNORECASE)
+            for operation, keywords in self.OPERATION_KEYWORDS.items()
+        }
+        self._load_stats()
+
+    def set_tiers(self, tiers: List[str]):
+        """جایگزینی سطوح مدل (مثلاً پس از تغییر تنظیمات API)"""
+        tiers = self._valid_tiers(tiers)
+        with self._lock:
+            self.tiers = tiers
+
+    @classmethod
+    def _valid_tiers(cls, tiers: List[str]) -> List[str]:
+        """حذف نام‌های خالی؛ لیست خالی با DEFAULT_MODEL جایگزین می‌شود تا choose همیشه سطحی داشته باشد"""
+        valid = [t.strip() for t in tiers if t and t.strip()]
+        if not valid:
+            logger.warning(f"هیچ مدلی تنظیم نشده است؛ از {cls.DEFAULT_MODEL} استفاده می‌شود")
+            return [cls.DEFAULT_MODEL]
+        return valid
+
+    def estimate_complexity(self, query: str) -> Dict[str, Any]:
+        """تخمین پیچیدگی درخواست
+
+        Args:
+            query: متن درخواست
+
+        Returns:
+            Dict[str, Any]: عملیات شناسایی شده، تعداد ابعاد، تعداد کلمات، امتیاز و دسته
+        """
+        operations = [op for op, pattern in self._keyword_patterns.items() if pattern.search(query)]
+        dimensions = len(self._DIMENSION_PATTERN.findall(query))
+        words = len(query.split())
+        score = len(operations) + 0.5 * dimensions + words / 20.0
+        band_index = sum(score >= threshold for threshold in self.BAND_THRESHOLDS)
+        return {
+            "operations": operations,
+            "dimensions": dimensions,
+            "words": words,
+            "score": round(score, 2),
+            "band": self.BANDS[band_index],
+        }
+
+    def choose(self, query: str, min_tier: int = 0) -> RouteDecision:
+        """انتخاب سطح مدل برای یک درخواست
+
+        Args:
+            query: متن درخواست
+            min_tier: حداقل سطح مجاز (برای تلاش مجدد پس از شکست اجرا)
+
+        Returns:
+            RouteDecision: سطح، مدل، max_tokens و دسته پیچیدگی
+        """
+        complexity = self.estimate_complexity(query)
+        band = complexity["band"]
+        with self._lock:
+            tiers = list(self.tiers)
+        last = len(tiers) - 1
+        base = min(last, max(min_tier, self.BANDS.index(band) * last // 2))
+        
+        best, best_cost = base, None
+        for tier in range(base, last + 1):
+            cost = self.expected_seconds(tiers[tier], band)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = tier, cost
+        
+        max_tokens = self.MIN_TOKENS + 250 * len(complexity["operations"]) + 25 * complexity["dimensions"]
+        decision = RouteDecision(best, tiers[best], min(self.MAX_TOKENS, max_tokens), band, complexity)
+        logger.info(f"مسیریابی مدل: {decision} (امتیاز پیچیدگی {complexity['score']})")
+        return decision
+
+    def escalate(self, decision: RouteDecision) -> Optional[RouteDecision]:
+        """سطح بعدی (قوی‌تر) با max_tokens بیشتر
+
+        Args:
+            decision: تصمیم قبلی
+
+        Returns:
+            Optional[RouteDecision]: تصمیم جدید یا None اگر سطح بالاتری وجود ندارد
+        """
+        with self._lock:
+            tiers = list(self.tiers)
+        if decision.tier + 1 >= len(tiers):
+            return None
+        max_tokens = min(self.MAX_TOKENS, int(decision.max_tokens * self.ESCALATION_TOKEN_FACTOR))
+        return RouteDecision(decision.tier + 1, tiers[decision.tier + 1], max_tokens, decision.band, decision.complexity)
+
+    def expected_seconds(self, model: str, band: str) -> float:
+        """زمان مورد انتظار تا یک اسکریپت سالم برای یک مدل در یک دسته پیچیدگی"""
+        with self._lock:
+            stats = self._stats.get(model, {}).get(band, {})
+        attempts = stats.get("attempts", 0)
+        success_rate = (stats.get("successes", 0) + self.PRIOR_SUCCESS * self.PRIOR_WEIGHT) / (attempts + self.PRIOR_WEIGHT)
+        latency = stats.get("latency_s") or self.PRIOR_LATENCY_S
+        return (latency + (1 - success_rate) * self.FAILURE_PENALTY_S) / max(success_rate, 0.01)
+
+    def record(self, model: str, band: str, success: bool, latency_s: Optional[float] = None):
+        """ثبت نتیجه یک تلاش (اعتبارسنجی تولید یا اجرای اسکریپت)
+
+        Args:
+            model: نام مدل
+            band: دسته پیچیدگی
+            success: موفقیت
+            latency_s: زمان پاسخ API (فقط برای تولید)
+        """
+        with self._lock:
+            stats = self._stats.setdefault(model, {}).setdefault(band, {"attempts": 0, "successes": 0, "latency_s": 0.0})
+            stats["attempts"] += 1
+            stats["successes"] += 1 if success else 0
+            if latency_s is not None:
+                # میانگین متحرک نمایی تأخیر
+                stats["latency_s"] = latency_s if not stats["latency_s"] else 0.7 * stats["latency_s"] + 0.3 * latency_s
+            self._save_stats()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """آمار تجمیعی هر مدل (تعداد تلاش، نرخ موفقیت و تأخیر میانگین)"""
+        result = {}
+        with self._lock:
+            for model, bands in self._stats.items():
+                attempts = sum(b["attempts"] for b in bands.values())
+                successes = sum(b["successes"] for b in bands.values())
+                latencies = [b["latency_s"] for b in bands.values() if b["latency_s"]]
+                result[model] = {
+                    "attempts": attempts,
+                    "success_rate": round(successes / attempts, 3) if attempts else None,
+                    "latency_s": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                }
+        return result
+
+    def _load_stats(self):
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                self._stats = json.load(f)
+        except Exception as e:
+            logger.warning(f"خطا در خواندن آمار مسیریابی مدل: {e}")
+
+    def _save_stats(self):
+        if not self.stats_path:
+            return
+        try:
+            with open(self.stats_path, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"خطا در ذخیره آمار مسیریابی مدل: {e}")
+
+class SolidWorksScriptGenerator:
+    """کلاس تولید کننده اسکریپت‌های VBS برای SolidWorks"""
+    
+    # دمای نامزدها در تولید موازی؛ اولی همان دمای تولید عادی است
+    CANDIDATE_TEMPERATURES = (0.2, 0.5, 0.8, 0.35, 0.65, 1.0)
+    EDIT_MAX_TOKENS = 1000  # وصله‌ها کوتاه هستند؛ سقف پایین‌تر از تولید کامل
+    
+    # پرامپت‌های سیستمی ثابت (پیشوند یکسان همه درخواست‌ها برای کش پرامپت سرویس‌دهنده)
+    SYSTEM_PROMPT = """You are an expert in SolidWorks automation with VBScript. 
+Your task is to generate VBScript code that can automate SolidWorks operations.
+You MUST understand user instructions in both English and Persian (Farsi) language.
+When user instructions are in Persian, you should understand words like "بکش", "دایره", "خط", "مستطیل", etc.
+Keep your responses focused only on the VBScript code without any explanations.
+
+IMPORTANT: Always structure your script in this sequence:
+1. Start with 'Option Explicit'
+2. Include connection code that connects to SolidWorks first:
+
+Dim swApp
+On Error Resume Next
+WScript.Echo "در حال اتصال به SolidWorks..."
+Set swApp = GetObject(, "SldWorks.Application")
+If Err.Number <> 0 Then
+    Err.Clear
+    WScript.Echo "SolidWorks در حال اجرا نیست. تلاش برای اجرای SolidWorks..."
+    Set swApp = CreateObject("SldWorks.Application")
+    If Err.Number <> 0 Then
+        WScript.Echo "خطا در اتصال به SolidWorks: " & Err.Description
+        WScript.Quit(1)
+    End If
+End If
+swApp.Visible = True
+WScript.Echo "اتصال به SolidWorks با موفقیت انجام شد."
+On Error Goto 0
+
+3. Create or open a document
+4. Implement the requested feature or operation
+5. Include proper error handling
+
 The script must run independently and include all necessary code to connect to SolidWorks, 
 not relying on any external functions or files.
 Always end with a success message and return 0 exit code on success.
 
-PERSIAN COMMANDS GLOSSARY:
-- "دایره بکش" or "یک دایره بکش" or "رسم دایره" = Draw a circle
-- "مستطیل بکش" or "یک مستطیل بکش" = Draw a rectangle
-- "خط بکش" = Draw a line
-- "اکسترود کن" = Extrude
-- "برش بزن" = Cut
-- "ذخیره کن" = Save
+PERSIAN COMMANDS GLOSSARY:
+- "دایره بکش" or "یک دایره بکش" or "رسم دایره" = Draw a circle
+- "مستطیل بکش" or "یک مستطیل بکش" = Draw a rectangle
+- "خط بکش" = Draw a line
+- "اکسترود کن" = Extrude
+- "برش بزن" = Cut
+- "ذخیره کن" = Save
+"""
+    EDIT_SYSTEM_PROMPT = """You edit existing SolidWorks VBScript files.
+The user gives you the current script and a follow-up change request (English or Persian).
+Respond ONLY with one or more edit blocks in exactly this format, and nothing else:
+
+<<<<<<< SEARCH
+exact lines copied from the current script
+=======
+replacement lines
+>>>>>>> REPLACE
+
+Rules:
+- SEARCH must match the current script exactly, including indentation, and be as short as possible while unique.
+- Use an empty SEARCH section to append new code before the final success message.
+- Keep the existing connection code, document handling and error handling unchanged.
+- Never return the whole script.
+"""
+    
+    def __init__(self, api_key: str = "", base_url: str = "", api_model: str = "",
+                 com_runner: Optional[SolidWorksCOMRunner] = None):
+        """راه اندازی تولید کننده اسکریپت
+
+        Args:
+            api_key: کلید API برای استفاده از سرویس هوش مصنوعی
+            base_url: آدرس API
+            api_model: مدل هوش مصنوعی
+            com_runner: اجرا کننده COM ماندگار (در صورت عدم تعیین از cscript استفاده می‌شود)
+        """
+        config = get_config().prepare_runtime()
+        self.api_key = api_key if api_key else config.api_key
+        self.api_url = base_url if base_url else config.base_url
+        self.api_model = api_model if api_model else config.api_model
+        self.com_runner = com_runner
+        self.bundler = ScriptBundler()
+        self.history_index = HistoryIndex(config.history_dir)
+        self.llm = get_llm_client()
+        self.candidate_count = config.generation_candidates
+        self._candidate_pool = None
+        self.validator = ScriptValidator()
+        self.patcher = ScriptPatcher()
+        self.prompts = get_prompt_builder()
+        self.fewshot_tokens = config.fewshot_tokens
+        self.retriever = ScriptRetriever(os.path.join(config.history_dir, "retrieval"))
+        self.part_cache = PartScriptCache(os.path.join(config.history_dir, "parts"))
+        # سازنده‌های دسته اسکریپت‌های چندمرحله‌ای اخیر (برای گزارش خروجی به تفکیک مرحله)
+        self.batch_builders: "collections.OrderedDict[str, BatchScriptBuilder]" = collections.OrderedDict()
+        self.router = ModelRouter(config.model_tiers or [self.api_model],
+                                  stats_path=os.path.join(config.history_dir, "router_stats.json"))
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": "https://solipy.app"
+        }
+    
+    def generate_script(self, query: str, min_tier: int = 0,
+                        priority: int = RequestScheduler.PRIORITY_INTERACTIVE) -> Tuple[bool, str, Optional[str]]:
+        """تولید اسکریپت VBS بر اساس درخواست کاربر
+
+        Args:
+            query: متن درخواست کاربر
+            min_tier: حداقل سطح مدل (برای تولید دوباره با مدل قوی‌تر پس از شکست اجرا)
+            priority: کلاس اولویت در زمان‌بند (سرویس‌های پس‌زمینه PRIORITY_BATCH می‌فرستند)
+
+        Returns:
+            (موفقیت, پیام, مسیر_اسکریپت): وضعیت تولید اسکریپت، پیام و مسیر فایل اسکریپت تولید شده
+        """
+        with get_tracer().span("generate", query=query[:200], min_tier=min_tier), get_profiler().stage("generation"):
+            return self._generate_script(query, min_tier, priority)
+    
+    def _generate_script(self, query: str, min_tier: int, priority: int) -> Tuple[bool, str, Optional[str]]:
+        try:
+            # لاگ کردن درخواست
+            logger.info(f"درخواست جدید: {query}")
+            
+            # درخواست‌های چندقطعه‌ای به قطعات مستقل تجزیه و همزمان تولید می‌شوند
+            if min_tier == 0 and AssemblyPlanner.is_assembly_request(query):
+                result = self.generate_assembly_script(query, priority)
+                if result is not None:
+                    return result
+            
+            success, message, script_content, decision = self._request_routed(query, min_tier, priority)
+            if not success:
+                return False, message, None
+            
+            script_path = self._save_script(script_content, query, model=decision.model,
+                                            tier=decision.tier, band=decision.band)
+            if message:
+                return True, f"اسکریپت ایجاد شد اما اعتبارسنجی کامل نشد: {message}", script_path
+            return True, "اسکریپت با موفقیت ایجاد شد.", script_path
+            
+        except Exception as e:
+            logger.error(f"خطا در تولید اسکریپت: {e}")
+            return False, f"خطا در تولید اسکریپت: {str(e)}", None
+    
+    def generate_assembly_script(self, query: str, priority: int = RequestScheduler.PRIORITY_INTERACTIVE
+                                 ) -> Optional[Tuple[bool, str, Optional[str]]]:
+        """تولید اسکریپت اسمبلی با تولید همزمان قطعات و یک مرحله مونتاژ
+
+        اسکریپت هر قطعه جداگانه تولید، اعتبارسنجی و کش می‌شود؛ مرحله مونتاژ هم همزمان با
+        قطعات تولید می‌شود چون مسیر فایل قطعات از پیش معلوم است. در پایان همه در یک
+        اسکریپت دسته‌ای ادغام می‌شوند که هر قطعه را می‌سازد و ذخیره می‌کند و سپس اسمبلی را
+        می‌سازد، پس زمان کل به اندازه کندترین قطعه است و نه مجموع آنها.
+
+        Args:
+            query: درخواست کاربر
+            priority: کلاس اولویت در زمان‌بند برای همه درخواست‌های طرح، قطعات و مونتاژ
+
+        Returns:
+            مشابه generate_script، یا None اگر درخواست به بیش از یک قطعه تجزیه نشد
+        """
+        success, message, plan = self._request_plan(query, priority)
+        if not success or plan is None:
+            if message:
+                logger.warning(f"برنامه‌ریزی اسمبلی ناموفق بود ({message}) - تولید یک‌جا")
+            return None
+        parts = plan["parts"]
+        if len(parts) == 1 and parts[0]["quantity"] == 1:
+            return None
+        
+        output_dir = os.path.abspath(os.path.join(get_config().scripts_dir, "assemblies",
+                                                  datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")))
+        os.makedirs(output_dir, exist_ok=True)
+        part_bases = {part["name"]: os.path.join(output_dir, part["name"]) for part in parts}
+        assembly_path = os.path.join(output_dir, "assembly.SLDASM")
+        logger.info("طرح اسمبلی: " + ", ".join(f"{part['name']} x{part['quantity']}" for part in parts))
+        
+        def _part(part):
+            cached = self.part_cache.get(part["description"])
+            if cached is not None:
+                logger.info(f"اسکریپت قطعه {part['name']} از کش خوانده شد")
+                return True, "", cached
+            success, message, script_content, _ = self._request_routed(AssemblyPlanner.part_query(part), priority=priority)
+            if success and not message:
+                self.part_cache.put(part["description"], script_content)
+            return success, message, script_content
+        
+        assembly_query = AssemblyPlanner.assembly_query(
+            plan, {name: f"{base}.SLDPRT" for name, base in part_bases.items()}, assembly_path)
+        tracer = get_tracer()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(parts) + 1, thread_name_prefix="AssemblyParts") as pool:
+            assembly_future = pool.submit(tracer.wrap(self._request_routed, "generate.assembly_step"), assembly_query, 0, priority)
+            part_results = list(pool.map(tracer.wrap(_part, "generate.part"), parts))
+            assembly_result = assembly_future.result()
+        
+        builder = BatchScriptBuilder(reuse_document=False)
+        warnings = []
+        for index, (part, (success, message, script_content)) in enumerate(zip(parts, part_results), 1):
+            if not success:
+                return False, f"خطا در تولید قطعه {part['name']}: {message}", None
+            if message:
+                warnings.append(f"{part['name']}: {message}")
+            builder.add_step(f"قطعه {part['name']}: {part['description']}",
+                             script_content + "\n" + builder.save_step(index, part_bases[part["name"]],
+                                                                        AssemblyPlanner.PART_MARKER))
+        success, message, script_content, decision = assembly_result
+        if not success:
+            return False, f"خطا در تولید مرحله مونتاژ: {message}", None
+        if message:
+            warnings.append(f"مونتاژ: {message}")
+        builder.add_step(f"مونتاژ: {plan['assembly']}", script_content)
+        
+        script_path = self._save_script(builder.build(), query, model=decision.model, batch_steps=len(parts) + 1,
+                                        assembly=output_dir, parts=[part["name"] for part in parts])
+        self.batch_builders[script_path] = builder
+        while len(self.batch_builders) > 20:
+            self.batch_builders.popitem(last=False)
+        summary = f"اسکریپت اسمبلی با {len(parts)} قطعه ایجاد شد."
+        if warnings:
+            return True, f"{summary} اعتبارسنجی کامل نشد: {'؛ '.join(warnings)}", script_path
+        return True, summary, script_path
+    
+    def _request_plan(self, query: str, priority: int = RequestScheduler.PRIORITY_INTERACTIVE
+                      ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+        """درخواست طرح اسمبلی (قطعات و مرحله مونتاژ) از API
+
+        Returns:
+            (موفقیت, پیام, طرح): طرح None یعنی پاسخ قابل استفاده نبود
+        """
+        if not self.api_key:
+            return False, "کلید API تنظیم نشده است.", None
+        messages, error = self.prompts.build("plan", AssemblyPlanner.PLAN_SYSTEM_PROMPT, query)
+        if messages is None:
+            return False, error, None
+        payload = {
+            "model": self.router.choose(query).model or self.api_model,
+            "messages": messages,
+            "temperature": 0,
+            "max_tokens": AssemblyPlanner.PLAN_MAX_TOKENS,
+        }
+        response = self.llm.post(self.api_url, self.headers, payload, timeout=60, priority=priority)
+        if response.status_code != 200:
+            return False, f"خطا در درخواست API: {response.status_code}", None
+        response_data = response.json()
+        self.prompts.record_usage("plan", response_data)
+        plan = AssemblyPlanner.parse_plan(response_data['choices'][0]['message']['content'])
+        return True, "" if plan else "طرح JSON نامعتبر است", plan
+    
+    def edit_script(self, script_content: str, instruction: str,
+                    parent_path: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
+        """ویرایش تدریجی اسکریپت فعلی بر اساس دستور پیگیری (مثلاً «حالا 10 میلی‌متر اکسترود کن»)
+
+        مدل فقط وصله‌های SEARCH/REPLACE را برمی‌گرداند که به صورت محلی اعمال و اعتبارسنجی
+        می‌شوند. اگر وصله قابل اعمال نباشد یا اسکریپت حاصل نامعتبر شود، اسکریپت کامل با
+        درخواست قبلی و دستور جدید دوباره تولید می‌شود.
+
+        Args:
+            script_content: متن اسکریپت فعلی (همان چیزی که در ویرایشگر است)
+            instruction: دستور پیگیری کاربر
+            parent_path: مسیر ورودی تاریخچه اسکریپت فعلی (در صورت وجود)
+
+        Returns:
+            (موفقیت, پیام, مسیر_اسکریپت): مشابه generate_script
+        """
+        with get_tracer().span("generate.edit", instruction=instruction[:200]), get_profiler().stage("generation"):
+            return self._edit_script(script_content, instruction, parent_path)
+    
+    def _edit_script(self, script_content: str, instruction: str,
+                     parent_path: Optional[str]) -> Tuple[bool, str, Optional[str]]:
+        parent = self.history_index.get(parent_path) if parent_path else None
+        parent_query = parent["query"] if parent else ""
+        combined_query = f"{parent_query}. {instruction}" if parent_query else instruction
+        try:
+            logger.info(f"درخواست ویرایش: {instruction}")
+            decision = self.router.choose(instruction)
+            minified = self.prompts.minify(script_content)
+            success, message, response = self._request_edit(minified, instruction, decision.model,
+                                                            min(decision.max_tokens, self.EDIT_MAX_TOKENS))
+            if not success:
+                return False, message, None
+            
+            applied, new_content, errors = self.patcher.apply(minified.text, response)
+            if applied:
+                new_content = minified.restore(new_content)
+                valid, issues = self.validator.validate(new_content)
+                errors = [] if valid else issues
+            if applied and not errors:
+                script_path = self._save_script(new_content, combined_query, model=decision.model, tier=decision.tier,
+                                                band=decision.band, parent=parent_path, edit=instruction)
+                return True, "اسکریپت با وصله ویرایش شد.", script_path
+            
+            logger.warning(f"وصله ویرایش قابل استفاده نیست ({'؛ '.join(errors)}) - تولید کامل اسکریپت")
+        except Exception as e:
+            logger.error(f"خطا در ویرایش اسکریپت: {e} - تولید کامل اسکریپت")
+        return self.generate_script(combined_query)
+    
+    def _request_edit(self, minified: MinifiedScript, instruction: str, model: str,
+                      max_tokens: int) -> Tuple[bool, str, str]:
+        """درخواست وصله SEARCH/REPLACE از API برای نسخه فشرده اسکریپت
+
+        Returns:
+            (موفقیت, پیام, پاسخ): پاسخ خام مدل شامل بلوک‌های وصله
+        """
+        if not self.api_key:
+            return False, "کلید API تنظیم نشده است. لطفاً کلید API را در فایل .env یا doc.txt تنظیم کنید.", ""
+        
+        messages, error = self.prompts.build(
+            "edit", self.EDIT_SYSTEM_PROMPT,
+            f"Current script:\n{minified.text}\n\nChange request: {instruction}",
+            saved_tokens=PromptBuilder.count_tokens(minified.original) - PromptBuilder.count_tokens(minified.text),
+        )
+        if messages is None:
+            return False, error, ""
+        payload = {
+            "model": model or self.api_model,
+            "messages": messages,
+            "temperature": 0.1,
+            "max_tokens": max_tokens
+        }
+        
+        logger.info(f"ارسال درخواست ویرایش به API... ({self.api_url}, {model or self.api_model})")
+        response = self.llm.post(self.api_url, self.headers, payload, timeout=120)
+        if response.status_code != 200:
+            logger.error(f"خطا در پاسخ API: {response.status_code} - {truncate_for_log(response.text)}",
+                         extra={"duration_ms": round(response.latency_s * 1000, 1), "endpoint": response.endpoint})
+            return False, f"خطا در درخواست API: {response.status_code}", ""
+        
+        response_data = response.json()
+        self.prompts.record_usage("edit", response_data)
+        return True, "", response_data['choices'][0]['message']['content']
+    
+    def generate_batch_script(self, queries: List[str]) -> Tuple[bool, str, Optional[str], Optional["BatchScriptBuilder"]]:
+        """تولید یک اسکریپت واحد برای چند دستور پشت سر هم
+
+        اسکریپت هر دستور به صورت همزمان تولید می‌شود و سپس همه در یک اسکریپت با یک
+        اتصال و یک سند ادغام می‌شوند.
+
+        Args:
+            queries: لیست دستورات کاربر به ترتیب اجرا
+
+        Returns:
+            (موفقیت, پیام, مسیر_اسکریپت, سازنده): وضعیت، پیام، مسیر اسکریپت ادغام شده و سازنده دسته
+        """
+        try:
+            if not queries:
+                return False, "هیچ دستوری در صف وجود ندارد.", None, None
+            
+            logger.info(f"درخواست دسته‌ای جدید با {len(queries)} دستور")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(queries))) as pool:
+                results = list(pool.map(lambda q: self._request_routed(q, priority=RequestScheduler.PRIORITY_BATCH)[:3], queries))
+            
+            builder = BatchScriptBuilder()
+            for index, (query, (success, message, script_content)) in enumerate(zip(queries, results), 1):
+                if not success:
+                    return False, f"خطا در تولید مرحله {index} ({query}): {message}", None, None
+                builder.add_step(query, script_content)
+            
+            script_path = self._save_script(builder.build(), " | ".join(queries), batch_steps=len(queries))
+            return True, f"اسکریپت دسته‌ای با {len(queries)} مرحله ایجاد شد.", script_path, builder
+            
+        except Exception as e:
+            logger.error(f"خطا در تولید اسکریپت دسته‌ای: {e}")
+            return False, f"خطا در تولید اسکریپت دسته‌ای: {str(e)}", None, None
+    
+    def generate_sweep_script(self, script_content: str, ranges: Optional[Dict[str, str]] = None,
+                              table_path: str = "", constraints: Optional[List[str]] = None,
+                              name_template: str = "variant_{index:03d}",
+                              output_dir: str = "") -> Tuple[bool, str, Optional[str], Optional["BatchScriptBuilder"], Optional["DesignSweep"]]:
+        """ساخت اسکریپت دسته‌ای جاروب پارامتری از یک اسکریپت بدون درخواست LLM
+
+        Args:
+            script_content: اسکریپت پایه
+            ranges: نام پارامتر -> مشخصه بازه («شروع:پایان:گام» یا «a, b, c»)
+            table_path: جدول طراحی CSV
+            constraints: قیدهای فیلتر ترکیب‌ها
+            name_template: الگوی نام فایل نسخه‌ها
+            output_dir: پوشه ذخیره نسخه‌ها (پیش‌فرض: scripts/sweeps/<زمان>)
+
+        Returns:
+            (موفقیت, پیام, مسیر_اسکریپت, سازنده, جاروب)
+        """
+        try:
+            sweep = DesignSweep(script_content)
+            sweep.expand(ranges, table_path)
+            sweep.apply_constraints(constraints or [])
+            if not output_dir:
+                output_dir = os.path.join(get_config().scripts_dir, "sweeps",
+                                          datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+            builder = sweep.build(output_dir, name_template)
+            count = len(sweep.variants)
+            summary = ", ".join(sweep.names)
+            script_path = self._save_script(builder.build(), f"جاروب پارامتری ({summary}): {count} نسخه",
+                                            batch_steps=count, sweep_manifest=sweep.manifest_path)
+            logger.info(f"جاروب پارامتری با {count} نسخه ساخته شد ({sweep.rejected} ترکیب با قیدها حذف شد)")
+            return (True, f"اسکریپت جاروب با {count} نسخه ایجاد شد ({sweep.rejected} ترکیب حذف شد).",
+                    script_path, builder, sweep)
+        except (ValueError, OSError) as e:
+            return False, str(e), None, None, None
+        except Exception as e:
+            logger.error(f"خطا در ساخت جاروب پارامتری: {e}")
+            return False, f"خطا در ساخت جاروب پارامتری: {str(e)}", None, None, None
+    
+    def _request_routed(self, query: str, min_tier: int = 0,
+                        priority: int = RequestScheduler.PRIORITY_INTERACTIVE) -> Tuple[bool, str, str, Optional[RouteDecision]]:
+        """دریافت اسکریپت با مسیریابی مدل و ارتقای سطح در صورت شکست اعتبارسنجی
+
+        Args:
+            query: متن درخواست کاربر
+            min_tier: حداقل سطح مدل
+            priority: کلاس اولویت در زمان‌بند درخواست‌ها
+
+        Returns:
+            (موفقیت, پیام, متن_اسکریپت, تصمیم): پیام غیرخالی در حالت موفق یعنی حتی قوی‌ترین
+            سطح هم اعتبارسنجی را پاس نکرد و آخرین اسکریپت برای دیباگ برگردانده شده است
+        """
+        decision = self.router.choose(query, min_tier)
+        while True:
+            started = time.perf_counter()
+            success, message, script_content, issues = self._request_best(query, decision, priority)
+            latency = time.perf_counter() - started
+            if not success:
+                # خطای API (کلید، شبکه و ...) به کیفیت مدل ربطی ندارد؛ ارتقا کمکی نمی‌کند
+                return False, message, "", decision
+            
+            valid = not issues
+            self.router.record(decision.model, decision.band, valid, latency)
+            if valid:
+                return True, "", script_content, decision
+            
+            next_decision = self.router.escalate(decision)
+            logger.warning(f"اسکریپت مدل {decision.model} نامعتبر است: {'؛ '.join(issues)}"
+                           + (f" - تلاش مجدد با {next_decision.model}" if next_decision else ""))
+            if next_decision is None:
+                return True, "؛ ".join(issues), script_content, decision
+            decision = next_decision
+    
+    def _request_best(self, query: str, decision: RouteDecision,
+                      priority: int = RequestScheduler.PRIORITY_INTERACTIVE) -> Tuple[bool, str, str, List[str]]:
+        """تولید یک یا چند نامزد و انتخاب بهترین بر اساس اعتبارسنجی محلی
+
+        با candidate_count > 1 نامزدها با دماهای متفاوت به صورت همزمان درخواست می‌شوند و
+        اولین نامزدی که همه بررسی‌ها را پاس کند فوراً برگردانده می‌شود؛ در غیر این صورت
+        نامزد با کمترین مشکل انتخاب می‌شود.
+
+        Args:
+            query: متن درخواست کاربر
+            decision: مدل و max_tokens انتخاب شده
+            priority: کلاس اولویت در زمان‌بند درخواست‌ها
+
+        Returns:
+            (موفقیت, پیام_خطا, متن_اسکریپت, مشکلات): مشکلات خالی یعنی اسکریپت معتبر است
+        """
+        count = max(1, self.candidate_count)
+        if count == 1:
+            success, message, script_content = self._request_script(query, decision.model, decision.max_tokens,
+                                                                     priority=priority)
+            if not success:
+                return False, message, "", []
+            return True, "", script_content, self._candidate_issues(script_content, message)
+        
+        temperatures = [self.CANDIDATE_TEMPERATURES[i % len(self.CANDIDATE_TEMPERATURES)] for i in range(count)]
+        tracer = get_tracer()
+        # با انتخاب اولین نامزد معتبر، درخواست‌های بقیه (در صف زمان‌بند یا در جریان) رها می‌شوند
+        stop = threading.Event()
+        futures = [self._candidate_executor().submit(tracer.wrap(self._request_script, "generate.candidate"),
+                                                     query, decision.model, decision.max_tokens, t, priority, stop)
+                   for t in temperatures]
+        best, last_error = None, ""
+        for index, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            try:
+                success, message, script_content = future.result()
+            except Exception as e:
+                success, message = False, str(e)
+            if not success:
+                last_error = message
+                continue
+            
+            issues = self._candidate_issues(script_content, message)
+            if not issues:
+                logger.info(f"نامزد معتبر پس از {index} پاسخ از {count} انتخاب شد ({decision.model})")
+                stop.set()
+                for other in futures:
+                    other.cancel()
+                return True, "", script_content, []
+            if best is None or len(issues) < len(best[1]):
+                best = (script_content, issues)
+        
+        if best is None:
+            return False, last_error, "", []
+        logger.info(f"هیچ نامزدی از {count} نامزد کاملاً معتبر نبود؛ نامزد با {len(best[1])} مشکل انتخاب شد")
+        return True, "", best[0], best[1]
+    
+    def _candidate_issues(self, script_content: str, warning: str = "") -> List[str]:
+        """مشکلات یک نامزد (اعتبارسنجی محلی به علاوه هشدار پاسخ ناقص)"""
+        with get_tracer().span("generate.validate"):
+            _, issues = self.validator.validate(script_content)
+        return ([warning] if warning else []) + issues
+    
+    def _candidate_executor(self):
+        if self._candidate_pool is None:
+            self._candidate_pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.CANDIDATE_TEMPERATURES),
+                                                                         thread_name_prefix="ScriptCandidates")
+        return self._candidate_pool
+    
+    def record_execution(self, script_path: str, success: bool) -> Optional[Dict[str, Any]]:
+        """ثبت نتیجه اجرای یک اسکریپت تاریخچه در فهرست و آمار مسیریابی
+
+        Args:
+            script_path: مسیر فایل تاریخچه
+            success: وضعیت موفقیت اجرا
+
+        Returns:
+            Optional[Dict[str, Any]]: ورودی تاریخچه (برای تصمیم‌گیری درباره تولید دوباره) یا None
+        """
+        entry = self.history_index.get(script_path)
+        if entry is None:
+            return None
+        # شناسه trace اجراهای اخیر برای نمایش آبشاری از تاریخچه
+        run_meta = {}
+        trace_id = get_tracer().current_trace_id()
+        if trace_id:
+            run_meta["run_trace_ids"] = (entry["meta"].get("run_trace_ids", []) + [trace_id])[-5:]
+        self.history_index.update(script_path, "success" if success else "failed", **run_meta)
+        entry = self.history_index.get(script_path)
+        meta = entry["meta"]
+        if meta.get("model") and meta.get("band"):
+            self.router.record(meta["model"], meta["band"], success)
+        if success and self.fewshot_tokens and entry["query"] and not meta.get("batch_steps"):
+            try:
+                with open(script_path, "r", encoding="utf-8") as f:
+                    self.retriever.add(entry["query"], f.read(), script_path)
+            except Exception as e:
+                logger.error(f"خطا در افزودن نمونه موفق به بازیاب: {e}")
+        return entry
+    
+    def _fewshot_messages(self, query: str) -> List[Dict[str, str]]:
+        """پیام‌های نمونه (کاربر/دستیار) از اسکریپت‌های موفق مشابه در محدوده بودجه توکن
+
+        Args:
+            query: متن درخواست جدید
+
+        Returns:
+            List[Dict[str, str]]: جفت پیام‌ها به ترتیب کاهش شباهت (خالی در صورت نبود نمونه)
+        """
+        if not self.fewshot_tokens or not ScriptRetriever.available():
+            return []
+        try:
+            self._bootstrap_retriever()
+            matches = self.retriever.search(query, k=3)
+        except Exception as e:
+            logger.error(f"خطا در بازیابی نمونه‌های مشابه: {e}")
+            return []
+        
+        messages, budget = [], self.fewshot_tokens
+        for score, example in matches:
+            cost = PromptBuilder.count_tokens(example["query"]) + PromptBuilder.count_tokens(example["script"])
+            if cost > budget:
+                continue
+            budget -= cost
+            messages += [
+                {"role": "user", "content": f"Create a VBScript to automate the following SolidWorks task: {example['query']}"},
+                {"role": "assistant", "content": example["script"]},
+            ]
+            logger.info(f"نمونه مشابه با امتیاز {score:.2f} به پرامپت اضافه شد: {example['query'][:60]}")
+        return messages
+    
+    def _bootstrap_retriever(self):
+        """ساخت اولیه بازیاب از ورودی‌های موفق تاریخچه (فقط یک بار)"""
+        if getattr(self, "_retriever_bootstrapped", False):
+            return
+        self._retriever_bootstrapped = True
+        if os.path.exists(self.retriever.meta_path):
+            return
+        for entry in reversed(self.history_index.entries("success")):
+            if entry["query"] and not entry["meta"].get("batch_steps") and os.path.exists(entry["path"]):
+                with open(entry["path"], "r", encoding="utf-8") as f:
+                    self.retriever.add(entry["query"], f.read(), entry["path"])
+    
+    def next_tier(self, entry: Dict[str, Any]) -> Optional[int]:
+        """سطح مدل بالاتر برای تولید دوباره یک ورودی تاریخچه (در صورت وجود)"""
+        tier = entry["meta"].get("tier")
+        if tier is None or entry["meta"].get("batch_steps") or not entry["query"]:
+            return None
+        return tier + 1 if tier + 1 < len(self.router.tiers) else None
+    
+    def _request_script(self, query: str, model: Optional[str] = None, max_tokens: int = 2000,
+                        temperature: float = 0.2, priority: int = RequestScheduler.PRIORITY_INTERACTIVE,
+                        cancel: Optional[threading.Event] = None) -> Tuple[bool, str, str]:
+        """دریافت متن اسکریپت از API بدون ذخیره آن
+
+        Args:
+            query: متن درخواست کاربر
+            model: مدل (پیش‌فرض: api_model)
+            max_tokens: حداکثر توکن پاسخ
+            temperature: دمای نمونه‌برداری
+            priority: کلاس اولویت در زمان‌بند درخواست‌ها
+            cancel: رویداد لغو مشترک نامزدها (LLMClient.post)
+
+        Returns:
+            (موفقیت, پیام, متن_اسکریپت): وضعیت درخواست، پیام و کد اسکریپت (پیام در حالت موفق
+            فقط برای پاسخ ناقص پر می‌شود)
+        """
+        if not self.api_key:
+            return False, "کلید API تنظیم نشده است. لطفاً کلید API را در فایل .env یا doc.txt تنظیم کنید.", ""
+        
+        with get_tracer().span("generate.prompt"):
+            messages, error = self.prompts.build(
+                "generate", self.SYSTEM_PROMPT,
+                f"Create a VBScript to automate the following SolidWorks task: {query}. "
+                f"Only respond with the complete VBScript code without any explanations.",
+                optional_messages=self._fewshot_messages(query),
+            )
+        if messages is None:
+            return False, error, ""
+        payload = {
+            "model": model or self.api_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        
+        # ارسال درخواست به API
+        logger.info(f"ارسال درخواست به API... ({self.api_url}, {model or self.api_model})")
+        response = self.llm.post(self.api_url, self.headers, payload, timeout=120, priority=priority, cancel=cancel)
+        
+        if response.status_code != 200:
+            logger.error(f"خطا در پاسخ API: {response.status_code} - {truncate_for_log(response.text)}",
+                         extra={"duration_ms": round(response.latency_s * 1000, 1), "endpoint": response.endpoint})
+            return False, f"خطا در درخواست API: {response.status_code}", ""
+        
+        # استخراج کد اسکریپت از پاسخ
+        response_data = response.json()
+        self.prompts.record_usage("generate", response_data)
+        script_content = response_data['choices'][0]['message']['content'].strip()
+        truncated = response_data['choices'][0].get('finish_reason') == "length"
+        
+        # حذف بخش‌های توضیحی احتمالی و نگه داشتن فقط کد
+        if "```vb" in script_content or "```vbs" in script_content:
+            script_parts = script_content.split("```")
+            for part in script_parts:
+                if part.startswith("vb") or part.startswith("vbs"):
+                    script_content = part[part.index("\n")+1:]
+                elif not part.startswith("`") and len(part.strip()) > 10:
+                    script_content = part
+        
+        if truncated:
+            return True, f"پاسخ مدل به دلیل محدودیت max_tokens ({max_tokens}) ناقص است", script_content
+        return True, "", script_content
+    
+    def _save_script(self, script_content: str, query: str = "", **meta) -> str:
+        """ذخیره اسکریپت در تاریخچه و به عنوان اسکریپت فعلی
+
+        Args:
+            script_content: متن اسکریپت
+            query: درخواست کاربر برای ثبت در فهرست تاریخچه
+            **meta: اطلاعات اضافی برای فهرست تاریخچه
+
+        Returns:
+            str: مسیر فایل ذخیره شده در تاریخچه
+        """
+        tracer = get_tracer()
+        with tracer.span("history.save") as span:
+            # ایجاد نام فایل با تاریخ و زمان (با پسوند شماره برای اسکریپت‌های همزمان در یک ثانیه)
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            for number in itertools.count(1):
+                script_name = f"sw_script_{timestamp}.vbs" if number == 1 else f"sw_script_{timestamp}_{number}.vbs"
+                script_path = os.path.join(self.history_index.history_dir, script_name)
+                
+                # ذخیره اسکریپت در فایل (ایجاد انحصاری تا دو درخواست همزمان فایل یکدیگر را بازنویسی نکنند)
+                try:
+                    with open(script_path, "x", encoding='utf-8') as f:
+                        f.write(script_content)
+                    break
+                except FileExistsError:
+                    continue
+            
+            logger.info(f"اسکریپت ایجاد شد: {script_path}")
+            if span is not None:
+                span["attributes"]["path"] = os.path.basename(script_path)
+                meta.setdefault("trace_id", span["traceId"])
+            self.history_index.add(script_path, query, **meta)
+            
+            # حذف اسکریپت‌های قدیمی اگر تعداد آنها از حد مجاز بیشتر شد
+            self._cleanup_history()
+            
+            # کپی اسکریپت به پوشه اصلی اسکریپت‌ها
+            current_script_path = os.path.join(get_config().scripts_dir, "current_script.vbs")
+            shutil.copy2(script_path, current_script_path)
+        
+        return script_path
+    
+    def _cleanup_history(self):
+        """حذف اسکریپت‌های قدیمی اگر تعداد آنها از حد مجاز بیشتر شد"""
+        try:
+            # دریافت لیست همه اسکریپت‌ها
+            script_files = glob.glob(os.path.join(self.history_index.history_dir, HistoryIndex.FILE_PATTERN))
+            script_files.sort()  # مرتب‌سازی بر اساس نام (تاریخ و زمان)
+            
+            # حذف اسکریپت‌های قدیمی
+            max_history = get_config().max_history
+            if len(script_files) > max_history:
+                files_to_remove = script_files[0:len(script_files) - max_history]
+                for file_path in files_to_remove:
+                    try:
+                        os.remove(file_path)
+                        self.history_index.remove(file_path)
+                        logger.info(f"اسکریپت قدیمی حذف شد: {file_path}")
+                    except Exception as e:
+                        logger.error(f"خطا در حذف فایل {file_path}: {e}")
+        
+        except Exception as e:
+            logger.error(f"خطا در پاکسازی تاریخچه: {e}")
+    
+    def execute_script(self, script_path: str, args: Optional[List[str]] = None) -> Tuple[bool, str, str]:
+        """اجرای اسکریپت VBS
+
+        Args:
+            script_path: مسیر فایل اسکریپت
+            args: آرگومان‌های خط فرمان اسکریپت (مثلاً shape=circle radius=10)
+
+        Returns:
+            (موفقیت, پیام, خروجی): وضعیت اجرا، پیام و خروجی اسکریپت
+        """
+        if not os.path.exists(script_path):
+            return False, f"فایل اسکریپت وجود ندارد: {script_path}", ""
+        
+        tracer = get_tracer()
+        
+        # استفاده از نسخه مستقل اسکریپت‌هایی که فایل دیگری را اینکلود می‌کنند
+        try:
+            with tracer.span("execute.bundle"):
+                script_path = self.bundler.bundle(script_path)
+        except Exception as e:
+            logger.warning(f"خطا در ساخت نسخه مستقل اسکریپت، اجرای نسخه اصلی: {e}")
+        
+        in_process = self.com_runner is not None and self.com_runner.supports_scripts()
+        with tracer.span("execute.com" if in_process else "execute.cscript",
+                         path=os.path.basename(script_path)) as span:
+            if in_process:
+                result = self.com_runner.execute_script(script_path, args)
+            else:
+                result = self._execute_with_cscript(script_path, args)
+            if span is not None and not result[0]:
+                span["status"] = Tracer.STATUS_ERROR
+                span["attributes"]["error"] = result[1]
+        return result
+    
+    def _execute_with_cscript(self, script_path: str, args: Optional[List[str]] = None) -> Tuple[bool, str, str]:
+        """اجرای اسکریپت VBS در یک پردازش cscript جداگانه
+
+        Args:
+            script_path: مسیر فایل اسکریپت
+            args: آرگومان‌های خط فرمان اسکریپت
+
+        Returns:
+            (موفقیت, پیام, خروجی): وضعیت اجرا، پیام و خروجی اسکریپت
+        """
+        try:
+            if not os.path.exists(script_path):
+                return False, f"فایل اسکریپت وجود ندارد: {script_path}", ""
+            
+            # اجرای اسکریپت با تنظیم encoding=None برای دریافت خروجی به صورت bytes
+            started = time.perf_counter()
+            with get_tracer().span("subprocess.cscript") as span:
+                result = subprocess.run(["cscript", "//NoLogo", script_path] + list(args or []), 
+                                       capture_output=True, text=False, check=False)
+                if span is not None:
+                    span["attributes"]["exit_code"] = result.returncode
+            
+            exit_code = result.returncode
+            log_extra = {"duration_ms": round((time.perf_counter() - started) * 1000, 1), "exit_code": exit_code}
+            
+            # تبدیل خروجی با مدیریت خطای کدگذاری
+            try:
+                output = result.stdout.decode('utf-8', errors='replace')
+            except Exception as e:
+                logger.warning(f"خطا در تبدیل خروجی: {e}")
+                output = str(result.stdout)
+                
+            try:
+                error = result.stderr.decode('utf-8', errors='replace')
+            except Exception as e:
+                logger.warning(f"خطا در تبدیل خطا: {e}")
+                error = str(result.stderr)
+            
+            if exit_code == 0:
+                logger.info(f"اسکریپت با موفقیت اجرا شد: {script_path}", extra=log_extra)
+                return True, "اسکریپت با موفقیت اجرا شد.", output
+            else:
+                logger.error(f"خطا در اجرای اسکریپت {script_path}: {truncate_for_log(error or output)}", extra=log_extra)
+                # خروجی تا لحظه خطا هم نگه داشته می‌شود تا محل خطا قابل تشخیص باشد
+                combined = "\n".join(part for part in (output.rstrip(), error.strip()) if part)
+                return False, f"خطا در اجرای اسکریپت (کد خروج: {exit_code})", combined
+            
+        except Exception as e:
+            logger.error(f"خطا در اجرای اسکریپت: {e}")
+            return False, f"خطا در اجرای اسکریپت: {str(e)}", ""
+
+# کلاس دیباگر اسکریپت 
+class ScriptDebugger:
+    """کلاس دیباگر اسکریپت برای شناسایی و رفع باگ‌های VBScript با کمک LLM"""
+    
+    GUIDANCE_SYSTEM_PROMPT = """You are an expert in VBScript programming for SolidWorks automation. 
+You help users debug their SolidWorks scripts and provide guidance on script development.
+Focus on providing practical, specific advice that users can immediately apply to fix their code or improve their scripts.
+Your expertise includes:
+1. SolidWorks API methods and best practices
+2. VBScript syntax and common errors
+3. Debugging techniques for automation scripts
+4. Best practices for SolidWorks automation
+
+Respond in Persian (Farsi) language with:
+1. Clear, step-by-step advice for the user's specific question
+2. Code examples when relevant
+3. Explanations of common mistakes or misconceptions
+"""
+    DEBUG_SYSTEM_PROMPT = """You are an expert VBScript debugger for SolidWorks automation. 
+Your task is to analyze the provided VBScript code and error message, then fix the issue.
+Focus on common VBScript errors such as:
+1. Syntax errors (missing parentheses, wrong variable names)
+2. "Cannot use parentheses when calling a Sub" error - in VBScript function calls that return values use parentheses, but Sub calls do not use parentheses
+3. Invalid characters or encoding issues
+4. Incorrect method calls or parameters for SolidWorks API
+5. Issues with object references or method parameters
+
+Respond with:
+1. The fixed script - provide the complete corrected script
+2. A brief explanation of what you fixed and why
 """
+    
+    def __init__(self, api_key: str, base_url: str, api_model: str):
+        """راه‌اندازی دیباگر اسکریپت
+
+        Args:
+            api_key: کلید API برای استفاده از LLM
+            base_url: آدرس API
+            api_model: مدل هوش مصنوعی
+        """
+        self.api_key = api_key
+        self.api_url = base_url
+        self.api_model = api_model
+        self.llm = get_llm_client()
+        self.prompts = get_prompt_builder()
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": "https://solipy.app"
+        }
+    
+    def provide_user_guidance(self, user_query: str,
+                              priority: int = RequestScheduler.PRIORITY_INTERACTIVE) -> Tuple[bool, str]:
+        """ارائه راهنمایی به کاربر با استفاده از LLM برای سوالات مرتبط با دیباگ یا طراحی اسکریپت
+
+        Args:
+            user_query: سوال یا درخواست کاربر
+            priority: کلاس اولویت در زمان‌بند
+
+        Returns:
+            (موفقیت, پاسخ): وضعیت درخواست و پاسخ دریافتی
+        """
+        try:
+            messages, error = self.prompts.build("guidance", self.GUIDANCE_SYSTEM_PROMPT, user_query)
+            if messages is None:
+                return False, error
+            
             payload = {
                 "model": self.api_model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Create a VBScript to automate the following SolidWorks task: {query}. "
-                                              f"Only respond with the complete VBScript code without any explanations."}
-                ],
-                "temperature": 0.2,
+                "messages": messages,
+                "temperature": 0.3,
                 "max_tokens": 2000
             }
             
             # ارسال درخواست به API
-            logger.info(f"ارسال درخواست به API... ({self.api_url}, {self.api_model})")
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+            logger.info(f"ارسال درخواست راهنمایی به API... ({self.api_url}, {self.api_model})")
+            response = self.llm.post(self.api_url, self.headers, payload, timeout=30, priority=priority)
             
             if response.status_code != 200:
-                logger.error(f"خطا در پاسخ API: {response.status_code} - {response.text}")
-                return False, f"خطا در درخواست API: {response.status_code}", None
+                logger.error(f"خطا در پاسخ API راهنمایی: {response.status_code} - {truncate_for_log(response.text)}",
+                             extra={"duration_ms": round(response.latency_s * 1000, 1), "endpoint": response.endpoint})
+                return False, f"خطا در درخواست API راهنمایی: {response.status_code}"
             
-            # استخراج کد اسکریپت از پاسخ
+            # استخراج پاسخ از LLM
             response_data = response.json()
-            script_content = response_data['choices'][0]['message']['content'].strip()
-            
-            # حذف بخش‌های توضیحی احتمالی و نگه داشتن فقط کد
-            if "```vb" in script_content or "```vbs" in script_content:
-                script_parts = script_content.split("```")
-                for part in script_parts:
-                    if part.startswith("vb") or part.startswith("vbs"):
-                        script_content = part[part.index("\n")+1:]
-                    elif not part.startswith("`") and len(part.strip()) > 10:
-                        script_content = part
-            
-            # ایجاد نام فایل با تاریخ و زمان
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            script_name = f"sw_script_{timestamp}.vbs"
-            script_path = os.path.join(HISTORY_DIR, script_name)
+            self.prompts.record_usage("guidance", response_data)
+            llm_response = response_data['choices'][0]['message']['content'].strip()
             
-            # ذخیره اسکریپت در فایل
-            with open(script_path, "w", encoding='utf-8') as f:
-                f.write(script_content)
+            return True, llm_response
+        
+        except Exception as e:
+            logger.error(f"خطا در دریافت راهنمایی: {e}")
+            return False, f"خطا در دریافت راهنمایی: {str(e)}"
+    
+    def debug_script(self, script_content: str, error_message: str,
+                     priority: int = RequestScheduler.PRIORITY_INTERACTIVE) -> Tuple[bool, str, str]:
+        """دیباگ اسکریپت VBS با استفاده از LLM
+
+        Args:
+            script_content: محتوای اسکریپت دارای خطا
+            error_message: پیام خطای دریافت شده هنگام اجرا
+            priority: کلاس اولویت در زمان‌بند (سرویس‌های پس‌زمینه PRIORITY_BATCH می‌فرستند)
+
+        Returns:
+            (موفقیت, اسکریپت_اصلاح_شده, توضیحات): وضعیت دیباگ، اسکریپت اصلاح شده و توضیحات
+        """
+        with get_tracer().span("debug.script"):
+            return self._debug_script(script_content, error_message, priority)
+    
+    def _debug_script(self, script_content: str, error_message: str, priority: int) -> Tuple[bool, str, str]:
+        try:
+            # ارسال نسخه فشرده (بدون توضیحات و پیام‌های پیشرفت)؛ اصلاحات بعداً به اسکریپت اصلی برگردانده می‌شوند
+            minified = self.prompts.minify(script_content)
+            messages, error = self.prompts.build(
+                "debug", self.DEBUG_SYSTEM_PROMPT,
+                f"Debug this VBScript code for SolidWorks automation. Here's the script:\n\n```vbs\n{minified.text}\n```\n\n"
+                f"Here's the error message:\n{minified.remap_error(error_message)}\n\nPlease fix the code and explain what was wrong.",
+                saved_tokens=PromptBuilder.count_tokens(script_content) - PromptBuilder.count_tokens(minified.text),
+            )
+            if messages is None:
+                return False, "", error
             
-            logger.info(f"اسکریپت ایجاد شد: {script_path}")
+            payload = {
+                "model": self.api_model,
+                "messages": messages,
+                "temperature": 0.3,
+                "max_tokens": 2500
+            }
             
-            # حذف اسکریپت‌های قدیمی اگر تعداد آنها از حد مجاز بیشتر شد
-            self._cleanup_history()
+            # ارسال درخواست به API
+            logger.info(f"ارسال درخواست دیباگ به API... ({self.api_url}, {self.api_model})")
+            response = self.llm.post(self.api_url, self.headers, payload, timeout=30, priority=priority)
+            
+            if response.status_code != 200:
+                logger.error(f"خطا در پاسخ API دیباگ: {response.status_code} - {truncate_for_log(response.text)}",
+                             extra={"duration_ms": round(response.latency_s * 1000, 1), "endpoint": response.endpoint})
+                return False, "", f"خطا در درخواست API دیباگ: {response.status_code}"
+            
+            # استخراج پاسخ از LLM
+            response_data = response.json()
+            self.prompts.record_usage("debug", response_data)
+            llm_response = response_data['choices'][0]['message']['content'].strip()
+            
+            # جداسازی کد اصلاح شده و توضیحات
+            fixed_script = ""
+            explanation = ""
             
-            # کپی اسکریپت به پوشه اصلی اسکریپت‌ها
-            current_script_path = os.path.join(SCRIPTS_DIR, "current_script.vbs")
-            shutil.copy2(script_path, current_script_path)
+            if "```vbs" in llm_response or "```vbscript" in llm_response:
+                # استخراج کد از بخش‌های کد در پاسخ
+                code_parts = []
+                for part in llm_response.split("```"):
+                    if part.startswith("vbs") or part.startswith("vbscript"):
+                        code_parts.append(part[part.index("\n")+1:])
+                    elif not part.startswith("```") and not part.strip().startswith("vbs") and not part.strip().startswith("vbscript") and len(part.strip()) > 10:
+                        explanation += part.strip() + "\n"
+                
+                if code_parts:
+                    fixed_script = code_parts[0].strip()
+            else:
+                # اگر ساختار کد مشخص نشده، تلاش برای تشخیص بخش کد و توضیحات
+                lines = llm_response.split("\n")
+                is_code = False
+                code_lines = []
+                explanation_lines = []
+                
+                for line in lines:
+                    if line.strip().startswith("Option Explicit") or line.strip().startswith("Dim ") or line.strip().startswith("Set "):
+                        is_code = True
+                        code_lines.append(line)
+                    elif is_code and (line.strip() == "" or line.strip().startswith("'")):
+                        code_lines.append(line)
+                    elif is_code and ("=" in line or line.strip().startswith("If ") or line.strip().startswith("End ") or line.strip().startswith("WScript.")):
+                        code_lines.append(line)
+                    else:
+                        is_code = False
+                        explanation_lines.append(line)
+                
+                fixed_script = "\n".join(code_lines).strip()
+                explanation = "\n".join(explanation_lines).strip()
             
-            return True, "اسکریپت با موفقیت ایجاد شد.", script_path
+            # اگر نتوانستیم کد را استخراج کنیم، از کل پاسخ استفاده کنیم
+            if not fixed_script:
+                explanation = llm_response
+                return False, "", f"نتوانستم کد اصلاح شده را استخراج کنم. لطفاً پاسخ زیر را بررسی کنید:\n\n{explanation}"
             
+            return True, minified.restore(fixed_script), explanation
+        
         except Exception as e:
-            logger.error(f"خطا در تولید اسکریپت: {e}")
-            return False, f"خطا در تولید اسکریپت: {str(e)}", None
-    
-    def _cleanup_history(self):
-        """حذف اسکریپت‌های قدیمی اگر تعداد آنها از حد مجاز بیشتر شد"""
-        try:
-            # دریافت لیست همه اسکریپت‌ها
-            script_files = glob.glob(os.path.join(HISTORY_DIR, "sw_script_*.vbs"))
-            script_files.sort()  # مرتب‌سازی بر اساس نام (تاریخ و زمان)
-            
-            # حذف اسکریپت‌های قدیمی
-            if len(script_files) > MAX_HISTORY:
-                files_to_remove = script_files[0:len(script_files) - MAX_HISTORY]
-                for file_path in files_to_remove:
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"اسکریپت قدیمی حذف شد: {file_path}")
-                    except Exception as e:
-                        logger.error(f"خطا در حذف فایل {file_path}: {e}")
+            logger.error(f"خطا در دیباگ اسکریپت: {e}")
+            return False, "", f"خطا در دیباگ اسکریپت: {str(e)}"
+
+def create_com_runner(config: AppConfig) -> SolidWorksCOMRunner:
+    """ساخت اجرا کننده COM بر اساس حالت اجرا (standin: جایگزین محلی بدون CAD)"""
+    if config.execution_mode == "standin":
+        return SolidWorksCOMRunner(app_factory=LocalSolidWorksStandIn(),
+                                   script_host_factory=lambda: StandInScriptHost(config.standin_run_s))
+    return SolidWorksCOMRunner()
+
+class SolidWorksServices:
+    """سرویس‌های مشترک پنل و سرورها: تولید کننده، دیباگر و صف اجرای CAD
+
+    همه اجراهای اسکریپت (از پنل، سرور MCP یا سرویس‌های دیگر) از یک صف FIFO تک‌کارگره
+    عبور می‌کنند، چون یک نمونه SolidWorks در هر لحظه فقط یک اسکریپت را اجرا می‌کند.
+    اگر SW_FARM_URL تنظیم شده باشد اجراها به مزرعه اجرا فرستاده می‌شوند و به صورت
+    همزمان روی کارگرهای آن اجرا می‌شوند.
+    """
+
+    def __init__(self, config: Optional[AppConfig] = None):
+        """راه‌اندازی سرویس‌ها
+
+        Args:
+            config: تنظیمات برنامه (پیش‌فرض: تنظیمات سراسری)
+        """
+        self.config = config or get_config().prepare_runtime()
+        self.com_runner = create_com_runner(self.config)
+        self.session_broker = SolidWorksSessionBroker(self.com_runner)
+        in_process = self.config.execution_mode in ("com", "standin")
+        self.generator = SolidWorksScriptGenerator(self.config.api_key, self.config.base_url, self.config.api_model,
+                                                   self.com_runner if in_process else None)
+        self.debugger = ScriptDebugger(self.config.api_key, self.config.base_url, self.config.api_model)
+        self.farm = FarmClient(self.config.farm_url, token=self.config.farm_token) if self.config.farm_url else None
+        self._execution_pool = concurrent.futures.ThreadPoolExecutor(max_workers=16 if self.farm else 1,
+                                                                     thread_name_prefix="CADExecution")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit_execution(self, script_path: str, args: Optional[List[str]] = None) -> concurrent.futures.Future:
+        """افزودن اجرای یک اسکریپت به صف اجرای CAD
+
+        Returns:
+            Future: نتیجه (موفقیت, پیام, خروجی) مشابه execute_script
+        """
+        with self._lock:
+            self._pending += 1
+        tracer = get_tracer()
+        parent = tracer.current()
+        submitted_ns = time.time_ns()
+        
+        def _run():
+            try:
+                # بازه اجرا از لحظه ورود به صف شروع می‌شود؛ انتظار پشت اجراهای قبلی جداگانه ثبت می‌شود
+                with tracer.span("execute", parent=parent, new_trace=parent is None) as span, \
+                        get_profiler().stage("execution"):
+                    if span is not None:
+                        span["start"] = submitted_ns
+                        tracer.record("execute.queue_wait", submitted_ns, time.time_ns())
+                    if self.farm is not None:
+                        with tracer.span("execute.farm", path=os.path.basename(script_path)):
+                            return self.farm.execute(script_path, args)
+                    return self.generator.execute_script(script_path, args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+        
+        return self._execution_pool.submit(_run)
+
+    def execute(self, script_path: str, args: Optional[List[str]] = None) -> Tuple[bool, str, str]:
+        """اجرای اسکریپت از طریق صف و انتظار برای نتیجه"""
+        return self.submit_execution(script_path, args).result()
+
+    def queue_depth(self) -> int:
+        """تعداد اجراهای در صف یا در حال اجرا"""
+        with self._lock:
+            return self._pending
+
+    def stop(self):
+        """توقف صف اجرا و اتصال SolidWorks"""
+        self._execution_pool.shutdown(wait=False)
+        self.session_broker.stop()
+        self.com_runner.stop()
+
+class MockLLMServer:
+    """سرور HTTP محلی سازگار با chat/completions برای آزمایش بدون سرویس LLM واقعی
+
+    بر اساس پرامپت سیستمی پاسخ مناسب (اسکریپت، وصله، دیباگ یا راهنمایی) را با تأخیر
+    قابل تنظیم برمی‌گرداند. درخواست‌های "stream": true به صورت رویدادهای SSE با تأخیر
+    بین تکه‌ها پاسخ داده می‌شوند و با fail_every هر چندمین درخواست خطای 503 می‌گیرد.
+    """
+
+    SCRIPT = """Option Explicit
+Dim swApp, swModel
+On Error Resume Next
+Set swApp = GetObject(, "SldWorks.Application")
+If Err.Number <> 0 Then
+    Err.Clear
+    Set swApp = CreateObject("SldWorks.Application")
+End If
+On Error Goto 0
+swApp.Visible = True
+WScript.Echo "اتصال به SolidWorks با موفقیت انجام شد."
+Set swModel = swApp.NewDocument("Part.prtdot", 0, 0, 0)
+swModel.SketchManager.InsertSketch True
+swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01
+WScript.Echo "عملیات با موفقیت انجام شد."
+WScript.Quit 0"""
+
+    def __init__(self, latency_s: float = 0.0, port: int = 0, chunk_delay_s: float = 0.0, fail_every: int = 0):
+        self.latency_s = latency_s
+        self.port = port
+        self.chunk_delay_s = chunk_delay_s
+        self.fail_every = fail_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1/chat/completions"
+
+    def respond(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """ساخت پاسخ chat/completions برای یک درخواست"""
+        messages = payload.get("messages", [])
+        system_prompt = messages[0]["content"] if messages else ""
+        if system_prompt.startswith("You edit"):
+            content = '<<<<<<< SEARCH\n=======\nWScript.Echo "ویرایش اعمال شد."\n>>>>>>> REPLACE'
+        elif "debugger" in system_prompt:
+            content = f"```vbs\n{self.SCRIPT}\n```\nاتصال و فراخوانی‌ها اصلاح شدند."
+        elif "help users" in system_prompt:
+            content = "برای رفع خطا ابتدا اتصال به SolidWorks و سند فعال را بررسی کنید."
+        elif system_prompt.startswith("You plan"):
+            content = json.dumps({"parts": [
+                {"name": "box", "description": "open box 100x60x40 mm, 3 mm walls", "quantity": 1},
+                {"name": "lid", "description": "flat lid 100x60x3 mm", "quantity": 1},
+                {"name": "bolt", "description": "M4 bolt, 12 mm long", "quantity": 4},
+            ], "assembly": "lid on top of the box, bolts through the lid corners"})
+        else:
+            content = self.SCRIPT
+        prompt_tokens = PromptBuilder.count_messages(messages)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                      "total_tokens": prompt_tokens + len(content) // 4},
+        }
+
+    def start(self) -> "MockLLMServer":
+        """شروع سرور در ترد پس‌زمینه"""
+        http_server = importlib.import_module("http.server")
+        mock = self
+
+        class _Handler(http_server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                with mock._lock:
+                    mock.requests += 1
+                    number = mock.requests
+                if mock.latency_s:
+                    time.sleep(mock.latency_s)
+                if mock.fail_every and number % mock.fail_every == 0:
+                    self.send_error(503, "mock failure")
+                    return
+                payload = json.loads(body or b"{}")
+                if payload.get("stream"):
+                    self._stream(mock.respond(payload))
+                    return
+                data = json.dumps(mock.respond(payload), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, response):
+                content = response["choices"][0]["message"]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                pieces = re.findall(r'\S*\s*', content)[:-1] or [content]
+                for piece in pieces:
+                    if mock.chunk_delay_s:
+                        time.sleep(mock.chunk_delay_s)
+                    chunk = {"choices": [{"delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+                final = {"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": response["usage"]}
+                self.wfile.write(b"data: " + json.dumps(final).encode("utf-8") + b"\n\ndata: [DONE]\n\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http_server.ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockLLMServer", daemon=True)
+        self._thread.start()
+        logger.info(f"سرور LLM آزمایشی روی {self.url} اجرا شد")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+def use_mock_llm(latency_s: float = 0.0) -> MockLLMServer:
+    """اجرای سرور LLM آزمایشی و تنظیم برنامه برای استفاده از آن (پیش از ساخت سرویس‌ها)"""
+    server = MockLLMServer(latency_s).start()
+    config = get_config()
+    config.api_key = config.api_key or "mock"
+    config.base_url = server.url
+    config.api_model = "mock-model"
+    config.model_tiers = []
+    config.fallback_endpoints = []
+    return server
+
+class MCPServer:
+    """سرور Model Context Protocol برای دسترسی عامل‌ها به تولید، اجرا و دیباگ اسکریپت
+
+    پیام‌ها JSON-RPC 2.0 هستند و هر پیام در یک خط ارسال می‌شود (stdio یا سوکت TCP محلی).
+    هر فراخوانی ابزار یک task جداگانه asyncio است و کار مسدود کننده در استخر ترد انجام
+    می‌شود؛ بنابراین فراخوانی‌های متعدد همزمان پردازش می‌شوند و اجرای اسکریپت‌ها از صف
+    مشترک SolidWorksServices عبور می‌کند. در صورت ارسال progressToken پیشرفت کار با
+    notifications/progress اطلاع داده می‌شود و notifications/cancelled کار را لغو می‌کند.
+    """
+
+    PROTOCOL_VERSION = "2024-11-05"
+    TOOLS = [
+        {
+            "name": "generate_script",
+            "description": "Generate a SolidWorks VBScript from a natural-language (English or Persian) request "
+                           "and save it to history.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "What the script should do"},
+                    "min_tier": {"type": "integer", "minimum": 0, "description": "Minimum model tier"},
+                },
+                "required": ["query"],
+            },
+        },
+        {
+            "name": "execute_script",
+            "description": "Run a saved script on the SolidWorks seat (queued, one script at a time).",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "Script path (default: current_script.vbs)"},
+                    "args": {"type": "array", "items": {"type": "string"}},
+                },
+            },
+        },
+        {
+            "name": "debug_script",
+            "description": "Fix a failing script. Without error_message the script is executed first to get the error.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "Script path (default: current_script.vbs)"},
+                    "error_message": {"type": "string"},
+                },
+            },
+        },
+        {
+            "name": "provide_user_guidance",
+            "description": "Answer a question about SolidWorks automation or script debugging (answer in Persian).",
+            "inputSchema": {
+                "type": "object",
+                "properties": {"question": {"type": "string"}},
+                "required": ["question"],
+            },
+        },
+        {
+            "name": "history",
+            "description": "List generated scripts (newest first) or fetch one entry with its script.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "Return this entry and its script"},
+                    "status": {"type": "string", "enum": ["generated", "success", "failed"]},
+                    "offset": {"type": "integer", "minimum": 0},
+                    "limit": {"type": "integer", "minimum": 1, "maximum": 200},
+                },
+            },
+        },
+    ]
+
+    def __init__(self, services: SolidWorksServices, max_concurrency: int = 16):
+        """راه‌اندازی سرور
+
+        Args:
+            services: سرویس‌های مشترک (همان نمونه پنل در حالت تعبیه شده)
+            max_concurrency: حداکثر فراخوانی ابزار همزمان
+        """
+        self.services = services
+        self.max_concurrency = max_concurrency
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="MCPTool")
+        self._loop = None
+        self._socket_server = None
+        self._thread = None
+
+    def run_stdio(self, port: int = 0):
+        """اجرای سرور روی stdio (و در صورت تعیین پورت، سوکت محلی) تا بسته شدن ورودی"""
+        asyncio.run(self._main(stdio=True, port=port))
+
+    def run_socket(self, port: int, host: str = "127.0.0.1"):
+        """اجرای سرور فقط روی سوکت محلی (مسدود کننده)"""
+        asyncio.run(self._main(stdio=False, port=port, host=host))
+
+    def start_in_background(self, port: int, host: str = "127.0.0.1"):
+        """اجرای سرور سوکت در ترد پس‌زمینه (برای تعبیه در پنل)"""
+        self._thread = threading.Thread(target=self.run_socket, args=(port, host), name="MCPServer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """توقف سرور پس‌زمینه"""
+        if self._loop is not None and self._socket_server is not None:
+            self._loop.call_soon_threadsafe(self._socket_server.close)
+
+    async def _main(self, stdio: bool, port: int = 0, host: str = "127.0.0.1"):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(self._executor)
+        if port:
+            self._socket_server = await asyncio.start_server(self._serve_connection, host, port)
+            logger.info(f"سرور MCP روی {host}:{port} آماده است")
+        if stdio:
+            await self._serve_stdio()
+        elif self._socket_server is not None:
+            async with self._socket_server:
+                try:
+                    await self._socket_server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+
+    async def _serve_stdio(self):
+        """خواندن خطوط stdin در ترد جداگانه (روی ویندوز هم کار می‌کند) و پاسخ روی stdout"""
+        lines = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        
+        def _reader():
+            for line in sys.stdin.buffer:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, b"")
+        
+        threading.Thread(target=_reader, name="MCPStdin", daemon=True).start()
+        write_lock = asyncio.Lock()
+        
+        async def send(message: Dict[str, Any]):
+            data = json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+            async with write_lock:
+                # sys.__stdout__ چون configure_console_encoding روی ویندوز sys.stdout را جایگزین می‌کند
+                sys.__stdout__.buffer.write(data)
+                sys.__stdout__.buffer.flush()
+        
+        await self._session(lines.get, send)
+
+    async def _serve_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        
+        async def send(message: Dict[str, Any]):
+            async with write_lock:
+                writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
         
+        try:
+            await self._session(reader.readline, send)
+        finally:
+            writer.close()
+
+    async def _session(self, read_line: Callable, send: Callable):
+        """پردازش پیام‌های یک اتصال تا پایان ورودی"""
+        tasks: Dict[Any, Any] = {}
+        while True:
+            line = await read_line()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                await send({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}})
+                continue
+            if message.get("method") == "notifications/cancelled":
+                task = tasks.get((message.get("params") or {}).get("requestId"))
+                if task is not None:
+                    task.cancel()
+                continue
+            task = asyncio.ensure_future(self._dispatch(message, send))
+            if "id" in message:
+                tasks[message["id"]] = task
+                task.add_done_callback(lambda _, request_id=message["id"]: tasks.pop(request_id, None))
+        if tasks:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def _dispatch(self, message: Dict[str, Any], send: Callable):
+        """اجرای یک درخواست JSON-RPC و ارسال پاسخ آن"""
+        request_id = message.get("id")
+        method = message.get("method", "")
+        params = message.get("params") or {}
+        try:
+            if method == "initialize":
+                result = {
+                    "protocolVersion": self.PROTOCOL_VERSION,
+                    "capabilities": {"tools": {"listChanged": False}},
+                    "serverInfo": {"name": "SolidWorks-MCP-Server", "version": "1.0"},
+                }
+            elif method == "ping":
+                result = {}
+            elif method == "tools/list":
+                result = {"tools": self.TOOLS}
+            elif method == "tools/call":
+                result = await self._call_tool(params, send)
+            elif method.startswith("notifications/"):
+                return
+            else:
+                raise LookupError(method)
+        except LookupError as e:
+            if request_id is not None:
+                await send({"jsonrpc": "2.0", "id": request_id,
+                            "error": {"code": -32601, "message": f"Method not found: {e}"}})
+            return
+        except asyncio.CancelledError:
+            # طبق MCP برای درخواست لغو شده پاسخی ارسال نمی‌شود
+            logger.info(f"درخواست MCP لغو شد: {request_id}")
+            return
+        except Exception as e:
+            logger.error(f"خطا در پردازش درخواست MCP {method}: {e}")
+            if request_id is not None:
+                await send({"jsonrpc": "2.0", "id": request_id, "error": {"code": -32603, "message": str(e)}})
+            return
+        if request_id is not None:
+            await send({"jsonrpc": "2.0", "id": request_id, "result": result})
+
+    async def _call_tool(self, params: Dict[str, Any], send: Callable) -> Dict[str, Any]:
+        """اجرای یک ابزار در استخر ترد با ارسال پیشرفت"""
+        name = params.get("name")
+        handler = getattr(self, f"_tool_{name}", None)
+        if name not in {tool["name"] for tool in self.TOOLS} or handler is None:
+            raise LookupError(f"tool {name}")
+        loop = asyncio.get_running_loop()
+        token = (params.get("_meta") or {}).get("progressToken")
+        
+        def progress(step: int, total: int, text: str):
+            if token is not None:
+                notification = {"jsonrpc": "2.0", "method": "notifications/progress",
+                                "params": {"progressToken": token, "progress": step, "total": total, "message": text}}
+                asyncio.run_coroutine_threadsafe(send(notification), loop)
+        
+        arguments = params.get("arguments") or {}
+        logger.info(f"فراخوانی ابزار MCP: {name}")
+        success, payload = await loop.run_in_executor(None, handler, arguments, progress)
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, indent=2)
+        return {"content": [{"type": "text", "text": text}], "isError": not success}
+
+    def _script_path(self, arguments: Dict[str, Any]) -> str:
+        return arguments.get("path") or os.path.join(self.services.config.scripts_dir, "current_script.vbs")
+
+    def _tool_generate_script(self, arguments: Dict[str, Any], progress: Callable) -> Tuple[bool, Any]:
+        progress(0, 2, "در حال تولید اسکریپت...")
+        success, message, script_path = self.services.generator.generate_script(
+            arguments["query"], int(arguments.get("min_tier", 0)), RequestScheduler.PRIORITY_BATCH)
+        progress(1, 2, message)
+        result = {"success": success, "message": message, "path": script_path}
+        if success and script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                result["script"] = f.read()
+        progress(2, 2, "انجام شد")
+        return success, result
+
+    def _tool_execute_script(self, arguments: Dict[str, Any], progress: Callable) -> Tuple[bool, Any]:
+        script_path = self._script_path(arguments)
+        progress(0, 2, f"در صف اجرا ({self.services.queue_depth()} کار جلوتر)")
+        future = self.services.submit_execution(script_path, arguments.get("args"))
+        success, message, output = future.result()
+        progress(1, 2, message)
+        self.services.generator.record_execution(script_path, success)
+        progress(2, 2, "انجام شد")
+        return success, {"success": success, "message": message, "output": output, "path": script_path}
+
+    def _tool_debug_script(self, arguments: Dict[str, Any], progress: Callable) -> Tuple[bool, Any]:
+        script_path = self._script_path(arguments)
+        if not os.path.exists(script_path):
+            return False, f"فایل اسکریپت وجود ندارد: {script_path}"
+        error_message = arguments.get("error_message", "")
+        if not error_message:
+            progress(0, 3, "اجرای اسکریپت برای دریافت خطا...")
+            success, message, output = self.services.execute(script_path)
+            if success:
+                return True, {"success": True, "message": "اسکریپت بدون خطا اجرا شد؛ نیازی به دیباگ نیست.", "output": output}
+            error_message = f"{message}\n{output}"
+        progress(1, 3, "در حال دیباگ اسکریپت...")
+        with open(script_path, "r", encoding="utf-8") as f:
+            script_content = f.read()
+        success, fixed_script, explanation = self.services.debugger.debug_script(script_content, error_message,
+                                                                                  RequestScheduler.PRIORITY_BATCH)
+        progress(3, 3, "انجام شد")
+        return success, {"success": success, "fixed_script": fixed_script, "explanation": explanation, "path": script_path}
+
+    def _tool_provide_user_guidance(self, arguments: Dict[str, Any], progress: Callable) -> Tuple[bool, Any]:
+        progress(0, 1, "در حال دریافت راهنمایی...")
+        success, answer = self.services.debugger.provide_user_guidance(arguments["question"],
+                                                                         RequestScheduler.PRIORITY_BATCH)
+        progress(1, 1, "انجام شد")
+        return success, answer
+
+    def _tool_history(self, arguments: Dict[str, Any], progress: Callable) -> Tuple[bool, Any]:
+        index = self.services.generator.history_index
+        if arguments.get("path"):
+            entry = index.get(arguments["path"])
+            if entry is None:
+                return False, f"ورودی تاریخچه یافت نشد: {arguments['path']}"
+            if os.path.exists(entry["path"]):
+                with open(entry["path"], "r", encoding="utf-8") as f:
+                    entry["script"] = f.read()
+            return True, entry
+        offset = max(0, int(arguments.get("offset", 0)))
+        limit = min(200, max(1, int(arguments.get("limit", 20))))
+        if arguments.get("status"):
+            entries = index.entries(arguments["status"])[offset:offset + limit]
+        else:
+            entries = index.page(offset, limit)
+        return True, {"total": index.count(), "entries": entries}
+
+class _JSONHTTPServer:
+    """پایه سرورهای HTTP سبک asyncio (بدون وابستگی خارجی) با پاسخ‌های JSON
+
+    هر اتصال یک درخواست را پردازش می‌کند (Connection: close)؛ زیرکلاس‌ها _route را
+    پیاده‌سازی می‌کنند.
+    """
+
+    REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               409: "Conflict", 429: "Too Many Requests"}
+
+    @staticmethod
+    def is_loopback(host: str) -> bool:
+        """آیا آدرس شنود فقط از همین رایانه قابل دسترسی است"""
+        if host == "localhost":
+            return True
+        try:
+            return ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            return False
+
+    @classmethod
+    def check_bind(cls, host: str, authenticated: bool):
+        """جلوگیری از شنود روی شبکه بدون احراز هویت
+
+        Raises:
+            ValueError: آدرس غیر loopback و توکنی تنظیم نشده است
+        """
+        if not authenticated and not cls.is_loopback(host):
+            raise ValueError(f"شنود روی {host} بدون توکن مجاز نیست؛ ابتدا توکن دسترسی را تنظیم کنید")
+
+    @staticmethod
+    def bearer_token(headers: Dict[str, str]) -> str:
+        """توکن هدر Authorization: Bearer <token>"""
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        return token.strip() if scheme.lower() == "bearer" else ""
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) < 2:
+                return
+            method, target = request_line[0], request_line[1]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+            await self._route(method, target.split("?", 1)[0], headers, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"خطا در پردازش درخواست HTTP: {e}")
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes, writer):
+        raise NotImplementedError
+
+    @staticmethod
+    def _parse_json(body: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    @staticmethod
+    async def _respond(writer, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = _JSONHTTPServer.REASONS.get(status, "OK")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+class JobService(_JSONHTTPServer):
+    """سرویس HTTP چندکاربره برای اشتراک یک ایستگاه SolidWorks بین چند مهندس
+
+    کارها (تولید، اجرا یا هر دو) با POST /jobs ثبت می‌شوند و شناسه برمی‌گردانند؛ وضعیت با
+    GET /jobs/<id> یا به صورت جریانی با GET /jobs/<id>/events (SSE) دنبال می‌شود.
+    تولید اسکریپت با LLM به صورت همزمان انجام می‌شود، ولی اجرای CAD از یک صف منصفانه
+    (نوبت چرخشی بین کاربران) عبور می‌کند و هر ایستگاه (seat) در هر لحظه فقط یک کار اجرا
+    می‌کند. تعداد کارهای فعال هر کاربر با quota محدود است (پاسخ 429).
+
+    کاربر هر درخواست از توکن Authorization: Bearer <token> تعیین می‌شود (نه از هدرهای
+    دلخواه کلاینت) و هر کاربر فقط کارهای خودش را می‌بیند. بدون توکن‌ها سرویس فقط روی
+    loopback اجرا می‌شود و همه درخواست‌ها متعلق به کاربر local هستند.
+    """
+
+    KINDS = ("generate", "execute", "generate_execute")
+    FINAL_STATES = ("done", "failed")
+    MAX_FINISHED_JOBS = 1000
+
+    LOCAL_USER = "local"
+
+    def __init__(self, seats: List[SolidWorksServices], user_quota: int = 20, llm_concurrency: int = 16,
+                 tokens: Optional[Dict[str, str]] = None):
+        """راه‌اندازی سرویس
+
+        Args:
+            seats: سرویس‌های هر ایستگاه CAD (تولید اسکریپت با سرویس اولین ایستگاه انجام می‌شود)
+            user_quota: حداکثر کارهای فعال (در صف یا در حال اجرا) هر کاربر
+            llm_concurrency: حداکثر درخواست‌های همزمان تولید اسکریپت
+            tokens: توکن -> نام کاربر (خالی یعنی فقط loopback و یک کاربر local)
+        """
+        self.seats = seats
+        self.user_quota = user_quota
+        self.tokens = dict(tokens or {})
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished: collections.deque = collections.deque()
+        self._active_per_user: Dict[str, int] = collections.Counter()
+        self._pending: "collections.OrderedDict[str, collections.deque]" = collections.OrderedDict()
+        self._llm_pool = concurrent.futures.ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix="JobLLM")
+        self._seat_pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(seats), thread_name_prefix="JobSeat")
+        self._queue_changed = None
+        self._server = None
+        self.started = time.time()
+        self.completed = 0
+
+    async def start(self, port: int, host: str = "127.0.0.1"):
+        """شروع سرور HTTP و کارگرهای ایستگاه‌ها"""
+        self.check_bind(host, bool(self.tokens))
+        self._queue_changed = asyncio.Condition()
+        self._server = await asyncio.start_server(self._handle_connection, host, port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._workers = [asyncio.ensure_future(self._seat_worker(index)) for index in range(len(self.seats))]
+        logger.info(f"سرویس کارها روی {host}:{self.port} با {len(self.seats)} ایستگاه CAD آماده است")
+        return self
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def run(self, port: int, host: str = "127.0.0.1"):
+        """اجرای مسدود کننده سرویس"""
+        async def _main():
+            await self.start(port, host)
+            async with self._server:
+                await self._server.serve_forever()
+        asyncio.run(_main())
+
+    # --- کارها ---
+
+    def submit(self, user: str, kind: str, query: str = "", path: str = "") -> Tuple[int, Dict[str, Any]]:
+        """ثبت یک کار جدید
+
+        Returns:
+            (کد_HTTP, بدنه): 202 با شناسه کار، یا 400/429 با پیام خطا
+        """
+        if kind not in self.KINDS:
+            return 400, {"error": f"نوع کار نامعتبر است: {kind}"}
+        if kind != "execute" and not query.strip():
+            return 400, {"error": "query لازم است"}
+        if kind == "execute":
+            scripts_dir = os.path.realpath(self.seats[0].config.scripts_dir)
+            path = os.path.realpath(path or os.path.join(scripts_dir, "current_script.vbs"))
+            if not path.startswith(scripts_dir + os.sep) or not os.path.exists(path):
+                return 400, {"error": "مسیر اسکریپت باید فایلی در پوشه scripts باشد"}
+        if self._active_per_user[user] >= self.user_quota:
+            return 429, {"error": f"سهمیه کارهای فعال کاربر ({self.user_quota}) پر است"}
+        
+        job = {
+            "id": uuid.uuid4().hex[:12], "user": user, "kind": kind, "query": query, "path": path,
+            "status": "queued", "message": "", "output": "", "seat": None,
+            "times": {"created": time.time()}, "events": [],
+        }
+        job["changed"] = asyncio.Condition()
+        self.jobs[job["id"]] = job
+        self._active_per_user[user] += 1
+        self._record_event(job, "queued")
+        if kind == "execute":
+            asyncio.ensure_future(self._enqueue_execution(job))
+        else:
+            asyncio.ensure_future(self._generate(job))
+        return 202, {"id": job["id"], "status": job["status"]}
+
+    async def _set_status(self, job: Dict[str, Any], status: str, **fields):
+        """تغییر وضعیت کار و بیدار کردن شنونده‌های SSE"""
+        self._record_event(job, status, **fields)
+        async with job["changed"]:
+            job["changed"].notify_all()
+
+    def _record_event(self, job: Dict[str, Any], status: str, **fields):
+        job.update(fields)
+        job["status"] = status
+        job["times"][status] = time.time()
+        job["events"].append({"status": status, "time": job["times"][status],
+                              **{key: value for key, value in fields.items() if key != "output"}})
+        if status in self.FINAL_STATES:
+            self._active_per_user[job["user"]] -= 1
+            self.completed += 1
+            self._finished.append(job["id"])
+            while len(self._finished) > self.MAX_FINISHED_JOBS:
+                self.jobs.pop(self._finished.popleft(), None)
+
+    async def _generate(self, job: Dict[str, Any]):
+        """تولید اسکریپت (همزمان با کارهای دیگر)"""
+        await self._set_status(job, "generating")
+        loop = asyncio.get_running_loop()
+        try:
+            success, message, script_path = await loop.run_in_executor(
+                self._llm_pool, self.seats[0].generator.generate_script, job["query"], 0,
+                RequestScheduler.PRIORITY_BATCH)
+        except Exception as e:
+            success, message, script_path = False, str(e), None
+        if not success:
+            await self._set_status(job, "failed", message=message)
+        elif job["kind"] == "generate":
+            await self._set_status(job, "done", message=message, path=script_path)
+        else:
+            job["path"] = script_path
+            await self._enqueue_execution(job)
+
+    async def _enqueue_execution(self, job: Dict[str, Any]):
+        """افزودن کار به صف منصفانه اجرای CAD"""
+        async with self._queue_changed:
+            self._pending.setdefault(job["user"], collections.deque()).append(job)
+            await self._set_status(job, "waiting_seat", path=job["path"], position=self.queue_depth())
+            self._queue_changed.notify()
+
+    def queue_depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    async def _next_job(self) -> Dict[str, Any]:
+        """برداشتن کار بعدی به صورت نوبت چرخشی بین کاربران"""
+        async with self._queue_changed:
+            await self._queue_changed.wait_for(lambda: bool(self._pending))
+            user, jobs = next(iter(self._pending.items()))
+            job = jobs.popleft()
+            del self._pending[user]
+            if jobs:
+                self._pending[user] = jobs  # انتقال کاربر به انتهای نوبت
+            return job
+
+    async def _seat_worker(self, seat_index: int):
+        """اجرای کارها روی یک ایستگاه CAD، یکی پس از دیگری"""
+        loop = asyncio.get_running_loop()
+        services = self.seats[seat_index]
+        while True:
+            job = await self._next_job()
+            await self._set_status(job, "running", seat=seat_index)
+            try:
+                success, message, output = await loop.run_in_executor(self._seat_pool, services.execute, job["path"])
+                services.generator.record_execution(job["path"], success)
+            except Exception as e:
+                success, message, output = False, str(e), ""
+            await self._set_status(job, "done" if success else "failed", message=message, output=output)
+
+    def public_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in job.items() if key not in ("events", "changed")}
+
+    def stats(self) -> Dict[str, Any]:
+        """آمار توان عملیاتی و تأخیر صف"""
+        waits = sorted(job["times"]["running"] - job["times"]["waiting_seat"]
+                       for job in self.jobs.values() if "running" in job["times"] and "waiting_seat" in job["times"])
+        elapsed = max(1e-6, time.time() - self.started)
+        return {
+            "jobs": len(self.jobs), "completed": self.completed, "queue_depth": self.queue_depth(),
+            "seats": len(self.seats), "throughput_per_s": round(self.completed / elapsed, 3),
+            "queue_wait_p50_s": round(waits[len(waits) // 2], 3) if waits else None,
+            "queue_wait_p95_s": round(waits[int(len(waits) * 0.95)], 3) if waits else None,
+        }
+
+    def authenticate(self, headers: Dict[str, str]) -> Optional[str]:
+        """نام کاربر صاحب توکن درخواست (None اگر توکن نامعتبر است)"""
+        if not self.tokens:
+            return self.LOCAL_USER
+        token = self.bearer_token(headers).encode()
+        for known, user in self.tokens.items():
+            if hmac.compare_digest(token, known.encode()):
+                return user
+        return None
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes, writer):
+        user = self.authenticate(headers)
+        if user is None:
+            return await self._respond(writer, 401, {"error": "توکن دسترسی نامعتبر است"})
+        parts = [part for part in path.split("/") if part]
+        if method == "POST" and parts == ["jobs"]:
+            data = self._parse_json(body)
+            if data is None:
+                return await self._respond(writer, 400, {"error": "بدنه JSON نامعتبر است"})
+            status, payload = self.submit(user, data.get("kind", "generate_execute"),
+                                          data.get("query", ""), data.get("path", ""))
+            return await self._respond(writer, status, payload)
+        if method == "GET" and parts == ["stats"]:
+            return await self._respond(writer, 200, self.stats())
+        if method == "GET" and len(parts) >= 2 and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None or job["user"] != user:
+                return await self._respond(writer, 404, {"error": "کار یافت نشد"})
+            if len(parts) == 3 and parts[2] == "events":
+                return await self._stream_events(job, writer)
+            return await self._respond(writer, 200, self.public_job(job))
+        await self._respond(writer, 404, {"error": "مسیر نامعتبر است"})
+
+    async def _stream_events(self, job: Dict[str, Any], writer):
+        """ارسال رویدادهای وضعیت کار به صورت Server-Sent Events تا پایان کار"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        sent = 0
+        while True:
+            async with job["changed"]:
+                await job["changed"].wait_for(lambda: len(job["events"]) > sent)
+            for event in job["events"][sent:]:
+                writer.write(f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            sent = len(job["events"])
+            await writer.drain()
+            if job["status"] in self.FINAL_STATES:
+                data = json.dumps(self.public_job(job), ensure_ascii=False)
+                writer.write(f"event: result\ndata: {data}\n\n".encode("utf-8"))
+                await writer.drain()
+                return
+
+async def _load_test_client(port: int, user: str, token: str, jobs: int, kind: str) -> List[Dict[str, Any]]:
+    """یک کاربر شبیه‌سازی شده: ثبت کارها و دنبال کردن SSE هر کدام تا پایان"""
+    results = []
+    for number in range(jobs):
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps({"kind": kind, "query": f"یک دایره به شعاع {number + 1} بکش"}).encode("utf-8")
+        writer.write(f"POST /jobs HTTP/1.1\r\nHost: localhost\r\nAuthorization: Bearer {token}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        response = await reader.read()
+        writer.close()
+        status = int(response.split(b" ", 2)[1])
+        if status != 202:
+            results.append({"user": user, "status": status})
+            continue
+        job_id = json.loads(response.split(b"\r\n\r\n", 1)[1])["id"]
+        
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET /jobs/{job_id}/events HTTP/1.1\r\nHost: localhost\r\nAuthorization: Bearer {token}\r\n\r\n"
+                     .encode("latin-1"))
+        result = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"event: result"):
+                result = json.loads((await reader.readline())[len(b"data: "):])
+                break
+        writer.close()
+        times = (result or {}).get("times", {})
+        results.append({
+            "user": user, "status": 200, "state": (result or {}).get("status"),
+            "latency_s": time.perf_counter() - started,
+            "queue_wait_s": times["running"] - times["waiting_seat"] if "running" in times and "waiting_seat" in times else None,
+        })
+    return results
+
+def run_load_test(clients: int = 200, jobs_per_client: int = 1, seats: int = 1, kind: str = "generate_execute",
+                  run_seconds: float = 0.02, llm_latency_s: float = 0.2) -> Dict[str, Any]:
+    """آزمون بار سرویس کارها با کاربران شبیه‌سازی شده، LLM آزمایشی و ایستگاه‌های جایگزین
+
+    Args:
+        clients: تعداد کاربران همزمان
+        jobs_per_client: تعداد کارهای پشت سر هم هر کاربر
+        seats: تعداد ایستگاه‌های CAD جایگزین
+        kind: نوع کارها
+        run_seconds: مدت اجرای شبیه‌سازی شده هر اسکریپت
+        llm_latency_s: تأخیر پاسخ LLM آزمایشی
+
+    Returns:
+        Dict: توان عملیاتی، صدک‌های تأخیر کل و انتظار صف، انتظار زمان‌بند LLM به تفکیک اولویت و تعداد خطاها
+    """
+    mock = use_mock_llm(llm_latency_s)
+    config = get_config()
+    # پوشه موقت تا اسکریپت فعلی و تاریخچه کاربر دست نخورد و پاکسازی تاریخچه کارهای در صف را حذف نکند
+    config.scripts_dir = tempfile.mkdtemp(prefix="sw_load_test_")
+    config.history_dir = os.path.join(config.scripts_dir, "history")
+    os.makedirs(config.history_dir)
+    config.max_history = clients * jobs_per_client + 100
+    config.execution_mode = "standin"
+    config.standin_run_s = run_seconds
+    config.generation_candidates = 1
+    config.fewshot_tokens = 0
+    seat_services = [SolidWorksServices(config) for _ in range(seats)]
+    
+    tokens = {uuid.uuid4().hex: f"user{index}" for index in range(clients)}
+    
+    async def _main():
+        service = await JobService(seat_services, user_quota=max(20, jobs_per_client),
+                                   llm_concurrency=min(64, clients), tokens=tokens).start(0)
+        started = time.perf_counter()
+        batches = await asyncio.gather(*(_load_test_client(service.port, user, token, jobs_per_client, kind)
+                                         for token, user in tokens.items()))
+        elapsed = time.perf_counter() - started
+        await service.stop()
+        return [result for batch in batches for result in batch], elapsed
+    
+    try:
+        results, elapsed = asyncio.run(_main())
+    finally:
+        for services in seat_services:
+            services.stop()
+        mock.stop()
+        shutil.rmtree(config.scripts_dir, ignore_errors=True)
+    
+    def percentile(values, fraction):
+        values = sorted(value for value in values if value is not None)
+        return round(values[min(len(values) - 1, int(len(values) * fraction))], 3) if values else None
+    
+    llm = get_llm_client()
+    completed = [result for result in results if result.get("state") == "done"]
+    latencies = [result["latency_s"] for result in completed]
+    waits = [result["queue_wait_s"] for result in completed]
+    return {
+        "clients": clients, "jobs": len(results), "seats": seats, "completed": len(completed),
+        "failed": len(results) - len(completed), "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(completed) / elapsed, 2) if elapsed else None,
+        "latency_p50_s": percentile(latencies, 0.5), "latency_p95_s": percentile(latencies, 0.95),
+        "queue_wait_p50_s": percentile(waits, 0.5), "queue_wait_p95_s": percentile(waits, 0.95),
+        "llm_queue_wait_ms": llm.scheduler.metrics(), "llm_endpoints": llm.status(),
+    }
+
+class FarmQueue:
+    """صف ماندگار SQLite برای توزیع اجرای اسکریپت‌ها بین ایستگاه‌های CAD
+
+    هر کار هنگام واگذاری (lease) به یک کارگر برای مدت محدودی قفل می‌شود و کارگر با
+    heartbeat آن را تمدید می‌کند. فقط کارهایی که مهلتشان تمام شود (کارگر از کار افتاده)
+    تا سقف max_attempts دوباره در صف قرار می‌گیرند؛ شکست گزارش شده اسکریپت نهایی است، چون
+    اجرای دوباره همان اسکریپت معیوب روی ایستگاه CAD سند و فایل‌های اضافی می‌سازد.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id TEXT PRIMARY KEY,"
+            " script TEXT NOT NULL,"
+            " args TEXT NOT NULL DEFAULT '[]',"
+            " status TEXT NOT NULL DEFAULT 'queued',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL DEFAULT 3,"
+            " worker TEXT NOT NULL DEFAULT '',"
+            " lease_expires REAL NOT NULL DEFAULT 0,"
+            " result TEXT NOT NULL DEFAULT '{}',"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created)")
+
+    def enqueue(self, script: str, args: Optional[List[str]] = None, max_attempts: int = 3) -> str:
+        """افزودن یک کار به صف
+
+        Returns:
+            str: شناسه کار
+        """
+        task_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tasks (id, script, args, max_attempts, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (task_id, script, json.dumps(args or []), max(1, max_attempts), now, now),
+            )
+        return task_id
+
+    def lease(self, worker: str, count: int, lease_s: float) -> List[Dict[str, Any]]:
+        """واگذاری حداکثر count کار صف شده به یک کارگر (قدیمی‌ترین در ابتدا)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id FROM tasks WHERE status = 'queued' ORDER BY created LIMIT ?", (max(0, count),)
+                ).fetchall()
+                ids = [row["id"] for row in rows]
+                for task_id in ids:
+                    self._conn.execute(
+                        "UPDATE tasks SET status = 'leased', worker = ?, attempts = attempts + 1,"
+                        " lease_expires = ?, updated = ? WHERE id = ?",
+                        (worker, now + lease_s, now, task_id),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self.get(task_id) for task_id in ids]
+
+    def heartbeat(self, worker: str, task_ids: List[str], lease_s: float) -> List[str]:
+        """تمدید مهلت کارهای در حال اجرای یک کارگر
+
+        Returns:
+            List[str]: کارهایی که دیگر متعلق به این کارگر نیستند (باید رها شوند)
+        """
+        lost = []
+        with self._lock:
+            for task_id in task_ids:
+                cursor = self._conn.execute(
+                    "UPDATE tasks SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                    (time.time() + lease_s, time.time(), task_id, worker),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(task_id)
+        return lost
+
+    def complete(self, task_id: str, worker: str, success: bool, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """ثبت نتیجه نهایی یک کار (موفق یا ناموفق)
+
+        Returns:
+            Optional[Dict[str, Any]]: کار به‌روز شده یا None اگر کار به این کارگر واگذار نشده باشد
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                ("done" if success else "failed", json.dumps(result, ensure_ascii=False), time.time(), task_id, worker),
+            )
+            if cursor.rowcount == 0:
+                return None
+        return self.get(task_id)
+
+    def expire_leases(self) -> List[str]:
+        """بازگرداندن کارهایی که مهلتشان تمام شده (کارگر قطع شده) به صف یا علامت‌گذاری شکست"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, worker, attempts, max_attempts FROM tasks WHERE status = 'leased' AND lease_expires < ?", (now,)
+            ).fetchall()
+            for row in rows:
+                exhausted = row["attempts"] >= row["max_attempts"]
+                self._conn.execute(
+                    "UPDATE tasks SET status = ?, worker = CASE WHEN ? THEN worker ELSE '' END, result = ?, updated = ?"
+                    " WHERE id = ? AND status = 'leased'",
+                    ("failed" if exhausted else "queued", exhausted,
+                     json.dumps({"message": f"مهلت کار روی {row['worker']} تمام شد"}, ensure_ascii=False), now, row["id"]),
+                )
+        for row in rows:
+            logger.warning(f"مهلت کار {row['id']} روی کارگر {row['worker']} تمام شد")
+        return [row["id"] for row in rows]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = dict(row)
+        task["args"] = json.loads(task["args"])
+        task["result"] = json.loads(task["result"])
+        return task
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+class FarmCoordinator(_JSONHTTPServer):
+    """هماهنگ کننده مزرعه اجرا: ثبت کارگرها و توزیع کارهای صف ماندگار
+
+    API (JSON روی HTTP):
+        POST /tasks            {"script", "args", "max_attempts"} -> {"id"}
+        GET  /tasks/<id>       وضعیت و نتیجه کار
+        POST /workers/register {"worker", "host", "capacity"} -> {"lease_s", "heartbeat_s"}
+        POST /lease            {"worker", "count"} -> {"tasks": [...]}
+        POST /heartbeat        {"worker", "tasks": [...]} -> {"lost": [...]}
+        POST /complete         {"worker", "task", "success", "message", "output"}
+        GET  /stats            وضعیت صف و کارگرها
+
+    اگر token تنظیم شده باشد، همه مسیرها هدر Authorization: Bearer <token> لازم دارند.
+    هماهنگ کننده تاریخچه را نمی‌نویسد؛ ارسال کننده (پنل یا MCP) نتیجه را با record_execution ثبت می‌کند.
+    """
+
+    def __init__(self, farm_queue: FarmQueue, lease_s: float = 30.0, worker_timeout_s: float = 90.0,
+                 token: str = ""):
+        self.queue = farm_queue
+        self.lease_s = lease_s
+        self.worker_timeout_s = worker_timeout_s
+        self.token = token
+        self.workers: Dict[str, Dict[str, Any]] = {}
+        self._server = None
+        self._reaper = None
+
+    async def start(self, port: int, host: str = "127.0.0.1") -> "FarmCoordinator":
+        self.check_bind(host, bool(self.token))
+        self._server = await asyncio.start_server(self._handle_connection, host, port, backlog=256)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.ensure_future(self._reap_leases())
+        logger.info(f"هماهنگ کننده مزرعه اجرا روی {host}:{self.port} آماده است")
+        return self
+
+    def run(self, port: int, host: str = "127.0.0.1"):
+        async def _main():
+            await self.start(port, host)
+            async with self._server:
+                await self._server.serve_forever()
+        asyncio.run(_main())
+
+    async def stop(self):
+        self._reaper.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _reap_leases(self):
+        """بررسی دوره‌ای مهلت کارها"""
+        while True:
+            await asyncio.sleep(max(0.2, self.lease_s / 4))
+            self.queue.expire_leases()
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes, writer):
+        if self.token and not hmac.compare_digest(self.bearer_token(headers).encode(), self.token.encode()):
+            return await self._respond(writer, 401, {"error": "توکن مزرعه نامعتبر است"})
+        parts = [part for part in path.split("/") if part]
+        if method == "GET" and parts == ["stats"]:
+            now = time.time()
+            return await self._respond(writer, 200, {
+                "tasks": self.queue.counts(),
+                "workers": {name: {**info, "alive": now - info["last_seen"] < self.worker_timeout_s}
+                            for name, info in self.workers.items()},
+            })
+        if method == "GET" and len(parts) == 2 and parts[0] == "tasks":
+            task = self.queue.get(parts[1])
+            if task is None:
+                return await self._respond(writer, 404, {"error": "کار یافت نشد"})
+            task.pop("script")
+            return await self._respond(writer, 200, task)
+        
+        data = self._parse_json(body) if method == "POST" else None
+        if data is None:
+            return await self._respond(writer, 400 if method == "POST" else 404, {"error": "درخواست نامعتبر است"})
+        if parts == ["tasks"]:
+            if not data.get("script"):
+                return await self._respond(writer, 400, {"error": "script لازم است"})
+            task_id = self.queue.enqueue(data["script"], data.get("args"), int(data.get("max_attempts", 3)))
+            return await self._respond(writer, 202, {"id": task_id})
+        
+        worker = str(data.get("worker", ""))
+        if not worker:
+            return await self._respond(writer, 400, {"error": "worker لازم است"})
+        info = self.workers.setdefault(worker, {"host": "", "capacity": 1, "completed": 0, "failed": 0})
+        info["last_seen"] = time.time()
+        if parts == ["workers", "register"]:
+            info.update(host=data.get("host", ""), capacity=max(1, int(data.get("capacity", 1))))
+            logger.info(f"کارگر {worker} ({info['host']}) با ظرفیت {info['capacity']} ثبت شد")
+            return await self._respond(writer, 200, {"lease_s": self.lease_s, "heartbeat_s": self.lease_s / 3})
+        if parts == ["lease"]:
+            count = min(int(data.get("count", 1)), info["capacity"])
+            return await self._respond(writer, 200, {"tasks": self.queue.lease(worker, count, self.lease_s)})
+        if parts == ["heartbeat"]:
+            return await self._respond(writer, 200, {"lost": self.queue.heartbeat(worker, list(data.get("tasks", [])),
+                                                                                  self.lease_s)})
+        if parts == ["complete"]:
+            success = bool(data.get("success"))
+            task = self.queue.complete(str(data.get("task", "")), worker, success,
+                                       {"message": data.get("message", ""), "output": data.get("output", "")})
+            if task is None:
+                return await self._respond(writer, 409, {"error": "کار به این کارگر واگذار نشده است"})
+            info["completed" if success else "failed"] += 1
+            return await self._respond(writer, 200, {"status": task["status"]})
+        await self._respond(writer, 404, {"error": "مسیر نامعتبر است"})
+
+class FarmWorker:
+    """عامل کارگر روی هر ایستگاه CAD: دریافت کار از هماهنگ کننده، اجرا و گزارش نتیجه
+
+    ظرفیت کارگر برابر تعداد ایستگاه‌های محلی (SolidWorksServices) است؛ هر ایستگاه در هر
+    لحظه یک اسکریپت اجرا می‌کند. مهلت کارهای در حال اجرا با heartbeat تمدید می‌شود.
+    """
+
+    def __init__(self, coordinator_url: str, seats: List[SolidWorksServices], worker_id: str = "",
+                 poll_s: float = 0.5, token: str = ""):
+        self.url = coordinator_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.seats = seats
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_s = poll_s
+        self.heartbeat_s = 10.0
+        self._free_seats = queue.Queue()
+        for seat in seats:
+            self._free_seats.put(seat)
+        self._running: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._work_dir = tempfile.mkdtemp(prefix="sw_farm_")
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = requests.post(f"{self.url}{path}", json={"worker": self.worker_id, **payload},
+                                 headers=self.headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def run(self):
+        """حلقه اصلی کارگر تا توقف"""
+        registration = self._post("/workers/register", {"host": socket.gethostname(), "capacity": len(self.seats)})
+        self.heartbeat_s = registration["heartbeat_s"]
+        logger.info(f"کارگر مزرعه {self.worker_id} ثبت شد ({len(self.seats)} ایستگاه)")
+        threading.Thread(target=self._heartbeat_loop, name="FarmHeartbeat", daemon=True).start()
+        
+        while not self._stop.is_set():
+            free = self._free_seats.qsize()
+            tasks = []
+            if free:
+                try:
+                    tasks = self._post("/lease", {"count": free})["tasks"]
+                except Exception as e:
+                    logger.warning(f"خطا در دریافت کار از هماهنگ کننده: {e}")
+            for task in tasks:
+                seat = self._free_seats.get()
+                with self._lock:
+                    self._running[task["id"]] = time.time()
+                threading.Thread(target=self._run_task, args=(task, seat), daemon=True).start()
+            if not tasks:
+                self._stop.wait(self.poll_s)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_task(self, task: Dict[str, Any], seat: SolidWorksServices):
+        script_path = os.path.join(self._work_dir, f"farm_{task['id']}.vbs")
+        try:
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(task["script"])
+            success, message, output = seat.execute(script_path, task["args"])
         except Exception as e:
-            logger.error(f"خطا در پاکسازی تاریخچه: {e}")
-    
-    def execute_script(self, script_path: str) -> Tuple[bool, str, str]:
-        """اجرای اسکریپت VBS
+            success, message, output = False, f"خطا در اجرای کار: {e}", ""
+        finally:
+            self._free_seats.put(seat)
+            with self._lock:
+                self._running.pop(task["id"], None)
+        try:
+            self._post("/complete", {"task": task["id"], "success": success, "message": message, "output": output})
+        except Exception as e:
+            logger.error(f"خطا در گزارش نتیجه کار {task['id']}: {e}")
+        finally:
+            if os.path.exists(script_path):
+                os.remove(script_path)
 
-        Args:
-            script_path: مسیر فایل اسکریپت
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_s):
+            with self._lock:
+                task_ids = list(self._running)
+            try:
+                lost = self._post("/heartbeat", {"tasks": task_ids})["lost"]
+                if lost:
+                    logger.warning(f"واگذاری کارها از دست رفت: {lost}")
+            except Exception as e:
+                logger.warning(f"خطا در ارسال heartbeat: {e}")
+
+class FarmClient:
+    """ارسال اسکریپت به مزرعه اجرا و انتظار برای نتیجه (جایگزین اجرای محلی در SolidWorksServices)"""
+
+    def __init__(self, coordinator_url: str, poll_s: float = 0.5, timeout_s: float = 3600.0, token: str = ""):
+        self.url = coordinator_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.poll_s = poll_s
+        self.timeout_s = timeout_s
+
+    def execute(self, script_path: str, args: Optional[List[str]] = None) -> Tuple[bool, str, str]:
+        """اجرای اسکریپت روی یکی از کارگرهای مزرعه
+
+        خطای گذرای شبکه هنگام پرس‌وجوی وضعیت باعث شکست نمی‌شود (کار روی مزرعه ادامه دارد)؛
+        پرس‌وجو تا پایان مهلت تکرار می‌شود.
 
         Returns:
-            (موفقیت, پیام, خروجی): وضعیت اجرا، پیام و خروجی اسکریپت
+            (موفقیت, پیام, خروجی): مشابه SolidWorksScriptGenerator.execute_script
         """
         try:
-            if not os.path.exists(script_path):
-                return False, f"فایل اسکریپت وجود ندارد: {script_path}", ""
-            
-            # اجرای اسکریپت با تنظیم encoding=None برای دریافت خروجی به صورت bytes
-            result = subprocess.run(["cscript", "//NoLogo", script_path], 
-                                   capture_output=True, text=False, check=False)
-            
-            exit_code = result.returncode
-            
-            # تبدیل خروجی با مدیریت خطای کدگذاری
-            try:
-                output = result.stdout.decode('utf-8', errors='replace')
-            except Exception as e:
-                logger.warning(f"خطا در تبدیل خروجی: {e}")
-                output = str(result.stdout)
-                
-            try:
-                error = result.stderr.decode('utf-8', errors='replace')
-            except Exception as e:
-                logger.warning(f"خطا در تبدیل خطا: {e}")
-                error = str(result.stderr)
-            
-            if exit_code == 0:
-                logger.info(f"اسکریپت با موفقیت اجرا شد: {script_path}")
-                return True, "اسکریپت با موفقیت اجرا شد.", output
-            else:
-                logger.error(f"خطا در اجرای اسکریپت {script_path}: {error or output}")
-                return False, f"خطا در اجرای اسکریپت (کد خروج: {exit_code})", error or output
-            
+            with open(script_path, "r", encoding="utf-8") as f:
+                script = f.read()
+            response = requests.post(f"{self.url}/tasks", json={"script": script, "args": args or []},
+                                     headers=self.headers, timeout=30)
+            response.raise_for_status()
+            task_id = response.json()["id"]
+            deadline = time.time() + self.timeout_s
+            while time.time() < deadline:
+                try:
+                    response = requests.get(f"{self.url}/tasks/{task_id}", headers=self.headers, timeout=30)
+                    response.raise_for_status()
+                    task = response.json()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logger.warning(f"خطا در دریافت وضعیت کار مزرعه {task_id}: {e} - تلاش دوباره")
+                    time.sleep(self.poll_s)
+                    continue
+                if task["status"] in ("done", "failed"):
+                    result = task["result"]
+                    return task["status"] == "done", result.get("message", ""), result.get("output", "")
+                time.sleep(self.poll_s)
+            return False, "زمان انتظار برای نتیجه مزرعه اجرا به پایان رسید", ""
         except Exception as e:
-            logger.error(f"خطا در اجرای اسکریپت: {e}")
-            return False, f"خطا در اجرای اسکریپت: {str(e)}", ""
+            logger.error(f"خطا در اجرای اسکریپت روی مزرعه: {e}")
+            return False, f"خطا در اجرای اسکریپت روی مزرعه: {str(e)}", ""
 
-# کلاس دیباگر اسکریپت 
-class ScriptDebugger:
-    """کلاس دیباگر اسکریپت برای شناسایی و رفع باگ‌های VBScript با کمک LLM"""
+class VirtualHistoryList:
+    """لیست مجازی تاریخچه که فقط ردیف‌های قابل مشاهده را می‌سازد
+
+    ردیف‌ها با پرس‌وجوی صفحه‌بندی شده از HistoryIndex خوانده می‌شوند؛ اسکرول‌بار بر اساس
+    تعداد کل ورودی‌ها تنظیم می‌شود و Listbox همیشه فقط به اندازه ارتفاع خود ردیف دارد.
+    """
+
+    STATUS_MARKS = {"success": "✓", "failed": "✗"}
+
+    def __init__(self, parent, index: HistoryIndex, **listbox_options):
+        """ساخت لیست
+
+        Args:
+            parent: ویجت والد
+            index: فهرست تاریخچه
+            **listbox_options: تنظیمات ظاهری Listbox
+        """
+        self.index = index
+        self.total = 0
+        self.first = 0
+        self.visible_rows = 20
+        self.rows: List[Dict[str, Any]] = []
+        self.selected_path: Optional[str] = None
+        
+        self.frame = ttk.Frame(parent, style="Sidebar.TFrame")
+        self.scrollbar = ttk.Scrollbar(self.frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.listbox = tk.Listbox(self.frame, selectmode=tk.SINGLE, exportselection=False, **listbox_options)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<Configure>", self._on_configure)
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.listbox.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll(3))
+        self.listbox.bind("<Up>", lambda event: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda event: self._move_selection(1))
     
-    def __init__(self, api_key: str, base_url: str, api_model: str):
-        """راه‌اندازی دیباگر اسکریپت
+    def pack(self, **kwargs):
+        """چیدمان فریم لیست"""
+        self.frame.pack(**kwargs)
+    
+    def bind(self, sequence, func):
+        """اتصال رویداد به Listbox داخلی"""
+        self.listbox.bind(sequence, func, add="+")
+    
+    def refresh(self):
+        """خواندن دوباره تعداد کل و ردیف‌های قابل مشاهده"""
+        self.total = self.index.count()
+        self.scroll_to(self.first, force=True)
+    
+    def scroll(self, delta: int):
+        """اسکرول به اندازه تعدادی ردیف
 
         Args:
-            api_key: کلید API برای استفاده از LLM
-            base_url: آدرس API
-            api_model: مدل هوش مصنوعی
+            delta: تعداد ردیف (منفی به سمت بالا)
         """
-        self.api_key = api_key
-        self.api_url = base_url
-        self.api_model = api_model
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-            "HTTP-Referer": "https://solipy.app"
-        }
+        self.scroll_to(self.first + delta)
+        return "break"
     
-    def provide_user_guidance(self, user_query: str) -> Tuple[bool, str]:
-        """ارائه راهنمایی به کاربر با استفاده از LLM برای سوالات مرتبط با دیباگ یا طراحی اسکریپت
+    def scroll_to(self, first: int, force: bool = False):
+        """نمایش ردیف‌ها از شماره مشخص
 
         Args:
-            user_query: سوال یا درخواست کاربر
+            first: شماره اولین ردیف قابل مشاهده
+            force: بازسازی حتی اگر موقعیت تغییر نکرده باشد
+        """
+        first = max(0, min(int(first), self.total - self.visible_rows))
+        if first != self.first or force:
+            self.first = first
+            self._render()
+    
+    def selected_entry(self) -> Optional[Dict[str, Any]]:
+        """ورودی انتخاب شده (در صورت وجود)"""
+        if not self.selected_path:
+            return None
+        return self.index.get(self.selected_path)
+    
+    def format_row(self, entry: Dict[str, Any]) -> str:
+        """متن نمایشی یک ورودی
+
+        Args:
+            entry: ورودی فهرست تاریخچه
 
         Returns:
-            (موفقیت, پاسخ): وضعیت درخواست و پاسخ دریافتی
+            str: وضعیت، زمان و خلاصه درخواست
         """
-        try:
-            # ایجاد پرامپت برای LLM
-            system_prompt = """You are an expert in VBScript programming for SolidWorks automation. 
-You help users debug their SolidWorks scripts and provide guidance on script development.
-Focus on providing practical, specific advice that users can immediately apply to fix their code or improve their scripts.
-Your expertise includes:
-1. SolidWorks API methods and best practices
-2. VBScript syntax and common errors
-3. Debugging techniques for automation scripts
-4. Best practices for SolidWorks automation
+        mark = self.STATUS_MARKS.get(entry["status"], "•")
+        query = " ".join(entry["query"].split())
+        if len(query) > 40:
+            query = query[:39] + "…"
+        return f"{mark} {entry['created']}  {query}".rstrip()
+    
+    def _render(self):
+        """ساخت دوباره فقط ردیف‌های قابل مشاهده"""
+        self.rows = self.index.page(self.first, self.visible_rows)
+        self.listbox.delete(0, tk.END)
+        if self.rows:
+            self.listbox.insert(tk.END, *[self.format_row(entry) for entry in self.rows])
+        for i, entry in enumerate(self.rows):
+            if entry["path"] == self.selected_path:
+                self.listbox.selection_set(i)
+        
+        if self.total:
+            self.scrollbar.set(self.first / self.total, min(1.0, (self.first + len(self.rows)) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def _on_configure(self, event):
+        """محاسبه تعداد ردیف‌های قابل مشاهده پس از تغییر اندازه"""
+        linespace = int(self.listbox.tk.call("font", "metrics", self.listbox.cget("font"), "-linespace")) or 1
+        rows = max(1, event.height // (linespace + 1))
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.refresh()
+    
+    def _on_scrollbar(self, *args):
+        """تبدیل فرمان‌های اسکرول‌بار به جابجایی ردیف‌ها"""
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self.total)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_rows
+            self.scroll(step)
+    
+    def _on_select(self, event=None):
+        """ذخیره مسیر ورودی انتخاب شده (مستقل از موقعیت اسکرول)"""
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.rows):
+            self.selected_path = self.rows[selection[0]]["path"]
+    
+    def _move_selection(self, delta: int):
+        """حرکت انتخاب با کلیدهای جهت و اسکرول در صورت نیاز"""
+        current = self.first - 1
+        for i, entry in enumerate(self.rows):
+            if entry["path"] == self.selected_path:
+                current = self.first + i
+        target = max(0, min(current + delta, self.total - 1))
+        if target < self.first:
+            self.scroll_to(target)
+        elif target >= self.first + self.visible_rows:
+            self.scroll_to(target - self.visible_rows + 1)
+        
+        row = target - self.first
+        if 0 <= row < len(self.rows):
+            self.selected_path = self.rows[row]["path"]
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(row)
+            self.listbox.event_generate("<<ListboxSelect>>")
+        return "break"
 
-Respond in Persian (Farsi) language with:
-1. Clear, step-by-step advice for the user's specific question
-2. Code examples when relevant
-3. Explanations of common mistakes or misconceptions
-"""
-            
-            payload = {
-                "model": self.api_model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 2000
-            }
-            
-            # ارسال درخواست به API
-            logger.info(f"ارسال درخواست راهنمایی به API... ({self.api_url}, {self.api_model})")
-            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=30)
-            
-            if response.status_code != 200:
-                logger.error(f"خطا در پاسخ API راهنمایی: {response.status_code} - {response.text}")
-                return False, f"خطا در درخواست API راهنمایی: {response.status_code}"
-            
-            # استخراج پاسخ از LLM
-            response_data = response.json()
-            llm_response = response_data['choices'][0]['message']['content'].strip()
-            
-            return True, llm_response
+class OutputConsole:
+    """کنسول خروجی با تعداد خط محدود و افزودن تدریجی
+
+    ویجت متن حداکثر max_lines خط نگه می‌دارد (خطوط قدیمی از ابتدا حذف می‌شوند) و متن‌های
+    بزرگ در چند نوبت بیکاری درج می‌شوند تا رابط کاربری قفل نشود. خروجی کامل در یک فایل
+    موقت نوشته می‌شود و با save_full_log قابل ذخیره است.
+    """
+
+    def __init__(self, text_widget, max_lines: int = OUTPUT_MAX_LINES, chunk_lines: int = 500):
+        """راه‌اندازی کنسول
+
+        Args:
+            text_widget: ویجت Text یا ScrolledText (در حالت DISABLED)
+            max_lines: حداکثر خطوط نمایش داده شده
+            chunk_lines: تعداد خطوط درج شده در هر نوبت
+        """
+        self.text = text_widget
+        self.max_lines = max_lines
+        self.chunk_lines = chunk_lines
+        self.total_lines = 0
+        self._pending = collections.deque(maxlen=max_lines)
+        self._dropped = 0
+        self._line_count = 0
+        self._flush_scheduled = False
+        self._spool = None
+    
+    def clear(self):
+        """پاک کردن کنسول و خروجی کامل"""
+        self._pending.clear()
+        self._dropped = 0
+        self._line_count = 0
+        self.total_lines = 0
+        if self._spool is not None:
+            self._spool.seek(0)
+            self._spool.truncate()
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.config(state=tk.DISABLED)
+    
+    def set_text(self, text: str):
+        """جایگزینی محتوای کنسول"""
+        self.clear()
+        self.append(text)
+    
+    def append(self, text: str):
+        """افزودن متن به انتهای کنسول
+
+        Args:
+            text: متن (می‌تواند چند خطی باشد)
+        """
+        if not text:
+            return
         
-        except Exception as e:
-            logger.error(f"خطا در دریافت راهنمایی: {e}")
-            return False, f"خطا در دریافت راهنمایی: {str(e)}"
+        spool = self._spool_file()
+        spool.write(text if text.endswith("\n") else text + "\n")
+        
+        lines = text.splitlines()
+        self.total_lines += len(lines)
+        self._dropped += max(0, len(self._pending) + len(lines) - self.max_lines)
+        self._pending.extend(lines)
+        
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.text.after_idle(self._flush)
     
-    def debug_script(self, script_content: str, error_message: str) -> Tuple[bool, str, str]:
-        """دیباگ اسکریپت VBS با استفاده از LLM
+    def save_full_log(self, path: str) -> int:
+        """ذخیره خروجی کامل (شامل خطوط حذف شده از نمایش) در فایل
 
         Args:
-            script_content: محتوای اسکریپت دارای خطا
-            error_message: پیام خطای دریافت شده هنگام اجرا
+            path: مسیر فایل مقصد
 
         Returns:
-            (موفقیت, اسکریپت_اصلاح_شده, توضیحات): وضعیت دیباگ، اسکریپت اصلاح شده و توضیحات
+            int: تعداد خطوط ذخیره شده
         """
-        try:
-            # ایجاد پرامپت برای LLM
-            system_prompt = """You are an expert VBScript debugger for SolidWorks automation. 
-Your task is to analyze the provided VBScript code and error message, then fix the issue.
-Focus on common VBScript errors such as:
-1. Syntax errors (missing parentheses, wrong variable names)
-2. "Cannot use parentheses when calling a Sub" error - in VBScript function calls that return values use parentheses, but Sub calls do not use parentheses
-3. Invalid characters or encoding issues
-4. Incorrect method calls or parameters for SolidWorks API
-5. Issues with object references or method parameters
-
-Respond with:
-1. The fixed script - provide the complete corrected script
-2. A brief explanation of what you fixed and why
-"""
-            
-            payload = {
-                "model": self.api_model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Debug this VBScript code for SolidWorks automation. Here's the script:\n\n```vbs\n{script_content}\n```\n\nHere's the error message:\n{error_message}\n\nPlease fix the code and explain what was wrong."}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 2500
-            }
-            
-            # ارسال درخواست به API
-            logger.info(f"ارسال درخواست دیباگ به API... ({self.api_url}, {self.api_model})")
-            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=30)
-            
-            if response.status_code != 200:
-                logger.error(f"خطا در پاسخ API دیباگ: {response.status_code} - {response.text}")
-                return False, "", f"خطا در درخواست API دیباگ: {response.status_code}"
-            
-            # استخراج پاسخ از LLM
-            response_data = response.json()
-            llm_response = response_data['choices'][0]['message']['content'].strip()
-            
-            # جداسازی کد اصلاح شده و توضیحات
-            fixed_script = ""
-            explanation = ""
-            
-            if "```vbs" in llm_response or "```vbscript" in llm_response:
-                # استخراج کد از بخش‌های کد در پاسخ
-                code_parts = []
-                for part in llm_response.split("```"):
-                    if part.startswith("vbs") or part.startswith("vbscript"):
-                        code_parts.append(part[part.index("\n")+1:])
-                    elif not part.startswith("```") and not part.strip().startswith("vbs") and not part.strip().startswith("vbscript") and len(part.strip()) > 10:
-                        explanation += part.strip() + "\n"
-                
-                if code_parts:
-                    fixed_script = code_parts[0].strip()
-            else:
-                # اگر ساختار کد مشخص نشده، تلاش برای تشخیص بخش کد و توضیحات
-                lines = llm_response.split("\n")
-                is_code = False
-                code_lines = []
-                explanation_lines = []
-                
-                for line in lines:
-                    if line.strip().startswith("Option Explicit") or line.strip().startswith("Dim ") or line.strip().startswith("Set "):
-                        is_code = True
-                        code_lines.append(line)
-                    elif is_code and (line.strip() == "" or line.strip().startswith("'")):
-                        code_lines.append(line)
-                    elif is_code and ("=" in line or line.strip().startswith("If ") or line.strip().startswith("End ") or line.strip().startswith("WScript.")):
-                        code_lines.append(line)
-                    else:
-                        is_code = False
-                        explanation_lines.append(line)
-                
-                fixed_script = "\n".join(code_lines).strip()
-                explanation = "\n".join(explanation_lines).strip()
-            
-            # اگر نتوانستیم کد را استخراج کنیم، از کل پاسخ استفاده کنیم
-            if not fixed_script:
-                explanation = llm_response
-                return False, "", f"نتوانستم کد اصلاح شده را استخراج کنم. لطفاً پاسخ زیر را بررسی کنید:\n\n{explanation}"
-            
-            return True, fixed_script, explanation
-        
-        except Exception as e:
-            logger.error(f"خطا در دیباگ اسکریپت: {e}")
-            return False, "", f"خطا در دیباگ اسکریپت: {str(e)}"
+        spool = self._spool_file()
+        spool.flush()
+        spool.seek(0)
+        with open(path, "w", encoding="utf-8") as f:
+            shutil.copyfileobj(spool, f)
+        spool.seek(0, os.SEEK_END)
+        return self.total_lines
+    
+    def _spool_file(self):
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile("w+", encoding="utf-8", errors="replace")
+        return self._spool
+    
+    def _flush(self):
+        """درج یک بخش از خطوط در انتظار و حذف خطوط اضافی از ابتدا"""
+        self._flush_scheduled = False
+        batch = [self._pending.popleft() for _ in range(min(self.chunk_lines, len(self._pending)))]
+        
+        self.text.config(state=tk.NORMAL)
+        if self._dropped:
+            # خطوط حذف شده از قبل از همه خطوط نمایش داده شده جدیدترند؛ نمایش از نو شروع می‌شود
+            self.text.delete("1.0", tk.END)
+            self.text.insert(tk.END, f"... {self._dropped + self._line_count} خط قبلی نمایش داده نمی‌شود (ذخیره کامل خروجی را ببینید)\n")
+            self._line_count = 1
+            self._dropped = 0
+        
+        if batch:
+            self.text.insert(tk.END, "\n".join(batch) + "\n")
+            self._line_count += len(batch)
+        
+        excess = self._line_count - self.max_lines
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+            self._line_count -= excess
+        
+        self.text.see(tk.END)
+        self.text.config(state=tk.DISABLED)
+        
+        if self._pending:
+            self._flush_scheduled = True
+            self.text.after_idle(self._flush)
 
 class SolidWorksPanel:
     """پنل گرافیکی برای تعامل با SolidWorks از طریق اسکریپت‌های VBS"""
     
+    # متن نمایش وضعیت نشست SolidWorks
+    SESSION_STATE_TEXT = {
+        "idle": "SolidWorks: غیرفعال",
+        "connecting": "SolidWorks: در حال اتصال...",
+        "ready": "SolidWorks: آماده",
+        "failed": "SolidWorks: قطع (تلاش مجدد...)",
+        "stopped": "SolidWorks: متوقف",
+    }
+    
+    # حداکثر تولید دوباره خودکار با مدل قوی‌تر برای یک درخواست
+    MAX_AUTO_ESCALATIONS = 2
+    
     def __init__(self, root):
         """راه‌اندازی پنل
 
@@ -711,6 +8007,8 @@ class SolidWorksPanel:
             root: ریشه برنامه Tkinter
         """
         self.root = root
+        self._startup_started = time.perf_counter()
+        self.config = get_config().prepare_runtime()
         self.root.title("SolidWorks API Panel")
         self.root.geometry("1100x700")
         self.root.minsize(900, 650)
@@ -732,30 +8030,145 @@ class SolidWorksPanel:
         # تنظیم رنگ پس‌زمینه اصلی
         self.root.config(bg=self.bg_color)
         
-        # تنظیم استایل‌ها
-        self._configure_styles()
+        # سرویس‌های مشترک و سرور MCP تعبیه شده پس از اولین نمایش پنجره ساخته می‌شوند (_create_services)
+        self.services: Optional[SolidWorksServices] = None
+        self.mcp_server = None
         
-        # ایجاد تولید کننده اسکریپت
-        self.script_generator = SolidWorksScriptGenerator(API_KEY, BASE_URL, API_MODEL)
+        # کاتالوگ قالب‌های اسکریپت در حافظه با بارگذاری مجدد خودکار (بارگذاری پس از نمایش پنجره)
+        self.template_registry = ScriptTemplateRegistry()
+        self.template_registry.add_listener(lambda name, template: self.script_generator.bundler.invalidate())
         
-        # ایجاد دیباگر اسکریپت
-        self.script_debugger = ScriptDebugger(API_KEY, BASE_URL, API_MODEL)
+        # ایجاد صف برای ارتباط با ترد (همراه با بازه ردیابی فرستنده هر پیام)
+        self.tracer = get_tracer()
+        self.queue = TracedQueue(self.tracer)
+        self.profiler = get_profiler()
         
-        # ایجاد صف برای ارتباط با ترد
-        self.queue = queue.Queue()
+        # ورودی تاریخچه مربوط به اسکریپت فعلی (برای ثبت نتیجه اجرا)
+        self.current_history_path: Optional[str] = None
+        self._debug_requested = False
         
-        # لیست مسیرهای فایل‌های تاریخچه
-        self.history_paths = []
+        # اسکریپت تازه تولید شده‌ای که هنوز اجرا نشده (فقط اولین اجرای آن می‌تواند مدل را ارتقا دهد)
+        # و تعداد ارتقاهای خودکار هر درخواست
+        self._fresh_script_path: Optional[str] = None
+        self._auto_escalations: Dict[str, int] = collections.Counter()
         
-        # ایجاد اجزای رابط کاربری
-        self._create_ui()
+        # صف دستورات برای اجرای دسته‌ای؛ سازنده‌های اسکریپت‌های دسته‌ای (مسیر -> سازنده) در _create_services
+        self.batch_queue: List[str] = []
+        self.sweeps: Dict[str, DesignSweep] = {}
         
-        # بررسی تاریخچه
-        self._update_history_list()
+        # دیالوگ‌های سنگین یک بار ساخته و دوباره استفاده می‌شوند
+        self._guidance_dialog = None
+        self._debug_dialog = None
+        
+        # زمان‌های راه‌اندازی (میلی‌ثانیه) و وضعیت آمادگی رابط کاربری
+        self.startup_metrics: Dict[str, float] = {}
+        self.ui_ready = False
+        
+        # ایجاد پوسته حداقلی رابط کاربری؛ بقیه بخش‌ها در زمان بیکاری ساخته می‌شوند
+        self._create_ui()
+        self._deferred_steps: List[Callable[[], None]] = [
+            self._create_script_panel,
+            self._create_output_panel,
+            self._create_history_panel,
+            self._sync_history,
+            self._load_templates,
+            self._start_session_prewarm,
+        ]
+        self.root.after_idle(self._on_shell_painted)
         
         # بررسی دوره‌ای صف
         self.root.after(100, self._process_queue)
     
+    def _on_shell_painted(self):
+        """ثبت زمان اولین نمایش پنجره و شروع ساخت بخش‌های ثانویه
+
+        استایل‌ها و سرویس‌ها پیش از بازگشت به حلقه رویداد ساخته می‌شوند تا هیچ رویداد کاربری
+        پیش از آماده شدن آن‌ها پردازش نشود.
+        """
+        self.root.update_idletasks()
+        self.startup_metrics["first_paint_ms"] = round((time.perf_counter() - self._startup_started) * 1000, 1)
+        self._configure_styles()
+        self._create_services()
+        self.root.after_idle(self._run_deferred_step)
+    
+    def _create_services(self):
+        """ساخت سرویس‌های مشترک با سرور MCP و راه‌اندازی سرور MCP تعبیه شده (در صورت تنظیم پورت)"""
+        # اجرا کننده COM، کارگزار نشست، تولید کننده، دیباگر و صف اجرا
+        self.services = SolidWorksServices(self.config)
+        self.com_runner = self.services.com_runner
+        self.session_broker = self.services.session_broker
+        self.script_generator = self.services.generator
+        self.script_debugger = self.services.debugger
+        
+        # سازنده‌های اسمبلی‌هایی که تولید کننده می‌سازد هم در فهرست اسکریپت‌های دسته‌ای ثبت می‌شوند
+        self.batch_builders = self.script_generator.batch_builders
+        
+        self.session_broker.add_listener(lambda state, detail: self.queue.put(("session_state", state, detail)))
+        
+        if self.config.mcp_port:
+            self.mcp_server = MCPServer(self.services)
+            self.mcp_server.start_in_background(self.config.mcp_port)
+    
+    def _run_deferred_step(self):
+        """اجرای یک مرحله از ساخت تأخیری رابط کاربری در هر نوبت بیکاری
+
+        بین مراحل رویدادهای کاربر پردازش می‌شوند تا پنجره پاسخگو بماند.
+        """
+        if not self._deferred_steps:
+            self._on_ui_interactive()
+            return
+        
+        step = self._deferred_steps.pop(0)
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"خطا در ساخت تأخیری رابط کاربری ({step.__name__}): {e}")
+        
+        self.root.after_idle(self._run_deferred_step)
+    
+    def _on_ui_interactive(self):
+        """ثبت زمان آماده شدن کامل رابط کاربری"""
+        self.ui_ready = True
+        self.startup_metrics["interactive_ms"] = round((time.perf_counter() - self._startup_started) * 1000, 1)
+        logger.info(f"زمان راه‌اندازی پنل: اولین نمایش {self.startup_metrics['first_paint_ms']} ms، "
+                    f"آماده تعامل {self.startup_metrics['interactive_ms']} ms")
+        self.status_bar.config(text=f"آماده (راه‌اندازی در {self.startup_metrics['interactive_ms']:.0f} ms)")
+        if self.profiler.enabled:
+            self.profiler.watch_tk(self.root)
+    
+    def _profile_button_text(self):
+        """متن دکمه پروفایل بر اساس وضعیت فعلی"""
+        return "پروفایل عملکرد: روشن" if self.profiler.enabled else "پروفایل عملکرد: خاموش"
+    
+    def _on_toggle_profiling(self):
+        """روشن/خاموش کردن پروفایل؛ با خاموش شدن گزارش‌ها در پوشه diagnostics ذخیره می‌شوند"""
+        if not self.profiler.enabled:
+            self.profiler.set_enabled(True)
+            self.profiler.watch_tk(self.root)
+            self.status_bar.config(text="پروفایل عملکرد فعال شد؛ پس از بازتولید مشکل دوباره کلیک کنید.")
+        else:
+            try:
+                output_dir = self.profiler.dump()
+                self.status_bar.config(text=f"گزارش پروفایل ذخیره شد: {output_dir}")
+            except Exception as e:
+                logger.error(f"خطا در ذخیره گزارش پروفایل: {e}")
+                messagebox.showerror("خطا", f"خطا در ذخیره گزارش پروفایل: {str(e)}")
+            self.profiler.set_enabled(False)
+        self.profile_btn.config(text=self._profile_button_text())
+    
+    def _load_templates(self):
+        """بارگذاری کاتالوگ قالب‌ها و شروع پایش تغییرات پوشه scripts"""
+        self.template_registry.load_all()
+        self.template_registry.start_watching()
+    
+    def _start_session_prewarm(self):
+        """اتصال پیش‌دستانه به SolidWorks در پس‌زمینه"""
+        if self.config.prewarm_session:
+            if self.config.execution_mode == "cscript":
+                logger.info("حالت اجرای cscript: پیش‌گرم کردن فقط پردازش SolidWorks را آماده می‌کند و اسکریپت‌ها "
+                            "در پردازش جدید اجرا می‌شوند (برای اجرا روی نشست گرم SW_EXECUTION_MODE=com)")
+            self.session_broker.start()
+    
     def _configure_styles(self):
         """تنظیم استایل‌های مختلف برای ویجت‌ها"""
         style = ttk.Style()
@@ -835,6 +8248,14 @@ class SolidWorksPanel:
                        foreground=self.text_color,
                        font=("Segoe UI", 10))
         
+        # چک‌باکس کارت
+        style.configure("Card.TCheckbutton", 
+                       background=self.card_color, 
+                       foreground=self.text_color,
+                       font=("Segoe UI", 10))
+        style.map("Card.TCheckbutton",
+                 background=[("active", self.card_color)])
+        
         # هدر لیبل
         style.configure("Header.TLabel", 
                        foreground=self.text_color,
@@ -930,7 +8351,10 @@ class SolidWorksPanel:
         return wrapper
     
     def _create_ui(self):
-        """ایجاد اجزای رابط کاربری"""
+        """ایجاد پوسته حداقلی رابط کاربری (نوار بالا، منو، کارت درخواست و نوار وضعیت)
+
+        کارت‌های کد و خروجی و لیست تاریخچه در _run_deferred_step ساخته می‌شوند.
+        """
         # فریم اصلی برای چیدمان
         main_frame = tk.Frame(self.root, bg=self.bg_color)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
@@ -994,61 +8418,21 @@ class SolidWorksPanel:
                                                      width=25)
         self.samples_btn.pack(fill=tk.X, pady=5)
         
+        self.profile_btn = self._create_custom_button(menu_frame, self._profile_button_text(), 
+                                                     self._on_toggle_profiling, 
+                                                     style="sidebar", 
+                                                     width=25)
+        self.profile_btn.pack(fill=tk.X, pady=5)
+        
         # خط جداکننده
         separator2 = ttk.Separator(sidebar_frame, orient='horizontal')
         separator2.pack(fill=tk.X, padx=15, pady=15)
-        
-        # بخش تاریخچه
-        history_label = ttk.Label(sidebar_frame, text="تاریخچه اسکریپت‌ها", style="Sidebar.TLabel")
-        history_label.pack(fill=tk.X, padx=15, pady=5, anchor=tk.W)
-        
-        history_container = ttk.Frame(sidebar_frame, style="Sidebar.TFrame")
-        history_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-        
-        # اسکرول‌بار برای لیست
-        history_scrollbar = ttk.Scrollbar(history_container)
-        history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.history_list = tk.Listbox(history_container, 
-                                      selectmode=tk.SINGLE, 
-                                      bg=self.sidebar_color,
-                                      fg=self.text_color,
-                                      font=("Segoe UI", 9),
-                                      borderwidth=0,
-                                      highlightthickness=0,
-                                      activestyle="none",
-                                      selectbackground=self.accent_color,
-                                      selectforeground="white")
-        self.history_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # اتصال اسکرول‌بار
-        self.history_list.config(yscrollcommand=history_scrollbar.set)
-        history_scrollbar.config(command=self.history_list.yview)
-        
-        self.history_list.bind('<<ListboxSelect>>', self._on_history_select)
-        
-        # دکمه‌های تاریخچه
-        history_btn_frame = ttk.Frame(sidebar_frame, style="Sidebar.TFrame")
-        history_btn_frame.pack(fill=tk.X, padx=10, pady=(5, 15))
-        
-        btn_container = ttk.Frame(history_btn_frame, style="Sidebar.TFrame")
-        btn_container.pack(fill=tk.X, expand=True)
-        
-        self.load_btn = self._create_custom_button(btn_container, "بارگذاری", 
-                                                  self._on_load_history, 
-                                                  style="custom", 
-                                                  width=10)
-        self.load_btn.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
-        
-        self.run_history_btn = self._create_custom_button(btn_container, "اجرا", 
-                                                         self._on_run_history, 
-                                                         style="custom", 
-                                                         width=10)
-        self.run_history_btn.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        self.sidebar_frame = sidebar_frame
         
         # === فریم محتوا (سمت راست) ===
         content_frame = ttk.Frame(main_frame)
         content_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+        self.content_frame = content_frame
         
         # فریم بالایی برای ورود درخواست
         request_card = ttk.Frame(content_frame, style="Card.TFrame")
@@ -1089,6 +8473,88 @@ class SolidWorksPanel:
                                                   self._on_debug_current)
         self.debug_btn.pack(side=tk.LEFT, padx=2)
         
+        # دکمه‌های اجرای دسته‌ای
+        self.add_batch_btn = self._create_custom_button(buttons_frame, "افزودن به صف دسته‌ای", 
+                                                       self._on_add_to_batch)
+        self.add_batch_btn.pack(side=tk.LEFT, padx=2)
+        
+        self.run_batch_btn = self._create_custom_button(buttons_frame, "اجرای دسته‌ای (0)", 
+                                                       self._on_run_batch)
+        self.run_batch_btn.pack(side=tk.LEFT, padx=2)
+        
+        self.sweep_btn = self._create_custom_button(buttons_frame, "جاروب پارامتری", self._on_sweep)
+        self.sweep_btn.pack(side=tk.LEFT, padx=2)
+        
+        self.bulk_btn = self._create_custom_button(buttons_frame, "عملیات گروهی", self._on_bulk)
+        self.bulk_btn.pack(side=tk.LEFT, padx=2)
+        
+        # حالت ویرایش: دستور بعدی به صورت وصله روی اسکریپت فعلی اعمال می‌شود
+        self.edit_mode_var = tk.BooleanVar(value=False)
+        self.edit_mode_check = ttk.Checkbutton(buttons_frame, text="ویرایش اسکریپت فعلی",
+                                               variable=self.edit_mode_var, style="Card.TCheckbutton")
+        self.edit_mode_check.pack(side=tk.RIGHT, padx=2)
+        
+        # === بخش وضعیت ===
+        status_frame = ttk.Frame(self.root, style="Sidebar.TFrame")
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        # وضعیت نشست SolidWorks در سمت راست نوار وضعیت
+        self.session_label = ttk.Label(status_frame, text=self.SESSION_STATE_TEXT["idle"], style="Status.TLabel", anchor=tk.E)
+        self.session_label.pack(side=tk.RIGHT)
+        
+        self.status_bar = ttk.Label(status_frame, text="در حال بارگذاری...", style="Status.TLabel", anchor=tk.W)
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    
+    def _create_history_panel(self):
+        """ایجاد بخش تاریخچه در سایدبار (پس از نمایش پنجره)"""
+        sidebar_frame = self.sidebar_frame
+        
+        # بخش تاریخچه
+        history_label = ttk.Label(sidebar_frame, text="تاریخچه اسکریپت‌ها", style="Sidebar.TLabel")
+        history_label.pack(fill=tk.X, padx=15, pady=5, anchor=tk.W)
+        
+        # لیست مجازی: فقط ردیف‌های قابل مشاهده از فهرست تاریخچه خوانده می‌شوند
+        self.history_view = VirtualHistoryList(sidebar_frame, self.script_generator.history_index,
+                                               bg=self.sidebar_color,
+                                               fg=self.text_color,
+                                               font=("Segoe UI", 9),
+                                               borderwidth=0,
+                                               highlightthickness=0,
+                                               activestyle="none",
+                                               selectbackground=self.accent_color,
+                                               selectforeground="white")
+        self.history_view.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.history_view.bind('<<ListboxSelect>>', self._on_history_select)
+        
+        # دکمه‌های تاریخچه
+        history_btn_frame = ttk.Frame(sidebar_frame, style="Sidebar.TFrame")
+        history_btn_frame.pack(fill=tk.X, padx=10, pady=(5, 15))
+        
+        btn_container = ttk.Frame(history_btn_frame, style="Sidebar.TFrame")
+        btn_container.pack(fill=tk.X, expand=True)
+        
+        self.load_btn = self._create_custom_button(btn_container, "بارگذاری", 
+                                                  self._on_load_history, 
+                                                  style="custom", 
+                                                  width=10)
+        self.load_btn.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        
+        self.run_history_btn = self._create_custom_button(btn_container, "اجرا", 
+                                                         self._on_run_history, 
+                                                         style="custom", 
+                                                         width=10)
+        self.run_history_btn.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        
+        self.trace_history_btn = self._create_custom_button(btn_container, "ردیابی", 
+                                                           self._on_trace_history, 
+                                                           style="custom", 
+                                                           width=10)
+        self.trace_history_btn.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        
+    def _create_script_panel(self):
+        """ایجاد کارت نمایش و ویرایش کد اسکریپت"""
+        content_frame = self.content_frame
+        
         # فریم میانی برای نمایش اسکریپت
         script_card = ttk.Frame(content_frame, style="Card.TFrame")
         script_card.pack(fill=tk.BOTH, expand=True, padx=20, pady=(0, 20))
@@ -1108,6 +8574,10 @@ class SolidWorksPanel:
         
         # رنگ بندی کد
         self._setup_code_highlighting()
+    
+    def _create_output_panel(self):
+        """ایجاد کارت نمایش خروجی اجرا"""
+        content_frame = self.content_frame
         
         # فریم پایینی برای نمایش خروجی
         output_card = ttk.Frame(content_frame, style="Card.TFrame")
@@ -1125,10 +8595,11 @@ class SolidWorksPanel:
                                                    foreground="white")
         self.output_text.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
         self.output_text.config(state=tk.DISABLED)
+        self.output_console = OutputConsole(self.output_text)
         
-        # === بخش وضعیت ===
-        self.status_bar = ttk.Label(self.root, text="آماده", style="Status.TLabel", anchor=tk.W)
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        save_output_btn = self._create_custom_button(output_content, "ذخیره کامل خروجی", 
+                                                   self._on_save_output)
+        save_output_btn.pack(anchor=tk.E, pady=(5, 0))
     
     def _setup_code_highlighting(self):
         """تنظیم هایلایت ساده برای کد VBScript"""
@@ -1143,6 +8614,11 @@ class SolidWorksPanel:
     
     def _highlight_code(self, event=None):
         """هایلایت کردن کد VBScript به صورت ساده"""
+        with self.profiler.stage("highlight"):
+            self._apply_highlighting()
+    
+    def _apply_highlighting(self):
+        """اعمال تگ‌های کلمات کلیدی، توضیحات و رشته‌ها روی متن اسکریپت"""
         # حذف تمام تگ‌های موجود
         for tag in ["keyword", "comment", "string", "function"]:
             self.script_text.tag_remove(tag, "1.0", "end")
@@ -1198,20 +8674,32 @@ class SolidWorksPanel:
         
         # غیرفعال کردن دکمه ارسال
         self.submit_btn.config(state=tk.DISABLED)
-        self.status_bar.config(text="در حال تولید اسکریپت...")
         
-        # اجرای پردازش در ترد جداگانه
-        threading.Thread(target=self._generate_script_thread, args=(query,), daemon=True).start()
+        current_script = self.script_text.get("1.0", tk.END).strip() if self.ui_ready else ""
+        edit = self.edit_mode_var.get() and bool(current_script)
+        with self.tracer.span("ui.submit", new_trace=True, mode="edit" if edit else "generate"):
+            if edit:
+                self.status_bar.config(text="در حال ویرایش اسکریپت فعلی...")
+                threading.Thread(target=self.tracer.wrap(self._edit_script_thread, "thread.edit"),
+                                 args=(current_script, query, self.current_history_path), daemon=True).start()
+                return
+            
+            self.status_bar.config(text="در حال تولید اسکریپت...")
+            
+            # اجرای پردازش در ترد جداگانه
+            threading.Thread(target=self.tracer.wrap(self._generate_script_thread, "thread.generate"),
+                             args=(query,), daemon=True).start()
     
-    def _generate_script_thread(self, query):
+    def _generate_script_thread(self, query, min_tier=0):
         """پردازش درخواست در ترد جداگانه
 
         Args:
             query: متن درخواست کاربر
+            min_tier: حداقل سطح مدل
         """
         try:
             # تولید اسکریپت
-            success, message, script_path = self.script_generator.generate_script(query)
+            success, message, script_path = self.script_generator.generate_script(query, min_tier)
             
             # قرار دادن نتیجه در صف برای پردازش در ترد اصلی
             self.queue.put(("generate_result", success, message, script_path))
@@ -1220,33 +8708,204 @@ class SolidWorksPanel:
             logger.error(f"خطا در تولید اسکریپت: {e}")
             self.queue.put(("generate_result", False, f"خطا: {str(e)}", None))
     
+    def _edit_script_thread(self, script_content, instruction, parent_path):
+        """ویرایش تدریجی اسکریپت فعلی در ترد جداگانه
+
+        Args:
+            script_content: متن فعلی ویرایشگر اسکریپت
+            instruction: دستور پیگیری کاربر
+            parent_path: مسیر ورودی تاریخچه اسکریپت فعلی
+        """
+        try:
+            success, message, script_path = self.script_generator.edit_script(script_content, instruction, parent_path)
+            self.queue.put(("generate_result", success, message, script_path))
+            
+        except Exception as e:
+            logger.error(f"خطا در ویرایش اسکریپت: {e}")
+            self.queue.put(("generate_result", False, f"خطا: {str(e)}", None))
+    
+    def _on_add_to_batch(self):
+        """افزودن درخواست فعلی به صف اجرای دسته‌ای"""
+        query = self.query_entry.get("1.0", tk.END).strip()
+        
+        if not query:
+            messagebox.showwarning("خطا", "لطفاً درخواست خود را وارد کنید.")
+            return
+        
+        self.batch_queue.append(query)
+        self.query_entry.delete("1.0", tk.END)
+        self.run_batch_btn.config(text=f"اجرای دسته‌ای ({len(self.batch_queue)})")
+        self.status_bar.config(text=f"دستور به صف اضافه شد ({len(self.batch_queue)} دستور در صف)")
+    
+    def _on_run_batch(self):
+        """تولید و اجرای همه دستورات صف در یک اسکریپت"""
+        if not self.batch_queue:
+            messagebox.showwarning("خطا", "صف دسته‌ای خالی است.")
+            return
+        
+        queries = list(self.batch_queue)
+        self.batch_queue = []
+        self.run_batch_btn.config(text="اجرای دسته‌ای (0)", state=tk.DISABLED)
+        self.status_bar.config(text=f"در حال تولید اسکریپت دسته‌ای ({len(queries)} دستور)...")
+        
+        with self.tracer.span("ui.run_batch", new_trace=True, steps=len(queries)):
+            threading.Thread(target=self.tracer.wrap(self._batch_thread, "thread.batch"),
+                             args=(queries,), daemon=True).start()
+    
+    def _batch_thread(self, queries):
+        """تولید و اجرای اسکریپت دسته‌ای در ترد جداگانه
+
+        Args:
+            queries: لیست دستورات به ترتیب اجرا
+        """
+        try:
+            success, message, script_path, builder = self.script_generator.generate_batch_script(queries)
+            self.queue.put(("batch_generate_result", success, message, script_path, builder, queries))
+            
+            if success and script_path:
+                success, message, output = self.services.execute(script_path)
+                self.queue.put(("execute_result", success, message, output, script_path))
+                
+        except Exception as e:
+            logger.error(f"خطا در اجرای دسته‌ای: {e}")
+            self.queue.put(("batch_generate_result", False, f"خطا: {str(e)}", None, None, queries))
+    
+    def _on_sweep(self):
+        """ساخت خانواده قطعات از اسکریپت فعلی با بازه پارامترها یا جدول طراحی"""
+        script_content = self.script_text.get("1.0", tk.END).strip()
+        parameters = DesignSweep.extract_parameters(script_content)
+        if not parameters:
+            messagebox.showwarning("خطا", "اسکریپت فعلی پارامتر عددی سطح بالا (Const یا انتساب عددی) ندارد.")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("جاروب پارامتری")
+        dialog.geometry("620x520")
+        dialog.transient(self.root)
+        dialog.config(bg=self.bg_color)
+        
+        main_frame = tk.Frame(dialog, bg=self.bg_color, padx=15, pady=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        def _label(text):
+            tk.Label(main_frame, text=text, anchor=tk.W, justify=tk.LEFT, bg=self.bg_color,
+                     fg=self.text_color, font=("Segoe UI", 10)).pack(fill=tk.X, pady=(8, 2))
+        
+        defaults = ", ".join(f"{name}={DesignSweep._format_value(value)}" for name, value in parameters.items())
+        _label(f"پارامترهای اسکریپت: {defaults}")
+        _label("بازه‌ها (هر خط: نام = شروع:پایان:گام یا نام = a, b, c)")
+        ranges_text = tk.Text(main_frame, height=6, bg=self.sidebar_color, fg=self.text_color,
+                              insertbackground=self.text_color, font=("Consolas", 10), borderwidth=0)
+        ranges_text.pack(fill=tk.BOTH, expand=True)
+        
+        _label("قیدها (هر خط یک عبارت، مثل (outer - bore) / 2 > 2)")
+        constraints_text = tk.Text(main_frame, height=3, bg=self.sidebar_color, fg=self.text_color,
+                                   insertbackground=self.text_color, font=("Consolas", 10), borderwidth=0)
+        constraints_text.pack(fill=tk.X)
+        
+        _label("الگوی نام فایل نسخه‌ها")
+        name_var = tk.StringVar(value="variant_{index:03d}")
+        tk.Entry(main_frame, textvariable=name_var, bg=self.sidebar_color, fg=self.text_color,
+                 insertbackground=self.text_color, borderwidth=0, font=("Consolas", 10)).pack(fill=tk.X)
+        
+        table_var = tk.StringVar(value="")
+        table_label = tk.Label(main_frame, text="جدول طراحی: -", anchor=tk.W, bg=self.bg_color,
+                               fg=self.secondary_text, font=("Segoe UI", 9))
+        table_label.pack(fill=tk.X, pady=(8, 8))
+        
+        def _on_table():
+            path = filedialog.askopenfilename(parent=dialog, title="جدول طراحی",
+                                              filetypes=[("CSV", "*.csv"), ("All files", "*.*")])
+            if path:
+                table_var.set(path)
+                table_label.config(text=f"جدول طراحی: {path}")
+        
+        def _on_build():
+            ranges = {}
+            for line in ranges_text.get("1.0", tk.END).splitlines():
+                if "=" in line:
+                    name, spec = line.split("=", 1)
+                    ranges[name.strip()] = spec.strip()
+            constraints = [line for line in constraints_text.get("1.0", tk.END).splitlines() if line.strip()]
+            success, message, script_path, builder, sweep = self.script_generator.generate_sweep_script(
+                script_content, ranges, table_var.get(), constraints, name_var.get().strip() or "variant_{index:03d}")
+            if not success:
+                messagebox.showerror("خطا در جاروب پارامتری", message, parent=dialog)
+                return
+            dialog.destroy()
+            self.batch_builders[script_path] = builder
+            self.sweeps[script_path] = sweep
+            self._handle_generate_result(True, message, script_path)
+            self.status_bar.config(text=f"{message} در حال اجرا...")
+            with self.tracer.span("ui.run_sweep", new_trace=True, variants=len(sweep.variants)):
+                threading.Thread(target=self.tracer.wrap(self._execute_script_thread, "thread.execute"),
+                                 args=(script_path,), daemon=True).start()
+        
+        buttons = tk.Frame(main_frame, bg=self.bg_color)
+        buttons.pack(fill=tk.X)
+        self._create_custom_button(buttons, "ساخت و اجرا", _on_build, style="primary").pack(side=tk.LEFT, padx=5)
+        self._create_custom_button(buttons, "انتخاب جدول CSV...", _on_table).pack(side=tk.LEFT, padx=5)
+    
+    def _on_bulk(self):
+        """خروجی گرفتن از همه فایل‌های یک پوشه در یک نشست SolidWorks"""
+        source_dir = filedialog.askdirectory(parent=self.root, title="پوشه فایل‌های SolidWorks")
+        if not source_dir:
+            return
+        formats = simpledialog.askstring("عملیات گروهی",
+                                         f"قالب‌های خروجی (جدا شده با ویرگول):\n{', '.join(BulkOperation.FORMATS)}",
+                                         initialvalue="step, pdf", parent=self.root)
+        if not formats:
+            return
+        output_dir = filedialog.askdirectory(parent=self.root, title="پوشه خروجی (انصراف: export در پوشه مبدأ)")
+        try:
+            operation = BulkOperation.create(source_dir, formats.split(","), output_dir or "")
+        except ValueError as e:
+            messagebox.showerror("خطا در عملیات گروهی", str(e))
+            return
+        
+        # فایل‌های ناموفق اجرای قبلی همین عملیات فقط با تأیید کاربر دوباره اجرا می‌شوند
+        failed = sum(1 for item in operation.state["files"] if item["status"] == "failed")
+        retry_failed = failed > 0 and messagebox.askyesno(
+            "عملیات گروهی", f"{failed} فایل در اجرای قبلی ناموفق بود. دوباره اجرا شوند؟", parent=self.root)
+        
+        self.bulk_btn.config(state=tk.DISABLED)
+        self.output_console.clear()
+        self.status_bar.config(text=f"عملیات گروهی: {len(operation.state['files'])} فایل...")
+        threading.Thread(target=self._bulk_thread, args=(operation, retry_failed), daemon=True).start()
+    
+    def _bulk_thread(self, operation, retry_failed=False):
+        """اجرای عملیات گروهی در ترد جداگانه با ارسال پیشرفت هر فایل به کنسول خروجی
+
+        Args:
+            operation: عملیات گروهی ساخته یا بازیابی شده
+            retry_failed: اجرای دوباره فایل‌های ناموفق قبلی
+        """
+        try:
+            summary = operation.run(self.services.execute,
+                                    progress=lambda line: self.queue.put(("bulk_progress", line)),
+                                    retry_failed=retry_failed)
+            self.queue.put(("bulk_result", True, summary))
+        except Exception as e:
+            logger.error(f"خطا در عملیات گروهی: {e}")
+            self.queue.put(("bulk_result", False, {"message": str(e)}))
+    
     def _process_queue(self):
         """پردازش صف پیام‌ها از تردهای دیگر"""
+        # تا ساخته شدن کامل رابط کاربری پیام‌ها در صف می‌مانند
+        if not self.ui_ready:
+            self.root.after(100, self._process_queue)
+            return
+        
         try:
             while True:
-                message = self.queue.get_nowait()
-                message_type = message[0]
-                
-                if message_type == "generate_result":
-                    success, script, script_path = message[1], message[2], message[3]
-                    self._handle_generate_result(success, script, script_path)
-                
-                elif message_type == "execute_result":
-                    success, result_message, output, script_path = message[1], message[2], message[3], message[4]
-                    self._handle_execute_result(success, result_message, output, script_path)
-                
-                elif message_type == "debug_result":
-                    success, fixed_script, explanation, script_path = message[1], message[2], message[3], message[4]
-                    self._handle_debug_result(success, fixed_script, explanation, script_path)
-                
-                elif message_type == "api_test_result":
-                    success, message_text, result_label = message[1], message[2], message[3]
-                    self._handle_api_test_result(success, message_text, result_label)
-                
-                elif message_type == "guidance_result":
-                    success, answer, answer_widget, status_label = message[1], message[2], message[3], message[4]
-                    self._handle_guidance_result(success, answer, answer_widget, status_label)
-                
+                message, parent, put_ns = self.queue.get_traced(block=False)
+                if parent is None:
+                    self._dispatch_message(message)
+                else:
+                    # فاصله قرار گرفتن پیام در صف تا برداشتن آن (شامل تأخیر بررسی دوره‌ای صف)
+                    self.tracer.record("ui.queue_wait", put_ns, time.time_ns(), parent=parent)
+                    with self.tracer.span(f"ui.handle.{message[0]}", parent=parent):
+                        self._dispatch_message(message)
                 self.queue.task_done()
                 
         except queue.Empty:
@@ -1255,6 +8914,50 @@ class SolidWorksPanel:
         # دوباره پردازش را برنامه‌ریزی کن
         self.root.after(100, self._process_queue)
     
+    def _dispatch_message(self, message):
+        """فراخوانی پردازشگر مناسب یک پیام صف در ترد اصلی"""
+        message_type = message[0]
+        
+        if message_type == "generate_result":
+            success, script, script_path = message[1], message[2], message[3]
+            self._handle_generate_result(success, script, script_path)
+        
+        elif message_type == "execute_result":
+            success, result_message, output, script_path = message[1], message[2], message[3], message[4]
+            self._handle_execute_result(success, result_message, output, script_path)
+        
+        elif message_type == "debug_result":
+            success, fixed_script, explanation, script_path = message[1], message[2], message[3], message[4]
+            self._handle_debug_result(success, fixed_script, explanation, script_path)
+        
+        elif message_type == "api_test_result":
+            success, message_text, result_label = message[1], message[2], message[3]
+            self._handle_api_test_result(success, message_text, result_label)
+        
+        elif message_type == "guidance_result":
+            success, answer, answer_widget, status_label = message[1], message[2], message[3], message[4]
+            self._handle_guidance_result(success, answer, answer_widget, status_label)
+        
+        elif message_type == "bulk_progress":
+            self.output_console.append(message[1])
+        
+        elif message_type == "bulk_result":
+            self.bulk_btn.config(state=tk.NORMAL)
+            summary = message[2]
+            if message[1]:
+                self.status_bar.config(text=f"عملیات گروهی: {summary['done']} موفق، {summary['failed']} ناموفق "
+                                            f"از {summary['total']} ({summary['elapsed_s']}s) - {summary['manifest']}")
+            else:
+                self.status_bar.config(text=f"خطا در عملیات گروهی: {summary['message']}")
+        
+        elif message_type == "batch_generate_result":
+            success, result_message, script_path, builder, queries = message[1], message[2], message[3], message[4], message[5]
+            self._handle_batch_generate_result(success, result_message, script_path, builder, queries)
+        
+        elif message_type == "session_state":
+            state, detail = message[1], message[2]
+            self._handle_session_state(state, detail)
+    
     def _on_run_current(self):
         """اجرای اسکریپت فعلی"""
         script_path = os.path.join(SCRIPTS_DIR, "current_script.vbs")
@@ -1264,7 +8967,9 @@ class SolidWorksPanel:
             return
         
         # اجرا در ترد جداگانه
-        threading.Thread(target=self._execute_script_thread, args=(script_path,), daemon=True).start()
+        with self.tracer.span("ui.run", new_trace=True):
+            threading.Thread(target=self.tracer.wrap(self._execute_script_thread, "thread.execute"),
+                             args=(script_path,), daemon=True).start()
         
         self.status_bar.config(text="در حال اجرای اسکریپت...")
     
@@ -1276,7 +8981,7 @@ class SolidWorksPanel:
         """
         try:
             # اجرای اسکریپت
-            success, message, output = self.script_generator.execute_script(script_path)
+            success, message, output = self.services.execute(script_path)
             
             # قرار دادن نتیجه در صف
             self.queue.put(("execute_result", success, message, output, script_path))
@@ -1298,7 +9003,9 @@ class SolidWorksPanel:
         
         # اجرای اسکریپت برای دریافت خطا
         self.status_bar.config(text="در حال اجرای اسکریپت برای شناسایی خطا...")
-        threading.Thread(target=self._execute_script_thread, args=(script_path,), daemon=True).start()
+        with self.tracer.span("ui.debug", new_trace=True):
+            threading.Thread(target=self.tracer.wrap(self._execute_script_thread, "thread.execute"),
+                             args=(script_path,), daemon=True).start()
     
     def _debug_script_thread(self, script_path, error_message):
         """دیباگ اسکریپت در ترد جداگانه
@@ -1330,11 +9037,31 @@ class SolidWorksPanel:
             fixed_script: اسکریپت اصلاح شده
             explanation: توضیحات خطا و اصلاحات
         """
+        if self._debug_dialog is None or not self._debug_dialog.winfo_exists():
+            self._debug_dialog = self._build_debug_dialog()
+        
+        debug_dialog = self._debug_dialog
+        debug_dialog.script_path = script_path
+        
+        debug_dialog.explanation_text.delete("1.0", tk.END)
+        debug_dialog.explanation_text.insert("1.0", explanation)
+        debug_dialog.code_text.delete("1.0", tk.END)
+        debug_dialog.code_text.insert("1.0", fixed_script)
+        
+        self._show_cached_dialog(debug_dialog)
+    
+    def _build_debug_dialog(self):
+        """ساخت دیالوگ نتیجه دیباگ (یک بار؛ در نمایش‌های بعدی فقط محتوا عوض می‌شود)
+
+        Returns:
+            پنجره Toplevel با ویجت‌های explanation_text و code_text
+        """
         debug_dialog = tk.Toplevel(self.root)
         debug_dialog.title("نتیجه دیباگ اسکریپت")
         debug_dialog.geometry("900x700")
         debug_dialog.transient(self.root)
-        debug_dialog.grab_set()
+        debug_dialog.protocol("WM_DELETE_WINDOW", lambda: self._hide_dialog(debug_dialog))
+        debug_dialog.script_path = None
         
         # تنظیم رنگ پس‌زمینه
         debug_dialog.config(bg=self.bg_color)
@@ -1354,7 +9081,7 @@ class SolidWorksPanel:
                                                    background="#1E2A4A",
                                                    foreground="white")
         explanation_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        explanation_text.insert("1.0", explanation)
+        debug_dialog.explanation_text = explanation_text
         
         # بخش کد اصلاح شده
         code_frame = tk.LabelFrame(main_frame, text="کد اصلاح شده", 
@@ -1367,20 +9094,42 @@ class SolidWorksPanel:
                                             background="#1E2A4A",
                                             foreground="white")
         code_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        code_text.insert("1.0", fixed_script)
+        debug_dialog.code_text = code_text
         
         # فریم دکمه‌ها
         button_frame = tk.Frame(main_frame, bg=self.bg_color)
         button_frame.pack(fill=tk.X, pady=(0, 10))
         
         apply_btn = self._create_custom_button(button_frame, "اعمال تغییرات", 
-                                             lambda: self._apply_debug_changes(debug_dialog, script_path, code_text.get("1.0", tk.END)),
+                                             lambda: self._apply_debug_changes(debug_dialog, debug_dialog.script_path, code_text.get("1.0", tk.END)),
                                              style="primary")
         apply_btn.pack(side=tk.LEFT, padx=5)
         
         cancel_btn = self._create_custom_button(button_frame, "انصراف", 
-                                              lambda: debug_dialog.destroy())
+                                              lambda: self._hide_dialog(debug_dialog))
         cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        return debug_dialog
+    
+    def _show_cached_dialog(self, dialog):
+        """نمایش دوباره یک دیالوگ ذخیره شده به صورت مودال
+
+        Args:
+            dialog: پنجره Toplevel ساخته شده قبلی
+        """
+        dialog.deiconify()
+        dialog.lift()
+        dialog.grab_set()
+        dialog.focus_set()
+    
+    def _hide_dialog(self, dialog):
+        """پنهان کردن دیالوگ به جای حذف آن تا دفعه بعد دوباره استفاده شود
+
+        Args:
+            dialog: پنجره Toplevel
+        """
+        dialog.grab_release()
+        dialog.withdraw()
     
     def _apply_debug_changes(self, dialog, script_path, fixed_script):
         """اعمال تغییرات دیباگ شده به اسکریپت
@@ -1399,9 +9148,11 @@ class SolidWorksPanel:
             self.script_text.delete("1.0", tk.END)
             self.script_text.insert("1.0", fixed_script)
             self._highlight_code()
+            if os.path.basename(script_path) == "current_script.vbs":
+                self.current_history_path = None
             
             # بستن دیالوگ
-            dialog.destroy()
+            self._hide_dialog(dialog)
             
             # نمایش پیام موفقیت
             self.status_bar.config(text="اسکریپت با موفقیت اصلاح شد.")
@@ -1414,35 +9165,80 @@ class SolidWorksPanel:
             messagebox.showerror("خطا", f"خطا در اعمال تغییرات: {str(e)}")
     
     def _update_history_list(self):
-        """بروزرسانی لیست تاریخچه اسکریپت‌ها"""
+        """بروزرسانی ردیف‌های قابل مشاهده لیست تاریخچه"""
         try:
-            # دریافت لیست اسکریپت‌ها
-            script_files = glob.glob(os.path.join(HISTORY_DIR, "sw_script_*.vbs"))
-            script_files.sort(reverse=True)  # جدیدترین در بالا
-            
-            # پاک کردن لیست قبلی
-            self.history_list.delete(0, tk.END)
-            
-            # افزودن اسکریپت‌ها به لیست
-            self.history_paths = []  # ذخیره مسیرها در یک لیست جداگانه
-            
-            for script_path in script_files:
-                filename = os.path.basename(script_path)
-                # استخراج تاریخ و زمان از نام فایل
-                date_part = filename.replace("sw_script_", "").replace(".vbs", "")
-                try:
-                    date_obj = datetime.datetime.strptime(date_part, "%Y%m%d_%H%M%S")
-                    display_name = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    display_name = filename
-                
-                self.history_list.insert(tk.END, display_name)
-                # ذخیره مسیر کامل در لیست جداگانه
-                self.history_paths.append(script_path)
-            
+            with self.profiler.stage("history"):
+                self.history_view.refresh()
         except Exception as e:
             logger.error(f"خطا در بروزرسانی لیست تاریخچه: {e}")
     
+    def _sync_history(self):
+        """هماهنگ‌سازی فهرست تاریخچه با پوشه history و نمایش آن"""
+        try:
+            with self.profiler.stage("history"):
+                self.script_generator.history_index.sync()
+        except Exception as e:
+            logger.error(f"خطا در هماهنگ‌سازی فهرست تاریخچه: {e}")
+        self._update_history_list()
+    
+    def _is_first_run(self, script_path, entry) -> bool:
+        """آیا این اجرا اولین اجرای اسکریپت تازه تولید شده است و کاربر آن را ویرایش نکرده
+
+        Args:
+            script_path: مسیر اسکریپت اجرا شده
+            entry: ورودی تاریخچه مربوط (خروجی _record_execution)
+        """
+        fresh = self._fresh_script_path
+        if entry is None or fresh is None or entry["path"] != fresh:
+            return False
+        self._fresh_script_path = None
+        if os.path.abspath(script_path) == os.path.abspath(fresh):
+            return True
+        try:
+            with open(script_path, "r", encoding="utf-8") as f:
+                current = f.read()
+            with open(fresh, "r", encoding="utf-8") as f:
+                return current == f.read()
+        except OSError:
+            return False
+    
+    def _record_execution(self, script_path, success):
+        """ثبت نتیجه اجرا در فهرست تاریخچه و آمار مسیریابی مدل
+
+        Args:
+            script_path: مسیر اسکریپت اجرا شده (اسکریپت فعلی یا فایل تاریخچه)
+            success: وضعیت موفقیت اجرا
+
+        Returns:
+            ورودی تاریخچه مربوط یا None
+        """
+        if os.path.basename(script_path) == "current_script.vbs":
+            script_path = self.current_history_path
+        if not script_path:
+            return None
+        try:
+            entry = self.script_generator.record_execution(script_path, success)
+            if entry is not None:
+                self._update_history_list()
+            return entry
+        except Exception as e:
+            logger.error(f"خطا در ثبت نتیجه اجرا در تاریخچه: {e}")
+            return None
+    
+    def _on_save_output(self):
+        """ذخیره خروجی کامل آخرین اجرا (شامل خطوط حذف شده از نمایش) در فایل"""
+        path = filedialog.asksaveasfilename(parent=self.root, title="ذخیره کامل خروجی",
+                                            defaultextension=".log",
+                                            filetypes=[("Log files", "*.log"), ("Text files", "*.txt"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            line_count = self.output_console.save_full_log(path)
+            self.status_bar.config(text=f"خروجی کامل ({line_count} خط) ذخیره شد: {path}")
+        except Exception as e:
+            logger.error(f"خطا در ذخیره خروجی: {e}")
+            messagebox.showerror("خطا", f"خطا در ذخیره خروجی: {str(e)}")
+    
     def _on_history_select(self, event):
         """انتخاب یک اسکریپت از لیست تاریخچه"""
         # هیچ عملیاتی انجام نمی‌شود، فقط انتخاب
@@ -1450,15 +9246,14 @@ class SolidWorksPanel:
     
     def _on_load_history(self):
         """بارگذاری اسکریپت انتخابی از تاریخچه"""
-        selected_indices = self.history_list.curselection()
+        entry = self.history_view.selected_entry()
         
-        if not selected_indices:
+        if not entry:
             messagebox.showwarning("خطا", "لطفاً یک اسکریپت را از لیست انتخاب کنید.")
             return
         
         # دریافت مسیر اسکریپت انتخابی
-        idx = selected_indices[0]
-        script_path = self.history_paths[idx]
+        script_path = entry["path"]
         
         try:
             # نمایش محتوای اسکریپت
@@ -1471,6 +9266,7 @@ class SolidWorksPanel:
             # کپی به اسکریپت فعلی
             current_script_path = os.path.join(SCRIPTS_DIR, "current_script.vbs")
             shutil.copy2(script_path, current_script_path)
+            self.current_history_path = script_path
             
             self.status_bar.config(text=f"اسکریپت بارگذاری شد: {os.path.basename(script_path)}")
             
@@ -1480,46 +9276,179 @@ class SolidWorksPanel:
     
     def _on_run_history(self):
         """اجرای اسکریپت انتخابی از تاریخچه"""
-        selected_indices = self.history_list.curselection()
+        entry = self.history_view.selected_entry()
         
-        if not selected_indices:
+        if not entry:
             messagebox.showwarning("خطا", "لطفاً یک اسکریپت را از لیست انتخاب کنید.")
             return
         
         # دریافت مسیر اسکریپت انتخابی
-        idx = selected_indices[0]
-        script_path = self.history_paths[idx]
+        script_path = entry["path"]
         
         # اجرای اسکریپت
-        threading.Thread(target=self._execute_script_thread, args=(script_path,), daemon=True).start()
+        with self.tracer.span("ui.run", new_trace=True, source="history"):
+            threading.Thread(target=self.tracer.wrap(self._execute_script_thread, "thread.execute"),
+                             args=(script_path,), daemon=True).start()
         
         self.status_bar.config(text="در حال اجرای اسکریپت...")
 
+    def _on_trace_history(self):
+        """نمایش آبشاری بازه‌های زمانی تولید و اجراهای اسکریپت انتخابی از تاریخچه"""
+        entry = self.history_view.selected_entry()
+        
+        if not entry:
+            messagebox.showwarning("خطا", "لطفاً یک اسکریپت را از لیست انتخاب کنید.")
+            return
+        
+        trace_ids = HistoryIndex.trace_ids(entry)
+        spans = self.tracer.load(trace_ids) if trace_ids else []
+        if not spans:
+            messagebox.showinfo("ردیابی", "برای این ورودی ردیابی ثبت نشده است.")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"ردیابی - {os.path.basename(entry['path'])}")
+        dialog.geometry("960x520")
+        dialog.transient(self.root)
+        dialog.config(bg=self.bg_color)
+        
+        detail_label = tk.Label(dialog, text="برای دیدن جزئیات روی یک بازه کلیک کنید", anchor=tk.W, justify=tk.LEFT,
+                                bg=self.bg_color, fg=self.secondary_text, font=("Segoe UI", 9), wraplength=920)
+        detail_label.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 10))
+        
+        canvas = tk.Canvas(dialog, bg=self.sidebar_color, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(dialog, orient=tk.VERTICAL, command=canvas.yview)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
+        canvas.pack(fill=tk.BOTH, expand=True, padx=(10, 0), pady=10)
+        
+        colors = {"ui": self.accent_color, "llm": self.button_bg, "execute": "#2ECC71", "subprocess": "#27AE60",
+                  "history": "#F39C12", "generate": "#3498DB", "debug": "#3498DB"}
+        label_width, bar_left, bar_width, row_height = 300, 310, 600, 20
+        
+        def _show_detail(span):
+            attributes = ", ".join(f"{key}={value}" for key, value in span["attributes"].items())
+            detail_label.config(text=f"{span['name']}: {(span['end'] - span['start']) / 1e6:.1f} ms  {attributes}")
+        
+        by_trace = collections.defaultdict(list)
+        for span in spans:
+            by_trace[span["traceId"]].append(span)
+        y = 10
+        for trace_id, trace_spans in sorted(by_trace.items(), key=lambda item: min(s["start"] for s in item[1])):
+            begin = min(s["start"] for s in trace_spans)
+            total = max(1, max(s["end"] for s in trace_spans) - begin)
+            started = datetime.datetime.fromtimestamp(begin / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+            canvas.create_text(10, y, anchor=tk.NW, fill=self.text_color, font=("Segoe UI", 10, "bold"),
+                               text=f"{started}  -  {total / 1e6:.1f} ms  ({trace_id[:8]})")
+            y += row_height + 4
+            for index, (depth, span) in enumerate(Tracer.waterfall_rows(trace_spans)):
+                tag = f"span_{trace_id}_{index}"
+                x0 = bar_left + (span["start"] - begin) * bar_width / total
+                x1 = max(x0 + 2, bar_left + (span["end"] - begin) * bar_width / total)
+                color = colors.get(span["name"].split(".")[0], self.secondary_text)
+                canvas.create_text(10 + depth * 12, y, anchor=tk.NW, fill=self.text_color, font=("Consolas", 9),
+                                   text=span["name"][:label_width // 8], tags=(tag,))
+                canvas.create_rectangle(x0, y + 2, x1, y + row_height - 4, fill=color, tags=(tag,),
+                                        outline="#FF5555" if span["status"] == Tracer.STATUS_ERROR else color)
+                canvas.create_text(x1 + 4, y + 1, anchor=tk.NW, fill=self.secondary_text, font=("Consolas", 8),
+                                   text=f"{(span['end'] - span['start']) / 1e6:.1f} ms", tags=(tag,))
+                canvas.tag_bind(tag, "<Button-1>", lambda event, span=span: _show_detail(span))
+                y += row_height
+            y += row_height
+        canvas.configure(scrollregion=(0, 0, bar_left + bar_width + 80, y))
+    
     def _on_use_sample(self):
-        """استفاده از اسکریپت نمونه"""
-        sample_script_path = os.path.join(SCRIPTS_DIR, "create_simple_part.vbs")
+        """انتخاب و استفاده از یکی از قالب‌های آماده"""
+        templates = self.template_registry.templates()
+        
+        if not templates:
+            messagebox.showwarning("خطا", "هیچ قالب اسکریپتی یافت نشد.")
+            return
+        
+        chooser = tk.Toplevel(self.root)
+        chooser.title("قالب‌های آماده")
+        chooser.geometry("600x400")
+        chooser.transient(self.root)
+        chooser.config(bg=self.bg_color)
+        
+        main_frame = tk.Frame(chooser, bg=self.bg_color, padx=15, pady=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        template_list = tk.Listbox(main_frame, 
+                                   selectmode=tk.SINGLE,
+                                   bg=self.sidebar_color,
+                                   fg=self.text_color,
+                                   font=("Segoe UI", 10),
+                                   borderwidth=0,
+                                   highlightthickness=0,
+                                   activestyle="none",
+                                   selectbackground=self.accent_color,
+                                   selectforeground="white",
+                                   height=8)
+        template_list.pack(fill=tk.BOTH, expand=True)
+        for template in templates:
+            template_list.insert(tk.END, template.name)
+        
+        details_label = tk.Label(main_frame, text="", anchor=tk.W, justify=tk.LEFT, wraplength=560,
+                                 bg=self.bg_color, fg=self.secondary_text, font=("Segoe UI", 9))
+        details_label.pack(fill=tk.X, pady=(10, 10))
+        
+        def _on_select(event=None):
+            selection = template_list.curselection()
+            if not selection:
+                return
+            template = templates[selection[0]]
+            params = ", ".join(
+                f"{p['name']}={p['default']}" if p["default"] else p["name"] for p in template.parameters
+            )
+            details_label.config(text=f"{template.description}\nپارامترها: {params or '-'}")
+        
+        def _on_load(event=None):
+            selection = template_list.curselection()
+            if not selection:
+                return
+            self._load_template(templates[selection[0]].name)
+            chooser.destroy()
+        
+        template_list.bind('<<ListboxSelect>>', _on_select)
+        template_list.bind('<Double-Button-1>', _on_load)
         
-        if not os.path.exists(sample_script_path):
-            messagebox.showwarning("خطا", "فایل اسکریپت نمونه یافت نشد.")
+        # انتخاب پیش‌فرض: قالب ساخت قطعه ساده
+        default_names = [template.name for template in templates]
+        default_index = default_names.index("create_simple_part.vbs") if "create_simple_part.vbs" in default_names else 0
+        template_list.selection_set(default_index)
+        _on_select()
+        
+        load_btn = self._create_custom_button(main_frame, "بارگذاری قالب", _on_load, style="primary")
+        load_btn.pack(side=tk.LEFT, padx=5)
+    
+    def _load_template(self, name):
+        """نمایش قالب از حافظه و قرار دادن آن به عنوان اسکریپت فعلی
+
+        Args:
+            name: نام فایل قالب
+        """
+        template = self.template_registry.get(name)
+        
+        if template is None:
+            messagebox.showwarning("خطا", f"قالب یافت نشد: {name}")
             return
         
         try:
-            # نمایش محتوای اسکریپت
-            with open(sample_script_path, "r", encoding='utf-8') as f:
-                script_content = f.read()
-            
             self.script_text.delete("1.0", tk.END)
-            self.script_text.insert("1.0", script_content)
+            self.script_text.insert("1.0", template.content)
             
-            # کپی به اسکریپت فعلی
+            # نوشتن به عنوان اسکریپت فعلی برای اجرا
             current_script_path = os.path.join(SCRIPTS_DIR, "current_script.vbs")
-            shutil.copy2(sample_script_path, current_script_path)
+            with open(current_script_path, "w", encoding='utf-8') as f:
+                f.write(template.content)
+            self.current_history_path = None
             
-            self.status_bar.config(text=f"اسکریپت نمونه بارگذاری شد")
+            self.status_bar.config(text=f"قالب بارگذاری شد: {name}")
             
         except Exception as e:
-            logger.error(f"خطا در بارگذاری اسکریپت نمونه: {e}")
-            messagebox.showerror("خطا", f"خطا در بارگذاری اسکریپت نمونه: {str(e)}")
+            logger.error(f"خطا در بارگذاری قالب: {e}")
+            messagebox.showerror("خطا", f"خطا در بارگذاری قالب: {str(e)}")
 
     def _on_api_settings(self):
         """نمایش دیالوگ تنظیمات API"""
@@ -1536,6 +9465,10 @@ class SolidWorksPanel:
             self.script_generator.api_key = result["api_key"]
             self.script_generator.api_url = result["base_url"]
             self.script_generator.api_model = result["api_model"]
+            if "model_tiers" in result:
+                # نقطه پایانی در مقایسه تغییر کرده و سطوح مدل با نام‌های آن بازنویسی شده‌اند
+                self.config.model_tiers = result["model_tiers"]
+            self.script_generator.router.set_tiers(self.config.model_tiers or [result["api_model"]])
             
             # بروزرسانی هدرها
             self.script_generator.headers = {
@@ -1546,19 +9479,21 @@ class SolidWorksPanel:
             
             # ذخیره تنظیمات در فایل .env
             try:
-                self._save_api_settings(result["api_key"], result["base_url"], result["api_model"])
+                self._save_api_settings(result["api_key"], result["base_url"], result["api_model"],
+                                        result.get("model_tiers"))
                 self.status_bar.config(text="تنظیمات API با موفقیت ذخیره شد.")
             except Exception as e:
                 logger.error(f"خطا در ذخیره تنظیمات API: {e}")
                 messagebox.showerror("خطا", f"خطا در ذخیره تنظیمات API: {str(e)}")
     
-    def _save_api_settings(self, api_key, base_url, api_model):
+    def _save_api_settings(self, api_key, base_url, api_model, model_tiers=None):
         """ذخیره تنظیمات API در فایل .env
         
         Args:
             api_key: کلید API جدید
             base_url: آدرس API جدید
             api_model: مدل هوش مصنوعی جدید
+            model_tiers: سطوح مدل جدید (None یعنی بدون تغییر)
         """
         env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
         
@@ -1573,6 +9508,7 @@ class SolidWorksPanel:
             api_key_found = False
             base_url_found = False
             api_model_found = False
+            tiers_found = model_tiers is None
             
             for i, line in enumerate(env_lines):
                 if line.startswith('OPENAI_API_KEY='):
@@ -1584,6 +9520,9 @@ class SolidWorksPanel:
                 elif line.startswith('OPENAI_MODEL='):
                     env_lines[i] = f'OPENAI_MODEL="{api_model}"\n'
                     api_model_found = True
+                elif line.startswith('SW_MODEL_TIERS=') and model_tiers is not None:
+                    env_lines[i] = f'SW_MODEL_TIERS="{",".join(model_tiers)}"\n'
+                    tiers_found = True
             
             # افزودن تنظیمات جدید اگر قبلاً وجود نداشته باشند
             if not api_key_found:
@@ -1592,6 +9531,8 @@ class SolidWorksPanel:
                 env_lines.append(f'OPENAI_BASE_URL="{base_url}"\n')
             if not api_model_found:
                 env_lines.append(f'OPENAI_MODEL="{api_model}"\n')
+            if not tiers_found:
+                env_lines.append(f'SW_MODEL_TIERS="{",".join(model_tiers)}"\n')
             
             # نوشتن در فایل
             with open(env_path, 'w', encoding='utf-8') as f:
@@ -1638,6 +9579,7 @@ class SolidWorksPanel:
             script: محتوای اسکریپت تولید شده
             script_path: مسیر فایل اسکریپت تولید شده
         """
+        self.submit_btn.config(state=tk.NORMAL)
         if success and script_path:
             # نمایش اسکریپت در بخش متن
             with open(script_path, "r", encoding='utf-8') as f:
@@ -1645,15 +9587,43 @@ class SolidWorksPanel:
             
             self.script_text.delete("1.0", tk.END)
             self.script_text.insert("1.0", script_content)
+            self.current_history_path = script_path
+            self._fresh_script_path = script_path
             
             # بروزرسانی لیست تاریخچه
             self._update_history_list()
             
-            self.status_bar.config(text=f"اسکریپت با موفقیت ایجاد شد: {os.path.basename(script_path)}")
+            # دستور بعدی به طور پیش‌فرض اسکریپت جدید را ویرایش می‌کند
+            self.edit_mode_var.set(True)
+            
+            self.status_bar.config(text=f"{script.rstrip('.')}: {os.path.basename(script_path)}")
         else:
             self.status_bar.config(text=f"خطا در تولید اسکریپت: {script or 'خطا در درخواست API'}")
             messagebox.showerror("خطا در تولید اسکریپت", script or "خطا در درخواست API")
     
+    def _handle_batch_generate_result(self, success, result_message, script_path, builder, queries):
+        """پردازش نتیجه تولید اسکریپت دسته‌ای
+
+        Args:
+            success: وضعیت موفقیت تولید
+            result_message: پیام نتیجه
+            script_path: مسیر اسکریپت ادغام شده
+            builder: سازنده دسته برای نگاشت خروجی به مراحل
+            queries: دستورات دسته
+        """
+        self.run_batch_btn.config(state=tk.NORMAL)
+        
+        if success and script_path:
+            self.batch_builders[script_path] = builder
+            self._handle_generate_result(True, result_message, script_path)
+            self.status_bar.config(text=f"{result_message} در حال اجرا...")
+        else:
+            # بازگرداندن دستورات به صف تا کاربر بتواند دوباره تلاش کند
+            self.batch_queue = list(queries) + self.batch_queue
+            self.run_batch_btn.config(text=f"اجرای دسته‌ای ({len(self.batch_queue)})")
+            self.status_bar.config(text=f"خطا در تولید اسکریپت دسته‌ای: {result_message}")
+            messagebox.showerror("خطا در اجرای دسته‌ای", result_message)
+    
     def _handle_execute_result(self, success, result_message, output, script_path):
         """پردازش نتیجه درخواست اجرای اسکریپت
 
@@ -1663,18 +9633,55 @@ class SolidWorksPanel:
             output: خروجی اسکریپت
             script_path: مسیر فایل اسکریپت
         """
+        # ثبت فایل‌های ذخیره شده جاروب در مانیفست
+        sweep_note = ""
+        sweep = self.sweeps.get(script_path)
+        if sweep is not None:
+            counts = sweep.record_results(output)
+            sweep_note = f" (نسخه‌های ذخیره شده: {counts.get('saved', 0)} از {len(sweep.variants)})"
+        
+        # نمایش خروجی اسکریپت‌های دسته‌ای به تفکیک مراحل
+        builder = self.batch_builders.get(script_path)
+        if builder is not None:
+            output = builder.format_report(output)
+        
+        self.output_console.set_text(output or result_message)
+        entry = self._record_execution(script_path, success)
+        first_run = self._is_first_run(script_path, entry)
+        
+        # اجرای درخواست شده از دکمه دیباگ: خطا زیر همان trace برای دیباگر فرستاده می‌شود
+        if self._debug_requested:
+            self._debug_requested = False
+            if not success:
+                self.status_bar.config(text="در حال دیباگ اسکریپت...")
+                threading.Thread(target=self.tracer.wrap(self._debug_script_thread, "thread.debug"),
+                                 args=(script_path, output or result_message), daemon=True).start()
+                return
+        
+        # پیشنهاد تولید دوباره با مدل قوی‌تر فقط برای اولین اجرای اسکریپت تازه تولید شده و ویرایش نشده
+        # (مگر اینکه SolidWorks در دسترس نباشد)؛ کاربر می‌تواند آن را رد کند
+        if (not success and first_run and self.session_broker.state != SolidWorksSessionBroker.STATE_FAILED
+                and self._auto_escalations[entry["query"]] < self.MAX_AUTO_ESCALATIONS):
+            next_tier = self.script_generator.next_tier(entry)
+            if next_tier is not None:
+                model = self.script_generator.router.tiers[next_tier]
+                self.status_bar.config(text=f"خطا در اجرای اسکریپت: {result_message}{sweep_note}")
+                if messagebox.askyesno("خطا در اجرای اسکریپت",
+                                       f"{result_message}\n\nاسکریپت با مدل قوی‌تر ({model}) دوباره تولید شود؟"):
+                    self._auto_escalations[entry["query"]] += 1
+                    self.status_bar.config(text=f"خطا در اجرا؛ تولید دوباره اسکریپت با مدل {model}...")
+                    threading.Thread(target=self.tracer.wrap(self._generate_script_thread, "thread.generate"),
+                                     args=(entry["query"], next_tier), daemon=True).start()
+                else:
+                    self.session_broker.request_check()
+                return
+        
         if success:
-            self.output_text.config(state=tk.NORMAL)
-            self.output_text.delete("1.0", tk.END)
-            self.output_text.insert("1.0", output or result_message)
-            self.output_text.config(state=tk.DISABLED)
-            self.status_bar.config(text="اسکریپت با موفقیت اجرا شد.")
+            self.status_bar.config(text=f"اسکریپت با موفقیت اجرا شد.{sweep_note}")
         else:
-            self.output_text.config(state=tk.NORMAL)
-            self.output_text.delete("1.0", tk.END)
-            self.output_text.insert("1.0", output or result_message)
-            self.output_text.config(state=tk.DISABLED)
-            self.status_bar.config(text=f"خطا در اجرای اسکریپت: {result_message}")
+            self.status_bar.config(text=f"خطا در اجرای اسکریپت: {result_message}{sweep_note}")
+            # بررسی فوری نشست؛ ممکن است SolidWorks بسته شده باشد
+            self.session_broker.request_check()
             messagebox.showerror("خطا در اجرای اسکریپت", result_message)
     
     def _handle_debug_result(self, success, fixed_script, explanation, script_path):
@@ -1726,13 +9733,35 @@ class SolidWorksPanel:
             answer_widget.insert("1.0", f"خطا در دریافت پاسخ: {answer}")
             status_label.config(text="خطا در دریافت پاسخ", fg="red")
     
+    def _handle_session_state(self, state, detail):
+        """نمایش وضعیت نشست SolidWorks در نوار وضعیت
+
+        Args:
+            state: وضعیت جدید نشست
+            detail: توضیحات (پیام خطا در صورت شکست)
+        """
+        self.session_label.config(text=self.SESSION_STATE_TEXT.get(state, state))
+        if detail:
+            logger.info(f"وضعیت نشست SolidWorks: {state} - {detail}")
+    
     def _show_debug_guidance(self):
-        """نمایش دیالوگ راهنمایی دیباگ و طراحی اسکریپت"""
+        """نمایش دیالوگ راهنمایی دیباگ و طراحی اسکریپت (ساخته شده در اولین بار و ذخیره برای دفعات بعد)"""
+        if self._guidance_dialog is None or not self._guidance_dialog.winfo_exists():
+            self._guidance_dialog = self._build_debug_guidance()
+        
+        self._show_cached_dialog(self._guidance_dialog)
+    
+    def _build_debug_guidance(self):
+        """ساخت دیالوگ راهنمایی دیباگ
+
+        Returns:
+            پنجره Toplevel دیالوگ راهنما
+        """
         guidance_dialog = tk.Toplevel(self.root)
         guidance_dialog.title("راهنمای دیباگ و طراحی اسکریپت")
         guidance_dialog.geometry("900x700")
         guidance_dialog.transient(self.root)
-        guidance_dialog.grab_set()
+        guidance_dialog.protocol("WM_DELETE_WINDOW", lambda: self._hide_dialog(guidance_dialog))
         
         # تنظیم رنگ پس‌زمینه
         guidance_dialog.config(bg=self.bg_color)
@@ -1789,7 +9818,7 @@ class SolidWorksPanel:
         button_frame.pack(fill=tk.X, pady=(0, 10))
         
         close_btn = self._create_custom_button(button_frame, "بستن", 
-                                             lambda: guidance_dialog.destroy())
+                                             lambda: self._hide_dialog(guidance_dialog))
         close_btn.pack(side=tk.RIGHT, padx=5)
         
         # پیشنهادات رایج
@@ -1816,6 +9845,8 @@ class SolidWorksPanel:
                                       relief=tk.FLAT, padx=5, pady=3,
                                       command=make_click_handler(suggestion))
             suggestion_btn.pack(fill=tk.X, pady=2, padx=3, anchor=tk.W)
+        
+        return guidance_dialog
     
     def _send_guidance_request(self, question, answer_text_widget, status_label):
         """ارسال درخواست راهنمایی به LLM
@@ -1868,6 +9899,186 @@ class SolidWorksPanel:
 
 def main():
     """تابع اصلی برنامه"""
+    parser = argparse.ArgumentParser(description="SoliPy - SolidWorks API Panel")
+    parser.add_argument("--bench-import", action="store_true",
+                        help="اندازه‌گیری زمان import ماژول با python -X importtime")
+    parser.add_argument("--import-budget-ms", type=float, default=100.0,
+                        help="حداکثر زمان مجاز import (میلی‌ثانیه) برای --bench-import")
+    parser.add_argument("--mcp", action="store_true",
+                        help="اجرای سرور MCP روی stdio به جای رابط کاربری")
+    parser.add_argument("--mcp-port", type=int, default=0,
+                        help="پورت سرور MCP روی 127.0.0.1 (همراه با --mcp یا به تنهایی)")
+    parser.add_argument("--mock-llm", action="store_true",
+                        help="استفاده از سرور LLM آزمایشی محلی (برای آزمایش سرورها بدون کلید API)")
+    parser.add_argument("--serve", type=int, default=0, metavar="PORT",
+                        help="اجرای سرویس کارهای HTTP چندکاربره روی 127.0.0.1")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="آدرس شنود سرویس کارها (برای دسترسی از شبکه: 0.0.0.0)")
+    parser.add_argument("--seats", type=int, default=1,
+                        help="تعداد ایستگاه‌های CAD (هر کدام یک اجرای همزمان)")
+    parser.add_argument("--load-test", type=int, default=0, metavar="CLIENTS",
+                        help="آزمون بار سرویس کارها با این تعداد کاربر شبیه‌سازی شده و ایستگاه جایگزین")
+    parser.add_argument("--load-jobs", type=int, default=1,
+                        help="تعداد کارهای هر کاربر در آزمون بار")
+    parser.add_argument("--sweep", default="", metavar="SCRIPT",
+                        help="ساخت اسکریپت جاروب پارامتری از این اسکریپت (همراه با --param و/یا --table)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=RANGE",
+                        help="بازه یک پارامتر جاروب: نام=شروع:پایان:گام یا نام=a,b,c (قابل تکرار)")
+    parser.add_argument("--table", default="", help="جدول طراحی CSV برای جاروب")
+    parser.add_argument("--constraint", action="append", default=[],
+                        help="قید فیلتر ترکیب‌های جاروب، مثل \"(outer - bore) / 2 > 2\" (قابل تکرار)")
+    parser.add_argument("--sweep-out", default="", help="پوشه ذخیره نسخه‌های جاروب و manifest.json")
+    parser.add_argument("--bulk", default="", metavar="FOLDER",
+                        help="خروجی گرفتن از همه فایل‌های SolidWorks یک پوشه در یک نشست (ادامه خودکار اجرای ناتمام)")
+    parser.add_argument("--formats", default="step",
+                        help=f"قالب‌های خروجی عملیات گروهی، جدا شده با ویرگول ({', '.join(BulkOperation.FORMATS)})")
+    parser.add_argument("--bulk-out", default="", help="پوشه خروجی عملیات گروهی (پیش‌فرض: FOLDER/export)")
+    parser.add_argument("--chunk-size", type=int, default=25, help="تعداد فایل‌های هر اسکریپت عملیات گروهی")
+    parser.add_argument("--retry-failed", action="store_true", help="اجرای دوباره فایل‌های ناموفق عملیات گروهی")
+    parser.add_argument("--farm-coordinator", type=int, default=0, metavar="PORT",
+                        help="اجرای هماهنگ کننده مزرعه اجرا (صف ماندگار کارها) روی این پورت")
+    parser.add_argument("--farm-worker", default="", metavar="URL",
+                        help="اجرای کارگر مزرعه روی این ایستگاه و اتصال به هماهنگ کننده")
+    parser.add_argument("--worker-id", default="",
+                        help="نام کارگر مزرعه (پیش‌فرض: نام میزبان و شناسه پردازه)")
+    parser.add_argument("--trace", default="", metavar="HISTORY_PATH|TRACE_ID",
+                        help="نمایش آبشاری بازه‌های زمانی یک ورودی تاریخچه یا یک شناسه ردیابی")
+    parser.add_argument("--bench-endpoints", action="store_true",
+                        help="سنجش همزمان نقاط پایانی/مدل‌های تنظیم شده (اتصال، TTFT، توکن در ثانیه، نرخ خطا)")
+    parser.add_argument("--bench-samples", type=int, default=3,
+                        help="تعداد درخواست برای هر جفت نقطه پایانی/مدل در --bench-endpoints")
+    args = parser.parse_args()
+    
+    if args.bench_import:
+        result = measure_import_time()
+        print(json.dumps(result, ensure_ascii=False))
+        # شکست در صورت بارگذاری ماژول‌های سنگین یا عبور از بودجه زمانی
+        if result["heavy_modules"] or result["median_ms"] > args.import_budget_ms:
+            sys.exit(1)
+        return
+    
+    configure_console_encoding()
+    get_config().prepare_runtime()
+    atexit.register(get_profiler().dump_on_exit)
+    
+    if args.trace:
+        entry = HistoryIndex(get_config().history_dir).get(os.path.abspath(args.trace))
+        trace_ids = HistoryIndex.trace_ids(entry) if entry is not None else [args.trace]
+        spans = get_tracer().load(trace_ids)
+        if not spans:
+            print(f"ردیابی برای {args.trace} پیدا نشد.")
+            sys.exit(1)
+        print(Tracer.format_waterfall(spans))
+        return
+    
+    if args.bench_endpoints:
+        if args.mock_llm:
+            use_mock_llm()
+        config = get_config()
+        targets = EndpointBenchmark.targets(config.api_key, config.base_url, config.api_model,
+                                            config.model_tiers, config.fallback_endpoints)
+        results = EndpointBenchmark(samples=args.bench_samples).run(targets)
+        for result in results:
+            result.pop("api_key", None)
+        best = EndpointBenchmark.best(results)
+        print(json.dumps({"results": results, "best": best}, ensure_ascii=False, indent=2))
+        if best is None:
+            sys.exit(1)
+        return
+    
+    if args.load_test:
+        print(json.dumps(run_load_test(args.load_test, args.load_jobs, max(1, args.seats)), ensure_ascii=False))
+        return
+    
+    if args.sweep:
+        with open(args.sweep, "r", encoding="utf-8") as f:
+            script_content = f.read()
+        ranges = dict(spec.split("=", 1) for spec in args.param if "=" in spec)
+        generator = SolidWorksScriptGenerator(get_config().api_key, get_config().base_url, get_config().api_model)
+        success, message, script_path, _, sweep = generator.generate_sweep_script(
+            script_content, ranges, args.table, args.constraint, output_dir=args.sweep_out)
+        print(json.dumps({"success": success, "message": message, "script": script_path,
+                          "manifest": sweep.manifest_path if sweep else None}, ensure_ascii=False))
+        if not success:
+            sys.exit(1)
+        return
+    
+    if args.bulk:
+        try:
+            operation = BulkOperation.create(args.bulk, args.formats.split(","), args.bulk_out,
+                                             chunk_size=args.chunk_size)
+        except ValueError as e:
+            print(json.dumps({"success": False, "message": str(e)}, ensure_ascii=False))
+            sys.exit(1)
+        services = SolidWorksServices()
+        try:
+            summary = operation.run(services.execute, progress=print, retry_failed=args.retry_failed)
+        except KeyboardInterrupt:
+            summary = operation.write_manifest()
+        finally:
+            services.stop()
+        print(json.dumps(summary, ensure_ascii=False))
+        if summary["failed"] or summary["pending"]:
+            sys.exit(1)
+        return
+    
+    if args.farm_coordinator:
+        farm_queue = FarmQueue(os.path.join(get_config().scripts_dir, "farm", "tasks.db"))
+        try:
+            FarmCoordinator(farm_queue, get_config().farm_lease_s,
+                            token=get_config().farm_token).run(args.farm_coordinator, args.host)
+        except ValueError as e:
+            print(json.dumps({"success": False, "message": str(e)}, ensure_ascii=False))
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    if args.farm_worker:
+        # کارگر همیشه به صورت محلی اجرا می‌کند
+        get_config().farm_url = ""
+        seats = [SolidWorksServices() for _ in range(max(1, args.seats))]
+        try:
+            FarmWorker(args.farm_worker, seats, args.worker_id, token=get_config().farm_token).run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for services in seats:
+                services.stop()
+        return
+    
+    if args.serve:
+        if args.mock_llm:
+            use_mock_llm()
+        seats = [SolidWorksServices() for _ in range(max(1, args.seats))]
+        try:
+            JobService(seats, user_quota=get_config().job_quota, tokens=get_config().job_tokens).run(args.serve, args.host)
+        except ValueError as e:
+            print(json.dumps({"success": False, "message": str(e)}, ensure_ascii=False))
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for services in seats:
+                services.stop()
+        return
+    
+    if args.mcp or args.mcp_port:
+        if args.mock_llm:
+            use_mock_llm()
+        services = SolidWorksServices()
+        server = MCPServer(services)
+        try:
+            if args.mcp:
+                server.run_stdio(args.mcp_port)
+            else:
+                server.run_socket(args.mcp_port)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            services.stop()
+        return
+    
     try:
         # بررسی سیستم عامل
         if not sys.platform.startswith('win'):
@@ -1878,6 +10089,11 @@ def main():
         root = tk.Tk()
         app = SolidWorksPanel(root)
         root.mainloop()
+        if app.mcp_server is not None:
+            app.mcp_server.stop()
+        if app.services is not None:
+            app.services.stop()
+        app.template_registry.stop_watching()
         
     except Exception as e:
         logger.error(f"خطا در اجرای برنامه: {e}")
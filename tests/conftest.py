@@ -0,0 +1,56 @@
+"""تنظیمات مشترک آزمون‌ها: اجرای جایگزین بدون SolidWorks و پوشه‌های موقت برای تاریخچه و اسکریپت‌ها"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# پیش از اولین get_config تنظیم می‌شوند (تنظیمات فقط یک بار خوانده می‌شود)
+TEST_ENV = {
+    "SW_EXECUTION_MODE": "standin",
+    "SW_STANDIN_RUN_SECONDS": "0.05",
+    "SW_PREWARM": "0",
+    "SW_TRACE": "0",
+    "SW_FEWSHOT_TOKENS": "0",
+    "OPENAI_API_KEY": "test-key",
+}
+os.environ.update(TEST_ENV)
+
+import pytest
+
+import sw_api_panel
+
+
+def wait_for(predicate, timeout: float = 20.0, interval: float = 0.05):
+    """انتظار تا برقرار شدن شرط؛ آخرین مقدار شرط برگردانده می‌شود"""
+    deadline = time.time() + timeout
+    while True:
+        value = predicate()
+        if value or time.time() > deadline:
+            return value
+        time.sleep(interval)
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """تنظیمات سراسری با پوشه‌های موقت (تاریخچه واقعی scripts/ دست نمی‌خورد)"""
+    config = sw_api_panel.get_config()
+    scripts_dir = tmp_path / "scripts"
+    history_dir = scripts_dir / "history"
+    history_dir.mkdir(parents=True)
+    monkeypatch.setattr(config, "scripts_dir", str(scripts_dir))
+    monkeypatch.setattr(config, "history_dir", str(history_dir))
+    monkeypatch.setattr(config, "diagnostics_dir", str(tmp_path / "diagnostics"))
+    for name in ("api_key", "base_url", "api_model", "model_tiers", "fallback_endpoints", "farm_url"):
+        monkeypatch.setattr(config, name, getattr(config, name))
+    return config
+
+
+@pytest.fixture
+def mock_llm(config):
+    """سرور LLM آزمایشی که تنظیمات برنامه به آن اشاره می‌کند"""
+    server = sw_api_panel.use_mock_llm()
+    yield server
+    server.stop()
@@ -0,0 +1,34 @@
+"""آزمون تشخیص محلی درخواست‌های چندقطعه‌ای"""
+
+import pytest
+
+import sw_api_panel
+
+
+@pytest.mark.parametrize("query", [
+    "a plate 100x50 with four holes",
+    "draw a flange with six bolt holes",
+    "یک صفحه با چهار سوراخ بکش",
+    "a cube with 4 chamfers",
+    "یک پیچ M8 بکش",
+    "add thread for a screw hole",
+    "a base plate with four holes",
+    "یک صفحه با سوراخ‌های پیچ",
+    "یک دایره در صفحه جلو بکش",
+    "draw a circle on the front plane",
+])
+def test_single_part_requests_skip_planning(query):
+    assert not sw_api_panel.AssemblyPlanner.is_assembly_request(query)
+
+
+@pytest.mark.parametrize("query", [
+    "a box with four bolts and a lid",
+    "یک جعبه با چهار پیچ و درپوش",
+    "a shaft with two bearings",
+    "M8 bolt and nut",
+    "a base plate with 4 bolts",
+    "create an assembly of a pulley",
+    "دو قطعه را مونتاژ کن",
+])
+def test_multi_part_requests_are_planned(query):
+    assert sw_api_panel.AssemblyPlanner.is_assembly_request(query)
@@ -0,0 +1,34 @@
+"""آزمون‌های جدولی بازنویسی مراحل اسکریپت دسته‌ای (خروج‌های موفق نباید دسته را متوقف کنند)"""
+
+import pytest
+
+import sw_api_panel
+
+CONNECT = 'Set swApp = CreateObject("SldWorks.Application")'
+
+
+def _step_lines(body: str):
+    """خطوط مرحله دوم اسکریپت دسته‌ای پس از بازنویسی"""
+    builder = sw_api_panel.BatchScriptBuilder()
+    builder.add_step("first", CONNECT + "\nWScript.Echo \"first\"\n")
+    builder.add_step("second", CONNECT + "\n" + body)
+    lines = builder.build().split("\n")
+    return [line for line, origin in zip(lines, builder.line_map) if origin and origin[0] == 2][1:]
+
+
+@pytest.mark.parametrize("body, expected", [
+    pytest.param("x = 1\nWScript.Quit 0\n", ["x = 1"], id="quit-0"),
+    pytest.param("x = 1\nWScript.Quit(0) ' done\n", ["x = 1"], id="quit-parenthesized-with-comment"),
+    pytest.param("x = 1\nWScript.Quit\n", ["x = 1"], id="quit-without-code"),
+    pytest.param("WScript.Quit 1\n", ["WScript.Quit 1"], id="failure-quit-kept"),
+    pytest.param("If done Then WScript.Quit 0\nx = 1\n", ["x = 1"], id="inline-if-quit"),
+    pytest.param("  If done Then WScript.Quit(0) ' early exit\nx = 1\n", ["x = 1"], id="inline-if-quit-comment"),
+    pytest.param("If done Then: WScript.Quit 0\n", [], id="inline-if-colon"),
+    pytest.param("If done Then WScript.Quit 0 Else x = 1\n", ["If Not (done) Then x = 1"], id="inline-if-else"),
+    pytest.param("If failed Then WScript.Quit 1\n", ["If failed Then WScript.Quit 1"], id="inline-failure-kept"),
+    pytest.param("If done Then\n    WScript.Quit 0\nEnd If\n", ["If done Then", "End If"], id="block-if"),
+    pytest.param("Sub Finish\n    WScript.Quit 0\nEnd Sub\n", ["Sub Finish", "    WScript.Quit 0", "End Sub"],
+                 id="inside-sub-kept"),
+])
+def test_success_exits_are_removed(body, expected):
+    assert _step_lines(body) == expected
@@ -0,0 +1,124 @@
+"""آزمون ادامه عملیات گروهی پس از توقف یا قطع شدن اجرا"""
+
+import json
+import re
+
+import pytest
+
+import sw_api_panel
+
+CALL_PATTERN = re.compile(r'^If BulkExport\((\d+), ', re.MULTILINE)
+
+
+class FakeSeat:
+    """اجرا کننده ساختگی: همه فایل‌های بخش را موفق گزارش می‌کند (به جز شماره‌های failing)"""
+
+    def __init__(self, failing=(), crash_on_chunk=None, on_chunk=None, exit_after=None):
+        self.failing = set(failing)
+        self.crash_on_chunk = crash_on_chunk
+        self.exit_after = exit_after
+        self.on_chunk = on_chunk
+        self.chunks = []
+
+    def execute(self, script_path, args=None):
+        with open(script_path, "r", encoding="utf-8") as f:
+            indexes = [int(number) for number in CALL_PATTERN.findall(f.read())]
+        self.chunks.append(indexes)
+        if self.on_chunk is not None:
+            self.on_chunk(len(self.chunks))
+        if len(self.chunks) == self.crash_on_chunk:
+            raise RuntimeError("SolidWorks از کار افتاد")
+        output = [f"@@FILE {index} FAILED ذخیره ناموفق بود" if index in self.failing else f"@@FILE {index} OK"
+                  for index in indexes]
+        if self.exit_after is not None and len(output) > self.exit_after:
+            # اسکریپت پس از چند فایل با کد خطا خارج می‌شود
+            return False, "اجرای اسکریپت ناموفق بود. کد خروج: 1", "\n".join(output[:self.exit_after])
+        return True, "", "\n".join(output)
+
+
+@pytest.fixture
+def source(tmp_path):
+    folder = tmp_path / "parts"
+    (folder / "sub").mkdir(parents=True)
+    for name in ("a.SLDPRT", "b.SLDPRT", "c.sldasm", "sub/d.SLDPRT", "sub/e.SLDDRW"):
+        (folder / name).write_bytes(b"")
+    (folder / "notes.txt").write_text("not a part")
+    return folder
+
+
+def _create(source, tmp_path, **options):
+    options.setdefault("chunk_size", 2)
+    return sw_api_panel.BulkOperation.create(str(source), ["step", "pdf"], jobs_dir=str(tmp_path / "bulk"), **options)
+
+
+def _statuses(operation):
+    return [item["status"] for item in operation.state["files"]]
+
+
+def test_resume_after_stop(source, tmp_path):
+    operation = _create(source, tmp_path)
+    assert len(operation.state["files"]) == 5
+    seat = FakeSeat(on_chunk=lambda chunk: operation.stop())
+    summary = operation.run(seat.execute)
+    assert seat.chunks == [[1, 2]]
+    assert summary["done"] == 2 and summary["pending"] == 3
+
+    resumed = _create(source, tmp_path)
+    assert _statuses(resumed) == ["done", "done", "pending", "pending", "pending"]
+    seat = FakeSeat()
+    summary = resumed.run(seat.execute)
+    assert seat.chunks == [[3, 4], [5]]
+    assert summary["done"] == 5 and summary["pending"] == 0
+    with open(summary["manifest"], "r", encoding="utf-8") as f:
+        assert json.load(f)["done"] == 5
+
+
+def test_resume_after_crash_keeps_finished_chunks(source, tmp_path):
+    operation = _create(source, tmp_path)
+    with pytest.raises(RuntimeError):
+        operation.run(FakeSeat(crash_on_chunk=2).execute)
+
+    resumed = _create(source, tmp_path)
+    assert _statuses(resumed) == ["done", "done", "pending", "pending", "pending"]
+    seat = FakeSeat()
+    assert resumed.run(seat.execute)["done"] == 5
+    assert seat.chunks == [[3, 4], [5]]
+
+
+def test_files_not_reached_by_a_failed_chunk_stay_pending(source, tmp_path):
+    operation = _create(source, tmp_path, chunk_size=4)
+    summary = operation.run(FakeSeat(failing={2}, exit_after=2).execute)
+    assert _statuses(operation) == ["done", "failed", "pending", "pending", "done"]
+    assert summary["done"] == 2 and summary["failed"] == 1 and summary["pending"] == 2
+    assert operation.state["files"][2]["error"] == "اجرای اسکریپت ناموفق بود. کد خروج: 1"
+
+    seat = FakeSeat()
+    summary = _create(source, tmp_path, chunk_size=4).run(seat.execute)
+    assert seat.chunks == [[3, 4]]
+    assert summary["done"] == 4 and summary["failed"] == 1 and summary["pending"] == 0
+
+
+def test_failed_files_are_retried_only_on_request(source, tmp_path):
+    operation = _create(source, tmp_path)
+    summary = operation.run(FakeSeat(failing={2}).execute)
+    assert summary["failed"] == 1
+    assert operation.state["files"][1]["error"] == "ذخیره ناموفق بود"
+
+    seat = FakeSeat()
+    _create(source, tmp_path).run(seat.execute)
+    assert seat.chunks == []
+    summary = _create(source, tmp_path).run(seat.execute, retry_failed=True)
+    assert seat.chunks == [[2]]
+    assert summary["done"] == 5 and summary["failed"] == 0
+
+
+def test_files_added_after_interruption_are_picked_up(source, tmp_path):
+    operation = _create(source, tmp_path)
+    operation.run(FakeSeat(on_chunk=lambda chunk: operation.stop()).execute)
+    (source / "z.SLDPRT").write_bytes(b"")
+
+    resumed = _create(source, tmp_path)
+    assert len(resumed.state["files"]) == 6
+    seat = FakeSeat()
+    assert resumed.run(seat.execute)["done"] == 6
+    assert seat.chunks == [[3, 4], [5, 6]]
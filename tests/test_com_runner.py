@@ -0,0 +1,125 @@
+"""آزمون SolidWorksCOMRunner با شیء جایگزین SolidWorks: ترد کارگر، مهلت، اتصال دوباره و میزبان اسکریپت"""
+
+import threading
+
+import pytest
+
+import sw_api_panel
+
+
+@pytest.fixture
+def runner_with():
+    runners = []
+
+    def _create(script_host_factory=sw_api_panel.StandInScriptHost, app_factory=sw_api_panel.FakeSolidWorksApp):
+        runner = sw_api_panel.SolidWorksCOMRunner(app_factory=app_factory, script_host_factory=script_host_factory)
+        runners.append(runner)
+        return runner
+
+    yield _create
+    for runner in runners:
+        runner.stop()
+
+
+def test_missing_script_host_is_detected_once(runner_with):
+    attempts = []
+
+    def _unavailable():
+        attempts.append(1)
+        raise RuntimeError("Class not registered")
+
+    runner = runner_with(_unavailable)
+    assert [runner.supports_scripts() for _ in range(3)] == [False, False, False]
+    assert len(attempts) == 1
+
+
+def test_available_script_host_is_created_once(runner_with):
+    hosts = []
+    runner = runner_with(lambda: hosts.append(sw_api_panel.StandInScriptHost()) or hosts[-1])
+    assert [runner.supports_scripts() for _ in range(3)] == [True, True, True]
+    assert len(hosts) == 1
+
+
+def test_operations_run_on_the_worker_thread_with_one_connection(runner_with):
+    apps = []
+
+    def _connect():
+        apps.append(sw_api_panel.FakeSolidWorksApp())
+        return apps[-1]
+
+    runner = runner_with(app_factory=_connect)
+    ok, _, result = runner.run_operation(lambda app: (threading.current_thread().name, app), timeout=5)
+    assert ok and result == ("SolidWorksCOMRunner", apps[0])
+
+    ok, _, model = runner.run_operation(lambda app: app.NewDocument("Part.prtdot", 0, 0, 0), timeout=5)
+    assert ok and model is apps[0].ActiveDoc
+    runner.run_operation(lambda app: app.ActiveDoc.SketchManager.CreateCircleByRadius(0, 0, 0, 0.01), timeout=5)
+    assert len(apps) == 1
+    assert apps[0].calls == [
+        ("SldWorks.Application.NewDocument", ("Part.prtdot", 0, 0, 0)),
+        ("ModelDoc2.SketchManager.CreateCircleByRadius", (0, 0, 0, 0.01)),
+    ]
+
+
+def test_operation_error_is_returned_and_keeps_the_connection(runner_with):
+    standin = sw_api_panel.LocalSolidWorksStandIn()
+    runner = runner_with(app_factory=standin)
+
+    def _fail(app):
+        raise ValueError("bad dimension")
+
+    assert runner.run_operation(_fail, timeout=5) == (False, "خطا در اجرای عملیات: bad dimension", None)
+    assert runner.run_operation(lambda app: app.Visible, timeout=5)[0]
+    assert standin.connect_count == 1
+
+
+def test_operation_timeout(runner_with):
+    runner = runner_with()
+    release = threading.Event()
+    ok, message, result = runner.run_operation(lambda app: release.wait(5), timeout=0.05)
+    assert (ok, message, result) == (False, "زمان اجرای عملیات به پایان رسید", None)
+    release.set()
+    # کار طولانی روی ترد کارگر تمام می‌شود و عملیات بعدی اجرا می‌شود
+    assert runner.run_operation(lambda app: "next", timeout=5) == (True, "عملیات با موفقیت اجرا شد.", "next")
+
+
+def test_dropped_connection_reconnects_on_next_operation(runner_with):
+    standin = sw_api_panel.LocalSolidWorksStandIn()
+    runner = runner_with(app_factory=standin)
+    ok, _, first = runner.run_operation(lambda app: app, timeout=5)
+    assert ok and standin.connect_count == 1
+
+    standin.crash()
+    ok, message, _ = runner.run_operation(lambda app: app.Visible, timeout=5)
+    assert not ok and "disconnected" in message
+
+    ok, _, second = runner.run_operation(lambda app: app, timeout=5)
+    assert ok and second is not first
+    assert standin.connect_count == 2
+
+
+@pytest.mark.parametrize("body, ok, message, output", [
+    pytest.param('WScript.Echo "done"\n', True, "اسکریپت با موفقیت اجرا شد.", "done", id="success"),
+    pytest.param('If x Then\nWScript.Echo "done"\n', False, "خطا در اجرای اسکریپت (کد خروج: 1)",
+                 "Stand-in VBScript error", id="script-error"),
+])
+def test_execute_script_runs_the_host_on_the_worker_thread(runner_with, tmp_path, body, ok, message, output):
+    calls = []
+
+    class RecordingHost(sw_api_panel.StandInScriptHost):
+        def run(self, source, app, script_path, args=None):
+            calls.append((threading.current_thread().name, type(app), args))
+            return super().run(source, app, script_path, args)
+
+    runner = runner_with(RecordingHost)
+    script = tmp_path / "script.vbs"
+    script.write_text('Set swApp = CreateObject("SldWorks.Application")\n' + body, encoding="utf-8")
+    result = runner.execute_script(str(script), ["10"], timeout=5)
+    assert result[:2] == (ok, message)
+    assert output in result[2]
+    assert calls == [("SolidWorksCOMRunner", sw_api_panel.FakeSolidWorksApp, ["10"])]
+
+
+def test_execute_script_missing_file(runner_with, tmp_path):
+    path = str(tmp_path / "missing.vbs")
+    assert runner_with().execute_script(path) == (False, f"فایل اسکریپت وجود ندارد: {path}", "")
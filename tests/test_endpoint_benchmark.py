@@ -0,0 +1,66 @@
+"""آزمون سنجش نقاط پایانی با سرورهای LLM آزمایشی سریع، کند و ناموفق"""
+
+import pytest
+
+import sw_api_panel
+
+
+@pytest.fixture
+def servers():
+    started = {
+        "fast": sw_api_panel.MockLLMServer().start(),
+        "slow": sw_api_panel.MockLLMServer(chunk_delay_s=0.01).start(),
+        "failing": sw_api_panel.MockLLMServer(fail_every=1).start(),
+    }
+    yield started
+    for server in started.values():
+        server.stop()
+
+
+def _target(server):
+    return sw_api_panel.LLMEndpoint(server.url, "test-key"), "mock-model"
+
+
+def test_run_ranks_slow_before_failing(servers):
+    results = sw_api_panel.EndpointBenchmark(samples=2, timeout=10).run(
+        [_target(servers["failing"]), _target(servers["slow"])])
+
+    assert [result["url"] for result in results] == [servers["slow"].url, servers["failing"].url]
+    slow, failing = results
+    assert slow["rank"] == 1 and slow["healthy"] and slow["errors"] == 0
+    assert slow["ttft_ms"] is not None and slow["tokens_per_s"] > 0 and slow["expected_ms"] > 0
+    assert failing["rank"] == 2 and not failing["healthy"]
+    assert failing["error_rate"] == 1.0 and failing["expected_ms"] is None
+    assert failing["error"].startswith("HTTP 503")
+    assert sw_api_panel.EndpointBenchmark.best(results)["url"] == servers["slow"].url
+
+
+def test_run_prefers_faster_healthy_endpoint(servers):
+    reported = []
+    results = sw_api_panel.EndpointBenchmark(samples=2, timeout=10).run(
+        [_target(servers["slow"]), _target(servers["fast"]), _target(servers["failing"])], progress=reported.append)
+
+    assert len(reported) == 3
+    assert [result["url"] for result in results] == [servers["fast"].url, servers["slow"].url, servers["failing"].url]
+    assert results[0]["expected_ms"] < results[1]["expected_ms"]
+
+
+def test_best_is_none_when_every_endpoint_fails(servers):
+    results = sw_api_panel.EndpointBenchmark(samples=1, timeout=10).run([_target(servers["failing"])])
+    assert sw_api_panel.EndpointBenchmark.best(results) is None
+
+
+@pytest.mark.parametrize("results, expected", [
+    # سریع‌تر ولی با خطای زیاد (ناسالم) پشت جفت سالم کندتر قرار می‌گیرد
+    ([{"name": "flaky", "healthy": False, "expected_ms": 100.0, "error_rate": 0.5},
+      {"name": "steady", "healthy": True, "expected_ms": 900.0, "error_rate": 0.0}], ["steady", "flaky"]),
+    ([{"name": "slow", "healthy": True, "expected_ms": 900.0, "error_rate": 0.0},
+      {"name": "fast", "healthy": True, "expected_ms": 300.0, "error_rate": 0.0}], ["fast", "slow"]),
+    # ناسالم‌ها بر اساس نرخ خطا
+    ([{"name": "dead", "healthy": False, "expected_ms": None, "error_rate": 1.0},
+      {"name": "flaky", "healthy": False, "expected_ms": 100.0, "error_rate": 0.5}], ["flaky", "dead"]),
+])
+def test_rank(results, expected):
+    ranked = sw_api_panel.EndpointBenchmark.rank(results)
+    assert [result["name"] for result in ranked] == expected
+    assert [result["rank"] for result in ranked] == list(range(1, len(expected) + 1))
@@ -0,0 +1,140 @@
+"""آزمون مزرعه اجرا: هماهنگ کننده در همین پردازش و کارگرها به صورت پردازش‌های جداگانه"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import sw_api_panel
+from conftest import ROOT, wait_for
+
+TOKEN = "farm-test-token"
+LEASE_S = 1.0
+
+VALID_SCRIPT = 'Set swApp = CreateObject("SldWorks.Application")\nWScript.Echo "ok"\n'
+# بدون کد اتصال؛ میزبان جایگزین آن را با خطا برمی‌گرداند
+INVALID_SCRIPT = 'WScript.Echo "no connection"\n'
+
+
+class Farm:
+    """هماهنگ کننده در ترد پس‌زمینه و راه‌انداز پردازش‌های کارگر"""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.queue = sw_api_panel.FarmQueue(str(tmp_path / "farm" / "tasks.db"))
+        self.coordinator = sw_api_panel.FarmCoordinator(self.queue, LEASE_S, token=TOKEN)
+        self.workers = {}
+        # نسخه جداگانه ماژول تا پوشه‌های scripts و logs کارگرها در مسیر موقت ساخته شوند
+        app_dir = tmp_path / "app"
+        app_dir.mkdir()
+        self.app = str(app_dir / "sw_api_panel.py")
+        shutil.copy(os.path.join(ROOT, "sw_api_panel.py"), self.app)
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def _run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.coordinator.start(0))
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=_run, name="FarmCoordinatorTest", daemon=True).start()
+        assert started.wait(10)
+        self.url = f"http://127.0.0.1:{self.coordinator.port}"
+
+    def start_worker(self, name: str, run_seconds: float = 0.2) -> subprocess.Popen:
+        env = dict(os.environ, SW_FARM_TOKEN=TOKEN, SW_STANDIN_RUN_SECONDS=str(run_seconds),
+                   SW_LOG_FILE=str(self.tmp_path / "logs" / f"{name}.log"))
+        env.pop("SW_FARM_URL", None)
+        process = subprocess.Popen([sys.executable, self.app, "--farm-worker", self.url, "--worker-id", name],
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.workers[name] = process
+        assert wait_for(lambda: name in self.coordinator.workers), f"کارگر {name} ثبت نشد"
+        return process
+
+    def stop(self):
+        for process in self.workers.values():
+            process.kill()
+            process.wait(10)
+        asyncio.run_coroutine_threadsafe(self.coordinator.stop(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def wait_for_status(farm: Farm, task_id: str, status: str):
+    """انتظار تا رسیدن کار به وضعیت نهایی مورد انتظار"""
+    return wait_for(lambda: farm.queue.get(task_id)["status"] == status, timeout=30) and farm.queue.get(task_id)
+
+
+@pytest.fixture
+def farm(tmp_path):
+    farm = Farm(tmp_path)
+    yield farm
+    farm.stop()
+
+
+def test_requests_without_token_are_rejected(farm):
+    response = sw_api_panel.requests.get(f"{farm.url}/stats", timeout=10)
+    assert response.status_code == 401
+
+
+def test_non_loopback_bind_requires_token():
+    with pytest.raises(ValueError):
+        sw_api_panel.FarmCoordinator.check_bind("0.0.0.0", authenticated=False)
+    sw_api_panel.FarmCoordinator.check_bind("0.0.0.0", authenticated=True)
+    sw_api_panel.FarmCoordinator.check_bind("127.0.0.1", authenticated=False)
+
+
+def test_tasks_are_spread_over_two_workers(farm, tmp_path):
+    farm.start_worker("w1")
+    farm.start_worker("w2")
+    script = tmp_path / "script.vbs"
+    script.write_text(VALID_SCRIPT, encoding="utf-8")
+    client = sw_api_panel.FarmClient(farm.url, poll_s=0.1, timeout_s=60, token=TOKEN)
+    results = [None] * 6
+
+    def _submit(index):
+        results[index] = client.execute(str(script))
+
+    threads = [threading.Thread(target=_submit, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert all(result is not None and result[0] for result in results), results
+    assert results[0][2] == "ok"
+    assert farm.coordinator.workers["w1"]["completed"] > 0
+    assert farm.coordinator.workers["w2"]["completed"] > 0
+    assert farm.queue.counts().get("done") == len(results)
+
+
+def test_expired_lease_is_dispatched_to_another_worker(farm):
+    # کارگر اول کار طولانی را می‌گیرد و پیش از گزارش نتیجه از کار می‌افتد
+    first = farm.start_worker("w1", run_seconds=30)
+    task_id = farm.queue.enqueue(VALID_SCRIPT)
+    assert wait_for(lambda: farm.queue.get(task_id)["worker"] == "w1")
+    first.kill()
+    first.wait(10)
+    farm.start_worker("w2")
+
+    task = wait_for_status(farm, task_id, "done")
+    assert task, farm.queue.get(task_id)
+    assert task["worker"] == "w2"
+    assert task["attempts"] == 2
+
+
+def test_failed_script_is_not_retried(farm):
+    farm.start_worker("w1")
+    farm.start_worker("w2")
+    task_id = farm.queue.enqueue(INVALID_SCRIPT, max_attempts=3)
+
+    task = wait_for_status(farm, task_id, "failed")
+    assert task, farm.queue.get(task_id)
+    assert task["attempts"] == 1
+    assert "Stand-in VBScript error" in task["result"]["output"]
+    failures = sum(info["failed"] for info in farm.coordinator.workers.values())
+    assert failures == 1
@@ -0,0 +1,66 @@
+"""آزمون hedging کلاینت LLM: پاسخ سریع‌تر برگردانده و درخواست بازنده قطع می‌شود"""
+
+import concurrent.futures
+import time
+
+import pytest
+
+import sw_api_panel
+from conftest import wait_for
+
+PAYLOAD = {"model": "mock-model", "messages": [{"role": "system", "content": "You write VBScript."},
+                                               {"role": "user", "content": "draw a circle"}]}
+
+
+@pytest.fixture
+def servers():
+    # بدنه کامل سرور کند حدود 3 ثانیه طول می‌کشد
+    slow = sw_api_panel.MockLLMServer(chunk_delay_s=0.05).start()
+    fast = sw_api_panel.MockLLMServer().start()
+    yield slow, fast
+    slow.stop()
+    fast.stop()
+
+
+@pytest.fixture
+def sends(monkeypatch):
+    """ثبت نتیجه و مدت هر ارسال به تفکیک نقطه پایانی"""
+    records = {}
+    send = sw_api_panel.LLMClient._send
+
+    def _recording_send(endpoint, body, timeout, cancel):
+        started = time.perf_counter()
+        try:
+            response = send(endpoint, body, timeout, cancel)
+            records[endpoint.url] = ("done", time.perf_counter() - started)
+            return response
+        except concurrent.futures.CancelledError:
+            records[endpoint.url] = ("cancelled", time.perf_counter() - started)
+            raise
+
+    monkeypatch.setattr(sw_api_panel.LLMClient, "_send", staticmethod(_recording_send))
+    return records
+
+
+def test_stream_is_collected_into_a_completion(servers, sends):
+    _, fast = servers
+    response = sw_api_panel.LLMClient(hedge=False).post(fast.url, {}, PAYLOAD, timeout=10)
+    data = response.json()
+    assert response.status_code == 200
+    assert data["choices"][0]["message"]["content"] == sw_api_panel.MockLLMServer.SCRIPT
+    assert data["choices"][0]["finish_reason"] == "stop"
+    assert data["usage"]["total_tokens"] > 0
+
+
+def test_hedge_loser_is_aborted_before_it_completes(servers, sends):
+    slow, fast = servers
+    client = sw_api_panel.LLMClient([sw_api_panel.LLMEndpoint(fast.url)], default_hedge_delay_s=0.2,
+                                    min_hedge_delay_s=0.1)
+    response = client.post(slow.url, {}, PAYLOAD, timeout=10)
+    assert response.endpoint == sw_api_panel.LLMEndpoint(fast.url).name
+    assert response.json()["choices"][0]["message"]["content"] == sw_api_panel.MockLLMServer.SCRIPT
+
+    assert wait_for(lambda: slow.url in sends, timeout=5)
+    outcome, elapsed = sends[slow.url]
+    assert outcome == "cancelled"
+    assert elapsed < 1.0
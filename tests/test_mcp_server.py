@@ -0,0 +1,102 @@
+"""آزمون رفت و برگشت سرور MCP روی سوکت محلی با LLM آزمایشی و اجرای جایگزین"""
+
+import json
+import os
+import socket
+
+import pytest
+
+import sw_api_panel
+from conftest import wait_for
+
+
+class MCPConnection:
+    """کلاینت ساده JSON-RPC خط به خط"""
+
+    def __init__(self, port: int):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=30)
+        self.reader = self.sock.makefile("rb")
+        self.notifications = []
+        self._next_id = 0
+
+    def request(self, method: str, params=None):
+        self._next_id += 1
+        request_id = self._next_id
+        message = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}}
+        self.sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        while True:
+            line = self.reader.readline()
+            assert line, "اتصال MCP بسته شد"
+            response = json.loads(line)
+            if response.get("id") == request_id:
+                return response
+            self.notifications.append(response)
+
+    def call_tool(self, name: str, arguments, progress_token=None):
+        params = {"name": name, "arguments": arguments}
+        if progress_token is not None:
+            params["_meta"] = {"progressToken": progress_token}
+        return self.request("tools/call", params)["result"]
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _connect(port: int):
+    try:
+        return MCPConnection(port)
+    except OSError:
+        return None
+
+
+@pytest.fixture
+def mcp(mock_llm):
+    services = sw_api_panel.SolidWorksServices(sw_api_panel.get_config())
+    server = sw_api_panel.MCPServer(services)
+    port = _free_port()
+    server.start_in_background(port)
+    connection = wait_for(lambda: _connect(port), timeout=10)
+    assert connection, "سرور MCP آماده نشد"
+    yield connection
+    connection.close()
+    server.stop()
+    services.stop()
+
+
+def test_initialize_and_list_tools(mcp):
+    result = mcp.request("initialize", {"protocolVersion": sw_api_panel.MCPServer.PROTOCOL_VERSION})["result"]
+    assert result["protocolVersion"] == sw_api_panel.MCPServer.PROTOCOL_VERSION
+    tools = {tool["name"] for tool in mcp.request("tools/list")["result"]["tools"]}
+    assert {"generate_script", "execute_script", "debug_script", "provide_user_guidance", "history"} <= tools
+
+
+def test_generate_and_execute_round_trip(mcp):
+    result = mcp.call_tool("generate_script", {"query": "یک دایره به شعاع 10 بکش"}, progress_token="gen")
+    assert not result["isError"]
+    generated = json.loads(result["content"][0]["text"])
+    assert generated["success"]
+    assert os.path.exists(generated["path"])
+    assert "SldWorks.Application" in generated["script"]
+    progress = [n["params"] for n in mcp.notifications if n.get("method") == "notifications/progress"]
+    assert progress and all(p["progressToken"] == "gen" for p in progress)
+
+    result = mcp.call_tool("execute_script", {"path": generated["path"]})
+    executed = json.loads(result["content"][0]["text"])
+    assert executed["success"], executed
+    assert "عملیات با موفقیت انجام شد." in executed["output"]
+
+    result = mcp.call_tool("history", {"path": generated["path"]})
+    entry = json.loads(result["content"][0]["text"])
+    assert entry["status"] == "success"
+
+
+def test_unknown_tool_and_method(mcp):
+    assert mcp.request("tools/call", {"name": "nope", "arguments": {}})["error"]["code"] == -32601
+    assert mcp.request("nope/nope")["error"]["code"] == -32601
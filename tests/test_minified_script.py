@@ -0,0 +1,101 @@
+"""آزمون‌های جدولی فشرده‌سازی اسکریپت، نگاشت شماره خط خطاها و بازگرداندن ویرایش‌ها"""
+
+import pytest
+
+import sw_api_panel
+
+ORIGINAL = "\n".join([
+    "Option Explicit",                                                # 1
+    "' connect to SolidWorks",                                        # 2
+    "Dim swApp, swModel",                                             # 3
+    'Set swApp = CreateObject("SldWorks.Application")',               # 4
+    'WScript.Echo "connected"',                                       # 5
+    "",                                                               # 6
+    "If swApp Is Nothing Then",                                       # 7
+    "    WScript.Quit 1",                                             # 8
+    "End If",                                                         # 9
+    'Set swModel = swApp.NewDocument("Part.prtdot", 0, 0, 0)',        # 10
+    "    swModel.SketchManager.InsertSketch True ' sketch",           # 11
+    'WScript.Echo "done"',                                            # 12
+    "WScript.Quit 0",                                                 # 13
+])
+
+
+@pytest.fixture
+def minified():
+    return sw_api_panel.PromptBuilder().minify(ORIGINAL)
+
+
+def test_minify_drops_comments_blank_lines_and_literal_echoes(minified):
+    assert minified.lines == [
+        "Option Explicit",
+        "Dim swApp, swModel",
+        'Set swApp = CreateObject("SldWorks.Application")',
+        "If swApp Is Nothing Then",
+        "WScript.Quit 1",
+        "End If",
+        'Set swModel = swApp.NewDocument("Part.prtdot", 0, 0, 0)',
+        "swModel.SketchManager.InsertSketch True",
+        "WScript.Quit 0",
+    ]
+    assert minified.line_map == [0, 2, 3, 6, 7, 8, 9, 10, 12]
+
+
+@pytest.mark.parametrize("error, expected", [
+    pytest.param("script.vbs(11, 5) Microsoft VBScript runtime error", "script.vbs(8, 5) Microsoft VBScript runtime error",
+                 id="cscript-position"),
+    pytest.param("error on line 10", "error on line 7", id="english-line"),
+    pytest.param("Error at Line 4: bad", "Error at Line 3: bad", id="english-line-case"),
+    pytest.param("خطا در خط 13", "خطا در خط 9", id="persian-line"),
+    pytest.param("script.vbs(12, 1) error", "script.vbs(9, 1) error", id="removed-line-maps-to-next-kept-line"),
+    pytest.param("script.vbs(99, 1) error", "script.vbs(9, 1) error", id="past-end-clamped"),
+    pytest.param("no line number", "no line number", id="unchanged"),
+])
+def test_remap_error(minified, error, expected):
+    assert minified.remap_error(error) == expected
+
+
+def _edit(minified, change):
+    lines = list(minified.lines)
+    change(lines)
+    return minified.restore("\n".join(lines))
+
+
+def _original_with(change):
+    lines = ORIGINAL.split("\n")
+    change(lines)
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("edit, expected", [
+    pytest.param(lambda lines: None, lambda lines: None, id="unchanged"),
+    pytest.param(lambda lines: lines.insert(8, "swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01"),
+                 lambda lines: lines.insert(11, "    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01"),
+                 id="inserted-line-takes-indent-of-anchor"),
+    pytest.param(lambda lines: lines.insert(0, "' header"), lambda lines: lines.insert(0, "' header"),
+                 id="inserted-at-start"),
+    pytest.param(lambda lines: lines.append("swModel.EditRebuild3"), lambda lines: lines.append("swModel.EditRebuild3"),
+                 id="inserted-at-end"),
+    pytest.param(lambda lines: lines.__delitem__(slice(3, 6)), lambda lines: lines.__delitem__(slice(6, 9)),
+                 id="deleted-block-keeps-comments-and-echoes"),
+    pytest.param(lambda lines: lines.__setitem__(7, "swModel.SketchManager.InsertSketch False"),
+                 lambda lines: lines.__setitem__(10, "    swModel.SketchManager.InsertSketch False"),
+                 id="replaced-line-keeps-indent"),
+    pytest.param(lambda lines: lines.__setitem__(slice(4, 5), ["Err.Clear", "WScript.Quit 2"]),
+                 lambda lines: lines.__setitem__(slice(7, 8), ["    Err.Clear", "    WScript.Quit 2"]),
+                 id="one-line-replaced-by-two"),
+    pytest.param(lambda lines: (lines.__delitem__(4), lines.insert(7, "swModel.ClearSelection2 True")),
+                 lambda lines: (lines.__delitem__(7), lines.insert(10, "    swModel.ClearSelection2 True")),
+                 id="delete-and-insert"),
+])
+def test_restore(minified, edit, expected):
+    assert _edit(minified, edit) == _original_with(expected)
+
+
+def test_restored_line_numbers_follow_the_edit(minified):
+    # پس از حذف بلوک If، خطای خط InsertSketch اسکریپت بازگردانده شده به همان دستور در نسخه فشرده جدید نگاشت می‌شود
+    restored = _edit(minified, lambda lines: lines.__delitem__(slice(3, 6)))
+    remapped = sw_api_panel.PromptBuilder().minify(restored)
+    line = restored.split("\n").index("    swModel.SketchManager.InsertSketch True ' sketch") + 1
+    assert remapped.remap_error(f"script.vbs({line}, 5) error") == "script.vbs(5, 5) error"
+    assert remapped.lines[4] == "swModel.SketchManager.InsertSketch True"
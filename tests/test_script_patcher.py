@@ -0,0 +1,81 @@
+"""آزمون‌های جدولی اعمال وصله‌های SEARCH/REPLACE روی اسکریپت"""
+
+import pytest
+
+import sw_api_panel
+
+
+def block(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE\n"
+
+
+SCRIPT = "\n".join([
+    'Set swApp = CreateObject("SldWorks.Application")',
+    'Set swModel = swApp.NewDocument("Part.prtdot", 0, 0, 0)',
+    "    swModel.SketchManager.InsertSketch True",
+    "    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01",
+    'WScript.Echo "done"',
+    "WScript.Quit 0",
+])
+
+
+@pytest.fixture
+def patcher():
+    return sw_api_panel.ScriptPatcher()
+
+
+@pytest.mark.parametrize("response, expected", [
+    pytest.param(block("    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01\n",
+                       "    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.02\n"),
+                 SCRIPT.replace("0.01", "0.02"), id="exact-match"),
+    pytest.param(block("swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01\n",
+                       "    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.02\n"),
+                 SCRIPT.replace("0.01", "0.02"), id="whitespace-insensitive-match"),
+    pytest.param(block("    swModel.SketchManager.InsertSketch True\n", "    swModel.SketchManager.InsertSketch True\n"
+                       "    swModel.ClearSelection2 True\n"),
+                 SCRIPT.replace("InsertSketch True", "InsertSketch True\n    swModel.ClearSelection2 True"),
+                 id="insert-lines"),
+    pytest.param(block("    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01\n", ""),
+                 SCRIPT.replace("    swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01\n", ""),
+                 id="delete-lines"),
+    pytest.param(block("", "swModel.EditRebuild3\n"),
+                 SCRIPT.replace('WScript.Echo "done"', 'swModel.EditRebuild3\nWScript.Echo "done"'),
+                 id="empty-search-appends-before-final-message"),
+    pytest.param(block("WScript.Echo \"done\"\n", "WScript.Echo \"finished\"\n")
+                 + "some explanation\n" + block("WScript.Quit 0\n", "WScript.Quit 1\n"),
+                 SCRIPT.replace('"done"', '"finished"').replace("Quit 0", "Quit 1"), id="multiple-blocks"),
+    pytest.param(block("WScript.Quit 0\n", "WScript.Quit 1\n").replace("\n", "\r\n"),
+                 SCRIPT.replace("Quit 0", "Quit 1"), id="crlf-response"),
+])
+def test_apply(patcher, response, expected):
+    assert patcher.apply(SCRIPT, response) == (True, expected, [])
+
+
+@pytest.mark.parametrize("response, error", [
+    pytest.param("no patch here", "پاسخ مدل هیچ بلوک SEARCH/REPLACE معتبری ندارد", id="no-blocks"),
+    pytest.param(block("swModel.Missing\n", "x\n"), "بلوک 1: متن SEARCH در اسکریپت فعلی یافت نشد (swModel.Missing)",
+                 id="search-not-found"),
+])
+def test_apply_failure_keeps_original(patcher, response, error):
+    assert patcher.apply(SCRIPT, response) == (False, SCRIPT, [error])
+
+
+def test_apply_is_all_or_nothing(patcher):
+    response = block("WScript.Quit 0\n", "WScript.Quit 1\n") + block("swModel.Missing\n", "x\n")
+    applied, content, errors = patcher.apply(SCRIPT, response)
+    assert not applied and content == SCRIPT
+    assert errors == ["بلوک 2: متن SEARCH در اسکریپت فعلی یافت نشد (swModel.Missing)"]
+
+
+@pytest.mark.parametrize("lines, expected", [
+    pytest.param(["a", 'WScript.Echo "done"', "WScript.Quit 0"], ["a", "NEW", 'WScript.Echo "done"', "WScript.Quit 0"],
+                 id="before-final-echo-and-quit"),
+    pytest.param(["a", "WScript.Quit 0", "' end", ""], ["a", "NEW", "WScript.Quit 0", "' end", ""],
+                 id="skips-trailing-comments"),
+    pytest.param(["a", "b"], ["a", "b", "NEW"], id="no-final-message"),
+    pytest.param(["If x Then", "  WScript.Quit 1", "End If"], ["If x Then", "  WScript.Quit 1", "End If", "NEW"],
+                 id="quit-inside-block"),
+    pytest.param([], ["NEW"], id="empty-script"),
+])
+def test_insert_before_end(lines, expected):
+    assert sw_api_panel.ScriptPatcher._insert_before_end(lines, ["NEW"]) == expected
@@ -0,0 +1,86 @@
+"""آزمون‌های جدولی اعتبارسنجی ایستای اسکریپت (توازن بلوک‌ها و تعداد آرگومان‌های API)"""
+
+import pytest
+
+import sw_api_panel
+
+CONNECT = 'Set swApp = CreateObject("SldWorks.Application")\n'
+
+
+@pytest.fixture
+def validator():
+    return sw_api_panel.ScriptValidator()
+
+
+@pytest.mark.parametrize("body", [
+    pytest.param("If x Then y = 1\n", id="single-line-if"),
+    pytest.param("If x Then y = 1 Else y = 2\n", id="single-line-if-else"),
+    pytest.param("If x Then: y = 1\n", id="single-line-if-colon"),
+    pytest.param("If x Then ' comment\n  y = 1\nEnd If\n", id="block-if-comment"),
+    pytest.param("If x Then\n  y = 1\nElseIf z Then\n  y = 2\nElse\n  y = 3\nEnd If\n", id="elseif"),
+    pytest.param('If x = "Then" Then y = 1\n', id="then-in-string"),
+    pytest.param("If a And _\n   b Then\n  y = 1\nEnd If\n", id="continued-if"),
+    pytest.param("For i = 1 To 3\n  If i = 2 Then Exit For\nNext\n", id="exit-for-single-line-if"),
+    pytest.param("For i = 1 To 3\n  Exit For\nNext\n", id="exit-for"),
+    pytest.param("For Each f In c\n  x = f\nNext\n", id="for-each"),
+    pytest.param("Do While x\n  Exit Do\nLoop\n", id="exit-do"),
+    pytest.param("Do\n  x = x + 1\nLoop Until x > 3\n", id="loop-until"),
+    pytest.param("While x\n  x = 0\nWend\n", id="while-wend"),
+    pytest.param("With swModel\n  .ClearSelection2 True\nEnd With\n", id="with"),
+    pytest.param("Select Case x\n  Case 1\n    y = 1\n  Case Else\n    y = 2\nEnd Select\n", id="select"),
+    pytest.param("Function F(a)\n  If a Then Exit Function\n  F = 1\nEnd Function\n", id="exit-function"),
+    pytest.param("Class A\n  Private v\n  Public Property Get Value\n    Value = v\n  End Property\n"
+                 "  Public Property Let Value(x)\n    v = x\n  End Property\nEnd Class\n", id="property-get-let"),
+    pytest.param("Class A\n  Public Default Property Get Item(i)\n    Item = i\n  End Property\nEnd Class\n",
+                 id="default-property"),
+    pytest.param("Class A\n  Property Get V\n    Exit Property\n  End Property\nEnd Class\n", id="exit-property"),
+    pytest.param("Rem If x Then\n", id="rem"),
+])
+def test_balanced_blocks(validator, body):
+    assert validator.validate(CONNECT + body) == (True, [])
+
+
+@pytest.mark.parametrize("body, message", [
+    pytest.param("Sub A\n  x = 1\n", "بلوک sub در خط 2 بسته نشده است", id="unclosed-sub"),
+    pytest.param("If x Then\n  y = 1\n", "بلوک if در خط 2 بسته نشده است", id="unclosed-if"),
+    pytest.param("For i = 1 To 3\n  x = i\n", "بلوک for در خط 2 بسته نشده است", id="unclosed-for"),
+    pytest.param("Property Get V\n  V = 1\n", "بلوک property در خط 2 بسته نشده است", id="unclosed-property"),
+    pytest.param("For i = 1 To 3\nLoop\n", "خط 3: «Loop» با for (خط 2) مطابقت ندارد", id="mismatched-closer"),
+    pytest.param("End If\n", "خط 2: «End If» با هیچ بلوکی مطابقت ندارد", id="closer-without-opener"),
+])
+def test_unbalanced_blocks(validator, body, message):
+    valid, issues = validator.validate(CONNECT + body)
+    assert not valid
+    assert any(issue.startswith(message) for issue in issues), issues
+
+
+@pytest.mark.parametrize("statement, issue", [
+    pytest.param('swApp.NewDocument("a,b,c", 0, 0, 0)', None, id="commas-in-string"),
+    pytest.param('swApp.NewDocument("a "", b", 0, 0, 0)', None, id="escaped-quote-in-string"),
+    pytest.param('x = "it\'s, ok": swApp.NewDocument("x", 0, 0, 0) \' c, d', None, id="apostrophe-in-string"),
+    pytest.param('swModel.SketchManager.CreateCircleByRadius 0, 0, 0, 0.01', None, id="statement-call"),
+    pytest.param('x = swModel.Extension.SelectByID2("Front, Plane", "PLANE", Abs(-1), 0, 0, False, 0, Nothing, 0)',
+                 None, id="nested-parentheses"),
+    pytest.param('swApp.NewDocument("x", _\n  0, 0, 0)', None, id="line-continuation"),
+    pytest.param('swModel.UnknownMethod 1, 2', None, id="unknown-method"),
+    pytest.param('swModel.SketchManager.CreateCircleByRadius 0, 0, 0',
+                 "خط 2: CreateCircleByRadius به 4 آرگومان نیاز دارد اما 3 آرگومان داده شده", id="statement-too-few"),
+    pytest.param('Call swApp.NewDocument("a, b", 0, 0)',
+                 "خط 2: NewDocument به 4 آرگومان نیاز دارد اما 3 آرگومان داده شده", id="call-too-few"),
+    pytest.param('swModel.ClearSelection2()', "خط 2: ClearSelection2 به 1 آرگومان نیاز دارد اما 0 آرگومان داده شده",
+                 id="empty-parentheses"),
+])
+def test_call_arity(validator, statement, issue):
+    issues = validator.check_arity(CONNECT + statement + "\n")
+    assert issues == ([issue] if issue else [])
+
+
+@pytest.mark.parametrize("script, message", [
+    pytest.param("", "اسکریپت خالی است", id="empty"),
+    pytest.param("x = 1\n", "کد اتصال به SolidWorks (SldWorks.Application) یافت نشد", id="no-connection"),
+    pytest.param("```vbs\n" + CONNECT + "```\n", "اسکریپت شامل علامت‌های markdown است", id="markdown"),
+])
+def test_script_level_checks(validator, script, message):
+    valid, issues = validator.validate(script)
+    assert not valid
+    assert message in issues